@@ -53,6 +53,7 @@ app.conf.update(
         # Phase 2: Webhook 回调和数据解析
         'apps.data_acquisition.tasks.process_webscraper_tracking': {'queue': 'tracking_webhook_queue'},
         'apps.data_acquisition.tasks.batch_writeback_tracking_data': {'queue': 'tracking_webhook_queue'},
+        'apps.data_acquisition.tasks.flush_excel_writeback': {'queue': 'tracking_webhook_queue'},
 
         # Default queue for other acquisition tasks
         'apps.data_acquisition.tasks.*': {'queue': 'acquisition_queue'},
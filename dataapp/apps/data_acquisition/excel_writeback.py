@@ -2,7 +2,15 @@
 Excel 回写工具模块
 
 用于将 WebScraper 追踪数据回写到原始 Excel 文件中。
+
+所有回写最终都通过 patch_excel_cells 完成：一次下载、批量改写 C 列、带 If-Match
+（下载时的 ETag）上传；文件在此期间被其他人（如 OnlyOffice）修改时服务端返回 412，
+重新下载后再合并一次，不会覆盖别人的修改。
+
+逐行回写请使用 queue_writeback：单元格先暂存在 Redis，按文件合并，
+由 flush_excel_writeback 任务在防抖时间后一次性写入。
 """
+import hashlib
 import pandas as pd
 import numpy as np
 import logging
@@ -84,6 +92,80 @@ def extract_writeback_data(df: pd.DataFrame) -> str:
     return ''
 
 
+class WritebackConflict(Exception):
+    """文件在多次重试期间持续被修改（If-Match 一直失败）"""
+
+
+def _webdav_target(file_path: str):
+    nc_config = settings.NEXTCLOUD_CONFIG
+    base_url = nc_config['webdav_hostname'].rstrip('/')
+    webdav_url = base_url + '/' + file_path.lstrip('/')
+    auth = (nc_config['webdav_login'], nc_config['webdav_password'])
+    return webdav_url, auth
+
+
+def patch_excel_cells(file_path: str, cells: dict, task_id: str = '', max_conflicts: int = 3) -> int:
+    """
+    一次下载 / 改写 / 上传，把 cells 写入 Excel 的 C 列
+
+    上传时带 If-Match: <下载时的 ETag>。如果文件在下载之后被修改（412），
+    重新下载并再次写入，最多 max_conflicts 次。
+
+    Args:
+        file_path: Nextcloud 文件路径
+        cells: {row_index: writeback_data}，row_index 从 0 开始（数据从 Excel 第 2 行开始）
+        task_id: Celery 任务 ID（用于日志）
+        max_conflicts: ETag 冲突时的最大重试次数
+
+    Returns:
+        int: 实际下载次数（无冲突时为 1）
+
+    Raises:
+        WritebackConflict: 冲突重试次数用尽
+        requests.HTTPError: 其他 HTTP 错误（如 423 文件被锁定）
+    """
+    webdav_url, auth = _webdav_target(file_path)
+
+    for attempt in range(max_conflicts + 1):
+        logger.info(f"[Task {task_id}] Downloading Excel from: {file_path}")
+        response = requests.get(webdav_url, auth=auth, timeout=60)
+        response.raise_for_status()
+        etag = response.headers.get('ETag')
+
+        workbook = load_workbook(filename=io.BytesIO(response.content))
+        sheet = workbook.active
+        for row_index, writeback_data in cells.items():
+            # Excel 从 1 开始，且第 1 行是表头
+            sheet.cell(row=int(row_index) + 2, column=3).value = writeback_data
+
+        output = io.BytesIO()
+        workbook.save(output)
+
+        headers = {'If-Match': etag} if etag else {}
+        logger.info(
+            f"[Task {task_id}] Uploading {len(cells)} cells to: {file_path} (etag={etag})"
+        )
+        upload_response = requests.put(
+            webdav_url,
+            auth=auth,
+            data=output.getvalue(),
+            headers=headers,
+            timeout=60
+        )
+        if upload_response.status_code == 412:
+            logger.warning(
+                f"[Task {task_id}] {file_path} changed since download "
+                f"(attempt {attempt + 1}/{max_conflicts + 1}), re-applying"
+            )
+            continue
+        upload_response.raise_for_status()
+        return attempt + 1
+
+    raise WritebackConflict(
+        f"{file_path} kept changing during writeback ({max_conflicts + 1} attempts)"
+    )
+
+
 def writeback_to_excel(
     file_path: str,
     row_index: int,
@@ -123,46 +205,11 @@ def writeback_to_excel(
                 )
                 time.sleep(sleep_time)
 
-            # Step 1: 下载 Excel 文件
-            logger.info(f"[Task {task_id}] Downloading Excel from: {file_path}")
-            nc_config = settings.NEXTCLOUD_CONFIG
-            base_url = nc_config['webdav_hostname'].rstrip('/')
-            webdav_url = base_url + '/' + file_path.lstrip('/')
-            auth = (nc_config['webdav_login'], nc_config['webdav_password'])
-
-            response = requests.get(webdav_url, auth=auth, timeout=60)
-            response.raise_for_status()
-            content = response.content
-
-            # Step 2: 加载 Excel 文件
-            workbook = load_workbook(filename=io.BytesIO(content))
-            sheet = workbook.active
-
-            # Step 3: 计算 Excel 行号（row_index + 2，因为 Excel 从 1 开始，且第 1 行是表头）
             excel_row = row_index + 2
-
-            # Step 4: 写入 C 列（列索引为 3）
-            cell = sheet.cell(row=excel_row, column=3)
-            cell.value = writeback_data
-
             logger.info(
                 f"[Task {task_id}] Writing to cell C{excel_row}: {writeback_data[:50]}..."
             )
-
-            # Step 5: 保存到内存
-            output = io.BytesIO()
-            workbook.save(output)
-            output.seek(0)
-
-            # Step 6: 上传回 Nextcloud
-            logger.info(f"[Task {task_id}] Uploading modified Excel to: {file_path}")
-            upload_response = requests.put(
-                webdav_url,
-                auth=auth,
-                data=output.read(),
-                timeout=60
-            )
-            upload_response.raise_for_status()
+            patch_excel_cells(file_path, {row_index: writeback_data}, task_id=task_id)
 
             logger.info(f"[Task {task_id}] Successfully wrote back to Excel at row {excel_row}")
 
@@ -283,48 +330,9 @@ def batch_writeback_to_excel(batch_uuid: str, task_id: str = ''):
                 'written': 0
             }
 
-        # 下载 Excel 文件
-        logger.info(f"[Task {task_id}] Downloading Excel from: {file_path}")
-        nc_config = settings.NEXTCLOUD_CONFIG
-        base_url = nc_config['webdav_hostname'].rstrip('/')
-        webdav_url = base_url + '/' + file_path.lstrip('/')
-        auth = (nc_config['webdav_login'], nc_config['webdav_password'])
-
-        response = requests.get(webdav_url, auth=auth, timeout=60)
-        response.raise_for_status()
-        content = response.content
-
-        # 加载 Excel 文件
-        workbook = load_workbook(filename=io.BytesIO(content))
-        sheet = workbook.active
-
-        # 批量写入所有数据
-        written_count = 0
-        for row_index, writeback_data in writeback_data_map.items():
-            excel_row = row_index + 2  # 表头在第 1 行
-            cell = sheet.cell(row=excel_row, column=3)
-            cell.value = writeback_data
-            written_count += 1
-            logger.debug(
-                f"[Task {task_id}] Wrote to cell C{excel_row}: {writeback_data[:30]}..."
-            )
-
-        logger.info(f"[Task {task_id}] Wrote {written_count} rows to Excel")
-
-        # 保存到内存
-        output = io.BytesIO()
-        workbook.save(output)
-        output.seek(0)
-
-        # 上传回 Nextcloud
-        logger.info(f"[Task {task_id}] Uploading modified Excel to: {file_path}")
-        upload_response = requests.put(
-            webdav_url,
-            auth=auth,
-            data=output.read(),
-            timeout=60
-        )
-        upload_response.raise_for_status()
+        # 一次下载 / 写入 / 上传（带 ETag 校验）
+        patch_excel_cells(file_path, writeback_data_map, task_id=task_id)
+        written_count = len(writeback_data_map)
 
         logger.info(
             f"[Task {task_id}] Successfully completed batch writeback for {batch_uuid}, "
@@ -386,3 +394,195 @@ def batch_writeback_to_excel(batch_uuid: str, task_id: str = ''):
             'status': 'error',
             'reason': str(e)
         }
+
+
+# ============================================================================
+# 合并回写（Redis 暂存 + 防抖）
+#
+# queue_writeback 把单元格写入 Redis hash（按文件分 key），第一次写入时投递一个
+# flush_excel_writeback 任务。flush 时如果距最后一次写入不足 DEBOUNCE 秒、且最早
+# 一次写入还没超过 MAX_WAIT 秒，就顺延；否则取出全部待写单元格，一次下载 / 上传。
+# 同一个 500 行的批次只需要一次（或少数几次）WebDAV 往返。
+#
+# Redis keys（<h> 为 file_path 的 sha1）：
+# - excel_writeback:pending:<h>    hash  row_index -> writeback_data
+# - excel_writeback:meta:<h>       hash  first_ts / last_ts
+# - excel_writeback:scheduled:<h>  已有 flush 任务在排队的标记
+# ============================================================================
+
+WRITEBACK_KEY_PREFIX = 'excel_writeback'
+PENDING_TTL = 24 * 3600
+
+
+def _writeback_keys(file_path: str):
+    h = hashlib.sha1(file_path.encode('utf-8')).hexdigest()
+    return (
+        f"{WRITEBACK_KEY_PREFIX}:pending:{h}",
+        f"{WRITEBACK_KEY_PREFIX}:meta:{h}",
+        f"{WRITEBACK_KEY_PREFIX}:scheduled:{h}",
+    )
+
+
+def _writeback_timing():
+    debounce = getattr(settings, 'TRACKING_WRITEBACK_DEBOUNCE', 10)
+    max_wait = getattr(settings, 'TRACKING_WRITEBACK_MAX_WAIT', 60)
+    return debounce, max_wait
+
+
+def _get_redis():
+    from .rate_limiter import get_redis_client
+    return get_redis_client()
+
+
+def _schedule_flush(file_path: str, countdown: float, attempt: int = 0):
+    from .tasks import flush_excel_writeback
+    flush_excel_writeback.apply_async(args=[file_path, attempt], countdown=countdown)
+
+
+def queue_writeback(file_path: str, cells: dict, task_id: str = '', client=None) -> int:
+    """
+    暂存待回写的单元格，由 flush_excel_writeback 合并写入
+
+    同一单元格多次写入时以最后一次为准。
+
+    Args:
+        file_path: Nextcloud 文件路径
+        cells: {row_index: writeback_data}
+        task_id: Celery 任务 ID（用于日志）
+        client: Redis 连接（默认使用 data_acquisition 的 Redis）
+
+    Returns:
+        int: 暂存的单元格数
+    """
+    cells = {str(k): v for k, v in cells.items() if v}
+    if not cells:
+        return 0
+
+    client = client or _get_redis()
+    pending_key, meta_key, scheduled_key = _writeback_keys(file_path)
+    debounce, max_wait = _writeback_timing()
+    now = time.time()
+
+    pipe = client.pipeline()
+    pipe.hset(pending_key, mapping=cells)
+    pipe.hsetnx(meta_key, 'first_ts', now)
+    pipe.hset(meta_key, 'last_ts', now)
+    pipe.expire(pending_key, PENDING_TTL)
+    pipe.expire(meta_key, PENDING_TTL)
+    # 标记的有效期兜底：flush 任务丢失时，过期后的下一次写入会重新投递
+    pipe.set(scheduled_key, task_id or '1', nx=True, ex=int(max_wait + 600))
+    scheduled = pipe.execute()[-1]
+
+    if scheduled:
+        _schedule_flush(file_path, countdown=debounce)
+        logger.info(
+            f"[Task {task_id}] Queued {len(cells)} cells for {file_path}, flush in {debounce}s"
+        )
+    else:
+        logger.debug(f"[Task {task_id}] Queued {len(cells)} cells for {file_path} (flush pending)")
+
+    return len(cells)
+
+
+def _restore_pending(client, file_path: str, cells: dict):
+    """flush 失败时把单元格放回队列；期间有更新的单元格保留新值"""
+    pending_key, meta_key, _ = _writeback_keys(file_path)
+    pipe = client.pipeline()
+    for row_index, writeback_data in cells.items():
+        pipe.hsetnx(pending_key, row_index, writeback_data)
+    pipe.hsetnx(meta_key, 'first_ts', time.time())
+    pipe.hsetnx(meta_key, 'last_ts', 0)
+    pipe.expire(pending_key, PENDING_TTL)
+    pipe.expire(meta_key, PENDING_TTL)
+    pipe.execute()
+
+
+def flush_pending_writeback(file_path: str, task_id: str = '', attempt: int = 0, client=None) -> dict:
+    """
+    把 Redis 中暂存的单元格一次性写入 Excel
+
+    Args:
+        file_path: Nextcloud 文件路径
+        task_id: Celery 任务 ID（用于日志）
+        attempt: 第几次重试（文件被锁定等失败后重新投递时递增）
+        client: Redis 连接（默认使用 data_acquisition 的 Redis）
+
+    Returns:
+        dict: {'status': 'success' | 'deferred' | 'empty' | 'retrying' | 'error', ...}
+    """
+    from .models import SyncLog
+
+    client = client or _get_redis()
+    pending_key, meta_key, scheduled_key = _writeback_keys(file_path)
+    debounce, max_wait = _writeback_timing()
+    now = time.time()
+
+    first_ts, last_ts = client.hmget(meta_key, 'first_ts', 'last_ts')
+    if first_ts is not None and last_ts is not None:
+        quiet = now - float(last_ts)
+        age = now - float(first_ts)
+        if quiet < debounce and age < max_wait:
+            # 仍有新单元格在写入，顺延（不超过 MAX_WAIT）
+            countdown = max(min(debounce - quiet, max_wait - age), 1)
+            _schedule_flush(file_path, countdown=countdown, attempt=attempt)
+            return {'status': 'deferred', 'retry_in': countdown}
+
+    # 先清除标记再取数据：之后到达的单元格会投递新的 flush
+    pipe = client.pipeline()
+    pipe.delete(scheduled_key)
+    pipe.hgetall(pending_key)
+    pipe.delete(pending_key, meta_key)
+    _, raw_cells, _ = pipe.execute()
+
+    cells = {
+        int(k.decode() if isinstance(k, bytes) else k): v.decode() if isinstance(v, bytes) else v
+        for k, v in raw_cells.items()
+    }
+    if not cells:
+        return {'status': 'empty'}
+
+    try:
+        downloads = patch_excel_cells(file_path, dict(sorted(cells.items())), task_id=task_id)
+    except Exception as e:
+        max_attempts = getattr(settings, 'TRACKING_WRITEBACK_MAX_ATTEMPTS', 5)
+        logger.warning(
+            f"[Task {task_id}] Coalesced writeback failed for {file_path} "
+            f"(attempt {attempt + 1}/{max_attempts}): {e}"
+        )
+        if attempt + 1 < max_attempts:
+            _restore_pending(client, file_path, {str(k): v for k, v in cells.items()})
+            countdown = getattr(settings, 'TRACKING_WRITEBACK_RETRY_DELAY', 30) * (2 ** attempt)
+            client.set(scheduled_key, task_id or '1', ex=int(countdown + max_wait + 600))
+            _schedule_flush(file_path, countdown=countdown, attempt=attempt + 1)
+            return {'status': 'retrying', 'cells': len(cells), 'retry_in': countdown}
+
+        # 放弃：TrackingJob.writeback_data 仍在库中，批次回写时会再写一次
+        SyncLog.objects.create(
+            operation_type='excel_writeback',
+            celery_task_id=task_id,
+            file_path=file_path,
+            message=f"Coalesced writeback failed after {max_attempts} attempts",
+            success=False,
+            error_message=str(e),
+            details={'row_indices': sorted(cells), 'attempts': max_attempts}
+        )
+        return {'status': 'error', 'cells': len(cells), 'reason': str(e)}
+
+    logger.info(
+        f"[Task {task_id}] Coalesced writeback: {len(cells)} cells to {file_path} "
+        f"in {downloads} download(s)"
+    )
+    SyncLog.objects.create(
+        operation_type='excel_writeback',
+        celery_task_id=task_id,
+        file_path=file_path,
+        message=f"Coalesced writeback: {len(cells)} cells",
+        success=True,
+        details={
+            'row_indices': sorted(cells),
+            'written': len(cells),
+            'downloads': downloads,
+            'attempt': attempt + 1
+        }
+    )
+    return {'status': 'success', 'written': len(cells), 'downloads': downloads}
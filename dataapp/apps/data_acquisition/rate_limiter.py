@@ -0,0 +1,137 @@
+"""
+WebScraper API 分布式限流（Redis 令牌桶）
+
+所有发布 WebScraper 爬虫任务的 worker 共用同一个桶（按 API token 区分），
+取不到令牌的任务由调用方带 countdown 重新入队，而不是在 worker 里 sleep 占住进程。
+
+桶状态保存在 Redis hash 中：
+- tokens: 当前剩余令牌（浮点）
+- ts:     上次更新的时间（秒，浮点；取 Redis TIME，避免各 worker 时钟不一致）
+
+更新通过 WATCH/MULTI 乐观事务完成，并发冲突时重试，保证多个进程/主机同时取令牌时不会超发。
+"""
+import hashlib
+import logging
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# WebScraper 限制：每 15 分钟最多 200 个 scraping job。
+# 默认 150 / 900 秒 + 突发 10 个，任意 15 分钟窗口内最多 160 个，留出余量。
+DEFAULT_CAPACITY = 10
+DEFAULT_REFILL_COUNT = 150
+DEFAULT_REFILL_PERIOD = 900
+
+KEY_PREFIX = 'webscraper:ratelimit'
+
+_redis_client = None
+
+
+def get_redis_client():
+    """限流用的 Redis 连接（进程内复用，与 data_acquisition 的 broker 同库）"""
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis(
+            host=getattr(settings, 'REDIS_HOST', 'localhost'),
+            port=int(getattr(settings, 'REDIS_PORT', 6379)),
+            db=int(getattr(settings, 'REDIS_DB_ACQUISITION', 1)),
+            socket_timeout=5,
+        )
+    return _redis_client
+
+
+class TokenBucket:
+    """
+    Redis 令牌桶
+
+    Args:
+        client: redis.Redis 实例
+        key: 桶的 Redis key
+        capacity: 桶容量（允许的突发数量）
+        refill_rate: 每秒补充的令牌数
+        max_attempts: WATCH 冲突时的最大重试次数
+    """
+
+    def __init__(self, client, key, capacity, refill_rate, max_attempts=50):
+        if capacity < 1 or refill_rate <= 0:
+            raise ValueError("capacity must be >= 1 and refill_rate > 0")
+        self.client = client
+        self.key = key
+        self.capacity = float(capacity)
+        self.refill_rate = float(refill_rate)
+        self.max_attempts = max_attempts
+        # 桶满之后状态与不存在等价，过期即可回收
+        self.ttl_ms = int((self.capacity / self.refill_rate + 60) * 1000)
+
+    def _now(self, pipe):
+        sec, usec = pipe.time()
+        return sec + usec / 1_000_000
+
+    def acquire(self, tokens=1):
+        """
+        尝试取 tokens 个令牌
+
+        Returns:
+            tuple: (acquired, wait_seconds)
+                acquired 为 False 时 wait_seconds 为令牌足够所需的最短等待时间
+        """
+        if tokens > self.capacity:
+            raise ValueError(f"cannot acquire {tokens} tokens from a bucket of {self.capacity:g}")
+
+        with self.client.pipeline() as pipe:
+            for _ in range(self.max_attempts):
+                try:
+                    pipe.watch(self.key)
+                    now = self._now(pipe)
+                    stored_tokens, stored_ts = pipe.hmget(self.key, 'tokens', 'ts')
+                    if stored_tokens is None or stored_ts is None:
+                        available = self.capacity
+                    else:
+                        elapsed = max(0.0, now - float(stored_ts))
+                        available = min(self.capacity, float(stored_tokens) + elapsed * self.refill_rate)
+
+                    if available < tokens:
+                        pipe.unwatch()
+                        return False, (tokens - available) / self.refill_rate
+
+                    pipe.multi()
+                    pipe.hset(self.key, mapping={'tokens': available - tokens, 'ts': now})
+                    pipe.pexpire(self.key, self.ttl_ms)
+                    pipe.execute()
+                    return True, 0.0
+                except redis.WatchError:
+                    continue
+
+        # 竞争极其激烈时放弃本次，按一个补充周期后再试
+        logger.warning(f"Token bucket {self.key}: gave up after {self.max_attempts} contended attempts")
+        return False, tokens / self.refill_rate
+
+
+def _bucket_key(api_token, sitemap_id=None):
+    token_hash = hashlib.sha1(str(api_token).encode('utf-8')).hexdigest()[:16]
+    if sitemap_id is None:
+        return f"{KEY_PREFIX}:{token_hash}"
+    return f"{KEY_PREFIX}:{token_hash}:{sitemap_id}"
+
+
+def get_webscraper_bucket(api_token, sitemap_id=None, client=None):
+    """
+    获取 WebScraper 发布用的令牌桶
+
+    WebScraper 的配额按账号（API token）计算，所以默认只按 token 分桶；
+    传入 sitemap_id 时按 token + sitemap 单独分桶。
+    容量和速率可通过 settings 调整：
+    - WEBSCRAPER_RATE_LIMIT_CAPACITY
+    - WEBSCRAPER_RATE_LIMIT_COUNT / WEBSCRAPER_RATE_LIMIT_PERIOD（每 PERIOD 秒补充 COUNT 个）
+    """
+    capacity = getattr(settings, 'WEBSCRAPER_RATE_LIMIT_CAPACITY', DEFAULT_CAPACITY)
+    count = getattr(settings, 'WEBSCRAPER_RATE_LIMIT_COUNT', DEFAULT_REFILL_COUNT)
+    period = getattr(settings, 'WEBSCRAPER_RATE_LIMIT_PERIOD', DEFAULT_REFILL_PERIOD)
+    return TokenBucket(
+        client or get_redis_client(),
+        _bucket_key(api_token, sitemap_id),
+        capacity=capacity,
+        refill_rate=count / period,
+    )
@@ -6,11 +6,14 @@ from .celery import app
 import logging
 import pandas as pd
 import time
+import random
 import requests
 import io
 from openpyxl import load_workbook
 from django.conf import settings
 
+from .rate_limiter import get_webscraper_bucket
+
 logger = logging.getLogger(__name__)
 
 
@@ -782,45 +785,35 @@ def process_webscraper_tracking(
         # Excel 回写：将追踪数据回写到原始 Excel 文件
         #
         # 回写策略说明：
-        # 1. 即时回写（IMMEDIATE_WRITEBACK=True）：每个任务完成后立即回写
-        #    优点：实时性好，用户可以立即看到结果
-        #    缺点：可能出现并发写入冲突（文件锁定错误）
+        # 1. 即时回写（IMMEDIATE_WRITEBACK=True）：每个任务完成后把单元格暂存到 Redis，
+        #    由 flush_excel_writeback 按文件合并，防抖后一次下载 / 上传（带 ETag 校验）
+        #    优点：几秒内可以看到结果，同一批次的多行只产生一次 WebDAV 往返
         #
-        # 2. 批量回写（IMMEDIATE_WRITEBACK=False，默认）：整个 batch 完成后一次性回写
-        #    优点：避免并发冲突，性能更好
-        #    缺点：需要等待整个 batch 完成才能看到结果
+        # 2. 批量回写（IMMEDIATE_WRITEBACK=False，默认）：每完成 10 个及 batch 完成时回写
+        #    优点：不依赖 Redis 暂存
+        #    缺点：需要等待里程碑才能看到结果
         #
-        # 建议：使用批量回写（默认设置）
+        # 两种方式都会在 batch 完成时做一次完整的批量回写
         # ============================================================================
         IMMEDIATE_WRITEBACK = getattr(settings, 'TRACKING_IMMEDIATE_WRITEBACK', False)
 
         if IMMEDIATE_WRITEBACK and tracking_job and writeback_data:
-            from .excel_writeback import writeback_to_excel
+            from .excel_writeback import queue_writeback
 
             # 获取文件路径和行索引
             file_path = tracking_job.batch.file_path
             row_index = tracking_job.index
 
             logger.info(
-                f"[Task {task_id}] Writing back to Excel (immediate mode): {file_path}, "
+                f"[Task {task_id}] Queueing Excel writeback (immediate mode): {file_path}, "
                 f"row_index={row_index}, data={writeback_data[:50]}..."
             )
 
-            # 执行回写（带重试）
-            writeback_success = writeback_to_excel(
-                file_path=file_path,
-                row_index=row_index,
-                writeback_data=writeback_data,
-                task_id=task_id,
-                max_retries=3,
-                retry_delay=2.0
-            )
-
-            if writeback_success:
-                logger.info(f"[Task {task_id}] Excel writeback completed successfully")
-            else:
+            try:
+                queue_writeback(file_path, {row_index: writeback_data}, task_id=task_id)
+            except Exception as e:
                 logger.warning(
-                    f"[Task {task_id}] Excel writeback failed after retries, "
+                    f"[Task {task_id}] Failed to queue Excel writeback: {e}, "
                     f"will be handled by batch writeback"
                 )
         elif tracking_job and writeback_data:
@@ -952,6 +945,34 @@ def batch_writeback_tracking_data(self, batch_uuid: str):
         }
 
 
+@app.task(
+    name='apps.data_acquisition.tasks.flush_excel_writeback',
+    bind=True,
+    max_retries=0,
+    queue='tracking_webhook_queue'
+)
+def flush_excel_writeback(self, file_path: str, attempt: int = 0):
+    """
+    合并回写：把 Redis 中暂存的单元格一次性写入 Excel
+
+    由 excel_writeback.queue_writeback 投递；防抖、顺延和失败重投都在
+    flush_pending_writeback 内部处理（重新投递本任务，不在 worker 内 sleep）。
+
+    Args:
+        file_path: Nextcloud 文件路径
+        attempt: 第几次重试
+
+    Returns:
+        dict: 回写结果
+    """
+    from .excel_writeback import flush_pending_writeback
+
+    task_id = self.request.id
+    result = flush_pending_writeback(file_path, task_id=task_id or '', attempt=attempt)
+    logger.info(f"[Task {task_id}] Flush excel writeback for {file_path}: {result}")
+    return result
+
+
 @app.task(
     name='apps.data_acquisition.tasks.publish_tracking_batch',
     bind=True,
@@ -964,12 +985,13 @@ def publish_tracking_batch(self, task_name, url, batch_uuid_str, custom_id, inde
     """
     发布单个追踪任务到 WebScraper API（优化版）
 
-    此函数只处理单个 URL 的发布，由 Excel 处理函数批量调用。
-    执行完成后强制睡眠 6 秒，确保 API 频率限制。
+    此函数只处理单个 URL 的发布，由 Excel 处理函数 / worker 批量投递（见 dispatch_publish_tasks）。
 
     频率限制策略：
-    - 每个任务完成后（无论成功、失败、跳过）都睡眠 6 秒
-    - 这确保每 15 分钟最多发布约 150 个任务（900秒/6秒=150），远低于 200 个限制
+    - 调用 API 前从 Redis 令牌桶（rate_limiter.get_webscraper_bucket）取令牌，
+      所有发布者按 API token 共用同一个桶，默认任意 15 分钟内最多约 160 个，低于 200 个限制
+    - 取不到令牌时带 countdown 重新入队，当前任务立即返回 'deferred'，不占用 worker
+    - 跳过 / 批次不存在的情况不消耗令牌
 
     Args:
         task_name: 任务名称，必须是 TRACKING_TASK_CONFIGS 中的 key
@@ -980,9 +1002,10 @@ def publish_tracking_batch(self, task_name, url, batch_uuid_str, custom_id, inde
 
     Returns:
         dict: {
-            'status': 'success' | 'failed' | 'skipped',
+            'status': 'success' | 'failed' | 'skipped' | 'deferred',
             'custom_id': str,
             'job_id': str (如果成功),
+            'retry_in': float (如果 deferred),
             'url': str,
             'index': int
         }
@@ -1001,8 +1024,6 @@ def publish_tracking_batch(self, task_name, url, batch_uuid_str, custom_id, inde
         f"task={task_name}, custom_id={custom_id}, url={url}"
     )
 
-    result = None  # 用于存储返回结果
-
     try:
         # 查找 TrackingBatch
         tracking_batch = TrackingBatch.objects.filter(
@@ -1035,6 +1056,29 @@ def publish_tracking_batch(self, task_name, url, batch_uuid_str, custom_id, inde
         API_TOKEN = config['api_token']
         SITEMAP_ID = config['sitemap_id']
 
+        # 取令牌，取不到则延后重新入队
+        acquired, wait_seconds = get_webscraper_bucket(API_TOKEN).acquire()
+        if not acquired:
+            # 加随机抖动，避免大量延后任务在同一时刻一起醒来争抢
+            countdown = wait_seconds + random.uniform(
+                0, getattr(settings, 'WEBSCRAPER_DEFER_JITTER', 30)
+            )
+            self.apply_async(
+                args=[task_name, url, batch_uuid_str, custom_id, index],
+                countdown=countdown
+            )
+            logger.info(
+                f"[Task {task_id}] Rate limited, re-enqueued {custom_id} in {countdown:.1f}s"
+            )
+            result = {
+                'status': 'deferred',
+                'custom_id': custom_id,
+                'url': url,
+                'index': index,
+                'retry_in': countdown
+            }
+            return result
+
         payload = {
             "sitemap_id": SITEMAP_ID,
             "driver": "fulljs",
@@ -1101,14 +1145,50 @@ def publish_tracking_batch(self, task_name, url, batch_uuid_str, custom_id, inde
         }
         return result
 
-    finally:
-        # ============================================================================
-        # 强制睡眠 6 秒（API 频率限制）
-        # 无论成功、失败还是跳过，都睡眠 6 秒，确保不超过 API 频率限制
-        # 计算：15 分钟 = 900 秒，900 / 6 = 150 个任务，远低于 200 个限制
-        # ============================================================================
-        time.sleep(6)
-        logger.debug(f"[Task {task_id}] Rate limit sleep (6s) completed")
+
+def dispatch_publish_tasks(task_name, batch, items, stagger=2):
+    """
+    批量投递 publish_tracking_batch 任务（断点续传）
+
+    已投递的 custom_id 用一次查询取出，不再逐条 exists()。
+    实际的 API 频率由 publish_tracking_batch 内的令牌桶控制，这里的 stagger
+    只是把任务在队列里错开，减少被限流后重新入队的次数。
+
+    Args:
+        task_name: TRACKING_TASK_CONFIGS 中的 key
+        batch: TrackingBatch 实例
+        items: 可迭代的 (url, custom_id, index)
+        stagger: 相邻任务的 countdown 间隔（秒）
+
+    Returns:
+        tuple: (dispatched_custom_ids, skipped_custom_ids)
+    """
+    from .models import TrackingJob
+
+    items = list(items)
+    existing = set(
+        TrackingJob.objects.filter(
+            batch=batch,
+            custom_id__in=[custom_id for _, custom_id, _ in items]
+        ).values_list('custom_id', flat=True)
+    )
+
+    batch_uuid_str = str(batch.batch_uuid)
+    dispatched = []
+    skipped = []
+
+    for url, custom_id, index in items:
+        if custom_id in existing:
+            skipped.append(custom_id)
+            continue
+
+        publish_tracking_batch.apply_async(
+            args=[task_name, url, batch_uuid_str, custom_id, index],
+            countdown=len(dispatched) * stagger
+        )
+        dispatched.append(custom_id)
+
+    return dispatched, skipped
 
 
 @app.task(
@@ -1141,7 +1221,7 @@ def process_tracking_excel(self, task_name, file_path, document_url=None):
             'dispatched': int  # 投递的任务数
         }
     """
-    from .models import SyncLog, TrackingBatch, TrackingJob
+    from .models import SyncLog, TrackingBatch
     import uuid
 
     # 获取任务配置
@@ -1228,27 +1308,13 @@ def process_tracking_excel(self, task_name, file_path, document_url=None):
             logger.info(f"[Task {task_id}] Found existing TrackingBatch {batch_short}")
 
         # Step 4: 批量投递任务到 publish_tracking_queue
-        # 检查已投递的任务，只投递未投递的
-        dispatched_count = 0
-        skipped_count = 0
-
-        for idx, url in enumerate(urls):
-            custom_id = f"{config['custom_id_prefix']}-{batch_short}-{idx:04d}"
-
-            # 检查是否已投递（断点续传）
-            if TrackingJob.objects.filter(batch=batch, custom_id=custom_id).exists():
-                skipped_count += 1
-                logger.debug(f"[Task {task_id}] Skipping already dispatched: {custom_id}")
-                continue
-
-            # 投递任务到 publish_tracking_queue
-            # 使用 countdown 参数实现 2 秒间隔
-            publish_tracking_batch.apply_async(
-                args=[task_name, url, batch_uuid_str, custom_id, idx],
-                countdown=dispatched_count * 2  # 每个任务延迟 2 秒
-            )
-
-            dispatched_count += 1
+        # 检查已投递的任务，只投递未投递的（断点续传）
+        dispatched, skipped = dispatch_publish_tasks(task_name, batch, [
+            (url, f"{config['custom_id_prefix']}-{batch_short}-{idx:04d}", idx)
+            for idx, url in enumerate(urls)
+        ])
+        dispatched_count = len(dispatched)
+        skipped_count = len(skipped)
 
         logger.info(
             f"[Task {task_id}] Dispatched {dispatched_count} tasks, skipped {skipped_count}"
@@ -1317,7 +1383,7 @@ def process_japan_post_tracking_10_excel(self, file_path, document_url=None):
             'warnings': list
         }
     """
-    from .models import SyncLog, TrackingBatch, TrackingJob
+    from .models import SyncLog, TrackingBatch
     import re
     import random
     import uuid
@@ -1442,25 +1508,12 @@ def process_japan_post_tracking_10_excel(self, file_path, document_url=None):
             logger.info(f"[Task {task_id}] Found existing TrackingBatch {batch_short}")
 
         # Step 5: 批量投递任务到 publish_tracking_queue
-        dispatched_count = 0
-        skipped_count = 0
-
-        for idx, (url, custom_id_suffix, start_row) in enumerate(url_data):
-            custom_id = f"{config['custom_id_prefix']}-{batch_short}-{custom_id_suffix}"
-
-            # 检查是否已投递
-            if TrackingJob.objects.filter(batch=batch, custom_id=custom_id).exists():
-                skipped_count += 1
-                logger.debug(f"[Task {task_id}] Skipping already dispatched: {custom_id}")
-                continue
-
-            # 投递任务
-            publish_tracking_batch.apply_async(
-                args=[task_name, url, batch_uuid_str, custom_id, start_row],
-                countdown=dispatched_count * 2  # 每个任务延迟 2 秒
-            )
-
-            dispatched_count += 1
+        dispatched, skipped = dispatch_publish_tasks(task_name, batch, [
+            (url, f"{config['custom_id_prefix']}-{batch_short}-{custom_id_suffix}", start_row)
+            for url, custom_id_suffix, start_row in url_data
+        ])
+        dispatched_count = len(dispatched)
+        skipped_count = len(skipped)
 
         logger.info(
             f"[Task {task_id}] Dispatched {dispatched_count} tasks, skipped {skipped_count}"
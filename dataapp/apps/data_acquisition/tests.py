@@ -1,3 +1,186 @@
-from django.test import TestCase
+import io
+import threading
+import time
+import uuid
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+import requests
+from django.test import SimpleTestCase, TestCase, override_settings
+from openpyxl import Workbook, load_workbook
+
+from .rate_limiter import TokenBucket
+
+
+class TokenBucketTests(SimpleTestCase):
+    """WebScraper 令牌桶：多 worker 并发取令牌时不能超过配额"""
+
+    def test_burst_then_wait(self):
+        bucket = TokenBucket(fakeredis.FakeRedis(), 'test:bucket', capacity=3, refill_rate=0.5)
+        self.assertEqual([bucket.acquire()[0] for _ in range(4)], [True, True, True, False])
+        acquired, wait = bucket.acquire()
+        self.assertFalse(acquired)
+        self.assertGreater(wait, 1.0)
+        self.assertLessEqual(wait, 2.0)
+
+    def test_concurrent_quota(self):
+        server = fakeredis.FakeServer()
+        capacity, rate, duration = 5, 40.0, 1.0
+        granted = []
+        lock = threading.Lock()
+
+        def worker():
+            # 每个线程一个独立连接，模拟不同的 Celery worker
+            bucket = TokenBucket(fakeredis.FakeRedis(server=server), 'test:bucket', capacity, rate)
+            deadline = time.monotonic() + duration
+            while time.monotonic() < deadline:
+                acquired, wait = bucket.acquire()
+                if acquired:
+                    with lock:
+                        granted.append(time.monotonic())
+                else:
+                    time.sleep(min(wait, 0.01))
+
+        start = time.monotonic()
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.monotonic() - start
+
+        self.assertLessEqual(len(granted), capacity + rate * elapsed + 1)
+        # 任意 0.5 秒窗口内也不能超过 capacity + 补充量
+        for i, t0 in enumerate(granted):
+            in_window = sum(1 for t in granted[i:] if t - t0 <= 0.5)
+            self.assertLessEqual(in_window, capacity + rate * 0.5 + 1)
+        # 桶不会被锁死：补充的令牌都能被取走
+        self.assertGreaterEqual(len(granted), capacity + rate * duration * 0.5)
+
+
+class PublishTrackingBatchTests(TestCase):
+    """publish_tracking_batch：取不到令牌时延后重新入队，不调用 API"""
+
+    def test_deferred_when_rate_limited(self):
+        from .models import TrackingBatch
+        from . import tasks
+
+        batch = TrackingBatch.objects.create(
+            batch_uuid=uuid.uuid4(), file_path='test.xlsx', task_name='official_website_tracking', total_jobs=1,
+        )
+        empty = TokenBucket(fakeredis.FakeRedis(), 'test:bucket', capacity=1, refill_rate=0.01)
+        empty.acquire()
+
+        with mock.patch.object(tasks, 'get_webscraper_bucket', return_value=empty), \
+                mock.patch.object(tasks.publish_tracking_batch, 'apply_async') as apply_async, \
+                mock.patch.object(tasks.requests, 'post') as post:
+            result = tasks.publish_tracking_batch.run(
+                'official_website_tracking', 'https://example.com', str(batch.batch_uuid), 'owt-test-0000', 0
+            )
+
+        self.assertEqual(result['status'], 'deferred')
+        self.assertGreater(result['retry_in'], 90)
+        post.assert_not_called()
+        apply_async.assert_called_once()
+        self.assertEqual(apply_async.call_args.kwargs['countdown'], result['retry_in'])
+
+
+def _workbook_bytes(rows):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(['tracking_number', 'url', 'result'])
+    for i in range(rows):
+        sheet.append([f'T{i:04d}', f'https://example.com/{i}', None])
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+@override_settings(
+    TRACKING_WRITEBACK_DEBOUNCE=0,
+    NEXTCLOUD_CONFIG={'webdav_hostname': 'http://nc/dav/', 'webdav_login': 'u', 'webdav_password': 'p'},
+)
+class CoalescedWritebackTests(TestCase):
+    """合并回写：同一文件的逐行回写只产生一次下载 / 上传，上传带 If-Match"""
+
+    FILE = 'tracking/OWT-test.xlsx'
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.uploads = []
+        patcher = mock.patch('apps.data_acquisition.excel_writeback._schedule_flush')
+        self.schedule = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _get(self, *etags):
+        etags = iter(etags)
+
+        def get(url, **kwargs):
+            return mock.Mock(status_code=200, content=_workbook_bytes(500), headers={'ETag': next(etags)})
+        return get
+
+    def _put(self, *statuses):
+        statuses = iter(statuses)
+
+        def put(url, data=None, headers=None, **kwargs):
+            status = next(statuses)
+            self.uploads.append((data, headers))
+            response = mock.Mock(status_code=status)
+            if status >= 400:
+                response.raise_for_status.side_effect = requests.HTTPError(f'{status} Locked')
+            return response
+        return put
+
+    def test_batch_is_one_round_trip(self):
+        from .excel_writeback import flush_pending_writeback, queue_writeback
+
+        for i in range(500):
+            queue_writeback(self.FILE, {i: f'data-{i}'}, client=self.redis)
+        queue_writeback(self.FILE, {0: 'data-0-latest'}, client=self.redis)
+        self.schedule.assert_called_once()
+
+        with mock.patch('requests.get', side_effect=self._get('"e1"')) as get, \
+                mock.patch('requests.put', side_effect=self._put(201)):
+            result = flush_pending_writeback(self.FILE, client=self.redis)
+
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual(result['written'], 500)
+        self.assertEqual(get.call_count, 1)
+        data, headers = self.uploads[0]
+        self.assertEqual(headers, {'If-Match': '"e1"'})
+        sheet = load_workbook(io.BytesIO(data)).active
+        self.assertEqual(sheet['C2'].value, 'data-0-latest')
+        self.assertEqual(sheet['C501'].value, 'data-499')
+        self.assertEqual(flush_pending_writeback(self.FILE, client=self.redis)['status'], 'empty')
+
+    def test_etag_conflict_reapplies(self):
+        from .excel_writeback import flush_pending_writeback, queue_writeback
+
+        queue_writeback(self.FILE, {3: 'x'}, client=self.redis)
+        with mock.patch('requests.get', side_effect=self._get('"e1"', '"e2"')) as get, \
+                mock.patch('requests.put', side_effect=self._put(412, 204)):
+            result = flush_pending_writeback(self.FILE, client=self.redis)
+
+        self.assertEqual(result['downloads'], 2)
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual([h for _, h in self.uploads], [{'If-Match': '"e1"'}, {'If-Match': '"e2"'}])
+
+    def test_locked_file_is_requeued(self):
+        from .excel_writeback import _writeback_keys, flush_pending_writeback, queue_writeback
+
+        queue_writeback(self.FILE, {1: 'old', 2: 'b'}, client=self.redis)
+        locked = self._put(423)
+
+        def put(url, **kwargs):
+            # 上传期间第 1 行有了新值，重新入队时不能被旧值覆盖
+            queue_writeback(self.FILE, {1: 'new'}, client=self.redis)
+            return locked(url, **kwargs)
+
+        with mock.patch('requests.get', side_effect=self._get('"e1"')), \
+                mock.patch('requests.put', side_effect=put):
+            result = flush_pending_writeback(self.FILE, client=self.redis)
+
+        self.assertEqual(result['status'], 'retrying')
+        pending = self.redis.hgetall(_writeback_keys(self.FILE)[0])
+        self.assertEqual(pending, {b'1': b'new', b'2': b'b'})
+        self.assertEqual(self.schedule.call_args.kwargs['attempt'], 1)
@@ -165,7 +165,8 @@ class TrackingNumberEmptyWorker:
         from apps.data_acquisition.tasks import publish_tracking_batch
 
         # Dispatch task to publish_tracking_queue
-        # Use countdown for rate limiting (2 seconds per task)
+        # Stagger tasks by 2 seconds; the API rate itself is enforced by the
+        # shared token bucket inside publish_tracking_batch
         result = publish_tracking_batch.apply_async(
             args=[self.TASK_NAME, url, batch_uuid_str, custom_id, index],
             countdown=index * 2  # 2 second delay per task
@@ -234,6 +234,16 @@ EXCEL_OUTPUT_PATH_DASHBOARD = 'Data_Dashboard/'
 # Set to False to disable historical tracking and only keep latest version
 ENABLE_EXCEL_HISTORICAL_TRACKING = config('ENABLE_EXCEL_HISTORICAL_TRACKING', default=True, cast=bool)
 
+# Tracking 结果回写 Excel（apps/data_acquisition/excel_writeback.py）
+# 即时回写：每个任务完成后暂存到 Redis，按文件合并后一次写入
+TRACKING_IMMEDIATE_WRITEBACK = config('TRACKING_IMMEDIATE_WRITEBACK', default=False, cast=bool)
+# 最后一次写入后静默多少秒再 flush；最早一次写入后最多等待多少秒
+TRACKING_WRITEBACK_DEBOUNCE = config('TRACKING_WRITEBACK_DEBOUNCE', default=10, cast=int)
+TRACKING_WRITEBACK_MAX_WAIT = config('TRACKING_WRITEBACK_MAX_WAIT', default=60, cast=int)
+# flush 失败（文件被锁定等）后的重投：初始延迟（秒，指数退避）和最大次数
+TRACKING_WRITEBACK_RETRY_DELAY = config('TRACKING_WRITEBACK_RETRY_DELAY', default=30, cast=int)
+TRACKING_WRITEBACK_MAX_ATTEMPTS = config('TRACKING_WRITEBACK_MAX_ATTEMPTS', default=5, cast=int)
+
 # Batch Stats API Token
 # Simple token authentication for batch encoding stats API
 BATCH_STATS_API_TOKEN = config('BATCH_STATS_API_TOKEN', default='FAZEHBZu0g2o3sRfQ58MxRC0w0htdUoPaLDN8R3ku8dJxk5exDgEUC1GtbJhwWWJKr4s8E')
@@ -242,6 +252,14 @@ BATCH_STATS_API_TOKEN = config('BATCH_STATS_API_TOKEN', default='FAZEHBZu0g2o3sR
 # WebScraper Cloud API 访问令牌（在 Web Scraper Cloud 的 API 页面可见）
 WEB_SCRAPER_API_TOKEN = "YNndD5WeM3UFO32RKdrogf2p4hNVPlZE3r3rLCoHD3B4idpJcjyqRJbNndXM"
 
+# WebScraper 发布限流（Redis 令牌桶，见 apps/data_acquisition/rate_limiter.py）
+# 官方限制每 15 分钟 200 个任务：每 PERIOD 秒补充 COUNT 个令牌，突发上限 CAPACITY
+WEBSCRAPER_RATE_LIMIT_CAPACITY = config('WEBSCRAPER_RATE_LIMIT_CAPACITY', default=10, cast=int)
+WEBSCRAPER_RATE_LIMIT_COUNT = config('WEBSCRAPER_RATE_LIMIT_COUNT', default=150, cast=int)
+WEBSCRAPER_RATE_LIMIT_PERIOD = config('WEBSCRAPER_RATE_LIMIT_PERIOD', default=900, cast=int)
+# 被限流的任务重新入队时附加的随机延迟上限（秒）
+WEBSCRAPER_DEFER_JITTER = config('WEBSCRAPER_DEFER_JITTER', default=30, cast=int)
+
 # 导出地址模板（如官方变更，可在这里改）
 # WEB_SCRAPER_EXPORT_URL_TEMPLATE = "https://api.webscraper.io/api/v1/scraping-job/{job_id}/csv?api_token=vrbBYdfX805GgpQoDfgyPcm45QMoEx6ygvkfHohjo3CJBky7qO0oiFbXUjAp"
 WEB_SCRAPER_EXPORT_URL_TEMPLATE = "https://api.webscraper.io/api/v1/scraping-job/{job_id}/csv"
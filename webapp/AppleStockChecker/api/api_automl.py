@@ -19,6 +19,7 @@ from AppleStockChecker.tasks.automl_tasks import (
     quantification_of_impact,
     schedule_automl_jobs,
     run_preprocessing_for_job,
+    run_sliding_window_analysis,
     run_var_for_job,
     run_impact_for_job,
 )
@@ -488,6 +489,8 @@ class SlidingWindowAnalysisView(APIView):
             created_jobs = []
             existing_jobs = []
             skipped_jobs = []
+            # 未完成的窗口汇总后一次派发：批任务内共享 PSTA 读取、面板与 VAR 充分统计量
+            to_analyze = []
 
             for window in windows:
                 # 检查是否已存在相同窗口的任务
@@ -517,15 +520,8 @@ class SlidingWindowAnalysisView(APIView):
                         "status": existing.preprocessing_status
                     })
 
-                    # 重新触发预处理
-                    if existing.preprocessing_status in [
-                        AutomlCausalJob.StageStatus.PENDING,
-                        AutomlCausalJob.StageStatus.FAILED,
-                    ]:
-                        run_preprocessing_for_job.apply_async(
-                            args=[existing.id],
-                            queue="automl_preprocessing"
-                        )
+                    # 重新触发（已完成的阶段在任务内跳过）
+                    to_analyze.append(existing.id)
                 else:
                     # 创建新任务
                     job = AutomlCausalJob.objects.create(
@@ -542,13 +538,16 @@ class SlidingWindowAnalysisView(APIView):
                         "window_end": window["end"].isoformat(),
                     })
 
-                    # 触发预处理任务
-                    run_preprocessing_for_job.apply_async(
-                        args=[job.id],
-                        queue="automl_preprocessing"
-                    )
+                    to_analyze.append(job.id)
                     logger.info(f"Created sliding window job {job.id} for {iphone.part_number}")
 
+            # 触发滑动窗口分析任务
+            if to_analyze:
+                run_sliding_window_analysis.apply_async(
+                    args=[to_analyze],
+                    queue="automl_cause_effect"
+                )
+
             return Response({
                 "status": "success",
                 "iphone": {
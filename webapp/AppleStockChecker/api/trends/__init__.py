@@ -2,11 +2,12 @@
 from .model_colors import trends_model_colors
 from .avg_only import TrendsAvgOnlyApiView
 from .color_std import TrendsColorStdApiView
-from .core import compute_trends_for_model_capacity
+from .core import compute_trends_for_model_capacity, compute_trend_arrays
 
 __all__ = [
     "trends_model_colors",
     "TrendsAvgOnlyApiView",
     "TrendsColorStdApiView",
     "compute_trends_for_model_capacity",
+    "compute_trend_arrays",
 ]
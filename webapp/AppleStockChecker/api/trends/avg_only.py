@@ -1,4 +1,4 @@
-from .core import compute_trends_for_model_capacity
+from .core import compute_trend_arrays
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -22,15 +22,15 @@ class TrendsAvgOnlyApiView(APIView):
         if not model_name or not capacity_gb:
             return Response({"detail": "model_name/capacity_gb 不能为空"}, status=400)
 
-        data = compute_trends_for_model_capacity(
+        data = compute_trend_arrays(
             model_name=model_name,
             capacity_gb=capacity_gb,
             days=days,
             selected_shops=shops,
             avg_cfg=avg_cfg,
             grid_cfg=grid_cfg,
-        )
-        # 只返回平均线，丢弃 stores，以缩小体积
+        ).to_dict(include_stores=False)
+        # 只返回平均线，不生成 stores 明细，以缩小体积
         resp = {
             "merged": {"avg": data["merged"]["avg"]},
             "per_color": [{"color": it["color"], "avg": it["avg"]} for it in data["per_color"]],
@@ -1,15 +1,22 @@
 """
 价格趋势计算核心：机型+容量下的回收价时间序列、重采样、A/B/C 平均线。
+
+计算全部在 NumPy 数组上完成：
+  - 每个 (颜色, 店) 的原始点用 searchsorted 重采样到网格，组成 (颜色 × 店 × 网格) 立方体；
+  - 跨颜色 / 跨店均值为带掩码的 nanmean，B/C 线为累积和实现的时间窗移动平均；
+  - {"x", "y"} 字典只在 TrendResult.to_dict() 组装响应时生成。
+15 分钟格网格的取数走 services.trend_cache 的预聚合桶序列，PG 只读未缓存的尾部。
 """
 from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from django.utils import timezone
-from ...models import Iphone, PurchasingShopPriceRecord
-from typing import Dict, List, Tuple
+from ...models import Iphone, PurchasingShopPriceRecord, SecondHandShop
+from ...services import trend_cache
+from typing import Dict, List, Optional, Tuple
 from datetime import timedelta, datetime
 from django.conf import settings
-import math
-import os
+import numpy as np
 import pytz
 
 # =========================
@@ -19,7 +26,6 @@ JST = pytz.timezone('Asia/Tokyo')
 
 TREND_MAX_LOOKBACK_DAYS = int(getattr(settings, "TREND_MAX_LOOKBACK_DAYS", 90))
 TREND_DB_MAX_WORKERS    = int(getattr(settings, "TREND_DB_MAX_WORKERS", 6))
-TREND_CPU_MAX_WORKERS   = int(getattr(settings, "TREND_CPU_MAX_WORKERS", 0)) or (os.cpu_count() or 2)
 TREND_DOWNSAMPLE_TARGET = int(getattr(settings, "TREND_DOWNSAMPLE_TARGET", 0))  # 0=关闭，>0=每条最多点数
 
 
@@ -58,67 +64,163 @@ def _build_time_grid(start_dt, end_dt, step_minutes: int = 15, offset_minute: in
     return grid
 
 
+# =========================
+# 向量化内核
+# =========================
+NEAR_MS = 12 * 60 * 1000                # 20 分钟
+FALLBACK_MS = 120 * 60 * 60 * 1000      # 12 小时
+
+
 def _resample_nearest(
-    points: List[Dict],
-    grid_ms: List[int],
+    xs: np.ndarray,
+    ys: np.ndarray,
+    grid: np.ndarray,
     *,
-    near_ms: int = 12 * 60 * 1000,      # 20 分钟
-    fallback_ms: int = 120 * 60 * 60 * 1000  # 12 小时
-) -> List[Dict]:
+    near_ms: int = NEAR_MS,
+    fallback_ms: int = FALLBACK_MS,
+) -> np.ndarray:
     """
     历史最近点重采样（不允许未来点）：
       - 对每个网格 t，选择最后一个 <= t 的记录（它就是历史最近点）；
-      - 若该点与 t 的时间差 <= near_ms（默认 20 分钟），使用它；
-      - 否则若 <= fallback_ms（默认 12 小时），使用它；
-      - 否则返回 None。
-    要求 points 按 x 升序。
+      - 若该点与 t 的时间差 <= fallback_ms（默认 12 小时，不小于 near_ms），使用它；
+      - 否则为 NaN。
+    要求 xs 升序；返回与 grid 等长的 float64 数组。
     """
-    if fallback_ms < near_ms:
-        fallback_ms = near_ms
-
-    n = len(points)
-    if n == 0:
-        return [{"x": t, "y": None} for t in grid_ms]
-
-    out: List[Dict] = []
-    i = 0  # 维护 points[i] 为最后一个 <= t 的点（若存在）
-
-    for t in grid_ms:
-        # 推进到最后一个 <= t 的点
-        while i + 1 < n and points[i + 1]["x"] <= t:
-            i += 1
-
-        if points[i]["x"] <= t:
-            delta = t - points[i]["x"]
-            if delta <= near_ms:
-                out.append({"x": t, "y": points[i].get("y")})
-            elif delta <= fallback_ms:
-                out.append({"x": t, "y": points[i].get("y")})
-            else:
-                out.append({"x": t, "y": None})
-        else:
-            # 没有任何 <= t 的点（全部在未来）
-            out.append({"x": t, "y": None})
-
+    fallback_ms = max(fallback_ms, near_ms)
+    out = np.full(grid.shape, np.nan)
+    if xs.size == 0:
+        return out
+    idx = np.searchsorted(xs, grid, side="right") - 1
+    has_past = idx >= 0
+    j = idx[has_past]
+    out[has_past] = np.where(grid[has_past] - xs[j] <= fallback_ms, ys[j], np.nan)
     return out
 
 
+def _masked_nanmean(values: np.ndarray, mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    沿第 0 轴的 nanmean；mask 为第 0 轴的布尔选择（None=全选）。
+    全为 NaN（或未选中任何行）的位置返回 NaN，不产生 RuntimeWarning。
+    """
+    if mask is not None:
+        values = values[mask]
+    if values.shape[0] == 0:
+        return np.full(values.shape[1:], np.nan)
+    valid = ~np.isnan(values)
+    cnt = valid.sum(axis=0)
+    total = np.where(valid, values, 0.0).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(cnt > 0, total / cnt, np.nan)
+
+
+def _moving_average(xs: np.ndarray, ys: np.ndarray, window_minutes: int) -> np.ndarray:
+    """时间窗(分钟)移动平均（包含当前点，窗口 [t-w, t]）；xs 升序、ys 无 NaN。"""
+    if xs.size == 0:
+        return ys.astype(np.float64)
+    wms = max(1, int(window_minutes)) * 60 * 1000
+    csum = np.concatenate(([0.0], np.cumsum(ys, dtype=np.float64)))
+    right = np.arange(1, xs.size + 1)
+    left = np.searchsorted(xs, xs - wms, side="left")
+    return (csum[right] - csum[left]) / (right - left)
+
+
+def _to_points(xs: np.ndarray, ys: np.ndarray, *, as_int: bool = False) -> List[Dict]:
+    """数组 → [{x, y}]；NaN → None。as_int=True 时 y 还原为整数円"""
+    nan = np.isnan(ys)
+    vals = (np.where(nan, 0, ys).astype(np.int64) if as_int else ys).astype(object)
+    vals[nan] = None
+    return [{"x": x, "y": y} for x, y in zip(xs.tolist(), vals.tolist())]
+
+
 def _moving_average_time(points: List[Dict], window_minutes: int) -> List[Dict]:
     """时间窗(分钟)移动平均（包含当前点），在 A 线结果上做平滑。"""
     if not points:
         return []
-    wms = max(1, int(window_minutes)) * 60 * 1000
     pts = sorted(points, key=lambda p: p["x"])
-    out = []
-    head = 0
-    s = 0.0
-    c = 0
-    for i, pt in enumerate(pts):
-        s += float(pt["y"]); c += 1
-        while head <= i and (pt["x"] - pts[head]["x"]) > wms:
-            s -= float(pts[head]["y"]); c -= 1; head += 1
-        out.append({"x": pt["x"], "y": s / c if c else None})
-    return out
+    xs = np.fromiter((p["x"] for p in pts), dtype=np.int64, count=len(pts))
+    ys = np.fromiter((float(p["y"]) for p in pts), dtype=np.float64, count=len(pts))
+    return _to_points(xs, _moving_average(xs, ys, window_minutes))
+
+
+@dataclass
+class AvgLines:
+    """A 线（只保留有值的网格点）及其 B/C 移动平均"""
+    x: np.ndarray
+    a: np.ndarray
+    b: np.ndarray
+    c: np.ndarray
+
+    @classmethod
+    def from_grid(cls, grid: np.ndarray, mean: np.ndarray, b_win: int, c_win: int) -> "AvgLines":
+        keep = ~np.isnan(mean)
+        x, a = grid[keep], mean[keep]
+        return cls(x=x, a=a, b=_moving_average(x, a, b_win), c=_moving_average(x, a, c_win))
+
+    def to_dict(self, idxs: Optional[List[int]] = None) -> Dict[str, List[Dict]]:
+        x, a, b, c = self.x, self.a, self.b, self.c
+        if idxs is not None:
+            sel = np.asarray([i for i in idxs if i < x.size], dtype=np.int64)
+            x, a, b, c = x[sel], a[sel], b[sel], c[sel]
+        return {"A": _to_points(x, a), "B": _to_points(x, b), "C": _to_points(x, c)}
+
+
+@dataclass
+class TrendResult:
+    """
+    compute_trend_arrays 的结果（全部为数组）。
+
+    cube[c, s, g]：颜色 c、店 s 在网格 g 的重采样价格（NaN=无数据）
+    present[c, s]：该 (颜色, 店) 在窗口内有原始点
+    merged[s, g]：跨颜色均值
+    """
+    shop_order_all: List[str]
+    shop_order_present: List[str]
+    colors: List[str]
+    grid: np.ndarray
+    cube: np.ndarray
+    present: np.ndarray
+    merged: np.ndarray
+    merged_avg: AvgLines
+    per_color_avg: List[AvgLines]
+    downsample_target: int = 0
+    cache: Optional[dict] = None  # 预聚合缓存统计（未走缓存为 None）
+
+    def to_dict(self, include_stores: bool = True) -> dict:
+        """组装 API 响应（此时才生成 {x, y} 字典）；include_stores=False 时只输出平均线"""
+        grid_idxs = avg_idxs = None
+        grid = self.grid
+        if self.downsample_target > 0:
+            grid_idxs = _compute_stride_indices(grid.size, self.downsample_target)
+            avg_idxs = grid_idxs
+            grid = grid[grid_idxs]
+
+        def _store(row: np.ndarray, as_int: bool = False) -> List[Dict]:
+            return _to_points(grid, row if grid_idxs is None else row[grid_idxs], as_int=as_int)
+
+        merged = {"avg": self.merged_avg.to_dict(avg_idxs)}
+        if include_stores:
+            merged["stores"] = [
+                {"label": shop, "data": _store(self.merged[s])}
+                for s, shop in enumerate(self.shop_order_present)
+            ]
+
+        per_color = []
+        for c, color in enumerate(self.colors):
+            item = {"color": color}
+            if include_stores:
+                item["stores"] = [
+                    {"label": shop, "data": _store(self.cube[c, s], as_int=True)}
+                    for s, shop in enumerate(self.shop_order_present) if self.present[c, s]
+                ]
+            item["avg"] = self.per_color_avg[c].to_dict(avg_idxs)
+            per_color.append(item)
+
+        out = {"colors": self.colors, "merged": merged, "per_color": per_color}
+        if include_stores:
+            out = {"shop_order_all": self.shop_order_all, "shop_order_present": self.shop_order_present, **out}
+        if self.cache is not None:
+            out["cache"] = self.cache
+        return out
 
 
 def _order_shops(all_names: List[str]) -> List[str]:
@@ -130,28 +232,6 @@ def _order_shops(all_names: List[str]) -> List[str]:
     return sorted(all_names, key=key)
 
 
-def _downsample_minmax(points: List[Dict], target: int) -> List[Dict]:
-    """简易 min/max 桶降采样，保留趋势峰谷；target<=0 时不降采样"""
-    if target <= 0:
-        return points
-    n = len(points)
-    if n <= target:
-        return points
-    bucket = n // target
-    out: List[Dict] = []
-    for i in range(0, n, bucket):
-        chunk = points[i:i + bucket]
-        if not chunk:
-            continue
-        # 取时间顺序中的最小/最大 y
-        ymin = min(chunk, key=lambda p: (p["y"] if p["y"] is not None else math.inf))
-        ymax = max(chunk, key=lambda p: (p["y"] if p["y"] is not None else -math.inf))
-        uniq = {id(ymin): ymin}
-        uniq[id(ymax)] = ymax
-        out.extend(sorted(uniq.values(), key=lambda p: p["x"]))
-    return out
-
-
 def _compute_stride_indices(n: int, target: int) -> list[int]:
     """给定序列长度 n 和目标点数 target，生成一组共享的等步长索引，保证首尾保留。"""
     if target <= 0 or n <= target:
@@ -166,60 +246,104 @@ def _compute_stride_indices(n: int, target: int) -> list[int]:
 
 
 # =========================
-# 并行计算（Map / Reduce）
+# 并行取数
 # =========================
-def _fetch_points_for_color(model_name: str, capacity_gb: int, color: str, history_after, fields=("recorded_at", "price_new", "shop__name")) -> Dict[str, List[Dict]]:
+def _fetch_points_for_color(model_name: str, capacity_gb: int, color: str, history_after) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
     """
     在线程池中调用：读取某颜色下所有 PN 的记录（限制最早时间 history_after），仅取必要字段，
-    输出：{shop -> [{x,y}...升序]}
+    输出：{shop -> (x 毫秒时间戳 int64 升序, y 价格 float64)}
     """
-    tz = timezone.get_current_timezone()
     pns = list(Iphone.objects.filter(model_name=model_name, capacity_gb=capacity_gb, color=color)
                .values_list("part_number", flat=True))
-    store_map: Dict[str, List[Dict]] = defaultdict(list)
     if not pns:
-        return store_map
+        return {}
 
-    qs = PurchasingShopPriceRecord.objects.filter(
+    rows = PurchasingShopPriceRecord.objects.filter(
         iphone__part_number__in=pns,
         recorded_at__gte=history_after
-    ).select_related("shop").only(*fields).order_by("recorded_at")
+    ).order_by("recorded_at").values_list("shop__name", "recorded_at", "price_new")
+
+    cols: Dict[str, Tuple[List[int], List[float]]] = defaultdict(lambda: ([], []))
+    for shop_name, recorded_at, price in rows.iterator():
+        xs, ys = cols[_norm_name(shop_name)]
+        xs.append(int(recorded_at.timestamp() * 1000))
+        ys.append(price)
+
+    store_map: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+    for shop, (xs, ys) in cols.items():
+        x = np.asarray(xs, dtype=np.int64)
+        y = np.asarray(ys, dtype=np.float64)
+        order = np.argsort(x, kind="stable")
+        store_map[shop] = (x[order], y[order])
+    return store_map
 
-    # 组装轻量点集
-    for r in qs.iterator():
-        shop_name = _norm_name(r.shop.name)
-        t = int(timezone.localtime(r.recorded_at, tz).timestamp() * 1000)
-        store_map[shop_name].append({"x": t, "y": r.price_new})
 
-    # 排序
-    for shop in store_map:
-        store_map[shop].sort(key=lambda p: p["x"])
-    return store_map
+def _fetch_points_parallel(model_name: str, capacity_gb: int, colors: List[str], history_after):
+    """按颜色并行直接查 PG → {color: {shop: (xs, ys)}}"""
+    per_color_store_raw: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = {}
+    with ThreadPoolExecutor(max_workers=TREND_DB_MAX_WORKERS) as pool:
+        futures = {
+            pool.submit(_fetch_points_for_color, model_name, capacity_gb, color, history_after): color
+            for color in colors
+        }
+        for fut in as_completed(futures):
+            color = futures[fut]
+            try:
+                per_color_store_raw[color] = fut.result()
+            except Exception as e:
+                # 某色失败不应影响其它，记空
+                per_color_store_raw[color] = {}
+                print(f"[warn] fetch color={color} failed: {e}")
+    return per_color_store_raw
 
 
-def _resample_task(args: Tuple[str, str, List[Dict], List[int]]) -> Tuple[str, str, List[Dict]]:
+def _fetch_points_cached(model_name: str, capacity_gb: int, colors: List[str], history_after, now):
     """
-    在进程池中调用：对 (shop,color) 的原始点做最近邻重采样
-    入参：color, shop, points, grid_ms
-    出参：(color, shop, resampled_points)
+    经 trend_cache 取数（仅 15 分钟格网格）：缓存里是每 (PN, 店, 15 分钟桶) 的最后一条，
+    PG 只读水位线之后的尾部。同色多 PN、同名多店按桶合并，输出结构同 _fetch_points_parallel。
+    返回 (per_color_store_raw, TrendCacheStats)；Redis 不可用时返回 None。
     """
-    color, shop, points, grid_ms = args
-    seq = _resample_nearest(points, grid_ms)
-    return color, shop, seq
+    pn_colors: Dict[int, str] = dict(
+        Iphone.objects.filter(model_name=model_name, capacity_gb=capacity_gb, color__in=colors)
+        .values_list("id", "color")
+    )
+    loaded = trend_cache.load_points(pn_colors, history_after, now)
+    if loaded is None:
+        return None
+    rows_by_iphone, stats = loaded
+
+    shop_ids = {sid for shops in rows_by_iphone.values() for sid in shops}
+    shop_names = dict(SecondHandShop.objects.filter(pk__in=shop_ids).values_list("id", "name"))
+    parts: Dict[str, Dict[str, list]] = defaultdict(lambda: defaultdict(list))
+    for iid, shops in rows_by_iphone.items():
+        for sid, rows in shops.items():
+            shop = _norm_name(shop_names.get(sid))
+            if rows.size and shop:
+                parts[pn_colors[iid]][shop].append(rows)
+
+    per_color_store_raw: Dict[str, Dict[str, Tuple[np.ndarray, np.ndarray]]] = {color: {} for color in colors}
+    for color, shops in parts.items():
+        for shop, chunks in shops.items():
+            rows = trend_cache.merge_rows(chunks)
+            per_color_store_raw[color][shop] = (rows["x"].copy(), rows["y"].copy())
+    return per_color_store_raw, stats
+
+
+def _distinct_shop_names() -> List[str]:
+    return list(PurchasingShopPriceRecord.objects.values_list("shop__name", flat=True).distinct())
 
 
 # =========================
 # 核心计算
 # =========================
-def compute_trends_for_model_capacity(model_name: str,
-                                      capacity_gb: int,
-                                      days: int,
-                                      selected_shops: set[str],
-                                      avg_cfg: dict,
-                                      grid_cfg: dict | None = None) -> dict:
+def compute_trend_arrays(model_name: str,
+                         capacity_gb: int,
+                         days: int,
+                         selected_shops: set[str],
+                         avg_cfg: dict,
+                         grid_cfg: dict | None = None) -> TrendResult:
     """
-    机型+容量下的价格趋势计算：按颜色并行拉取、重采样、计算 A/B/C 平均线。
-    返回 merged（跨颜色每店+平均线）、per_color（每色每店+平均线）。
+    机型+容量下的价格趋势计算：按颜色并行拉取、重采样、计算 A/B/C 平均线，结果保持为数组。
     """
     timezone.activate(JST)
     tz = timezone.get_current_timezone()
@@ -229,7 +353,6 @@ def compute_trends_for_model_capacity(model_name: str,
     history_after = min(start_window, now - timedelta(days=TREND_MAX_LOOKBACK_DAYS))
 
     # 配置
-    A_cfg = (avg_cfg or {}).get("A", {})
     B_cfg = (avg_cfg or {}).get("B", {})
     C_cfg = (avg_cfg or {}).get("C", {})
     b_win = max(1, int(B_cfg.get("windowMinutes", 60)))
@@ -242,21 +365,17 @@ def compute_trends_for_model_capacity(model_name: str,
                   .values_list("color", flat=True).distinct())
     colors = sorted({_norm_name(c) for c in colors if _norm_name(c)})
 
-    # 1) DB I/O 并行：按颜色并行取数 → per_color_store_raw[color][shop] = points
-    per_color_store_raw: Dict[str, Dict[str, List[Dict]]] = {}
-    with ThreadPoolExecutor(max_workers=TREND_DB_MAX_WORKERS) as pool:
-        futures = {
-            pool.submit(_fetch_points_for_color, model_name, capacity_gb, color, history_after): color
-            for color in colors
-        }
-        for fut in as_completed(futures):
-            color = futures[fut]
-            try:
-                per_color_store_raw[color] = fut.result()
-            except Exception as e:
-                # 某色失败不应影响其它，记空
-                per_color_store_raw[color] = {}
-                print(f"[warn] fetch color={color} failed: {e}")
+    # 1) 取数 → per_color_store_raw[color][shop] = (xs, ys)
+    #    15 分钟格网格走预聚合缓存（只查 PG 尾部）；否则或 Redis 不可用时按颜色并行查 PG
+    cached = None
+    if trend_cache.cache_enabled() and trend_cache.grid_is_cacheable(step_minutes, offset_minute):
+        cached = _fetch_points_cached(model_name, capacity_gb, colors, history_after, now)
+    if cached is not None:
+        per_color_store_raw, cache_stats = cached
+        cache_meta = cache_stats.as_dict()
+    else:
+        per_color_store_raw = _fetch_points_parallel(model_name, capacity_gb, colors, history_after)
+        cache_meta = None
 
     # 2) 生成网格
 
@@ -273,13 +392,10 @@ def compute_trends_for_model_capacity(model_name: str,
         return first + timedelta(minutes=k * step_minutes)
 
     # 以已抓到的点列求"窗口内的最后时间戳"（毫秒）
-    last_ts_ms = None
-    for color_store in per_color_store_raw.values():  # dict: shop -> [{x,y}...]
-        for seq in color_store.values():  # seq: [{x(ms),y}, ...] 已按时间升序
-            if seq:
-                cand = seq[-1]["x"]
-                if (last_ts_ms is None) or (cand > last_ts_ms):
-                    last_ts_ms = cand
+    last_ts_ms = max(
+        (int(xs[-1]) for store in per_color_store_raw.values() for xs, _ in store.values() if xs.size),
+        default=None,
+    )
 
     # 以"now 或 最后点向上对齐网格"的更大者作为网格结束时间
     end_dt = now
@@ -287,129 +403,67 @@ def compute_trends_for_model_capacity(model_name: str,
         last_dt = timezone.make_aware(datetime.fromtimestamp(last_ts_ms / 1000), tz)
         end_dt = max(end_dt, _ceil_to_grid(last_dt, step_minutes, offset_minute, tz))
 
-    grid_ms = _build_time_grid(start_window, end_dt, step_minutes=step_minutes, offset_minute=offset_minute)
-    grid_len = len(grid_ms)
-
-    # 3) CPU 并行：对每个 (店,色) 做最近邻重采样
-    tasks: List[Tuple[str, str, List[Dict], List[int]]] = []
-    all_shops_set: set[str] = set()
-    for color, store_map in per_color_store_raw.items():
-        for shop, pts in store_map.items():
-            tasks.append((color, shop, pts, grid_ms))
-            all_shops_set.add(shop)
-
-    per_color_resampled: Dict[str, Dict[str, List[Dict]]] = {c: {} for c in colors}
-    if tasks:
-        with ThreadPoolExecutor(max_workers=TREND_CPU_MAX_WORKERS or 8) as tpool:
-            for color, shop, seq in tpool.map(_resample_task, tasks, chunksize=max(1, len(tasks) // 8 or 1)):
-                per_color_resampled[color][shop] = seq
-
-    # 4) 整理顺序（全量 & 本次窗口）
-    all_names_db = list(PurchasingShopPriceRecord.objects.values_list("shop__name", flat=True).distinct())
+    grid = np.asarray(
+        _build_time_grid(start_window, end_dt, step_minutes=step_minutes, offset_minute=offset_minute),
+        dtype=np.int64,
+    )
+
+    # 3) 整理顺序（全量 & 本次窗口）
+    all_names_db = trend_cache.distinct_shop_names(_distinct_shop_names)
     names_norm = [_norm_name(n) for n in all_names_db if _norm_name(n)]
     names_unique = list(dict.fromkeys(names_norm))
     shop_order_all = _order_shops(names_unique)
+    all_shops_set = {shop for store in per_color_store_raw.values() for shop in store}
     shop_order_present = _order_shops(sorted(all_shops_set))
-
-    # 5) merged（跨颜色、每店）= 同一网格点，对所有颜色做横向均值（连续 15min）
-    merged_store_resampled_avg: Dict[str, List[Dict]] = {}
-    for shop in shop_order_present:
-        series = []
-        for idx in range(grid_len):
-            x = grid_ms[idx]
-            ys = []
-            for color, store_map in per_color_resampled.items():
-                seq = store_map.get(shop)
-                if not seq:
-                    continue
-                y = seq[idx].get("y")
-                if y is not None:
-                    ys.append(float(y))
-            series.append({"x": x, "y": (sum(ys)/len(ys)) if ys else None})
-        series = _downsample_minmax(series, TREND_DOWNSAMPLE_TARGET)
-        merged_store_resampled_avg[shop] = series
-
-    # 6) 横向均值（在网格上对勾选店做均值）
+    shop_idx = {shop: i for i, shop in enumerate(shop_order_present)}
+
+    # 4) 重采样到 (颜色 × 店 × 网格) 立方体
+    cube = np.full((len(colors), len(shop_order_present), grid.size), np.nan)
+    present = np.zeros((len(colors), len(shop_order_present)), dtype=bool)
+    for c, color in enumerate(colors):
+        for shop, (xs, ys) in per_color_store_raw.get(color, {}).items():
+            s = shop_idx[shop]
+            cube[c, s] = _resample_nearest(xs, ys, grid)
+            present[c, s] = True
+
+    # 5) merged（跨颜色、每店）= 同一网格点对所有颜色做横向均值；6) 勾选店横向均值 → A/B/C
     sel_shops = {_norm_name(s) for s in selected_shops or set(shop_order_all)}
-    any_series = next(iter(merged_store_resampled_avg.values()), [])
-    seriesA_merged: List[Dict] = []
-    for idx in range(len(any_series)):
-        x = any_series[idx]["x"]
-        ys = []
-        for shop, seq in merged_store_resampled_avg.items():
-            if shop not in sel_shops:
-                continue
-            y = seq[idx].get("y") if idx < len(seq) else None
-            if y is not None:
-                ys.append(float(y))
-        if ys:
-            seriesA_merged.append({"x": x, "y": sum(ys)/len(ys)})
-    seriesB_merged = _moving_average_time(seriesA_merged, b_win)
-    seriesC_merged = _moving_average_time(seriesA_merged, c_win)
-
-    if TREND_DOWNSAMPLE_TARGET > 0:
-        n = grid_len
-        idxs = _compute_stride_indices(n, TREND_DOWNSAMPLE_TARGET)
-        for shop in shop_order_present:
-            seq = merged_store_resampled_avg[shop]
-            merged_store_resampled_avg[shop] = [seq[i] for i in idxs if i < len(seq)]
-        seriesA_merged = [seriesA_merged[i] for i in idxs if i < len(seriesA_merged)]
-        seriesB_merged = [seriesB_merged[i] for i in idxs if i < len(seriesB_merged)]
-        seriesC_merged = [seriesC_merged[i] for i in idxs if i < len(seriesC_merged)]
-
-    merged = {
-        "stores": [
-            {"label": shop, "data": merged_store_resampled_avg[shop]}
-            for shop in shop_order_present
-        ],
-        "avg": {"A": seriesA_merged, "B": seriesB_merged, "C": seriesC_merged}
-    }
-
-    # 7) per_color：每色也返回"重采样后的每店曲线"及其 A/B/C
-    per_color = []
-    for color in colors:
-        stores_rs = per_color_resampled.get(color, {})
-        stores_list = [{"label": shop, "data": _downsample_minmax(stores_rs[shop], TREND_DOWNSAMPLE_TARGET)}
-                       for shop in shop_order_present if shop in stores_rs]
-
-        any_seq = next(iter(stores_rs.values()), [])
-        seriesA: List[Dict] = []
-        for idx in range(len(any_seq)):
-            x = any_seq[idx]["x"]
-            ys = []
-            for shop, seq in stores_rs.items():
-                if shop not in sel_shops:
-                    continue
-                y = seq[idx].get("y") if idx < len(seq) else None
-                if y is not None:
-                    ys.append(float(y))
-            if ys:
-                seriesA.append({"x": x, "y": sum(ys)/len(ys)})
-        seriesB = _moving_average_time(seriesA, b_win)
-        seriesC = _moving_average_time(seriesA, c_win)
-
-        if TREND_DOWNSAMPLE_TARGET > 0:
-            n = grid_len
-            idxs = _compute_stride_indices(n, TREND_DOWNSAMPLE_TARGET)
-            for shop in shop_order_present:
-                if shop in stores_rs:
-                    seq = stores_rs[shop]
-                    stores_rs[shop] = [seq[i] for i in idxs if i < len(seq)]
-            seriesA = [seriesA[i] for i in idxs if i < len(seriesA)]
-            seriesB = [seriesB[i] for i in idxs if i < len(seriesB)]
-            seriesC = [seriesC[i] for i in idxs if i < len(seriesC)]
-            stores_list = [{"label": shop, "data": stores_rs[shop]} for shop in shop_order_present if shop in stores_rs]
-
-        per_color.append({
-            "color": color,
-            "stores": stores_list,
-            "avg": {"A": seriesA, "B": seriesB, "C": seriesC}
-        })
-
-    return {
-        "shop_order_all": shop_order_all,
-        "shop_order_present": shop_order_present,
-        "colors": colors,
-        "merged": merged,
-        "per_color": per_color,
-    }
+    sel_mask = np.array([shop in sel_shops for shop in shop_order_present], dtype=bool)
+
+    merged = _masked_nanmean(cube)
+    merged_avg = AvgLines.from_grid(grid, _masked_nanmean(merged, sel_mask), b_win, c_win)
+
+    # 7) per_color：每色的勾选店横向均值 → A/B/C
+    per_color_avg = [
+        AvgLines.from_grid(grid, _masked_nanmean(cube[c], sel_mask), b_win, c_win)
+        for c in range(len(colors))
+    ]
+
+    return TrendResult(
+        shop_order_all=shop_order_all,
+        shop_order_present=shop_order_present,
+        colors=colors,
+        grid=grid,
+        cube=cube,
+        present=present,
+        merged=merged,
+        merged_avg=merged_avg,
+        per_color_avg=per_color_avg,
+        downsample_target=TREND_DOWNSAMPLE_TARGET,
+        cache=cache_meta,
+    )
+
+
+def compute_trends_for_model_capacity(model_name: str,
+                                      capacity_gb: int,
+                                      days: int,
+                                      selected_shops: set[str],
+                                      avg_cfg: dict,
+                                      grid_cfg: dict | None = None) -> dict:
+    """
+    机型+容量下的价格趋势计算：按颜色并行拉取、重采样、计算 A/B/C 平均线。
+    返回 merged（跨颜色每店+平均线）、per_color（每色每店+平均线）。
+    """
+    return compute_trend_arrays(
+        model_name, capacity_gb, days, selected_shops, avg_cfg, grid_cfg,
+    ).to_dict()
@@ -1,5 +1,5 @@
-from .core import compute_trends_for_model_capacity, _norm_name
-from ...models import PurchasingShopPriceRecord
+from .core import compute_trends_for_model_capacity, _distinct_shop_names, _norm_name
+from ...services import trend_cache
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
@@ -39,8 +39,7 @@ def trends_model_colors(request):
         selected_shops = set(_norm_name(str(s)) for s in shops)
     else:
         # ALL：从库中去重
-        selected_shops = set(_norm_name(n) for n in
-                             PurchasingShopPriceRecord.objects.values_list("shop__name", flat=True).distinct())
+        selected_shops = set(_norm_name(n) for n in trend_cache.distinct_shop_names(_distinct_shop_names))
 
     data = compute_trends_for_model_capacity(
         model_name, capacity_gb, days,
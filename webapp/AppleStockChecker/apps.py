@@ -9,5 +9,11 @@ class ApplestockcheckerConfig(AppConfig):
     def ready(self):
         # Celery worker 连接安全（fork 后关闭继承连接、任务前清理过期连接）
         from . import celery_db_connection_safety  # noqa: F401
+        # Iphone 变更时让清洗器共用的机型目录缓存失效
+        from .utils.external_ingest import iphone_catalog  # noqa: F401
+        # 报价记录逐条写入/删除时让趋势预聚合缓存中受影响的桶失效
+        from .services import trend_cache  # noqa: F401
+        # 店铺 / iPhone 变更时让 CH ViewSet 共用的元数据缓存失效
+        from .services import metadata_cache  # noqa: F401
 
 
@@ -39,6 +39,8 @@ def build_price_tensor(
     aligned_df: pd.DataFrame,
     *,
     device: str = "cpu",
+    iphone_ids: np.ndarray | None = None,
+    shop_ids: np.ndarray | None = None,
 ) -> PriceTensor:
     """将对齐后的 DataFrame 构建为 3D Tensor。
 
@@ -48,6 +50,9 @@ def build_price_tensor(
         必须包含: bucket, shop_id, iphone_id, price_new
     device : str
         PyTorch 设备
+    iphone_ids, shop_ids : ndarray | None
+        固定 iPhone / shop 轴 (流式分段时各段共用全局轴), 须覆盖 aligned_df
+        中出现的全部 id; 默认取 aligned_df 中出现的 id
 
     Returns
     -------
@@ -55,8 +60,10 @@ def build_price_tensor(
     """
     df = aligned_df.copy()
 
-    iphone_ids = np.sort(df["iphone_id"].unique())
-    shop_ids = np.sort(df["shop_id"].unique())
+    if iphone_ids is None:
+        iphone_ids = np.sort(df["iphone_id"].unique())
+    if shop_ids is None:
+        shop_ids = np.sort(df["shop_id"].unique())
     bucket_index = pd.DatetimeIndex(sorted(df["bucket"].unique()))
 
     iphone_map = {v: i for i, v in enumerate(iphone_ids)}
@@ -82,16 +89,28 @@ def build_price_tensor(
                        bucket_index=bucket_index)
 
 
+# 动态价格过滤的回看桶数 (2 桶 = 30 分钟), 流式分段时即需携带的已过滤尾部桶数
+DYNAMIC_FILTER_LOOKBACK: int = 2
+
+
 def apply_dynamic_price_filter(
     tensor: PriceTensor,
     *,
-    lookback_buckets: int = 2,
+    lookback_buckets: int = DYNAMIC_FILTER_LOOKBACK,
     tolerance: float = 0.10,
     min_samples: int = 3,
     fallback_range: tuple[float, float] = (100_000.0, 350_000.0),
+    max_sweeps: int = 8,
+    warm_buckets: int = 0,
 ) -> PriceTensor:
     """基于前 N 桶参考价过滤异常值，超出 ref ± tolerance 的置 NaN。
 
+    参考价取前 lookback_buckets 个桶中**已过滤**的有效值均值 (第 0 桶用自身)，
+    因此桶 b 的结果依赖桶 b-1、b-2 的过滤结果。向量化实现用不动点迭代:
+    每轮用 unfold 一次算出全部桶的窗口参考价并生成坏值掩码，掩码不再变化即
+    与逐桶串行结果一致。若 max_sweeps 轮仍未收敛，从第一个仍在变化的桶起
+    按桶串行补算 (iPhone 维仍并行)。
+
     Parameters
     ----------
     tensor : PriceTensor
@@ -104,77 +123,165 @@ def apply_dynamic_price_filter(
         参考价最小样本数，不足时用 fallback_range
     fallback_range : tuple
         固定价格范围 [min, max]
+    max_sweeps : int
+        不动点迭代最大轮数
+    warm_buckets : int
+        前 warm_buckets 个桶是上一段已过滤的尾部 (流式分段), 只作参考不再过滤
     """
-    data = tensor.data.clone()  # (I, S, B)
-    n_i, n_s, n_b = data.shape
-    filtered_count = 0
-
-    for b in range(n_b):
-        lb = max(0, b - lookback_buckets)
-        if lb == b:
-            # 第一个桶，只能用 fallback
-            ref_slice = data[:, :, b:b + 1]
-        else:
-            ref_slice = data[:, :, lb:b]  # (I, S, lookback)
-
-        for i in range(n_i):
-            ref_vals = ref_slice[i].reshape(-1)
-            ref_valid = ref_vals[~torch.isnan(ref_vals)]
-
-            if ref_valid.numel() >= min_samples:
-                ref_price = ref_valid.mean().item()
-                lo = ref_price * (1 - tolerance)
-                hi = ref_price * (1 + tolerance)
+    data = tensor.data  # (I, S, B)
+    n_b = data.shape[2]
+    valid = ~torch.isnan(data)
+    values = torch.where(valid, data, torch.zeros_like(data))
+
+    # 第 0 桶 (或 lookback=0) 以自身未过滤数据作参考
+    own_sum = values.sum(dim=1)     # (I, B)
+    own_cnt = valid.sum(dim=1)      # (I, B)
+
+    bad = torch.zeros_like(valid)
+    changed = None
+    for _ in range(max_sweeps):
+        kept = valid & ~bad
+        bkt_sum = torch.where(kept, values, torch.zeros_like(values)).sum(dim=1)
+        bkt_cnt = kept.sum(dim=1)
+        lo, hi = _dynamic_price_bounds(
+            _lookback_window_sum(bkt_sum, own_sum, lookback_buckets),
+            _lookback_window_sum(bkt_cnt, own_cnt, lookback_buckets),
+            tolerance=tolerance, min_samples=min_samples, fallback_range=fallback_range,
+        )
+        new_bad = valid & ((data < lo.unsqueeze(1)) | (data > hi.unsqueeze(1)))
+        new_bad[:, :, :warm_buckets] = False
+        changed = (new_bad != bad).any(dim=1).any(dim=0)  # (B,)
+        bad = new_bad
+        if not changed.any():
+            break
+    else:
+        # 首个变化桶之前已是不动点 (= 串行结果)，其后逐桶串行补算
+        start = 0 if changed is None else int(changed.nonzero()[0].item())
+        start = max(start, warm_buckets)
+        logger.info(
+            "apply_dynamic_price_filter: not converged in %d sweeps, sequential from bucket %d/%d",
+            max_sweeps, start, n_b,
+        )
+        for b in range(start, n_b):
+            lb = max(0, b - lookback_buckets)
+            if lb == b:
+                win_sum, win_cnt = own_sum[:, b], own_cnt[:, b]
             else:
-                lo, hi = fallback_range
-
-            prices = data[i, :, b]
-            bad = (~torch.isnan(prices)) & ((prices < lo) | (prices > hi))
-            filtered_count += bad.sum().item()
-            prices[bad] = float("nan")
-
+                kept = valid[:, :, lb:b] & ~bad[:, :, lb:b]
+                win_sum = torch.where(kept, values[:, :, lb:b], torch.zeros_like(values[:, :, lb:b])).sum(dim=(1, 2))
+                win_cnt = kept.sum(dim=(1, 2))
+            lo, hi = _dynamic_price_bounds(
+                win_sum, win_cnt,
+                tolerance=tolerance, min_samples=min_samples, fallback_range=fallback_range,
+            )
+            prices = data[:, :, b]
+            bad[:, :, b] = valid[:, :, b] & ((prices < lo.unsqueeze(1)) | (prices > hi.unsqueeze(1)))
+
+    filtered_count = int(bad.sum().item())
     if filtered_count > 0:
         logger.info("apply_dynamic_price_filter: %d values filtered", filtered_count)
 
     return PriceTensor(
-        data=data,
+        data=data.masked_fill(bad, float("nan")),
         iphone_ids=tensor.iphone_ids,
         shop_ids=tensor.shop_ids,
         bucket_index=tensor.bucket_index,
     )
 
 
+def _lookback_window_sum(
+    per_bucket: torch.Tensor,
+    own: torch.Tensor,
+    lookback: int,
+) -> torch.Tensor:
+    """(I, B) 逐桶统计量 → 窗口 [b-lookback, b) 之和; 窗口为空的桶取 own。"""
+    if lookback <= 0:
+        return own
+    n_b = per_bucket.shape[1]
+    padded = torch.nn.functional.pad(per_bucket, (lookback, 0))
+    win = padded.unfold(1, lookback, 1)[:, :n_b].sum(dim=-1)
+    if n_b:
+        win[:, 0] = own[:, 0]
+    return win
+
+
+def _dynamic_price_bounds(
+    win_sum: torch.Tensor,
+    win_cnt: torch.Tensor,
+    *,
+    tolerance: float,
+    min_samples: int,
+    fallback_range: tuple[float, float],
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """窗口和/计数 → (lo, hi)，样本不足的位置用 fallback_range。"""
+    ref = win_sum / win_cnt
+    enough = win_cnt >= min_samples
+    lo = torch.where(enough, ref * (1 - tolerance), torch.full_like(ref, fallback_range[0]))
+    hi = torch.where(enough, ref * (1 + tolerance), torch.full_like(ref, fallback_range[1]))
+    return lo, hi
+
+
+def _mad_filter_median_dim1(
+    data: torch.Tensor,
+    k: float = 3.0,
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """沿 dim=1 (shop 维度) 批量做 MAD 过滤，同时给出过滤后的 nanmedian。
+
+    threshold = median ± k × 1.4826 × MAD，有效值 < 3 或 threshold = 0 时不过滤。
+
+    沿 shop 轴整体排序一次 (NaN 排在末尾)，按每行有效计数取中位数；
+    偏差 |x - median| 再排序一次取 MAD。异常值只可能在排序后有效段的
+    两端，剔除后剩余值仍是连续区间，过滤后的中位数直接从同一排序结果读出。
+
+    Returns
+    -------
+    (filtered, median)  filtered shape (I, S, B), 异常值置 NaN; median shape (I, B)
+    """
+    valid = ~torch.isnan(data)
+    n_valid = valid.sum(dim=1, keepdim=True)                    # (I, 1, B)
+    sorted_v = data.sort(dim=1).values                          # NaN 在末尾
+    zero = torch.zeros_like(n_valid)
+
+    med = _sorted_median(sorted_v, zero, n_valid)               # (I, 1, B)
+    abs_devs = (sorted_v - med).abs().sort(dim=1).values        # NaN 仍在末尾
+    mad = _sorted_median(abs_devs, zero, n_valid)
+    threshold = k * 1.4826 * mad
+    active = (n_valid >= 3) & (threshold != 0)
+
+    outlier = valid & active & ((data - med).abs() > threshold)
+    filtered = data.masked_fill(outlier, float("nan"))
+
+    # 排序后的异常值: 低端前缀 + 高端后缀，保留区间 [n_low, n_valid - n_high)
+    sorted_out = active & ((sorted_v - med).abs() > threshold)
+    n_low = (sorted_out & (sorted_v < med)).sum(dim=1, keepdim=True)
+    n_high = (sorted_out & (sorted_v > med)).sum(dim=1, keepdim=True)
+    median = _sorted_median(sorted_v, n_low, n_valid - n_low - n_high)
+
+    return filtered, median.squeeze(1)
+
+
+def _sorted_median(
+    sorted_v: torch.Tensor,
+    start: torch.Tensor,
+    count: torch.Tensor,
+) -> torch.Tensor:
+    """已沿 dim=1 排序的张量中，取区间 [start, start + count) 的中位数。
+
+    偶数取两中间值平均；count = 0 的位置为 NaN。start/count shape (I, 1, B)。
+    """
+    last = sorted_v.shape[1] - 1
+    lo_idx = (start + (count - 1).clamp(min=0) // 2).clamp(max=last)
+    hi_idx = (start + count // 2).clamp(max=last)
+    med = (sorted_v.gather(1, lo_idx) + sorted_v.gather(1, hi_idx)) / 2.0
+    return med.masked_fill(count == 0, float("nan"))
+
+
 def _mad_filter_dim1(data: torch.Tensor, k: float = 3.0) -> torch.Tensor:
     """沿 dim=1 (shop 维度) 做 MAD 过滤，异常值置 NaN。
 
     threshold = median ± k × 1.4826 × MAD
     """
-    I, S, B = data.shape
-    result = data.clone()
-    for i in range(I):
-        for b in range(B):
-            vals = data[i, :, b]
-            valid_mask = ~torch.isnan(vals)
-            valid = vals[valid_mask]
-            if valid.numel() < 3:
-                continue
-            sorted_v = valid.sort().values
-            n = sorted_v.numel()
-            if n % 2 == 1:
-                med = sorted_v[n // 2]
-            else:
-                med = (sorted_v[n // 2 - 1] + sorted_v[n // 2]) / 2.0
-            abs_devs = (valid - med).abs().sort().values
-            if n % 2 == 1:
-                mad = abs_devs[n // 2]
-            else:
-                mad = (abs_devs[n // 2 - 1] + abs_devs[n // 2]) / 2.0
-            threshold = k * 1.4826 * mad
-            if threshold == 0:
-                continue
-            outlier = valid_mask & ((vals - med).abs() > threshold)
-            result[i, outlier, b] = float("nan")
-    return result
+    return _mad_filter_median_dim1(data, k)[0]
 
 
 def aggregate_cross_shop(
@@ -195,7 +302,7 @@ def aggregate_cross_shop(
     -------
     AggResult  每个字段 shape (n_iphones, n_buckets)
     """
-    data = _mad_filter_dim1(tensor.data)  # A1: MAD 过滤
+    data, median = _mad_filter_median_dim1(tensor.data)  # A1: MAD 过滤 + nanmedian
 
     # 非 NaN 计数
     valid_mask = ~torch.isnan(data)
@@ -204,9 +311,6 @@ def aggregate_cross_shop(
     # nanmean
     mean = torch.nanmean(data, dim=1)  # (I, B)
 
-    # nanmedian: 偶数取两中间值平均
-    median = _nanmedian_dim1(data)  # (I, B)
-
     # nanstd (无偏)
     std = _nanstd_dim1(data, mean)  # (I, B)
 
@@ -239,21 +343,9 @@ def aggregate_cross_shop(
 
 def _nanmedian_dim1(data: torch.Tensor) -> torch.Tensor:
     """沿 dim=1 计算 nanmedian, 偶数取两中间值平均, 返回 (I, B)。"""
-    I, S, B = data.shape
-    result = torch.full((I, B), float("nan"), dtype=data.dtype, device=data.device)
-
-    for i in range(I):
-        for b in range(B):
-            vals = data[i, :, b]
-            valid = vals[~torch.isnan(vals)]
-            n = valid.numel()
-            if n > 0:
-                sorted_v = valid.sort().values
-                if n % 2 == 1:
-                    result[i, b] = sorted_v[n // 2]
-                else:
-                    result[i, b] = (sorted_v[n // 2 - 1] + sorted_v[n // 2]) / 2.0
-    return result
+    n_valid = (~torch.isnan(data)).sum(dim=1, keepdim=True)
+    sorted_v = data.sort(dim=1).values
+    return _sorted_median(sorted_v, torch.zeros_like(n_valid), n_valid).squeeze(1)
 
 
 def _nanstd_dim1(data: torch.Tensor, mean: torch.Tensor) -> torch.Tensor:
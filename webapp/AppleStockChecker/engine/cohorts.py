@@ -13,7 +13,7 @@ import pandas as pd
 import torch
 
 from .aggregate import AggResult
-from .features import compute_all_features, compute_all_features_skipnan
+from .features import FeatureState, compute_all_features, compute_all_features_skipnan, scope_state
 
 logger = logging.getLogger(__name__)
 
@@ -92,6 +92,7 @@ def compute_cohort_features(
     *,
     device: str = "cpu",
     skipnan: bool = False,
+    states: dict[str, FeatureState] | None = None,
 ) -> pd.DataFrame:
     """对每个 Cohort 做加权聚合, 返回 features_wide 格式的 DataFrame。
 
@@ -101,6 +102,8 @@ def compute_cohort_features(
         iPhone 级跨店聚合结果
     configs : list[CohortConfig]
     device : str
+    states : dict | None
+        流式续算状态 (scope 组 → FeatureState), None 表示 agg 为完整序列
 
     Returns
     -------
@@ -150,7 +153,7 @@ def compute_cohort_features(
         # 在 cohort_mean 上重新计算特征
         cohort_mean_2d = cohort_mean.unsqueeze(0)  # (1, n_buckets) for feature funcs
         feat_fn = compute_all_features_skipnan if skipnan else compute_all_features
-        cohort_features = feat_fn(cohort_mean_2d)
+        cohort_features = feat_fn(cohort_mean_2d, state=scope_state(states, f"cohort:{cfg.slug}"))
 
         # 组装行
         scope = f"cohort:{cfg.slug}"
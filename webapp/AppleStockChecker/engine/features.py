@@ -6,7 +6,7 @@ PyTorch 向量化特征计算: EMA / SMA / WMA / Bollinger Bands。
 from __future__ import annotations
 
 import logging
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 import torch
 
@@ -23,6 +23,9 @@ def _forward_fill_1d(series: torch.Tensor) -> torch.Tensor:
     前导 NaN 保持不变, 中间/尾部 NaN 用最近有效值填充。
     返回新 Tensor (不 in-place 修改)。
 
+    有效位置记自身下标, NaN 位置记 0, 沿时间轴 cummax 即得最近有效值下标;
+    前导 NaN 指向下标 0 (本身为 NaN), 自然保持 NaN。
+
     Parameters
     ----------
     series : (n_iphones, n_buckets)
@@ -31,12 +34,12 @@ def _forward_fill_1d(series: torch.Tensor) -> torch.Tensor:
     -------
     Tensor  (n_iphones, n_buckets)
     """
-    out = series.clone()
-    mask = torch.isnan(out)
-    for t in range(1, out.shape[1]):
-        fill = mask[:, t]  # 当前列为 NaN 的行
-        out[:, t] = torch.where(fill, out[:, t - 1], out[:, t])
-    return out
+    if series.shape[1] == 0:
+        return series.clone()
+    pos = torch.arange(series.shape[1], device=series.device).expand_as(series)
+    idx = torch.where(torch.isnan(series), torch.zeros_like(pos), pos)
+    last_valid = idx.cummax(dim=1).values
+    return series.gather(1, last_valid)
 
 
 # EMA half-life 窗口 (分钟) → 桶数 (÷15min)
@@ -54,33 +57,138 @@ class BollingerResult:
 
 # ── EMA ──────────────────────────────────────────────────────────────────
 
-def compute_ema_batch(series: torch.Tensor, window: int) -> torch.Tensor:
-    """指数移动平均。时间维串行, iPhone 维并行。
+# 分块 EMA 的块长 (桶数)。块内用对数步前缀扫描, 块间只串行传递状态。
+# 流式续算时每段起点须落在 EMA_CHUNK 的整数倍位置, 块划分才与整段计算一致。
+EMA_CHUNK: int = 128
+
+
+def _ema_scan(
+    series: torch.Tensor,
+    alpha: float,
+    *,
+    skipnan: bool = False,
+    chunk: int = EMA_CHUNK,
+    init: torch.Tensor | None = None,
+) -> torch.Tensor:
+    """分块 EMA: y_t = alpha * x_t + (1 - alpha) * y_{t-1}。
+
+    写成仿射递推 y_t = g_t * y_{t-1} + b_t: 段起点 (首列; skipnan 下 NaN 之后的
+    首个有效值) g_t = 0, b_t = x_t; 其余 g_t = 1 - alpha, b_t = alpha * x_t。
+
+    按 chunk 切块, 块内对 (g, b) 做 log2(chunk) 步前缀复合 (Hillis-Steele,
+    全部为逐元素运算), 得到 y_t = G_t * carry + B_t; carry 为上一块末尾的 y,
+    只在块间 (B / chunk 次) 串行递推。逐元素运算与块数无关, 因此从块边界
+    续算 (init) 与整段计算逐位一致。
+
+    NaN 语义:
+      - skipnan=False: 与原串行递推一致, 首个 NaN 起之后全部为 NaN
+      - skipnan=True:  NaN 桶输出 NaN, 下一个有效值重新初始化
+
+    Parameters
+    ----------
+    series : (n_iphones, n_buckets)
+    alpha : float
+    skipnan : bool
+    chunk : int  块长 (桶数)
+    init : (n_iphones,) | None
+        上一段最后一桶的输出 (流式续算); None 表示序列从头开始
+
+    Returns
+    -------
+    Tensor  (n_iphones, n_buckets)
+    """
+    n_rows, n_cols = series.shape
+    if n_cols == 0:
+        return series.clone()
+
+    decay = 1.0 - alpha
+    nan_mask = torch.isnan(series)
+    x = torch.where(nan_mask, torch.zeros_like(series), series)
+
+    reset = torch.zeros_like(nan_mask)
+    if init is None:
+        reset[:, 0] = True
+    elif skipnan:
+        reset[:, 0] = torch.isnan(init)
+    if skipnan:
+        reset[:, 1:] = nan_mask[:, :-1]
+        reset &= ~nan_mask
+
+    gain = torch.where(reset, torch.zeros_like(x), torch.full_like(x, decay))
+    b = torch.where(reset, x, alpha * x)
+
+    c = min(chunk, n_cols)
+    n_chunks = -(-n_cols // c)
+    pad = n_chunks * c - n_cols
+    if pad:
+        gain = torch.nn.functional.pad(gain, (0, pad))
+        b = torch.nn.functional.pad(b, (0, pad))
+    gain = gain.reshape(n_rows, n_chunks, c)
+    b = b.reshape(n_rows, n_chunks, c)
+
+    # 块内前缀复合: (g, b)_t ∘ (g, b)_{t-s} → (g_t g_{t-s}, b_t + g_t b_{t-s})
+    step = 1
+    while step < c:
+        b = torch.cat([b[..., :step], b[..., step:] + gain[..., step:] * b[..., :-step]], dim=2)
+        gain = torch.cat([gain[..., :step], gain[..., step:] * gain[..., :-step]], dim=2)
+        step *= 2
+
+    # 块间递推: carry_j = G_end_j * carry_{j-1} + B_end_j
+    if init is None:
+        carry = torch.zeros(n_rows, dtype=series.dtype, device=series.device)
+    else:
+        carry = torch.nan_to_num(init, nan=0.0)
+    carry_in = torch.empty((n_rows, n_chunks), dtype=series.dtype, device=series.device)
+    for j in range(n_chunks):
+        carry_in[:, j] = carry
+        carry = gain[:, j, -1] * carry + b[:, j, -1]
+
+    y = (gain * carry_in.unsqueeze(2) + b).reshape(n_rows, n_chunks * c)[:, :n_cols]
+
+    if skipnan:
+        poisoned = nan_mask
+    else:
+        poisoned = nan_mask.cummax(dim=1).values
+        if init is not None:
+            poisoned = poisoned | torch.isnan(init).unsqueeze(1)
+    return y.masked_fill(poisoned, float("nan"))
+
+
+def compute_ema_batch(
+    series: torch.Tensor,
+    window: int,
+    *,
+    init: torch.Tensor | None = None,
+) -> torch.Tensor:
+    """指数移动平均。iPhone 维并行, 时间维分块扫描 (见 _ema_scan)。
 
     Parameters
     ----------
     series : (n_iphones, n_buckets)
     window : int  窗口 (桶数)
+    init : (n_iphones,) | None  流式续算的上一桶输出
 
     Returns
     -------
     Tensor  (n_iphones, n_buckets)
     """
     alpha = 2.0 / (window + 1.0)
-    ema = torch.zeros_like(series)
-    ema[:, 0] = series[:, 0]
-    for t in range(1, series.shape[1]):
-        ema[:, t] = alpha * series[:, t] + (1 - alpha) * ema[:, t - 1]
-    return ema
+    return _ema_scan(series, alpha, init=init)
 
 
-def compute_ema_halflife_batch(series: torch.Tensor, hl_buckets: int) -> torch.Tensor:
+def compute_ema_halflife_batch(
+    series: torch.Tensor,
+    hl_buckets: int,
+    *,
+    init: torch.Tensor | None = None,
+) -> torch.Tensor:
     """半衰期 EMA。alpha = 1 - exp(-ln2 / hl_buckets)。
 
     Parameters
     ----------
     series : (n_iphones, n_buckets)
     hl_buckets : int  半衰期 (桶数)
+    init : (n_iphones,) | None  流式续算的上一桶输出
 
     Returns
     -------
@@ -88,59 +196,46 @@ def compute_ema_halflife_batch(series: torch.Tensor, hl_buckets: int) -> torch.T
     """
     import math as _math
     alpha = 1.0 - _math.exp(-_math.log(2) / hl_buckets)
-    ema = torch.zeros_like(series)
-    ema[:, 0] = series[:, 0]
-    for t in range(1, series.shape[1]):
-        ema[:, t] = alpha * series[:, t] + (1 - alpha) * ema[:, t - 1]
-    return ema
+    return _ema_scan(series, alpha, init=init)
 
 
 # ── skip-nan EMA ─────────────────────────────────────────────────────
 
-def compute_ema_batch_skipnan(series: torch.Tensor, window: int) -> torch.Tensor:
+def compute_ema_batch_skipnan(
+    series: torch.Tensor,
+    window: int,
+    *,
+    init: torch.Tensor | None = None,
+) -> torch.Tensor:
     """skip-nan 版 EMA: NaN 桶输出 NaN, 有效值恢复时重新初始化。
 
     Parameters
     ----------
     series : (n_iphones, n_buckets)
     window : int
+    init : (n_iphones,) | None  流式续算的上一桶输出
 
     Returns
     -------
     Tensor  (n_iphones, n_buckets)
     """
     alpha = 2.0 / (window + 1.0)
-    n_rows, n_cols = series.shape
-    ema = torch.full_like(series, float("nan"))
-    ema[:, 0] = series[:, 0]  # 首列: NaN 保留, 有效值保留
-
-    for t in range(1, n_cols):
-        cur = series[:, t]
-        prev = ema[:, t - 1]
-        cur_valid = ~torch.isnan(cur)
-        prev_valid = ~torch.isnan(prev)
-
-        # 正常递推: cur 有效 且 prev 有效
-        normal = cur_valid & prev_valid
-        # 重新初始化: cur 有效 但 prev 为 NaN
-        reinit = cur_valid & ~prev_valid
-
-        ema[:, t] = torch.where(
-            normal,
-            alpha * cur + (1 - alpha) * prev,
-            torch.where(reinit, cur, torch.full_like(cur, float("nan"))),
-        )
-
-    return ema
+    return _ema_scan(series, alpha, skipnan=True, init=init)
 
 
-def compute_ema_halflife_batch_skipnan(series: torch.Tensor, hl_buckets: int) -> torch.Tensor:
+def compute_ema_halflife_batch_skipnan(
+    series: torch.Tensor,
+    hl_buckets: int,
+    *,
+    init: torch.Tensor | None = None,
+) -> torch.Tensor:
     """skip-nan 版半衰期 EMA。
 
     Parameters
     ----------
     series : (n_iphones, n_buckets)
     hl_buckets : int
+    init : (n_iphones,) | None  流式续算的上一桶输出
 
     Returns
     -------
@@ -148,43 +243,40 @@ def compute_ema_halflife_batch_skipnan(series: torch.Tensor, hl_buckets: int) ->
     """
     import math as _math
     alpha = 1.0 - _math.exp(-_math.log(2) / hl_buckets)
-    n_rows, n_cols = series.shape
-    ema = torch.full_like(series, float("nan"))
-    ema[:, 0] = series[:, 0]
-
-    for t in range(1, n_cols):
-        cur = series[:, t]
-        prev = ema[:, t - 1]
-        cur_valid = ~torch.isnan(cur)
-        prev_valid = ~torch.isnan(prev)
-
-        normal = cur_valid & prev_valid
-        reinit = cur_valid & ~prev_valid
-
-        ema[:, t] = torch.where(
-            normal,
-            alpha * cur + (1 - alpha) * prev,
-            torch.where(reinit, cur, torch.full_like(cur, float("nan"))),
-        )
-
-    return ema
+    return _ema_scan(series, alpha, skipnan=True, init=init)
 
 
 # ── SMA ──────────────────────────────────────────────────────────────────
 
-def compute_sma_batch(series: torch.Tensor, window: int) -> torch.Tensor:
+def compute_sma_batch(
+    series: torch.Tensor,
+    window: int,
+    *,
+    cum_before: torch.Tensor | None = None,
+) -> torch.Tensor:
     """简单移动平均, cumsum 向量化实现, 缩窗: 不足窗口时用实际可用长度。
 
     Parameters
     ----------
     series : (n_iphones, n_buckets)
     window : int
+    cum_before : (n_iphones, 1) | None
+        流式续算: series 起点之前的全局 cumsum。给出时 series 不是序列开头,
+        只输出满窗位置, 前 window-1 个桶为 NaN (由调用方作为 warm-up 丢弃)
 
     Returns
     -------
     Tensor  (n_iphones, n_buckets)
     """
     n = series.shape[1]
+    if cum_before is not None:
+        # 前接全局 cumsum 后逐项累加, 与整段 cumsum 逐位一致
+        padded = torch.cat([cum_before, series], dim=1).cumsum(dim=1)
+        sma = torch.full_like(series, float("nan"))
+        if n >= window:
+            sma[:, window - 1:] = (padded[:, window:] - padded[:, :n - window + 1]) / window
+        return sma
+
     cumsum = series.cumsum(dim=1)
     # 在 dim=1 前面补一列 0, 方便做差
     padded = torch.cat([torch.zeros(series.shape[0], 1, dtype=series.dtype,
@@ -250,6 +342,8 @@ def compute_bollinger_batch(
     series: torch.Tensor,
     window: int,
     k: float = 2.0,
+    *,
+    cum_before: torch.Tensor | None = None,
 ) -> BollingerResult:
     """布林带: mid (SMA) ± k * rolling_std。
 
@@ -258,12 +352,13 @@ def compute_bollinger_batch(
     series : (n_iphones, n_buckets)
     window : int
     k : float  标准差倍数 (默认 2)
+    cum_before : (n_iphones, 1) | None  见 compute_sma_batch
 
     Returns
     -------
     BollingerResult
     """
-    mid = compute_sma_batch(series, window)
+    mid = compute_sma_batch(series, window, cum_before=cum_before)
 
     # rolling std via unfold
     n_buckets = series.shape[1]
@@ -288,9 +383,110 @@ def compute_bollinger_batch(
 
 # ── 全部特征一次计算 ─────────────────────────────────────────────────────
 
+# 流式续算需要保留的 warm-up 桶数 (最长窗口 1800 min = 120 桶)
+FEATURE_WARMUP_BUCKETS: int = max(WINDOW_TO_BUCKETS.values())
+
+
+@dataclass
+class FeatureState:
+    """一个 scope 组 (同一批行) 的流式续算状态, 由 compute_all_features* 原地更新。
+
+    按时间顺序逐段传入同一个 state, 各段输出拼接后与整段一次计算一致;
+    每段起点落在 EMA_CHUNK 整数倍位置时逐位一致 (CPU), 否则 EMA 只差浮点舍入
+    (live tail 每次只续算几个桶)。
+    """
+    n_seen: int = 0                           # 已处理桶数
+    tail: torch.Tensor | None = None          # 最近 ≤ FEATURE_WARMUP_BUCKETS 桶的输入 (ffill 后)
+    cum_before: torch.Tensor | None = None    # tail 起点之前的全局 cumsum; tail 覆盖全部历史时为 None
+    last: torch.Tensor | None = None          # ffill 模式: 最后一桶的填充值 (n_rows, 1)
+    ema: dict[str, torch.Tensor] = field(default_factory=dict)  # EMA 列名 → 最后一桶输出
+
+
+def scope_state(states: dict[str, FeatureState] | None, key: str) -> FeatureState | None:
+    """states 为 None (整段计算) 时返回 None, 否则取出/新建 key 对应的 FeatureState。"""
+    if states is None:
+        return None
+    return states.setdefault(key, FeatureState())
+
+
+def _compute_features(
+    series: torch.Tensor,
+    windows: list[int],
+    *,
+    skipnan: bool,
+    state: FeatureState | None,
+) -> dict[str, torch.Tensor]:
+    """compute_all_features / compute_all_features_skipnan 的共同实现。
+
+    state 给出时 series 为接在 state 之后的新一段: EMA 从上一桶输出续算,
+    SMA/WMA/Bollinger 在 tail + series 上计算后丢弃 tail 部分。
+    """
+    if not skipnan:
+        # forward-fill NaN before computing features
+        if state is not None and state.last is not None:
+            series = _forward_fill_1d(torch.cat([state.last, series], dim=1))[:, 1:]
+        else:
+            series = _forward_fill_1d(series)
+
+    tail = state.tail if state is not None else None
+    cum_before = state.cum_before if state is not None else None
+    ema_init = state.ema if state is not None else {}
+    ext = series if tail is None else torch.cat([tail, series], dim=1)
+    n_tail = ext.shape[1] - series.shape[1]
+
+    ema_fn = compute_ema_batch_skipnan if skipnan else compute_ema_batch
+    ema_hl_fn = compute_ema_halflife_batch_skipnan if skipnan else compute_ema_halflife_batch
+
+    features: dict[str, torch.Tensor] = {}
+
+    for win_min in windows:
+        win_buckets = WINDOW_TO_BUCKETS[win_min]
+
+        name = f"ema_{win_min}"
+        features[name] = ema_fn(series, win_buckets, init=ema_init.get(name))
+        features[f"sma_{win_min}"] = compute_sma_batch(
+            ext, win_buckets, cum_before=cum_before,
+        )[:, n_tail:]
+        features[f"wma_{win_min}"] = compute_wma_batch(ext, win_buckets)[:, n_tail:]
+
+        boll = compute_bollinger_batch(ext, win_buckets, cum_before=cum_before)
+        features[f"boll_mid_{win_min}"] = boll.mid[:, n_tail:]
+        features[f"boll_up_{win_min}"] = boll.upper[:, n_tail:]
+        features[f"boll_low_{win_min}"] = boll.lower[:, n_tail:]
+        features[f"boll_width_{win_min}"] = boll.width[:, n_tail:]
+
+    # EMA half-life 系列
+    for hl_min in EMA_HL_WINDOWS:
+        name = f"ema_hl_{hl_min}"
+        features[name] = ema_hl_fn(series, EMA_HL_BUCKETS[hl_min], init=ema_init.get(name))
+
+    if state is not None and series.shape[1]:
+        cut = ext.shape[1] - FEATURE_WARMUP_BUCKETS
+        if cut > 0:
+            if cum_before is None:
+                cumsum = ext.cumsum(dim=1)
+            else:
+                cumsum = torch.cat([cum_before, ext], dim=1).cumsum(dim=1)[:, 1:]
+            state.cum_before = cumsum[:, cut - 1:cut].clone()
+            state.tail = ext[:, cut:].clone()
+        else:
+            state.tail = ext.clone()
+        if not skipnan:
+            state.last = series[:, -1:].clone()
+        state.ema = {
+            name: ftensor[:, -1].clone() for name, ftensor in features.items()
+            if name.startswith("ema_")
+        }
+        state.n_seen += series.shape[1]
+
+    return features
+
+
 def compute_all_features(
     agg_mean: torch.Tensor,
     windows: list[int] | None = None,
+    *,
+    state: FeatureState | None = None,
 ) -> dict[str, torch.Tensor]:
     """对每个窗口计算全部特征, 返回 {列名: Tensor}。
 
@@ -300,6 +496,8 @@ def compute_all_features(
         跨店聚合后的 mean 序列
     windows : list[int]
         特征窗口 (分钟), 默认 FEATURE_WINDOWS
+    state : FeatureState | None
+        流式续算状态 (见 FeatureState), None 表示 agg_mean 为完整序列
 
     Returns
     -------
@@ -308,28 +506,7 @@ def compute_all_features(
     if windows is None:
         windows = FEATURE_WINDOWS
 
-    # forward-fill NaN before computing features
-    filled = _forward_fill_1d(agg_mean)
-
-    features: dict[str, torch.Tensor] = {}
-
-    for win_min in windows:
-        win_buckets = WINDOW_TO_BUCKETS[win_min]
-
-        features[f"ema_{win_min}"] = compute_ema_batch(filled, win_buckets)
-        features[f"sma_{win_min}"] = compute_sma_batch(filled, win_buckets)
-        features[f"wma_{win_min}"] = compute_wma_batch(filled, win_buckets)
-
-        boll = compute_bollinger_batch(filled, win_buckets)
-        features[f"boll_mid_{win_min}"] = boll.mid
-        features[f"boll_up_{win_min}"] = boll.upper
-        features[f"boll_low_{win_min}"] = boll.lower
-        features[f"boll_width_{win_min}"] = boll.width
-
-    # EMA half-life 系列
-    for hl_min in EMA_HL_WINDOWS:
-        hl_buckets = EMA_HL_BUCKETS[hl_min]
-        features[f"ema_hl_{hl_min}"] = compute_ema_halflife_batch(filled, hl_buckets)
+    features = _compute_features(agg_mean, windows, skipnan=False, state=state)
 
     logger.info("compute_all_features: %d features computed for %d windows",
                 len(features), len(windows))
@@ -339,6 +516,8 @@ def compute_all_features(
 def compute_all_features_skipnan(
     agg_mean: torch.Tensor,
     windows: list[int] | None = None,
+    *,
+    state: FeatureState | None = None,
 ) -> dict[str, torch.Tensor]:
     """skip-nan 版全特征计算。
 
@@ -349,6 +528,8 @@ def compute_all_features_skipnan(
     ----------
     agg_mean : (n_iphones, n_buckets)
     windows : list[int]
+    state : FeatureState | None
+        流式续算状态, 同 compute_all_features
 
     Returns
     -------
@@ -357,25 +538,7 @@ def compute_all_features_skipnan(
     if windows is None:
         windows = FEATURE_WINDOWS
 
-    features: dict[str, torch.Tensor] = {}
-
-    for win_min in windows:
-        win_buckets = WINDOW_TO_BUCKETS[win_min]
-
-        features[f"ema_{win_min}"] = compute_ema_batch_skipnan(agg_mean, win_buckets)
-        features[f"sma_{win_min}"] = compute_sma_batch(agg_mean, win_buckets)
-        features[f"wma_{win_min}"] = compute_wma_batch(agg_mean, win_buckets)
-
-        boll = compute_bollinger_batch(agg_mean, win_buckets)
-        features[f"boll_mid_{win_min}"] = boll.mid
-        features[f"boll_up_{win_min}"] = boll.upper
-        features[f"boll_low_{win_min}"] = boll.lower
-        features[f"boll_width_{win_min}"] = boll.width
-
-    # EMA half-life 系列
-    for hl_min in EMA_HL_WINDOWS:
-        hl_buckets = EMA_HL_BUCKETS[hl_min]
-        features[f"ema_hl_{hl_min}"] = compute_ema_halflife_batch_skipnan(agg_mean, hl_buckets)
+    features = _compute_features(agg_mean, windows, skipnan=True, state=state)
 
     logger.info("compute_all_features_skipnan: %d features computed for %d windows",
                 len(features), len(windows))
@@ -0,0 +1,331 @@
+"""
+增量 live-tail pipeline: 每个 15 分钟 tick 只处理上次之后新封口的桶。
+
+段间状态 (全局轴 / 动态过滤尾部 / 各 scope 的 FeatureState) 复用流式 pipeline 的
+StreamContext, 序列化为 npz (张量) + JSON (键与计数, 不含 pickle) 后按 run_id 存入
+PipelineLiveState, 以最后处理的桶为键续算。
+首次运行、状态版本或 nan_mode 变化时从 bootstrap_days 前重新建立状态; 出现新的
+iPhone/shop 时只扩展轴, 新行的状态按"此前全部缺失"补 NaN, 已有 scope 的 EMA 等状态保留;
+此后才出现成员的 scope 组 (如只含新机型的 cohort) 从首个有数据的桶开始建立状态。
+"""
+from __future__ import annotations
+
+import io
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from .config import BucketConfig
+
+logger = logging.getLogger(__name__)
+
+STATE_VERSION = 2
+
+
+def run_live_tail(
+    run_id: str = "live",
+    *,
+    now: datetime | None = None,
+    device: str = "cpu",
+    nan_mode: str = "ffill",
+    lag_min: int | None = None,
+    bootstrap_days: int | None = None,
+) -> dict:
+    """处理 (上次最后一个桶, 当前已封口的最后一个桶] 区间, 写入 CH 并保存状态。
+
+    Parameters
+    ----------
+    run_id : str
+        写入 CH 的 run_id, 同时是 PipelineLiveState 的键
+    now : datetime | None
+        当前时间 (aware), 默认 timezone.now()
+    device : str
+        PyTorch 设备
+    nan_mode : str
+        ffill | skipnan, 与保存的状态不一致时重新 bootstrap
+    lag_min : int | None
+        封口延迟 (分钟): 桶结束后再等 lag_min 分钟才处理, 默认 settings.PIPELINE_LIVE_LAG_MIN
+    bootstrap_days : int | None
+        重新建立状态时回看的天数, 默认 settings.PIPELINE_LIVE_BOOTSTRAP_DAYS
+
+    Returns
+    -------
+    dict  执行统计, status = ok | up_to_date | busy
+    """
+    from django.conf import settings
+    from django.db import DatabaseError, transaction
+    from django.utils import timezone
+
+    from AppleStockChecker.models import PipelineLiveState
+
+    if lag_min is None:
+        lag_min = int(getattr(settings, "PIPELINE_LIVE_LAG_MIN", 5))
+    if bootstrap_days is None:
+        bootstrap_days = int(getattr(settings, "PIPELINE_LIVE_BOOTSTRAP_DAYS", 7))
+
+    config = BucketConfig()
+    step = timedelta(minutes=config.interval_min)
+    now = now or timezone.now()
+    cutoff = _floor_to_step(now - timedelta(minutes=lag_min), config.interval_min)
+
+    # 行在 tick 事务之外创建: 并发 tick 不会阻塞在未提交的 INSERT 上, 而是走下面的 nowait 跳过
+    PipelineLiveState.objects.get_or_create(run_id=run_id)
+
+    with transaction.atomic():
+        try:
+            row = PipelineLiveState.objects.select_for_update(nowait=True).get(run_id=run_id)
+        except DatabaseError:
+            logger.info("run_live_tail: run_id=%s is locked by another tick, skip", run_id)
+            return {"run_id": run_id, "status": "busy"}
+
+        stats = _advance(
+            row, cutoff,
+            step=step, config=config, device=device, nan_mode=nan_mode,
+            bootstrap_days=bootstrap_days,
+        )
+        if stats["status"] == "ok":
+            row.meta_json = {
+                "nan_mode": nan_mode,
+                "n_scope_groups": stats["n_scope_groups"],
+                "last_tick": stats,
+            }
+            row.save()
+
+    return stats
+
+
+def _advance(row, cutoff: datetime, *, step, config, device, nan_mode, bootstrap_days) -> dict:
+    """在已加锁的 PipelineLiveState 上推进到 cutoff (不含), 原地更新 row。"""
+    from AppleStockChecker.engine.cohorts import load_cohort_configs, load_shop_weight_profiles
+    from AppleStockChecker.engine.pipeline import StreamContext, _run_stages
+    from AppleStockChecker.services.clickhouse_service import ClickHouseService
+
+    stats: dict = {"run_id": row.run_id, "cutoff": cutoff.isoformat(), "bootstrap": False}
+    t0 = time.time()
+
+    ctx = None
+    if row.state_blob and row.last_bucket is not None:
+        ctx = _load_context(bytes(row.state_blob), nan_mode=nan_mode, device=device)
+    if ctx is not None:
+        start = row.last_bucket + step
+        if start >= cutoff:
+            stats["status"] = "up_to_date"
+            return stats
+        aligned = _read_aligned(start, cutoff, config)
+        if not aligned.empty:
+            stats["new_axes"] = _extend_axes(ctx, aligned)
+        ctx.profiles = load_shop_weight_profiles()
+        ctx.cohort_configs = load_cohort_configs()
+
+    if ctx is None:
+        start = cutoff - timedelta(days=bootstrap_days)
+        aligned = _read_aligned(start, cutoff, config)
+        ctx = StreamContext.open(start, cutoff, chunk_buckets=None, iphone_ids=None, shop_ids=None)
+        stats["bootstrap"] = True
+
+    stats["from"] = start.isoformat()
+    stats["aligned_rows"] = len(aligned)
+
+    ch = ClickHouseService()
+    if not aligned.empty:
+        stats["aligned_inserted"] = ch.insert_price_aligned(aligned, row.run_id)
+        chunks = ctx.push(aligned)
+        rest = ctx.flush()
+        if rest is not None:
+            chunks.append(rest)
+        for chunk in chunks:
+            _run_stages(
+                chunk, ch=ch, run_id=row.run_id, steps=["aggregate", "features", "cohorts"],
+                device=device, skipnan=nan_mode == "skipnan", config=config,
+                stats=stats, stream=ctx,
+            )
+
+    row.last_bucket = cutoff - step
+    row.state_blob = _dump_context(ctx, nan_mode=nan_mode)
+    stats["status"] = "ok"
+    stats["last_bucket"] = row.last_bucket.isoformat()
+    stats["n_scope_groups"] = len(ctx.states)
+    stats["total_seconds"] = round(time.time() - t0, 2)
+    logger.info(
+        "run_live_tail: run_id=%s  %s → %s  aligned=%d  bootstrap=%s  (%.1fs)",
+        row.run_id, start, cutoff, len(aligned), stats["bootstrap"], stats["total_seconds"],
+    )
+    return stats
+
+
+def _read_aligned(start: datetime, end: datetime, config: BucketConfig) -> pd.DataFrame:
+    from AppleStockChecker.engine.align import align_to_buckets
+    from AppleStockChecker.engine.reader import read_price_records
+
+    df = read_price_records(start, end)
+    if df.empty:
+        return pd.DataFrame()
+    return align_to_buckets(df, config)
+
+
+def _extend_axes(ctx, aligned: pd.DataFrame) -> dict:
+    """把 aligned 中新出现的 iPhone/shop 并入 ctx 的全局轴, 返回新增 id。
+
+    轴保持有序; 以 iPhone 为行的状态 (iphone / shop:* / shopcohort:*) 与过滤尾部
+    在新位置插入 NaN 行/列, 等价于该 id 一直在轴上但此前没有数据。
+    新 shop 的 scope 组 (shop:{sid} 等) 由 scope_state 按需新建。
+    """
+    import numpy as np
+    import torch
+
+    from AppleStockChecker.engine.aggregate import PriceTensor
+
+    old_iphones = np.asarray(ctx.iphone_ids)
+    old_shops = np.asarray(ctx.shop_ids)
+    iphones = np.union1d(old_iphones, aligned["iphone_id"].unique())
+    shops = np.union1d(old_shops, aligned["shop_id"].unique())
+    added = {
+        "iphones": [int(i) for i in np.setdiff1d(iphones, old_iphones)],
+        "shops": [int(s) for s in np.setdiff1d(shops, old_shops)],
+    }
+    if not added["iphones"] and not added["shops"]:
+        return added
+
+    logger.info("run_live_tail: extending axes with %s", added)
+    i_pos = torch.as_tensor(np.searchsorted(iphones, old_iphones))
+    s_pos = torch.as_tensor(np.searchsorted(shops, old_shops))
+
+    def pad_rows(t):
+        if t is None or not added["iphones"]:
+            return t
+        out = torch.full((len(iphones), *t.shape[1:]), float("nan"), dtype=t.dtype, device=t.device)
+        out[i_pos.to(t.device)] = t
+        return out
+
+    for key, state in ctx.states.items():
+        if _iphone_rows(key):
+            state.tail = pad_rows(state.tail)
+            state.cum_before = pad_rows(state.cum_before)
+            state.last = pad_rows(state.last)
+            state.ema = {name: pad_rows(t) for name, t in state.ema.items()}
+
+    tail = ctx.filter_tail
+    if tail is not None:
+        data = torch.full(
+            (len(iphones), len(shops), tail.data.shape[2]), float("nan"),
+            dtype=tail.data.dtype, device=tail.data.device,
+        )
+        data[i_pos.to(data.device)[:, None], s_pos.to(data.device)[None, :]] = tail.data
+        ctx.filter_tail = PriceTensor(data=data, iphone_ids=iphones, shop_ids=shops, bucket_index=tail.bucket_index)
+
+    ctx.iphone_ids = iphones
+    ctx.shop_ids = shops
+    return added
+
+
+def _iphone_rows(key: str) -> bool:
+    """该 scope 组的状态是否按 iPhone 轴分行 (cohort 聚合后的组只有 1 行)。"""
+    return key == "iphone" or ("|" not in key and key.startswith(("shop:", "shopcohort:")))
+
+
+def _floor_to_step(dt: datetime, step_min: int) -> datetime:
+    return dt - timedelta(minutes=dt.minute % step_min, seconds=dt.second, microseconds=dt.microsecond)
+
+
+# ── 状态序列化 ───────────────────────────────────────────────────────────
+
+_STATE_TENSORS = ("tail", "cum_before", "last")
+
+
+def _dump_context(ctx, *, nan_mode: str) -> bytes:
+    """StreamContext → npz bytes (不含 pickle)。
+
+    张量按数组存入 npz, 键名 / 计数等写入同一 npz 的 JSON 字段;
+    profiles / cohort 配置每次 tick 重新读取, 不保存。
+    """
+    import numpy as np
+
+    arrays = {
+        "iphone_ids": np.asarray(ctx.iphone_ids, dtype=np.int64),
+        "shop_ids": np.asarray(ctx.shop_ids, dtype=np.int64),
+    }
+    meta = {
+        "version": STATE_VERSION,
+        "nan_mode": nan_mode,
+        "chunk_buckets": ctx.chunk_buckets,
+        "filter_tail_tz": None,
+        "states": [],
+    }
+    tail = ctx.filter_tail
+    if tail is not None:
+        arrays["filter_tail"] = tail.data.cpu().numpy()
+        arrays["filter_tail_buckets"] = tail.bucket_index.asi8
+        meta["filter_tail_tz"] = None if tail.bucket_index.tz is None else str(tail.bucket_index.tz)
+
+    for i, (key, state) in enumerate(ctx.states.items()):
+        entry = {"key": key, "n_seen": state.n_seen, "tensors": [], "ema": []}
+        for name in _STATE_TENSORS:
+            t = getattr(state, name)
+            if t is not None:
+                arrays[f"s{i}.{name}"] = t.cpu().numpy()
+                entry["tensors"].append(name)
+        for j, (name, t) in enumerate(state.ema.items()):
+            arrays[f"s{i}.ema{j}"] = t.cpu().numpy()
+            entry["ema"].append(name)
+        meta["states"].append(entry)
+
+    arrays["meta"] = np.array(json.dumps(meta))
+    buf = io.BytesIO()
+    np.savez(buf, **arrays)
+    return buf.getvalue()
+
+
+def _load_context(blob: bytes, *, nan_mode: str, device: str):
+    """npz bytes → StreamContext; 无法解析、版本或 nan_mode 不一致时返回 None (需重新 bootstrap)。"""
+    import numpy as np
+    import torch
+
+    from AppleStockChecker.engine.aggregate import PriceTensor
+    from AppleStockChecker.engine.features import FeatureState
+    from AppleStockChecker.engine.pipeline import StreamContext
+
+    try:
+        npz = np.load(io.BytesIO(blob), allow_pickle=False)
+        meta = json.loads(str(npz["meta"]))
+    except Exception:
+        logger.warning("run_live_tail: saved state is unreadable (old format?), re-bootstrap")
+        return None
+    if meta.get("version") != STATE_VERSION or meta.get("nan_mode") != nan_mode:
+        logger.info("run_live_tail: saved state version/nan_mode mismatch, re-bootstrap")
+        return None
+
+    def tensor(name):
+        return torch.from_numpy(npz[name]).to(device)
+
+    iphone_ids = npz["iphone_ids"]
+    shop_ids = npz["shop_ids"]
+    filter_tail = None
+    if "filter_tail" in npz:
+        bucket_index = pd.DatetimeIndex(npz["filter_tail_buckets"])
+        if meta["filter_tail_tz"] is not None:
+            bucket_index = bucket_index.tz_localize("UTC").tz_convert(meta["filter_tail_tz"])
+        filter_tail = PriceTensor(
+            data=tensor("filter_tail"),
+            iphone_ids=iphone_ids,
+            shop_ids=shop_ids,
+            bucket_index=bucket_index,
+        )
+
+    states = {}
+    for i, entry in enumerate(meta["states"]):
+        state = FeatureState(n_seen=entry["n_seen"])
+        for name in entry["tensors"]:
+            setattr(state, name, tensor(f"s{i}.{name}"))
+        state.ema = {name: tensor(f"s{i}.ema{j}") for j, name in enumerate(entry["ema"])}
+        states[entry["key"]] = state
+
+    return StreamContext(
+        iphone_ids=iphone_ids,
+        shop_ids=shop_ids,
+        chunk_buckets=meta["chunk_buckets"],
+        states=states,
+        filter_tail=filter_tail,
+    )
@@ -6,6 +6,7 @@ from __future__ import annotations
 
 import logging
 import time
+from dataclasses import dataclass, field
 from datetime import date, datetime, timedelta
 
 import numpy as np
@@ -27,6 +28,8 @@ def run(
     iphone_ids: list[int] | None = None,
     shop_ids: list[int] | None = None,
     nan_mode: str = "ffill",
+    stream: bool = False,
+    chunk_buckets: int | None = None,
 ) -> dict:
     """执行 pipeline。
 
@@ -44,6 +47,12 @@ def run(
         每次从 PG 读取的天数 (align 阶段分段读取)
     iphone_ids, shop_ids : list[int] | None
         限定范围
+    stream : bool
+        流式模式: 不拼接全部 aligned 数据, aggregate/features/cohorts 按
+        chunk_buckets 个桶分段执行, 段间只携带过滤尾部与特征递推状态;
+        写入结果与整段执行一致 (CPU 逐位一致)
+    chunk_buckets : int | None
+        流式每段桶数, 须为 EMA_CHUNK 的整数倍, 默认 settings.PIPELINE_STREAM_CHUNK_BUCKETS
 
     Returns
     -------
@@ -51,9 +60,6 @@ def run(
     """
     from AppleStockChecker.engine.reader import read_price_records
     from AppleStockChecker.engine.align import align_to_buckets
-    from AppleStockChecker.engine.aggregate import build_price_tensor, aggregate_cross_shop, apply_dynamic_price_filter
-    from AppleStockChecker.engine.features import compute_all_features, compute_all_features_skipnan
-    from AppleStockChecker.engine.cohorts import load_cohort_configs, compute_cohort_features
     from AppleStockChecker.services.clickhouse_service import ClickHouseService
 
     effective_steps = steps or ALL_STEPS
@@ -71,11 +77,34 @@ def run(
     }
 
     logger.info(
-        "pipeline.run START  run_id=%s  range=%s→%s  steps=%s  device=%s  batch_days=%d",
-        run_id, date_from, date_to, effective_steps, device, batch_days,
+        "pipeline.run START  run_id=%s  range=%s→%s  steps=%s  device=%s  batch_days=%d  stream=%s",
+        run_id, date_from, date_to, effective_steps, device, batch_days, stream,
     )
     t0 = time.time()
 
+    stream_ctx = None
+    if stream:
+        stream_ctx = StreamContext.open(
+            datetime.combine(date_from, datetime.min.time()),
+            datetime.combine(date_to, datetime.min.time()),
+            chunk_buckets=chunk_buckets,
+            iphone_ids=iphone_ids, shop_ids=shop_ids,
+        )
+        stats["stream"] = {"chunk_buckets": stream_ctx.chunk_buckets, "chunks": []}
+
+    def _run_chunk(chunk: pd.DataFrame) -> None:
+        ct = time.time()
+        _run_stages(
+            chunk, ch=ch, run_id=run_id, steps=effective_steps, device=device,
+            skipnan=skipnan, config=config, stats=stats, stream=stream_ctx,
+        )
+        stats["stream"]["chunks"].append({
+            "from": str(chunk["bucket"].min()),
+            "to": str(chunk["bucket"].max()),
+            "aligned_rows": len(chunk),
+            "seconds": round(time.time() - ct, 2),
+        })
+
     # ── Step: align ──────────────────────────────────────────────────────
     all_aligned = []
 
@@ -102,7 +131,6 @@ def run(
 
             aligned = align_to_buckets(df, config)
             inserted = ch.insert_price_aligned(aligned, run_id)
-            all_aligned.append(aligned)
             elapsed = time.time() - bt
 
             batch_stat = {
@@ -111,6 +139,7 @@ def run(
                 "raw_rows": len(df),
                 "aligned_rows": len(aligned),
                 "inserted": inserted,
+                "insert_rows_per_sec": ch.last_insert_stats.get("rows_per_sec"),
                 "seconds": round(elapsed, 2),
             }
             stats["batches"].append(batch_stat)
@@ -123,121 +152,193 @@ def run(
             )
             cursor = batch_end
 
+            if stream_ctx is None:
+                all_aligned.append(aligned)
+            else:
+                for chunk in stream_ctx.push(aligned):
+                    _run_chunk(chunk)
+
         stats["total_aligned"] = total_aligned
         stats["align_seconds"] = round(time.time() - t_step, 2)
 
-    # 后续步骤需要全部 aligned 数据
-    if all_aligned:
-        full_aligned = pd.concat(all_aligned, ignore_index=True)
+    if stream_ctx is not None:
+        rest = stream_ctx.flush()
+        if rest is not None:
+            _run_chunk(rest)
+        elif not stats["stream"]["chunks"]:
+            _run_stages(
+                pd.DataFrame(), ch=ch, run_id=run_id, steps=effective_steps, device=device,
+                skipnan=skipnan, config=config, stats=stats,
+            )
     else:
-        full_aligned = pd.DataFrame()
+        # 后续步骤需要全部 aligned 数据
+        if all_aligned:
+            full_aligned = pd.concat(all_aligned, ignore_index=True)
+        else:
+            full_aligned = pd.DataFrame()
+        _run_stages(
+            full_aligned, ch=ch, run_id=run_id, steps=effective_steps, device=device,
+            skipnan=skipnan, config=config, stats=stats,
+        )
+
+    elapsed_total = time.time() - t0
+    stats["total_seconds"] = round(elapsed_total, 2)
+    logger.info(
+        "pipeline.run DONE  run_id=%s  total_time=%.1fs",
+        run_id, elapsed_total,
+    )
+    return stats
+
+
+def _run_stages(
+    aligned: pd.DataFrame,
+    *,
+    ch,
+    run_id: str,
+    steps: list[str],
+    device: str,
+    skipnan: bool,
+    config: BucketConfig,
+    stats: dict,
+    stream: StreamContext | None = None,
+) -> None:
+    """aggregate → features → cohorts, 结果写入 CH, 统计合并进 stats。
+
+    stream 为 None 时 aligned 是全部数据; 否则是流式的一段, 张量轴、过滤尾部
+    与特征递推状态取自 stream 并在此推进。
+    """
+    from AppleStockChecker.engine.aggregate import build_price_tensor, aggregate_cross_shop, apply_dynamic_price_filter
+    from AppleStockChecker.engine.features import compute_all_features, compute_all_features_skipnan, scope_state
+    from AppleStockChecker.engine.cohorts import load_cohort_configs, compute_cohort_features
+
+    states = stream.states if stream is not None else None
 
     # ── Step: aggregate ──────────────────────────────────────────────────
     agg = None
     tensor = None
-    if "aggregate" in effective_steps:
+    if "aggregate" in steps:
         t_step = time.time()
 
-        if full_aligned.empty:
+        if aligned.empty:
             logger.warning("  [aggregate] no aligned data available, skipping")
         else:
-            tensor = build_price_tensor(full_aligned, device=device)
-            tensor = apply_dynamic_price_filter(tensor)  # A5: 动态价格过滤
+            if stream is None:
+                tensor = build_price_tensor(aligned, device=device)
+                tensor = apply_dynamic_price_filter(tensor)  # A5: 动态价格过滤
+            else:
+                tensor = stream.filter(build_price_tensor(
+                    aligned, device=device,
+                    iphone_ids=stream.iphone_ids, shop_ids=stream.shop_ids,
+                ))
             agg = aggregate_cross_shop(tensor, min_quorum=config.min_quorum)
 
-            stats["aggregate"] = {
+            _merge_stat(stats, "aggregate", {
                 "n_iphones": len(agg.iphone_ids),
                 "n_buckets": len(agg.bucket_index),
                 "shop_count_min": int(agg.shop_count.min().item()),
                 "shop_count_max": int(agg.shop_count.max().item()),
-            }
+            })
             logger.info("  [aggregate] done: %d iphones × %d buckets",
                         len(agg.iphone_ids), len(agg.bucket_index))
 
-        stats["aggregate_seconds"] = round(time.time() - t_step, 2)
+        _merge_seconds(stats, "aggregate_seconds", t_step)
 
     # ── Step: features ───────────────────────────────────────────────────
-    iphone_features: dict[str, object] = {}
-    if "features" in effective_steps:
+    if "features" in steps:
         t_step = time.time()
 
         if agg is None:
             logger.warning("  [features] no agg data, skipping")
         else:
             feat_fn = compute_all_features_skipnan if skipnan else compute_all_features
-            iphone_features = feat_fn(agg.mean)
+            iphone_features = feat_fn(agg.mean, state=scope_state(states, "iphone"))
 
             # 写入 CH: 组装 iphone 级 features_wide DataFrame
             iphone_df = _agg_to_features_df(agg, iphone_features)
             inserted = ch.insert_features(iphone_df, run_id)
 
-            stats["features"] = {
+            _merge_stat(stats, "features", {
                 "n_feature_cols": len(iphone_features),
                 "rows_inserted": inserted,
-            }
+                "insert": ch.last_insert_stats,
+            })
             logger.info("  [features] done: %d feature cols → %d rows inserted",
                         len(iphone_features), inserted)
 
             # per-shop features (scope = shop:{sid}|iphone:{iid})
             if tensor is not None:
-                shop_df = _per_shop_features_df(tensor, skipnan=skipnan)
+                shop_df = _per_shop_features_df(tensor, skipnan=skipnan, states=states)
                 if not shop_df.empty:
                     shop_ins = ch.insert_features(shop_df, run_id)
-                    stats["features_per_shop"] = {"rows_inserted": shop_ins}
+                    _merge_stat(stats, "features_per_shop", {
+                        "rows_inserted": shop_ins, "insert": ch.last_insert_stats,
+                    })
                     logger.info("  [features/per-shop] %d rows inserted", shop_ins)
 
                 # per-profile features (scope = shopcohort:{slug}|iphone:{iid})
-                from AppleStockChecker.engine.cohorts import load_shop_weight_profiles
-                profiles = load_shop_weight_profiles()
+                if stream is not None:
+                    profiles = stream.profiles
+                else:
+                    from AppleStockChecker.engine.cohorts import load_shop_weight_profiles
+                    profiles = load_shop_weight_profiles()
                 profile_df = pd.DataFrame()
                 if profiles:
-                    profile_df = _per_profile_features_df(tensor, profiles, skipnan=skipnan)
+                    profile_df = _per_profile_features_df(
+                        tensor, profiles, skipnan=skipnan, states=states,
+                    )
                     if not profile_df.empty:
                         prof_ins = ch.insert_features(profile_df, run_id)
-                        stats["features_per_profile"] = {"rows_inserted": prof_ins}
+                        _merge_stat(stats, "features_per_profile", {
+                            "rows_inserted": prof_ins, "insert": ch.last_insert_stats,
+                        })
                         logger.info("  [features/per-profile] %d rows inserted", prof_ins)
 
                 # D2: per-shop × cohort (scope = shop:{sid}|cohort:{slug})
-                cohort_configs = load_cohort_configs()
+                cohort_configs = stream.cohort_configs if stream is not None else load_cohort_configs()
                 if cohort_configs:
                     sc_df = _per_shop_cohort_features_df(
-                        tensor, cohort_configs, skipnan=skipnan,
+                        tensor, cohort_configs, skipnan=skipnan, states=states,
                     )
                     if not sc_df.empty:
                         sc_ins = ch.insert_features(sc_df, run_id)
-                        stats["features_shop_cohort"] = {"rows_inserted": sc_ins}
+                        _merge_stat(stats, "features_shop_cohort", {
+                            "rows_inserted": sc_ins, "insert": ch.last_insert_stats,
+                        })
                         logger.info("  [features/shop-cohort] %d rows inserted", sc_ins)
 
                     # D3: per-profile × cohort (scope = shopcohort:{slug}|cohort:{slug})
                     if profiles:
                         pc_df = _per_profile_cohort_features_df(
-                            tensor, profiles, cohort_configs, skipnan=skipnan,
+                            tensor, profiles, cohort_configs, skipnan=skipnan, states=states,
                         )
                         if not pc_df.empty:
                             pc_ins = ch.insert_features(pc_df, run_id)
-                            stats["features_profile_cohort"] = {"rows_inserted": pc_ins}
+                            _merge_stat(stats, "features_profile_cohort", {
+                                "rows_inserted": pc_ins, "insert": ch.last_insert_stats,
+                            })
                             logger.info("  [features/profile-cohort] %d rows inserted", pc_ins)
 
-        stats["features_seconds"] = round(time.time() - t_step, 2)
+        _merge_seconds(stats, "features_seconds", t_step)
 
     # ── Step: cohorts ────────────────────────────────────────────────────
-    if "cohorts" in effective_steps:
+    if "cohorts" in steps:
         t_step = time.time()
 
         if agg is None:
             logger.warning("  [cohorts] no agg data, skipping")
         else:
-            configs = load_cohort_configs()
+            configs = stream.cohort_configs if stream is not None else load_cohort_configs()
             if configs:
                 cohort_df = compute_cohort_features(
-                    agg, configs, device=device, skipnan=skipnan,
+                    agg, configs, device=device, skipnan=skipnan, states=states,
                 )
                 if not cohort_df.empty:
                     inserted = ch.insert_features(cohort_df, run_id)
-                    stats["cohorts"] = {
+                    _merge_stat(stats, "cohorts", {
                         "n_cohorts": len(configs),
                         "rows_inserted": inserted,
-                    }
+                        "insert": ch.last_insert_stats,
+                    })
                     logger.info("  [cohorts] done: %d cohorts → %d rows inserted",
                                 len(configs), inserted)
                 else:
@@ -245,15 +346,135 @@ def run(
             else:
                 logger.info("  [cohorts] no cohort configs found in PG")
 
-        stats["cohorts_seconds"] = round(time.time() - t_step, 2)
+        _merge_seconds(stats, "cohorts_seconds", t_step)
+
+
+def _merge_stat(stats: dict, key: str, values: dict) -> None:
+    """写入一项阶段统计; 流式分段时逐段合并: 行数/桶数求和, min/max 取极值, 其余取最后一段。"""
+    prev = stats.get(key)
+    if prev is None:
+        stats[key] = dict(values)
+        return
+    for name, value in values.items():
+        if name in ("rows_inserted", "n_buckets"):
+            prev[name] = prev.get(name, 0) + value
+        elif name.endswith("_min"):
+            prev[name] = min(prev[name], value)
+        elif name.endswith("_max"):
+            prev[name] = max(prev[name], value)
+        else:
+            prev[name] = value
 
-    elapsed_total = time.time() - t0
-    stats["total_seconds"] = round(elapsed_total, 2)
-    logger.info(
-        "pipeline.run DONE  run_id=%s  total_time=%.1fs",
-        run_id, elapsed_total,
-    )
-    return stats
+
+def _merge_seconds(stats: dict, key: str, t_start: float) -> None:
+    stats[key] = round(stats.get(key, 0.0) + time.time() - t_start, 2)
+
+
+# ── 流式分段 ─────────────────────────────────────────────────────────────
+
+@dataclass
+class StreamContext:
+    """流式 pipeline 的段间状态。
+
+    aligned 数据按桶缓冲, 凑满 chunk_buckets 个桶即交给 _run_stages 处理一段;
+    段间只保留: 全局 iPhone/shop 轴、动态过滤已过滤的最后
+    DYNAMIC_FILTER_LOOKBACK 个桶, 以及每个 scope 组的 FeatureState
+    (最近 FEATURE_WARMUP_BUCKETS 桶输入 + EMA/cumsum/ffill 状态)。
+    """
+    iphone_ids: np.ndarray
+    shop_ids: np.ndarray
+    chunk_buckets: int
+    profiles: list = field(default_factory=list)
+    cohort_configs: list = field(default_factory=list)
+    states: dict = field(default_factory=dict)
+    filter_tail: object = None          # PriceTensor | None
+    pending: list = field(default_factory=list)
+
+    @classmethod
+    def open(
+        cls,
+        start: datetime,
+        end: datetime,
+        *,
+        chunk_buckets: int | None,
+        iphone_ids: list[int] | None,
+        shop_ids: list[int] | None,
+    ) -> StreamContext:
+        from django.conf import settings
+        from AppleStockChecker.engine.cohorts import load_cohort_configs, load_shop_weight_profiles
+        from AppleStockChecker.engine.features import EMA_CHUNK
+        from AppleStockChecker.engine.reader import read_price_axes
+
+        if chunk_buckets is None:
+            chunk_buckets = int(getattr(settings, "PIPELINE_STREAM_CHUNK_BUCKETS", 2048))
+        if chunk_buckets <= 0 or chunk_buckets % EMA_CHUNK:
+            raise ValueError(f"chunk_buckets 须为 EMA_CHUNK={EMA_CHUNK} 的正整数倍, 实际 {chunk_buckets}")
+
+        axis_iphones, axis_shops = read_price_axes(
+            start, end, shop_ids=shop_ids, iphone_ids=iphone_ids,
+        )
+        return cls(
+            iphone_ids=axis_iphones,
+            shop_ids=axis_shops,
+            chunk_buckets=chunk_buckets,
+            profiles=load_shop_weight_profiles(),
+            cohort_configs=load_cohort_configs(),
+        )
+
+    def push(self, aligned: pd.DataFrame) -> list[pd.DataFrame]:
+        """缓冲一批 aligned 行, 返回已凑满 chunk_buckets 个桶的完整段 (按时间顺序)。"""
+        self.pending.append(aligned)
+        buf = pd.concat(self.pending, ignore_index=True)
+        buckets = pd.DatetimeIndex(buf["bucket"].unique()).sort_values()
+
+        chunks = []
+        while len(buckets) >= self.chunk_buckets:
+            in_chunk = buf["bucket"] <= buckets[self.chunk_buckets - 1]
+            chunks.append(buf[in_chunk].reset_index(drop=True))
+            buf = buf[~in_chunk]
+            buckets = buckets[self.chunk_buckets:]
+
+        self.pending = [buf] if len(buf) else []
+        return chunks
+
+    def flush(self) -> pd.DataFrame | None:
+        """取出缓冲中剩余 (不足一段) 的行。"""
+        if not self.pending:
+            return None
+        rest = pd.concat(self.pending, ignore_index=True)
+        self.pending = []
+        return rest
+
+    def filter(self, tensor):
+        """对一段 PriceTensor 做动态价格过滤, 以上一段已过滤的尾部桶作参考。"""
+        import torch
+        from AppleStockChecker.engine.aggregate import (
+            DYNAMIC_FILTER_LOOKBACK, PriceTensor, apply_dynamic_price_filter,
+        )
+
+        n_warm = 0
+        if self.filter_tail is not None:
+            n_warm = self.filter_tail.data.shape[2]
+            tensor = PriceTensor(
+                data=torch.cat([self.filter_tail.data, tensor.data], dim=2),
+                iphone_ids=tensor.iphone_ids,
+                shop_ids=tensor.shop_ids,
+                bucket_index=self.filter_tail.bucket_index.append(tensor.bucket_index),
+            )
+        filtered = apply_dynamic_price_filter(tensor, warm_buckets=n_warm)
+
+        self.filter_tail = PriceTensor(
+            data=filtered.data[:, :, -DYNAMIC_FILTER_LOOKBACK:],
+            iphone_ids=filtered.iphone_ids,
+            shop_ids=filtered.shop_ids,
+            bucket_index=filtered.bucket_index[-DYNAMIC_FILTER_LOOKBACK:],
+        )
+        return PriceTensor(
+            data=filtered.data[:, :, n_warm:],
+            iphone_ids=filtered.iphone_ids,
+            shop_ids=filtered.shop_ids,
+            bucket_index=filtered.bucket_index[n_warm:],
+        )
 
 
 # ── 内部工具 ─────────────────────────────────────────────────────────────
@@ -263,100 +484,74 @@ def _agg_to_features_df(
     features: dict[str, object],
 ) -> pd.DataFrame:
     """将 AggResult + feature tensors 组装为 features_wide 格式 DataFrame。"""
-    import math
-    import torch
-
-    n_iphones = len(agg.iphone_ids)
-    n_buckets = len(agg.bucket_index)
-    rows = []
-
-    for i_idx in range(n_iphones):
-        iphone_id = int(agg.iphone_ids[i_idx])
-        scope = f"iphone:{iphone_id}"
-
-        for b_idx in range(n_buckets):
-            mean_val = agg.mean[i_idx, b_idx].item()
-            # shop_count=0 的桶 mean 为 NaN，无有效数据，跳过
-            if math.isnan(mean_val):
-                continue
-            row = {
-                "bucket": agg.bucket_index[b_idx],
-                "scope": scope,
-                "mean": round(mean_val, 2),
-                "median": round(agg.median[i_idx, b_idx].item(), 2),
-                "std": round(agg.std[i_idx, b_idx].item(), 2),
-                "shop_count": int(agg.shop_count[i_idx, b_idx].item()),
-                "dispersion": round(agg.dispersion[i_idx, b_idx].item(), 2),
-            }
-            for fname, ftensor in features.items():
-                row[fname] = round(ftensor[i_idx, b_idx].item(), 2)
-            rows.append(row)
-
-    return pd.DataFrame(rows)
-
-
-def _per_shop_features_df(tensor, *, skipnan: bool = False) -> pd.DataFrame:
+    scopes = [f"iphone:{int(iid)}" for iid in agg.iphone_ids]
+    mean = _to_numpy(agg.mean)
+    # shop_count=0 的桶 mean 为 NaN，无有效数据，跳过
+    part = _frame_part(agg.bucket_index, scopes, ~np.isnan(mean), {
+        "mean": mean,
+        "median": _to_numpy(agg.median),
+        "std": _to_numpy(agg.std),
+        "shop_count": _to_numpy(agg.shop_count).astype(np.int64),
+        "dispersion": _to_numpy(agg.dispersion),
+        **{fname: _to_numpy(ftensor) for fname, ftensor in features.items()},
+    })
+    return _concat_parts([part])
+
+
+def _per_shop_features_df(tensor, *, skipnan: bool = False, states=None) -> pd.DataFrame:
     """为每个 (shop_id, iphone_id) 计算特征，scope = shop:{sid}|iphone:{iid}。
 
     单店的 mean 就是价格本身 (shop_count=1, std=0)。
+    states 给出时为流式分段, 各 scope 组从 states 续算特征。
     """
-    import math
     import torch
-    from AppleStockChecker.engine.features import compute_all_features, compute_all_features_skipnan
+    from AppleStockChecker.engine.features import (
+        compute_all_features, compute_all_features_skipnan, scope_state,
+    )
 
-    n_iphones, n_shops, n_buckets = tensor.data.shape
-    rows = []
+    n_shops = tensor.data.shape[1]
+    parts = []
 
     for s_idx in range(n_shops):
         shop_id = int(tensor.shop_ids[s_idx])
         # 取该店的 2D 切片: (n_iphones, n_buckets)
         shop_slice = tensor.data[:, s_idx, :]
 
-        # 检查该店是否有任何有效数据
-        if torch.isnan(shop_slice).all():
+        # 检查该店是否有任何有效数据 (流式分段时仍需推进该店的特征状态)
+        if states is None and torch.isnan(shop_slice).all():
             continue
 
         feat_fn = compute_all_features_skipnan if skipnan else compute_all_features
-        features = feat_fn(shop_slice)
-
-        for i_idx in range(n_iphones):
-            iphone_id = int(tensor.iphone_ids[i_idx])
-            scope = f"shop:{shop_id}|iphone:{iphone_id}"
-
-            for b_idx in range(n_buckets):
-                price_val = shop_slice[i_idx, b_idx].item()
-                if math.isnan(price_val):
-                    continue
-                row = {
-                    "bucket": tensor.bucket_index[b_idx],
-                    "scope": scope,
-                    "mean": round(price_val, 2),
-                    "median": round(price_val, 2),
-                    "std": 0.0,
-                    "shop_count": 1,
-                    "dispersion": 0.0,
-                }
-                for fname, ftensor in features.items():
-                    row[fname] = round(ftensor[i_idx, b_idx].item(), 2)
-                rows.append(row)
+        features = feat_fn(shop_slice, state=scope_state(states, f"shop:{shop_id}"))
+
+        scopes = [f"shop:{shop_id}|iphone:{int(iid)}" for iid in tensor.iphone_ids]
+        price = _to_numpy(shop_slice)
+        parts.append(_frame_part(tensor.bucket_index, scopes, ~np.isnan(price), {
+            "mean": price,
+            "median": price,
+            "std": 0.0,
+            "shop_count": 1,
+            "dispersion": 0.0,
+            **{fname: _to_numpy(ftensor) for fname, ftensor in features.items()},
+        }))
 
-    logger.info("_per_shop_features_df: %d rows", len(rows))
-    return pd.DataFrame(rows)
+    df = _concat_parts(parts)
+    logger.info("_per_shop_features_df: %d rows", len(df))
+    return df
 
 
-def _per_profile_features_df(tensor, profiles, *, skipnan: bool = False) -> pd.DataFrame:
+def _per_profile_features_df(tensor, profiles, *, skipnan: bool = False, states=None) -> pd.DataFrame:
     """为每个 ShopWeightProfile × iphone_id 计算加权特征。
 
     scope = shopcohort:{slug}|iphone:{iid}
     """
-    import math
     import torch
-    from AppleStockChecker.engine.features import compute_all_features, compute_all_features_skipnan
+    from AppleStockChecker.engine.features import (
+        compute_all_features, compute_all_features_skipnan, scope_state,
+    )
 
     shop_id_to_idx = {int(v): i for i, v in enumerate(tensor.shop_ids)}
-    n_iphones = tensor.data.shape[0]
-    n_buckets = tensor.data.shape[2]
-    rows = []
+    parts = []
 
     for profile in profiles:
         # 找到 profile 中在 tensor 里存在的 shop 及其权重
@@ -407,62 +602,46 @@ def _per_profile_features_df(tensor, profiles, *, skipnan: bool = False) -> pd.D
         )  # (I, B)
 
         feat_fn = compute_all_features_skipnan if skipnan else compute_all_features
-        features = feat_fn(weighted_mean)
-
-        # E1: 如果是 full_store profile，预加载 official_prices 用于 logb
-        is_full_store = (profile.slug == "full_store")
-        official_prices = {}
-        if is_full_store:
+        features = feat_fn(weighted_mean, state=scope_state(states, f"shopcohort:{profile.slug}"))
+
+        scopes = [f"shopcohort:{profile.slug}|iphone:{int(iid)}" for iid in tensor.iphone_ids]
+        wmean = _to_numpy(weighted_mean)
+        mask = ~np.isnan(wmean)
+        part = _frame_part(tensor.bucket_index, scopes, mask, {
+            "mean": wmean,
+            "median": wmean,
+            "std": _to_numpy(weighted_std),
+            "shop_count": _to_numpy(valid_mask.sum(dim=1)).astype(np.int64),
+            "dispersion": _to_numpy(weighted_disp),
+            **{fname: _to_numpy(ftensor) for fname, ftensor in features.items()},
+        })
+
+        # E1: full_store profile 直接在此计算 logb，避免二次 INSERT
+        if profile.slug == "full_store":
             from django.conf import settings as _settings
             official_prices = getattr(_settings, "IPHONE_OFFICIAL_PRICES", {})
+            if official_prices:
+                _add_logb_columns(part, tensor.iphone_ids, mask, official_prices)
 
-        for i_idx in range(n_iphones):
-            iphone_id = int(tensor.iphone_ids[i_idx])
-            scope = f"shopcohort:{profile.slug}|iphone:{iphone_id}"
-
-            for b_idx in range(n_buckets):
-                mean_val = weighted_mean[i_idx, b_idx].item()
-                if math.isnan(mean_val):
-                    continue
-                row = {
-                    "bucket": tensor.bucket_index[b_idx],
-                    "scope": scope,
-                    "mean": round(mean_val, 2),
-                    "median": round(mean_val, 2),
-                    "std": round(weighted_std[i_idx, b_idx].item(), 2),
-                    "shop_count": int(valid_mask[i_idx, :, b_idx].sum().item()),
-                    "dispersion": round(weighted_disp[i_idx, b_idx].item(), 2),
-                }
-                for fname, ftensor in features.items():
-                    row[fname] = round(ftensor[i_idx, b_idx].item(), 2)
-
-                # E1: logb 直接在此计算，避免二次 INSERT
-                if is_full_store and official_prices:
-                    official = official_prices.get(iphone_id)
-                    if official and official > 0:
-                        for W in FEATURE_WINDOWS:
-                            wma_val = row.get(f"wma_{W}")
-                            if wma_val is not None and not math.isnan(wma_val) and wma_val > 0:
-                                row[f"logb_{W}"] = round(math.log(wma_val / official), 4)
-
-                rows.append(row)
-
-    logger.info("_per_profile_features_df: %d rows", len(rows))
-    return pd.DataFrame(rows)
+        parts.append(part)
+
+    df = _concat_parts(parts)
+    logger.info("_per_profile_features_df: %d rows", len(df))
+    return df
 
 
 def _per_shop_cohort_features_df(
-    tensor, cohort_configs, *, skipnan: bool = False,
+    tensor, cohort_configs, *, skipnan: bool = False, states=None,
 ) -> pd.DataFrame:
     """D2: 每个 shop × cohort 的加权特征。scope = shop:{sid}|cohort:{slug}"""
-    import math
     import torch
-    from AppleStockChecker.engine.features import compute_all_features, compute_all_features_skipnan
+    from AppleStockChecker.engine.features import (
+        compute_all_features, compute_all_features_skipnan, scope_state,
+    )
 
     iphone_id_to_idx = {int(v): i for i, v in enumerate(tensor.iphone_ids)}
     n_shops = tensor.data.shape[1]
-    n_buckets = tensor.data.shape[2]
-    rows = []
+    parts = []
 
     for cfg in cohort_configs:
         member_indices = []
@@ -500,42 +679,37 @@ def _per_shop_cohort_features_df(
 
             wmean_2d = wmean.unsqueeze(0)  # (1, B)
             feat_fn = compute_all_features_skipnan if skipnan else compute_all_features
-            features = feat_fn(wmean_2d)
-
-            scope = f"shop:{shop_id}|cohort:{cfg.slug}"
-            for b_idx in range(n_buckets):
-                mv = wmean[b_idx].item()
-                if math.isnan(mv):
-                    continue
-                row = {
-                    "bucket": tensor.bucket_index[b_idx],
-                    "scope": scope,
-                    "mean": round(mv, 2),
-                    "median": round(mv, 2),
-                    "std": round(wstd[b_idx].item(), 2),
+            features = feat_fn(wmean_2d, state=scope_state(states, f"shop:{shop_id}|cohort:{cfg.slug}"))
+
+            mean_np = _to_numpy(wmean_2d)
+            parts.append(_frame_part(
+                tensor.bucket_index, [f"shop:{shop_id}|cohort:{cfg.slug}"], ~np.isnan(mean_np), {
+                    "mean": mean_np,
+                    "median": mean_np,
+                    "std": _to_numpy(wstd.unsqueeze(0)),
                     "shop_count": 1,
-                    "dispersion": round(wdisp[b_idx].item(), 2),
-                }
-                for fname, ftensor in features.items():
-                    row[fname] = round(ftensor[0, b_idx].item(), 2)
-                rows.append(row)
+                    "dispersion": _to_numpy(wdisp.unsqueeze(0)),
+                    **{fname: _to_numpy(ftensor) for fname, ftensor in features.items()},
+                },
+            ))
 
-    logger.info("_per_shop_cohort_features_df: %d rows", len(rows))
-    return pd.DataFrame(rows)
+    df = _concat_parts(parts)
+    logger.info("_per_shop_cohort_features_df: %d rows", len(df))
+    return df
 
 
 def _per_profile_cohort_features_df(
-    tensor, profiles, cohort_configs, *, skipnan: bool = False,
+    tensor, profiles, cohort_configs, *, skipnan: bool = False, states=None,
 ) -> pd.DataFrame:
     """D3: 每个 profile × cohort 的加权特征。scope = shopcohort:{prof}|cohort:{slug}"""
-    import math
     import torch
-    from AppleStockChecker.engine.features import compute_all_features, compute_all_features_skipnan
+    from AppleStockChecker.engine.features import (
+        compute_all_features, compute_all_features_skipnan, scope_state,
+    )
 
     shop_id_to_idx = {int(v): i for i, v in enumerate(tensor.shop_ids)}
     iphone_id_to_idx = {int(v): i for i, v in enumerate(tensor.iphone_ids)}
-    n_buckets = tensor.data.shape[2]
-    rows = []
+    parts = []
 
     for profile in profiles:
         shop_indices = []
@@ -587,28 +761,134 @@ def _per_profile_cohort_features_df(
 
             wmean_2d = wmean.unsqueeze(0)
             feat_fn = compute_all_features_skipnan if skipnan else compute_all_features
-            features = feat_fn(wmean_2d)
+            features = feat_fn(
+                wmean_2d, state=scope_state(states, f"shopcohort:{profile.slug}|cohort:{cfg.slug}"),
+            )
 
             shop_count_per_bucket = valid.any(dim=0).sum(dim=0)  # (B,)
 
-            scope = f"shopcohort:{profile.slug}|cohort:{cfg.slug}"
-            for b_idx in range(n_buckets):
-                mv = wmean[b_idx].item()
-                if math.isnan(mv):
-                    continue
-                row = {
-                    "bucket": tensor.bucket_index[b_idx],
-                    "scope": scope,
-                    "mean": round(mv, 2),
-                    "median": round(mv, 2),
-                    "std": round(wstd[b_idx].item(), 2),
-                    "shop_count": int(shop_count_per_bucket[b_idx].item()),
-                    "dispersion": round(wdisp[b_idx].item(), 2),
-                }
-                for fname, ftensor in features.items():
-                    row[fname] = round(ftensor[0, b_idx].item(), 2)
-                rows.append(row)
-
-    logger.info("_per_profile_cohort_features_df: %d rows", len(rows))
-    return pd.DataFrame(rows)
+            mean_np = _to_numpy(wmean_2d)
+            parts.append(_frame_part(
+                tensor.bucket_index, [f"shopcohort:{profile.slug}|cohort:{cfg.slug}"], ~np.isnan(mean_np), {
+                    "mean": mean_np,
+                    "median": mean_np,
+                    "std": _to_numpy(wstd.unsqueeze(0)),
+                    "shop_count": _to_numpy(shop_count_per_bucket.unsqueeze(0)).astype(np.int64),
+                    "dispersion": _to_numpy(wdisp.unsqueeze(0)),
+                    **{fname: _to_numpy(ftensor) for fname, ftensor in features.items()},
+                },
+            ))
+
+    df = _concat_parts(parts)
+    logger.info("_per_profile_cohort_features_df: %d rows", len(df))
+    return df
+
+
+# ── 列式组装 ─────────────────────────────────────────────────────────────
+#
+# 特征表按列组装: 每个 (scope 组, 特征) 张量一次转 NumPy, 用 NaN 掩码按行优先
+# 取出有效 (scope, bucket), scope 字符串 np.repeat 展开; 不再逐元素 .item()。
+
+def _to_numpy(t) -> np.ndarray:
+    return t.detach().cpu().numpy()
+
 
+def _round_like_python(values: np.ndarray, ndigits: int, exact=None) -> np.ndarray:
+    """逐元素等价于 Python round(x, ndigits) 的向量化舍入。
+
+    np.round 先乘 10^n 再 rint; 只有 x·10^n 距 .5 几个 ulp 以内时可能与
+    Python 的十进制正确舍入不同, 这些元素回退到 Python round。
+    exact(i) 给出时用它重新求第 i 个元素的原值 (用于 np.log 等可能差 1 ulp 的列)。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    out = np.round(values, ndigits)
+    scaled = values * 10.0 ** ndigits
+    with np.errstate(invalid="ignore"):
+        near_tie = np.abs(scaled - np.floor(scaled) - 0.5) <= 4 * np.spacing(np.abs(scaled))
+    for i in np.flatnonzero(near_tie):
+        v = exact(i) if exact is not None else values[i]
+        out[i] = round(float(v), ndigits)
+    return out
+
+
+def _frame_part(
+    bucket_index: pd.DatetimeIndex,
+    scopes: list[str],
+    mask: np.ndarray,
+    columns: dict[str, object],
+) -> dict[str, object]:
+    """按 mask (n_scopes, n_buckets) 行优先取出有效 (scope, bucket) 的列数组。
+
+    columns 的值可以是 (n_scopes, n_buckets) 数组或标量常量;
+    浮点数组统一 round(…, 2), 整数数组与标量原样写入。
+    """
+    counts = mask.sum(axis=1)
+    b_idx = np.nonzero(mask)[1]
+    n_rows = len(b_idx)
+    part: dict[str, object] = {
+        "bucket": bucket_index[b_idx],
+        "scope": np.repeat(np.asarray(scopes, dtype=object), counts),
+    }
+    for name, value in columns.items():
+        if isinstance(value, np.ndarray):
+            picked = value[mask]
+            part[name] = _round_like_python(picked, 2) if picked.dtype.kind == "f" else picked
+        else:
+            part[name] = np.full(n_rows, value)
+    return part
+
+
+def _add_logb_columns(
+    part: dict[str, object],
+    iphone_ids: np.ndarray,
+    mask: np.ndarray,
+    official_prices: dict,
+) -> None:
+    """E1: logb_W = round(log(wma_W / official), 4), 仅 official > 0 且 wma_W > 0 的行有值。
+
+    列按首次出现的行顺序插入 part (与逐行 dict 组装时 DataFrame 的列顺序一致)。
+    """
+    import math
+
+    official = np.array(
+        [float(official_prices.get(int(iid)) or 0) for iid in iphone_ids], dtype=np.float64,
+    )
+    row_official = np.repeat(official, mask.sum(axis=1))
+    first_seen: list[tuple[int, int, str, np.ndarray]] = []
+
+    for order, W in enumerate(FEATURE_WINDOWS):
+        wma = part.get(f"wma_{W}")
+        if wma is None:
+            continue
+        with np.errstate(invalid="ignore", divide="ignore"):
+            present = (row_official > 0) & (wma > 0)
+        if not present.any():
+            continue
+        rows = np.flatnonzero(present)
+        ratio = wma[rows] / row_official[rows]
+        logb = np.full(len(wma), np.nan)
+        logb[rows] = _round_like_python(
+            np.log(ratio), 4, exact=lambda i, _r=ratio: math.log(_r[i]),
+        )
+        first_seen.append((int(rows[0]), order, f"logb_{W}", logb))
+
+    for _, _, name, logb in sorted(first_seen):
+        part[name] = logb
+
+
+def _concat_parts(parts: list[dict[str, object]]) -> pd.DataFrame:
+    """合并多个 _frame_part, 列按首次出现顺序取并集, 缺失列补 NaN。"""
+    parts = [p for p in parts if len(p["bucket"])]
+    if not parts:
+        return pd.DataFrame()
+
+    names: list[str] = []
+    for p in parts:
+        names.extend(n for n in p if n not in names)
+
+    data: dict[str, object] = {"bucket": parts[0]["bucket"].append([p["bucket"] for p in parts[1:]])}
+    for name in names[1:]:
+        data[name] = np.concatenate([
+            p[name] if name in p else np.full(len(p["bucket"]), np.nan) for p in parts
+        ])
+    return pd.DataFrame(data)
@@ -2,11 +2,17 @@
 LightGBM 价格预测模块。
 - 训练: 从 ClickHouse features_wide 读取特征, 训练 4 个 horizon 的 LightGBM 回归器
 - 推理: 加载最新 ModelArtifact, 预测未来 15/30/45/60 分钟均价
+- 批量: 多机型训练共用一次特征查询并在进程池中并行; 推理一次查询取全部机型最新特征行,
+  booster 反序列化结果进程内 LRU 缓存, ForecastSnapshot 批量 upsert
 """
 from __future__ import annotations
 
 import logging
+import os
 import pickle
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Any
 
@@ -86,6 +92,36 @@ def _fetch_features_df(
     return df
 
 
+def _fetch_features_frames(
+    ch_service,
+    iphone_ids: list[int],
+    run_id: str,
+    bucket_gte: datetime,
+    bucket_lte: datetime,
+) -> dict[int, pd.DataFrame]:
+    """一次查询读取多个机型的特征, 返回 {iphone_id: DataFrame (按 bucket 排序)}; 无数据的机型不在结果中。"""
+    scopes = {f"iphone:{iid}": iid for iid in iphone_ids}
+    rows, _ = ch_service.query_features(
+        run_id=run_id,
+        scope_in=list(scopes),
+        bucket_gte=bucket_gte,
+        bucket_lte=bucket_lte,
+        columns=FEATURE_COLUMNS,
+        limit=0,
+        need_total=False,
+        ordering="bucket",
+    )
+    if not rows:
+        return {}
+    df = pd.DataFrame(rows)
+    df["bucket"] = pd.to_datetime(df["bucket"])
+    return {
+        scopes[scope]: g.sort_values("bucket").reset_index(drop=True)
+        for scope, g in df.groupby("scope", sort=False)
+        if scope in scopes
+    }
+
+
 # ── 标签构造 ──────────────────────────────────────────────────────────
 
 def _build_targets(df: pd.DataFrame) -> pd.DataFrame:
@@ -122,6 +158,16 @@ def train_models_for_iphone(
         iphone_id, bucket_gte, now, run_id,
     )
     df = _fetch_features_df(ch_service, iphone_id, run_id, bucket_gte, now)
+    return _train_from_frame(df, iphone_id, now)
+
+
+def _train_from_frame(
+    df: pd.DataFrame,
+    iphone_id: int,
+    now: datetime,
+    num_threads: int | None = None,
+) -> dict:
+    """在已读取的特征 DataFrame 上训练 4 个 horizon 的模型 (返回结构同 train_models_for_iphone)。"""
     if df.empty or len(df) < 20:
         raise ValueError(
             f"Insufficient data for iphone {iphone_id}: {len(df)} rows (need >=20)"
@@ -144,6 +190,7 @@ def train_models_for_iphone(
     split_idx = int(len(X) * (1 - HOLDOUT_RATIO))
     X_train, X_val = X.iloc[:split_idx], X.iloc[split_idx:]
 
+    params = LGB_PARAMS if num_threads is None else {**LGB_PARAMS, "num_threads": num_threads}
     models: dict[int, lgb.Booster] = {}
     metrics: dict[int, dict] = {}
 
@@ -156,7 +203,7 @@ def train_models_for_iphone(
         dval = lgb.Dataset(X_val, label=y_val, reference=dtrain)
 
         bst = lgb.train(
-            LGB_PARAMS,
+            params,
             dtrain,
             num_boost_round=LGB_NUM_ROUNDS,
             valid_sets=[dval],
@@ -189,6 +236,67 @@ def train_models_for_iphone(
     }
 
 
+def _train_worker(args: tuple) -> tuple[int, dict | None, str | None]:
+    iphone_id, df, now, num_threads = args
+    try:
+        return iphone_id, _train_from_frame(df, iphone_id, now, num_threads=num_threads), None
+    except Exception as e:
+        logger.exception("training failed: iphone=%d", iphone_id)
+        return iphone_id, None, str(e)
+
+
+def train_models_for_iphones(
+    ch_service,
+    iphone_ids: list[int],
+    *,
+    run_id: str = "live",
+    train_days: int = TRAIN_DAYS_DEFAULT,
+    bucket_lte: datetime | None = None,
+    max_workers: int | None = None,
+) -> tuple[dict[int, dict], dict[int, str]]:
+    """多机型批量训练。
+
+    特征一次查询读出后按机型切分, 在线程池中并行训练 (lgb.train 执行期间释放 GIL, Celery prefork
+    worker 内也可用); 每个 booster 的 LightGBM 线程数限制为 settings.PREDICTION_LGB_THREADS
+    (0 = CPU 数 ÷ 训练线程数), 避免 线程池 × LightGBM 线程 超订, 串行训练时同样生效。
+    max_workers 默认 settings.PREDICTION_TRAIN_WORKERS (0 = CPU 数); <=1 时在当前线程串行训练。
+
+    Returns
+    -------
+    (results, errors)
+      results: {iphone_id: train_models_for_iphone 的返回值}
+      errors:  {iphone_id: 错误描述}
+    """
+    from django.conf import settings
+
+    if not iphone_ids:
+        return {}, {}
+    now = bucket_lte or datetime.utcnow()
+    bucket_gte = now - timedelta(days=train_days)
+    logger.info(
+        "Fetching features for %d iphones, range=[%s, %s], run_id=%s",
+        len(iphone_ids), bucket_gte, now, run_id,
+    )
+    frames = _fetch_features_frames(ch_service, iphone_ids, run_id, bucket_gte, now)
+
+    cpus = os.cpu_count() or 1
+    if max_workers is None:
+        max_workers = int(getattr(settings, "PREDICTION_TRAIN_WORKERS", 0) or cpus)
+    workers = max(1, min(max_workers, len(iphone_ids)))
+    threads = int(getattr(settings, "PREDICTION_LGB_THREADS", 0) or 0) or max(1, cpus // workers)
+    jobs = [(iid, frames.get(iid, pd.DataFrame()), now, threads) for iid in iphone_ids]
+
+    if workers == 1:
+        outputs = [_train_worker(job) for job in jobs]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            outputs = list(pool.map(_train_worker, jobs))
+
+    results = {iid: res for iid, res, err in outputs if err is None}
+    errors = {iid: err for iid, _res, err in outputs if err is not None}
+    return results, errors
+
+
 def save_artifacts(
     iphone_id: int,
     train_result: dict,
@@ -244,6 +352,148 @@ def load_model(iphone_id: int, horizon: int, version: str = MODEL_VERSION) -> di
     }
 
 
+# 已反序列化的 booster: (iphone_id, horizon, version, artifact_id, trained_at) -> {booster, feature_columns}
+# 重新训练时 save_artifacts 会刷新 trained_at, 旧键自然失效并随 LRU 淘汰
+_booster_lock = threading.Lock()
+_booster_cache: OrderedDict = OrderedDict()
+_booster_counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def _model_name(iphone_id: int, horizon: int) -> str:
+    return f"{MODEL_NAME_PREFIX}_{iphone_id}_h{horizon}"
+
+
+def load_models(iphone_ids: list[int], version: str = MODEL_VERSION) -> dict[tuple[int, int], dict]:
+    """批量加载多个机型全部 horizon 的最新模型, 返回 {(iphone_id, horizon): {booster, feature_columns}}。
+
+    先用一次查询取各模型最新产物的 (id, trained_at); LRU 命中的不再读取 params_blob、不再反序列化,
+    未命中的 blob 一次查询读出。没有产物的 (机型, horizon) 不在结果中。
+    """
+    from django.conf import settings
+    from AppleStockChecker.models import ModelArtifact
+
+    wanted = {_model_name(iid, h): (iid, h) for iid in iphone_ids for h in HORIZONS}
+    if not wanted:
+        return {}
+    latest: dict[str, dict] = {}
+    for row in (
+        ModelArtifact.objects.filter(model_name__in=list(wanted), version=version)
+        .order_by("model_name", "-trained_at")
+        .values("id", "model_name", "trained_at")
+    ):
+        latest.setdefault(row["model_name"], row)
+
+    out: dict[tuple[int, int], dict] = {}
+    missing: dict[int, tuple] = {}
+    with _booster_lock:
+        for name, meta in latest.items():
+            iid, h = wanted[name]
+            key = (iid, h, version, meta["id"], meta["trained_at"])
+            entry = _booster_cache.get(key)
+            if entry is not None:
+                _booster_cache.move_to_end(key)
+                _booster_counters["hits"] += 1
+                out[(iid, h)] = entry
+            else:
+                _booster_counters["misses"] += 1
+                missing[meta["id"]] = key
+
+    if missing:
+        blobs = dict(ModelArtifact.objects.filter(pk__in=list(missing)).values_list("pk", "params_blob"))
+        loaded = {}
+        for pk, key in missing.items():
+            payload = pickle.loads(bytes(blobs[pk]))
+            entry = {"booster": payload["booster"], "feature_columns": payload["feature_columns"]}
+            loaded[key] = entry
+            out[(key[0], key[1])] = entry
+
+        size = int(getattr(settings, "PREDICTION_BOOSTER_CACHE_SIZE", 512))
+        with _booster_lock:
+            _booster_cache.update(loaded)
+            while len(_booster_cache) > size:
+                _booster_cache.popitem(last=False)
+                _booster_counters["evictions"] += 1
+
+    return out
+
+
+def clear_booster_cache() -> None:
+    with _booster_lock:
+        _booster_cache.clear()
+
+
+def booster_cache_stats() -> dict:
+    with _booster_lock:
+        total = _booster_counters["hits"] + _booster_counters["misses"]
+        return {
+            **_booster_counters,
+            "size": len(_booster_cache),
+            "hit_ratio": round(_booster_counters["hits"] / total, 4) if total else None,
+        }
+
+
+def predict_for_iphones(
+    ch_service,
+    iphone_ids: list[int],
+    *,
+    run_id: str = "live",
+    bucket: datetime | None = None,
+    version: str = MODEL_VERSION,
+) -> tuple[list[dict], dict[int, str]]:
+    """多机型批量推理: 一次 ClickHouse 查询取全部机型的最新特征行, 模型经 load_models (LRU) 加载。
+
+    Returns
+    -------
+    (predictions, errors)
+      predictions: 与 predict_for_iphone 相同结构的预测列表 (所有机型拼接)
+      errors:      {iphone_id: 错误描述}, 缺特征或缺模型的机型
+    """
+    now = bucket or datetime.utcnow()
+    lookback = timedelta(hours=6)
+    latest_rows = ch_service.query_latest_features(
+        scopes=[f"iphone:{iid}" for iid in iphone_ids],
+        run_id=run_id,
+        bucket_gte=now - lookback,
+        bucket_lte=now,
+        columns=FEATURE_COLUMNS,
+    )
+    models = load_models(
+        [iid for iid in iphone_ids if f"iphone:{iid}" in latest_rows], version,
+    )
+
+    predictions: list[dict] = []
+    errors: dict[int, str] = {}
+    for iid in iphone_ids:
+        row = latest_rows.get(f"iphone:{iid}")
+        if row is None:
+            errors[iid] = f"No feature data for iphone {iid} near {now}"
+            continue
+        latest = pd.DataFrame([row])
+        latest_bucket = pd.to_datetime(latest["bucket"]).iloc[0]
+        try:
+            preds = []
+            for horizon in HORIZONS:
+                loaded = models.get((iid, horizon))
+                if loaded is None:
+                    raise FileNotFoundError(f"No artifact found: {_model_name(iid, horizon)} {version}")
+                X = latest[loaded["feature_columns"]].astype(float).fillna(0)
+                preds.append({
+                    "bucket": latest_bucket,
+                    "iphone_id": iid,
+                    "horizon_min": horizon,
+                    "yhat": float(loaded["booster"].predict(X)[0]),
+                    "model_name": _model_name(iid, horizon),
+                    "version": version,
+                })
+        except Exception as e:
+            logger.exception("predict failed: iphone=%d", iid)
+            errors[iid] = str(e)
+            continue
+        predictions.extend(preds)
+
+    return predictions, errors
+
+
 def predict_for_iphone(
     ch_service,
     iphone_id: int,
@@ -265,9 +515,12 @@ def predict_for_iphone(
     latest = df.iloc[[-1]]
     latest_bucket = latest["bucket"].iloc[0]
 
+    models = load_models([iphone_id], version)
     results = []
     for horizon in HORIZONS:
-        loaded = load_model(iphone_id, horizon, version)
+        loaded = models.get((iphone_id, horizon))
+        if loaded is None:
+            raise FileNotFoundError(f"No artifact found: {_model_name(iphone_id, horizon)} {version}")
         bst = loaded["booster"]
         feat_cols = loaded["feature_columns"]
 
@@ -286,25 +539,61 @@ def predict_for_iphone(
     return results
 
 
-def save_forecasts(predictions: list[dict]) -> int:
-    """将预测结果写入 ForecastSnapshot。"""
-    from AppleStockChecker.models import ForecastSnapshot, Iphone
-
-    created = 0
-    for p in predictions:
-        iphone = Iphone.objects.get(pk=p["iphone_id"])
-        _, was_created = ForecastSnapshot.objects.update_or_create(
-            bucket=p["bucket"],
-            model_name=p["model_name"],
-            version=p["version"],
-            horizon_min=p["horizon_min"],
-            iphone=iphone,
-            defaults={
-                "yhat": p["yhat"],
-                "yhat_var": None,
-                "is_final": False,
-            },
+def _forecast_key(p: dict) -> tuple:
+    from django.conf import settings
+    from django.utils import timezone
+
+    bucket = pd.Timestamp(p["bucket"]).to_pydatetime()
+    if settings.USE_TZ and timezone.is_naive(bucket):
+        # 与 ORM 保存 naive datetime 时的解释一致 (默认时区)
+        bucket = timezone.make_aware(bucket, timezone.get_default_timezone())
+    return bucket, p["model_name"], p["version"], p["horizon_min"], p["iphone_id"]
+
+
+def upsert_forecasts(predictions: list[dict]) -> list[bool]:
+    """批量 upsert ForecastSnapshot, 返回与 predictions 对齐的"是否新建"标记。
+
+    先一次查询已存在的键, 再以 INSERT ... ON CONFLICT DO UPDATE 一次写入
+    (唯一键 bucket/model_name/version/horizon_min/iphone); 同一批内重复的键以最后一条为准。
+    """
+    from AppleStockChecker.models import ForecastSnapshot
+
+    if not predictions:
+        return []
+    keys = [_forecast_key(p) for p in predictions]
+    existing = set(
+        ForecastSnapshot.objects.filter(
+            bucket__in={k[0] for k in keys},
+            model_name__in={k[1] for k in keys},
+            version__in={k[2] for k in keys},
+            iphone_id__in={k[4] for k in keys},
+        ).values_list("bucket", "model_name", "version", "horizon_min", "iphone_id")
+    )
+
+    objs: dict[tuple, ForecastSnapshot] = {}
+    created: list[bool] = []
+    for key, p in zip(keys, predictions):
+        created.append(key not in existing and key not in objs)
+        objs[key] = ForecastSnapshot(
+            bucket=key[0],
+            model_name=key[1],
+            version=key[2],
+            horizon_min=key[3],
+            iphone_id=key[4],
+            yhat=p["yhat"],
+            yhat_var=None,
+            is_final=False,
         )
-        if was_created:
-            created += 1
+    ForecastSnapshot.objects.bulk_create(
+        list(objs.values()),
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=["bucket", "model_name", "version", "horizon_min", "iphone"],
+        update_fields=["yhat", "yhat_var", "is_final"],
+    )
     return created
+
+
+def save_forecasts(predictions: list[dict]) -> int:
+    """将预测结果写入 ForecastSnapshot, 返回新建条数。"""
+    return sum(upsert_forecasts(predictions))
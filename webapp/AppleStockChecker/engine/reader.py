@@ -7,6 +7,7 @@ from __future__ import annotations
 import logging
 from datetime import date, datetime
 
+import numpy as np
 import pandas as pd
 from django.db import connection
 
@@ -28,6 +29,32 @@ WHERE recorded_at >= %s
 ORDER BY recorded_at
 """
 
+_AXES_SQL = """\
+SELECT DISTINCT shop_id, iphone_id
+FROM "AppleStockChecker_purchasingshoppricerecord"
+WHERE recorded_at >= %s
+  AND recorded_at <  %s
+  {shop_clause}
+  {iphone_clause}
+"""
+
+
+def _filter_clauses(
+    shop_ids: list[int] | None,
+    iphone_ids: list[int] | None,
+) -> tuple[str, str, list]:
+    params: list = []
+    shop_clause = ""
+    iphone_clause = ""
+
+    if shop_ids:
+        shop_clause = f"AND shop_id IN ({','.join('%s' for _ in shop_ids)})"
+        params.extend(shop_ids)
+    if iphone_ids:
+        iphone_clause = f"AND iphone_id IN ({','.join('%s' for _ in iphone_ids)})"
+        params.extend(iphone_ids)
+    return shop_clause, iphone_clause, params
+
 
 def read_price_records(
     date_from: date | datetime,
@@ -42,16 +69,8 @@ def read_price_records(
     -------
     DataFrame  columns: shop_id, iphone_id, price_new, price_a, price_b, recorded_at
     """
-    params: list = [date_from, date_to]
-    shop_clause = ""
-    iphone_clause = ""
-
-    if shop_ids:
-        shop_clause = f"AND shop_id IN ({','.join('%s' for _ in shop_ids)})"
-        params.extend(shop_ids)
-    if iphone_ids:
-        iphone_clause = f"AND iphone_id IN ({','.join('%s' for _ in iphone_ids)})"
-        params.extend(iphone_ids)
+    shop_clause, iphone_clause, params = _filter_clauses(shop_ids, iphone_ids)
+    params = [date_from, date_to, *params]
 
     sql = _SQL.format(shop_clause=shop_clause, iphone_clause=iphone_clause)
     logger.info("read_price_records  %s → %s  shops=%s iphones=%s",
@@ -67,3 +86,28 @@ def read_price_records(
 
     logger.info("read_price_records  rows=%d", len(df))
     return df
+
+
+def read_price_axes(
+    date_from: date | datetime,
+    date_to: date | datetime,
+    *,
+    shop_ids: list[int] | None = None,
+    iphone_ids: list[int] | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """读取范围内出现过的 (iphone_ids, shop_ids), 均已排序。
+
+    流式 pipeline 各段共用这组全局轴, 与整段 build_price_tensor 的轴一致。
+    """
+    shop_clause, iphone_clause, params = _filter_clauses(shop_ids, iphone_ids)
+    sql = _AXES_SQL.format(shop_clause=shop_clause, iphone_clause=iphone_clause)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [date_from, date_to, *params])
+        pairs = cursor.fetchall()
+
+    axis_iphones = np.unique(np.array([p[1] for p in pairs], dtype=np.int64))
+    axis_shops = np.unique(np.array([p[0] for p in pairs], dtype=np.int64))
+    logger.info("read_price_axes  %s → %s  iphones=%d shops=%d",
+                date_from, date_to, len(axis_iphones), len(axis_shops))
+    return axis_iphones, axis_shops
@@ -0,0 +1,501 @@
+"""
+逐元素循环参考实现 (向量化内核替换前的原版)。
+仅用于对拍测试与 scripts/bench_engine.py, pipeline 不引用。
+"""
+from __future__ import annotations
+
+import logging
+
+import pandas as pd
+import torch
+
+from .config import FEATURE_WINDOWS
+
+logger = logging.getLogger(__name__)
+
+
+def apply_dynamic_price_filter_loop(
+    data: torch.Tensor,
+    *,
+    lookback_buckets: int = 2,
+    tolerance: float = 0.10,
+    min_samples: int = 3,
+    fallback_range: tuple[float, float] = (100_000.0, 350_000.0),
+) -> torch.Tensor:
+    """aggregate.apply_dynamic_price_filter 原版: 逐桶 × 逐 iPhone, 返回过滤后的 (I, S, B)。"""
+    data = data.clone()
+    n_i, n_s, n_b = data.shape
+
+    for b in range(n_b):
+        lb = max(0, b - lookback_buckets)
+        if lb == b:
+            ref_slice = data[:, :, b:b + 1]
+        else:
+            ref_slice = data[:, :, lb:b]
+
+        for i in range(n_i):
+            ref_vals = ref_slice[i].reshape(-1)
+            ref_valid = ref_vals[~torch.isnan(ref_vals)]
+
+            if ref_valid.numel() >= min_samples:
+                ref_price = ref_valid.mean().item()
+                lo = ref_price * (1 - tolerance)
+                hi = ref_price * (1 + tolerance)
+            else:
+                lo, hi = fallback_range
+
+            prices = data[i, :, b]
+            bad = (~torch.isnan(prices)) & ((prices < lo) | (prices > hi))
+            prices[bad] = float("nan")
+
+    return data
+
+
+def mad_filter_dim1_loop(data: torch.Tensor, k: float = 3.0) -> torch.Tensor:
+    """aggregate._mad_filter_dim1 原版: 逐 (iphone, bucket) 排序。"""
+    I, S, B = data.shape
+    result = data.clone()
+    for i in range(I):
+        for b in range(B):
+            vals = data[i, :, b]
+            valid_mask = ~torch.isnan(vals)
+            valid = vals[valid_mask]
+            if valid.numel() < 3:
+                continue
+            sorted_v = valid.sort().values
+            n = sorted_v.numel()
+            if n % 2 == 1:
+                med = sorted_v[n // 2]
+            else:
+                med = (sorted_v[n // 2 - 1] + sorted_v[n // 2]) / 2.0
+            abs_devs = (valid - med).abs().sort().values
+            if n % 2 == 1:
+                mad = abs_devs[n // 2]
+            else:
+                mad = (abs_devs[n // 2 - 1] + abs_devs[n // 2]) / 2.0
+            threshold = k * 1.4826 * mad
+            if threshold == 0:
+                continue
+            outlier = valid_mask & ((vals - med).abs() > threshold)
+            result[i, outlier, b] = float("nan")
+    return result
+
+
+def nanmedian_dim1_loop(data: torch.Tensor) -> torch.Tensor:
+    """aggregate._nanmedian_dim1 原版: 逐 (iphone, bucket) 排序。"""
+    I, S, B = data.shape
+    result = torch.full((I, B), float("nan"), dtype=data.dtype, device=data.device)
+
+    for i in range(I):
+        for b in range(B):
+            vals = data[i, :, b]
+            valid = vals[~torch.isnan(vals)]
+            n = valid.numel()
+            if n > 0:
+                sorted_v = valid.sort().values
+                if n % 2 == 1:
+                    result[i, b] = sorted_v[n // 2]
+                else:
+                    result[i, b] = (sorted_v[n // 2 - 1] + sorted_v[n // 2]) / 2.0
+    return result
+
+
+def forward_fill_1d_loop(series: torch.Tensor) -> torch.Tensor:
+    """features._forward_fill_1d 原版: 逐列 forward-fill。"""
+    out = series.clone()
+    mask = torch.isnan(out)
+    for t in range(1, out.shape[1]):
+        fill = mask[:, t]
+        out[:, t] = torch.where(fill, out[:, t - 1], out[:, t])
+    return out
+
+
+def ema_loop(series: torch.Tensor, alpha: float) -> torch.Tensor:
+    """features.compute_ema_batch / compute_ema_halflife_batch 原版: 逐桶递推。"""
+    ema = torch.zeros_like(series)
+    ema[:, 0] = series[:, 0]
+    for t in range(1, series.shape[1]):
+        ema[:, t] = alpha * series[:, t] + (1 - alpha) * ema[:, t - 1]
+    return ema
+
+
+def ema_skipnan_loop(series: torch.Tensor, alpha: float) -> torch.Tensor:
+    """features.compute_ema_*_skipnan 原版: 逐桶递推, NaN 后重新初始化。"""
+    n_rows, n_cols = series.shape
+    ema = torch.full_like(series, float("nan"))
+    ema[:, 0] = series[:, 0]
+
+    for t in range(1, n_cols):
+        cur = series[:, t]
+        prev = ema[:, t - 1]
+        cur_valid = ~torch.isnan(cur)
+        prev_valid = ~torch.isnan(prev)
+
+        normal = cur_valid & prev_valid
+        reinit = cur_valid & ~prev_valid
+
+        ema[:, t] = torch.where(
+            normal,
+            alpha * cur + (1 - alpha) * prev,
+            torch.where(reinit, cur, torch.full_like(cur, float("nan"))),
+        )
+
+    return ema
+
+
+# ── pipeline 特征表组装 (逐行 dict 原版) ─────────────────────────────────
+
+def agg_to_features_df_loop(
+    agg,
+    features: dict[str, object],
+) -> pd.DataFrame:
+    """将 AggResult + feature tensors 组装为 features_wide 格式 DataFrame。"""
+    import math
+    import torch
+
+    n_iphones = len(agg.iphone_ids)
+    n_buckets = len(agg.bucket_index)
+    rows = []
+
+    for i_idx in range(n_iphones):
+        iphone_id = int(agg.iphone_ids[i_idx])
+        scope = f"iphone:{iphone_id}"
+
+        for b_idx in range(n_buckets):
+            mean_val = agg.mean[i_idx, b_idx].item()
+            # shop_count=0 的桶 mean 为 NaN，无有效数据，跳过
+            if math.isnan(mean_val):
+                continue
+            row = {
+                "bucket": agg.bucket_index[b_idx],
+                "scope": scope,
+                "mean": round(mean_val, 2),
+                "median": round(agg.median[i_idx, b_idx].item(), 2),
+                "std": round(agg.std[i_idx, b_idx].item(), 2),
+                "shop_count": int(agg.shop_count[i_idx, b_idx].item()),
+                "dispersion": round(agg.dispersion[i_idx, b_idx].item(), 2),
+            }
+            for fname, ftensor in features.items():
+                row[fname] = round(ftensor[i_idx, b_idx].item(), 2)
+            rows.append(row)
+
+    return pd.DataFrame(rows)
+
+
+def per_shop_features_df_loop(tensor, *, skipnan: bool = False) -> pd.DataFrame:
+    """为每个 (shop_id, iphone_id) 计算特征，scope = shop:{sid}|iphone:{iid}。
+
+    单店的 mean 就是价格本身 (shop_count=1, std=0)。
+    """
+    import math
+    import torch
+    from AppleStockChecker.engine.features import compute_all_features, compute_all_features_skipnan
+
+    n_iphones, n_shops, n_buckets = tensor.data.shape
+    rows = []
+
+    for s_idx in range(n_shops):
+        shop_id = int(tensor.shop_ids[s_idx])
+        # 取该店的 2D 切片: (n_iphones, n_buckets)
+        shop_slice = tensor.data[:, s_idx, :]
+
+        # 检查该店是否有任何有效数据
+        if torch.isnan(shop_slice).all():
+            continue
+
+        feat_fn = compute_all_features_skipnan if skipnan else compute_all_features
+        features = feat_fn(shop_slice)
+
+        for i_idx in range(n_iphones):
+            iphone_id = int(tensor.iphone_ids[i_idx])
+            scope = f"shop:{shop_id}|iphone:{iphone_id}"
+
+            for b_idx in range(n_buckets):
+                price_val = shop_slice[i_idx, b_idx].item()
+                if math.isnan(price_val):
+                    continue
+                row = {
+                    "bucket": tensor.bucket_index[b_idx],
+                    "scope": scope,
+                    "mean": round(price_val, 2),
+                    "median": round(price_val, 2),
+                    "std": 0.0,
+                    "shop_count": 1,
+                    "dispersion": 0.0,
+                }
+                for fname, ftensor in features.items():
+                    row[fname] = round(ftensor[i_idx, b_idx].item(), 2)
+                rows.append(row)
+
+    logger.debug("_per_shop_features_df: %d rows", len(rows))
+    return pd.DataFrame(rows)
+
+
+def per_profile_features_df_loop(tensor, profiles, *, skipnan: bool = False) -> pd.DataFrame:
+    """为每个 ShopWeightProfile × iphone_id 计算加权特征。
+
+    scope = shopcohort:{slug}|iphone:{iid}
+    """
+    import math
+    import torch
+    from AppleStockChecker.engine.features import compute_all_features, compute_all_features_skipnan
+
+    shop_id_to_idx = {int(v): i for i, v in enumerate(tensor.shop_ids)}
+    n_iphones = tensor.data.shape[0]
+    n_buckets = tensor.data.shape[2]
+    rows = []
+
+    for profile in profiles:
+        # 找到 profile 中在 tensor 里存在的 shop 及其权重
+        indices = []
+        weights = []
+        for item in profile.items:
+            s_idx = shop_id_to_idx.get(item["shop_id"])
+            if s_idx is not None:
+                indices.append(s_idx)
+                weights.append(item["weight"])
+
+        if not indices:
+            logger.warning("profile %s: no shops found in tensor, skipping", profile.slug)
+            continue
+
+        w = torch.tensor(weights, dtype=torch.float64, device=tensor.data.device)
+        w = w / w.sum()  # 归一化
+
+        # 对每个 iphone_id，按 shop 权重加权聚合
+        # tensor.data shape: (n_iphones, n_shops, n_buckets)
+        # 取 indices 对应的 shops: (n_iphones, len(indices), n_buckets)
+        shop_data = tensor.data[:, indices, :]
+
+        # 将 NaN 替换为 0 以便加权求和，同时跟踪有效性
+        valid_mask = ~torch.isnan(shop_data)  # (I, S_sub, B)
+        shop_data_clean = torch.where(valid_mask, shop_data, torch.zeros_like(shop_data))
+
+        # 加权有效掩码
+        w_expanded = w.unsqueeze(0).unsqueeze(2)  # (1, S_sub, 1)
+        valid_w = torch.where(valid_mask, w_expanded.expand_as(valid_mask), torch.zeros_like(shop_data))
+        w_sum = valid_w.sum(dim=1)  # (I, B)
+
+        # 加权平均
+        weighted_mean = (shop_data_clean * w_expanded.expand_as(shop_data_clean)).sum(dim=1)  # (I, B)
+        # 重新归一化 (只除以实际参与的权重之和)
+        weighted_mean = torch.where(w_sum > 0, weighted_mean / w_sum, torch.full_like(weighted_mean, float("nan")))
+
+        # 加权标准差: sqrt(sum(w_i * (x_i - mean)^2) / sum(w_i))
+        diff_sq = (shop_data_clean - weighted_mean.unsqueeze(1)) ** 2  # (I, S_sub, B)
+        weighted_var = torch.where(
+            valid_mask, diff_sq * w_expanded.expand_as(diff_sq), torch.zeros_like(diff_sq),
+        ).sum(dim=1)  # (I, B)
+        weighted_std = torch.where(
+            w_sum > 0, torch.sqrt(weighted_var / w_sum), torch.zeros_like(w_sum),
+        )  # (I, B)
+        weighted_disp = torch.where(
+            weighted_mean != 0, weighted_std / weighted_mean, torch.zeros_like(weighted_std),
+        )  # (I, B)
+
+        feat_fn = compute_all_features_skipnan if skipnan else compute_all_features
+        features = feat_fn(weighted_mean)
+
+        # E1: 如果是 full_store profile，预加载 official_prices 用于 logb
+        is_full_store = (profile.slug == "full_store")
+        official_prices = {}
+        if is_full_store:
+            from django.conf import settings as _settings
+            official_prices = getattr(_settings, "IPHONE_OFFICIAL_PRICES", {})
+
+        for i_idx in range(n_iphones):
+            iphone_id = int(tensor.iphone_ids[i_idx])
+            scope = f"shopcohort:{profile.slug}|iphone:{iphone_id}"
+
+            for b_idx in range(n_buckets):
+                mean_val = weighted_mean[i_idx, b_idx].item()
+                if math.isnan(mean_val):
+                    continue
+                row = {
+                    "bucket": tensor.bucket_index[b_idx],
+                    "scope": scope,
+                    "mean": round(mean_val, 2),
+                    "median": round(mean_val, 2),
+                    "std": round(weighted_std[i_idx, b_idx].item(), 2),
+                    "shop_count": int(valid_mask[i_idx, :, b_idx].sum().item()),
+                    "dispersion": round(weighted_disp[i_idx, b_idx].item(), 2),
+                }
+                for fname, ftensor in features.items():
+                    row[fname] = round(ftensor[i_idx, b_idx].item(), 2)
+
+                # E1: logb 直接在此计算，避免二次 INSERT
+                if is_full_store and official_prices:
+                    official = official_prices.get(iphone_id)
+                    if official and official > 0:
+                        for W in FEATURE_WINDOWS:
+                            wma_val = row.get(f"wma_{W}")
+                            if wma_val is not None and not math.isnan(wma_val) and wma_val > 0:
+                                row[f"logb_{W}"] = round(math.log(wma_val / official), 4)
+
+                rows.append(row)
+
+    logger.debug("_per_profile_features_df: %d rows", len(rows))
+    return pd.DataFrame(rows)
+
+
+def per_shop_cohort_features_df_loop(
+    tensor, cohort_configs, *, skipnan: bool = False,
+) -> pd.DataFrame:
+    """D2: 每个 shop × cohort 的加权特征。scope = shop:{sid}|cohort:{slug}"""
+    import math
+    import torch
+    from AppleStockChecker.engine.features import compute_all_features, compute_all_features_skipnan
+
+    iphone_id_to_idx = {int(v): i for i, v in enumerate(tensor.iphone_ids)}
+    n_shops = tensor.data.shape[1]
+    n_buckets = tensor.data.shape[2]
+    rows = []
+
+    for cfg in cohort_configs:
+        member_indices = []
+        member_weights = []
+        for m in cfg.members:
+            idx = iphone_id_to_idx.get(m["iphone_id"])
+            if idx is not None:
+                member_indices.append(idx)
+                member_weights.append(m["weight"])
+        if not member_indices:
+            continue
+
+        w = torch.tensor(member_weights, dtype=torch.float64, device=tensor.data.device)
+        w = w / w.sum()
+
+        for s_idx in range(n_shops):
+            shop_id = int(tensor.shop_ids[s_idx])
+            # (n_members, n_buckets)
+            member_data = tensor.data[member_indices, s_idx, :]
+
+            valid_mask = ~torch.isnan(member_data)
+            clean = torch.where(valid_mask, member_data, torch.zeros_like(member_data))
+
+            w_exp = w.unsqueeze(1)  # (n_members, 1)
+            valid_w = torch.where(valid_mask, w_exp.expand_as(valid_mask), torch.zeros_like(clean))
+            w_sum = valid_w.sum(dim=0)  # (n_buckets,)
+
+            weighted_sum = (clean * w_exp.expand_as(clean)).sum(dim=0)
+            wmean = torch.where(w_sum > 0, weighted_sum / w_sum, torch.full_like(w_sum, float("nan")))
+
+            diff_sq = (clean - wmean.unsqueeze(0)) ** 2
+            wvar = torch.where(valid_mask, diff_sq * w_exp.expand_as(diff_sq), torch.zeros_like(diff_sq)).sum(dim=0)
+            wstd = torch.where(w_sum > 0, torch.sqrt(wvar / w_sum), torch.zeros_like(w_sum))
+            wdisp = torch.where(wmean != 0, wstd / wmean, torch.zeros_like(wstd))
+
+            wmean_2d = wmean.unsqueeze(0)  # (1, B)
+            feat_fn = compute_all_features_skipnan if skipnan else compute_all_features
+            features = feat_fn(wmean_2d)
+
+            scope = f"shop:{shop_id}|cohort:{cfg.slug}"
+            for b_idx in range(n_buckets):
+                mv = wmean[b_idx].item()
+                if math.isnan(mv):
+                    continue
+                row = {
+                    "bucket": tensor.bucket_index[b_idx],
+                    "scope": scope,
+                    "mean": round(mv, 2),
+                    "median": round(mv, 2),
+                    "std": round(wstd[b_idx].item(), 2),
+                    "shop_count": 1,
+                    "dispersion": round(wdisp[b_idx].item(), 2),
+                }
+                for fname, ftensor in features.items():
+                    row[fname] = round(ftensor[0, b_idx].item(), 2)
+                rows.append(row)
+
+    logger.debug("_per_shop_cohort_features_df: %d rows", len(rows))
+    return pd.DataFrame(rows)
+
+
+def per_profile_cohort_features_df_loop(
+    tensor, profiles, cohort_configs, *, skipnan: bool = False,
+) -> pd.DataFrame:
+    """D3: 每个 profile × cohort 的加权特征。scope = shopcohort:{prof}|cohort:{slug}"""
+    import math
+    import torch
+    from AppleStockChecker.engine.features import compute_all_features, compute_all_features_skipnan
+
+    shop_id_to_idx = {int(v): i for i, v in enumerate(tensor.shop_ids)}
+    iphone_id_to_idx = {int(v): i for i, v in enumerate(tensor.iphone_ids)}
+    n_buckets = tensor.data.shape[2]
+    rows = []
+
+    for profile in profiles:
+        shop_indices = []
+        shop_weights = []
+        for item in profile.items:
+            s_idx = shop_id_to_idx.get(item["shop_id"])
+            if s_idx is not None:
+                shop_indices.append(s_idx)
+                shop_weights.append(item["weight"])
+        if not shop_indices:
+            continue
+
+        sw = torch.tensor(shop_weights, dtype=torch.float64, device=tensor.data.device)
+        sw = sw / sw.sum()
+
+        for cfg in cohort_configs:
+            member_indices = []
+            member_weights = []
+            for m in cfg.members:
+                idx = iphone_id_to_idx.get(m["iphone_id"])
+                if idx is not None:
+                    member_indices.append(idx)
+                    member_weights.append(m["weight"])
+            if not member_indices:
+                continue
+
+            mw = torch.tensor(member_weights, dtype=torch.float64, device=tensor.data.device)
+            mw = mw / mw.sum()
+
+            # (n_members, n_shops_sub, n_buckets)
+            sub = tensor.data[member_indices][:, shop_indices, :]
+            valid = ~torch.isnan(sub)
+            clean = torch.where(valid, sub, torch.zeros_like(sub))
+
+            # Combined weight: shop_weight × model_weight → (n_members, n_shops_sub, 1)
+            combined_w = (mw.unsqueeze(1) * sw.unsqueeze(0)).unsqueeze(2)  # (M, S, 1)
+            valid_w = torch.where(valid, combined_w.expand_as(valid), torch.zeros_like(clean))
+            w_sum = valid_w.sum(dim=(0, 1))  # (B,)
+
+            weighted_sum = (clean * combined_w.expand_as(clean)).sum(dim=(0, 1))  # (B,)
+            wmean = torch.where(w_sum > 0, weighted_sum / w_sum, torch.full_like(w_sum, float("nan")))
+
+            diff_sq = (clean - wmean.unsqueeze(0).unsqueeze(0)) ** 2
+            wvar = torch.where(
+                valid, diff_sq * combined_w.expand_as(diff_sq), torch.zeros_like(diff_sq),
+            ).sum(dim=(0, 1))
+            wstd = torch.where(w_sum > 0, torch.sqrt(wvar / w_sum), torch.zeros_like(w_sum))
+            wdisp = torch.where(wmean != 0, wstd / wmean, torch.zeros_like(wstd))
+
+            wmean_2d = wmean.unsqueeze(0)
+            feat_fn = compute_all_features_skipnan if skipnan else compute_all_features
+            features = feat_fn(wmean_2d)
+
+            shop_count_per_bucket = valid.any(dim=0).sum(dim=0)  # (B,)
+
+            scope = f"shopcohort:{profile.slug}|cohort:{cfg.slug}"
+            for b_idx in range(n_buckets):
+                mv = wmean[b_idx].item()
+                if math.isnan(mv):
+                    continue
+                row = {
+                    "bucket": tensor.bucket_index[b_idx],
+                    "scope": scope,
+                    "mean": round(mv, 2),
+                    "median": round(mv, 2),
+                    "std": round(wstd[b_idx].item(), 2),
+                    "shop_count": int(shop_count_per_bucket[b_idx].item()),
+                    "dispersion": round(wdisp[b_idx].item(), 2),
+                }
+                for fname, ftensor in features.items():
+                    row[fname] = round(ftensor[0, b_idx].item(), 2)
+                rows.append(row)
+
+    logger.debug("_per_profile_cohort_features_df: %d rows", len(rows))
+    return pd.DataFrame(rows)
+
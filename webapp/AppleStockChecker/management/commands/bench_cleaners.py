@@ -0,0 +1,141 @@
+"""
+management command: bench_cleaners
+
+把保存下来的各店原始文件（csv / xlsx 等）重放给 run_cleaners_parallel，
+输出每个清洗器的行数、耗时、正则命中数以及整体吞吐，用作清洗吞吐基准。
+
+文件名以清洗器名开头即可自动识别（最长前缀匹配，"-" 视同 "_"），例如：
+    shop5_2_20250301.csv  → shop5_2
+    shop11-latest.xlsx    → shop11
+
+用法示例：
+    python manage.py bench_cleaners --dir /data/raw_shops
+
+    # 每个文件重复 3 次、4 进程，并与串行执行对比
+    python manage.py bench_cleaners --dir /data/raw_shops --repeat 3 --workers 4 --compare-serial
+
+    # 只跑部分清洗器，结果另存 JSON
+    python manage.py bench_cleaners --dir /data/raw_shops --only shop3,shop11 --json bench.json
+"""
+from __future__ import annotations
+
+import json
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _match_cleaner(stem: str, names) -> str | None:
+    """文件名 → 清洗器名（最长前缀匹配）"""
+    s = stem.replace("-", "_")
+    best = None
+    for name in names:
+        if s == name or (s.startswith(name) and not s[len(name)].isdigit()):
+            if best is None or len(name) > len(best):
+                best = name
+    return best
+
+
+class Command(BaseCommand):
+    help = "重放原始店铺文件，测量各清洗器吞吐（run_cleaners_parallel）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dir", required=True, help="原始文件目录（递归查找）")
+        parser.add_argument("--workers", type=int, default=None,
+                            help="进程数（默认 settings.CLEANER_MAX_WORKERS / CPU 核数）")
+        parser.add_argument("--repeat", type=int, default=1, help="每个文件重复提交的次数")
+        parser.add_argument("--only", default=None, help="只跑这些清洗器，逗号分隔")
+        parser.add_argument("--compare-serial", action="store_true", default=False,
+                            help="额外以单进程跑一遍，对比加速比")
+        parser.add_argument("--json", dest="json_path", default=None, help="把明细指标写入 JSON 文件")
+
+    def handle(self, *args, **options):
+        from AppleStockChecker.tasks.webscraper_tasks import _read_tabular
+        from AppleStockChecker.utils.external_ingest.registry import CLEANERS, run_cleaners_parallel
+
+        root = Path(options["dir"])
+        if not root.is_dir():
+            raise CommandError(f"目录不存在: {root}")
+        names = list(CLEANERS)
+        if options["only"]:
+            names = [n.strip().replace("-", "_") for n in options["only"].split(",") if n.strip()]
+            unknown = [n for n in names if n not in CLEANERS]
+            if unknown:
+                raise CommandError(f"未注册的清洗器: {', '.join(unknown)}")
+
+        # ── 读取原始文件 ───────────────────────────────────────────────────
+        jobs = []
+        for path in sorted(p for p in root.rglob("*") if p.is_file()):
+            key = _match_cleaner(path.stem, names)
+            if key is None:
+                continue
+            try:
+                df = _read_tabular(path.name, path.read_bytes())
+            except Exception as e:
+                self.stderr.write(self.style.WARNING(f"跳过 {path}: {e}"))
+                continue
+            jobs.extend([(key, df)] * max(1, options["repeat"]))
+        if not jobs:
+            raise CommandError(f"{root} 下没有可识别的原始文件")
+
+        covered = sorted({k for k, _ in jobs})
+        missing = [n for n in names if n not in covered]
+        self.stdout.write(self.style.NOTICE(
+            f"文件任务 {len(jobs)} 个，覆盖清洗器 {len(covered)}/{len(names)}"
+        ))
+        if missing:
+            self.stdout.write(self.style.WARNING(f"缺少样本: {', '.join(missing)}"))
+
+        # ── 并行执行 ───────────────────────────────────────────────────────
+        t0 = time.perf_counter()
+        _, metrics = run_cleaners_parallel(jobs, max_workers=options["workers"])
+        wall = time.perf_counter() - t0
+        self._report(metrics, wall, "parallel")
+
+        summary = {"parallel": {"wall_seconds": round(wall, 3), "metrics": metrics}}
+
+        if options["compare_serial"]:
+            t0 = time.perf_counter()
+            _, serial_metrics = run_cleaners_parallel(jobs, max_workers=1)
+            serial_wall = time.perf_counter() - t0
+            self._report(serial_metrics, serial_wall, "serial")
+            summary["serial"] = {"wall_seconds": round(serial_wall, 3), "metrics": serial_metrics}
+            self.stdout.write(self.style.SUCCESS(f"加速比: {serial_wall / wall:.2f}x"))
+
+        if options["json_path"]:
+            Path(options["json_path"]).write_text(
+                json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8"
+            )
+            self.stdout.write(f"明细已写入 {options['json_path']}")
+
+    def _report(self, metrics, wall: float, label: str) -> None:
+        # 同一清洗器的多次任务合并展示
+        agg = {}
+        for m in metrics:
+            a = agg.setdefault(m["cleaner"], {"jobs": 0, "rows_in": 0, "rows_out": 0, "seconds": 0.0,
+                                              "regex_hits": 0, "errors": 0})
+            a["jobs"] += 1
+            for f in ("rows_in", "rows_out", "seconds", "regex_hits"):
+                a[f] += m[f]
+            a["errors"] += 1 if m["error"] else 0
+
+        self.stdout.write(f"\n[{label}]")
+        self.stdout.write(
+            f"{'cleaner':<10}{'jobs':>5}{'rows_in':>9}{'rows_out':>9}{'sec':>9}"
+            f"{'rows/s':>10}{'regex':>8}{'err':>5}"
+        )
+        for name in sorted(agg, key=lambda n: -agg[n]["seconds"]):
+            a = agg[name]
+            rate = a["rows_in"] / a["seconds"] if a["seconds"] else 0.0
+            self.stdout.write(
+                f"{name:<10}{a['jobs']:>5}{a['rows_in']:>9}{a['rows_out']:>9}{a['seconds']:>9.3f}"
+                f"{rate:>10.0f}{a['regex_hits']:>8}{a['errors']:>5}"
+            )
+
+        rows_in = sum(a["rows_in"] for a in agg.values())
+        cpu = sum(a["seconds"] for a in agg.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"合计: 输入 {rows_in} 行, 墙钟 {wall:.3f}s ({rows_in / wall if wall else 0:.0f} 行/s), "
+            f"清洗器累计耗时 {cpu:.3f}s"
+        ))
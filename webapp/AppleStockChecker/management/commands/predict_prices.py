@@ -13,8 +13,8 @@ import logging
 from django.core.management.base import BaseCommand
 
 from AppleStockChecker.engine.prediction import (
-    predict_for_iphone,
-    save_forecasts,
+    predict_for_iphones,
+    upsert_forecasts,
 )
 from AppleStockChecker.models import Iphone
 from AppleStockChecker.services.clickhouse_service import ClickHouseService
@@ -51,27 +51,29 @@ class Command(BaseCommand):
 
         self.stdout.write(f"Predicting: {len(iphone_ids)} iPhones, run_id={run_id}")
 
+        preds, errors = predict_for_iphones(ch, iphone_ids, run_id=run_id, version=version)
+        created = upsert_forecasts(preds)
+        by_iphone: dict[int, list] = {}
+        for p, was_created in zip(preds, created):
+            by_iphone.setdefault(p["iphone_id"], []).append((p, was_created))
+
         ok, fail = 0, 0
-        total_forecasts = 0
+        total_forecasts = len(preds)
         for iid in iphone_ids:
-            try:
-                preds = predict_for_iphone(
-                    ch, iid, run_id=run_id, version=version,
-                )
-                n = save_forecasts(preds)
-                total_forecasts += len(preds)
+            if iid in errors:
+                self.stderr.write(f"  iphone={iid}: FAILED - {errors[iid]}")
+                fail += 1
+                continue
+            rows = by_iphone.get(iid, [])
+            n = sum(1 for _, was_created in rows if was_created)
+            self.stdout.write(
+                f"  iphone={iid}: {len(rows)} predictions ({n} new)"
+            )
+            for p, _ in rows:
                 self.stdout.write(
-                    f"  iphone={iid}: {len(preds)} predictions ({n} new)"
+                    f"    h={p['horizon_min']}min  yhat={p['yhat']:.2f}"
                 )
-                for p in preds:
-                    self.stdout.write(
-                        f"    h={p['horizon_min']}min  yhat={p['yhat']:.2f}"
-                    )
-                ok += 1
-            except Exception as e:
-                logger.exception("Failed prediction iphone=%d", iid)
-                self.stderr.write(f"  iphone={iid}: FAILED - {e}")
-                fail += 1
+            ok += 1
 
         self.stdout.write(
             f"\nDone: {ok} succeeded, {fail} failed, {total_forecasts} total forecasts"
@@ -55,6 +55,15 @@ class Command(BaseCommand):
             default="ffill",
             help="NaN 处理模式: ffill=前向填充(默认), skipnan=跳过NaN(实验)",
         )
+        parser.add_argument(
+            "--stream", action="store_true",
+            help="流式模式: 按时间分段执行 aggregate/features/cohorts, 不把全部 aligned 数据放进内存",
+        )
+        parser.add_argument(
+            "--chunk-buckets", type=int,
+            default=int(getattr(settings, "PIPELINE_STREAM_CHUNK_BUCKETS", 2048)),
+            help="流式每段桶数, 须为 128 的整数倍 (默认 %(default)s)",
+        )
 
     def handle(self, *args, **options):
         from AppleStockChecker.engine.pipeline import run
@@ -85,9 +94,12 @@ class Command(BaseCommand):
         self.stdout.write(self.style.NOTICE(
             f"Pipeline START  run_id={options['run_id']}  "
             f"range={date_from}→{date_to}  device={options['device']}  "
-            f"nan_mode={nan_mode}"
+            f"nan_mode={nan_mode}  stream={options['stream']}"
         ))
 
+        if options["stream"] and options["chunk_buckets"] % 128:
+            raise CommandError("--chunk-buckets 必须为 128 的整数倍")
+
         stats = run(
             run_id=options["run_id"],
             date_from=date_from,
@@ -98,6 +110,8 @@ class Command(BaseCommand):
             iphone_ids=iphone_ids,
             shop_ids=shop_ids,
             nan_mode=nan_mode,
+            stream=options["stream"],
+            chunk_buckets=options["chunk_buckets"],
         )
 
         self.stdout.write(self.style.SUCCESS(
@@ -14,7 +14,7 @@ from datetime import datetime
 from django.core.management.base import BaseCommand
 
 from AppleStockChecker.engine.prediction import (
-    train_models_for_iphone,
+    train_models_for_iphones,
     save_artifacts,
 )
 from AppleStockChecker.models import Iphone
@@ -56,12 +56,18 @@ class Command(BaseCommand):
             f"Training models: {len(iphone_ids)} iPhones, {days} days, run_id={run_id}"
         )
 
+        trained, errors = train_models_for_iphones(
+            ch, iphone_ids, run_id=run_id, train_days=days,
+        )
+
         ok, fail = 0, 0
         for iid in iphone_ids:
+            if iid in errors:
+                self.stderr.write(f"  iphone={iid}: FAILED - {errors[iid]}")
+                fail += 1
+                continue
             try:
-                result = train_models_for_iphone(
-                    ch, iid, run_id=run_id, train_days=days,
-                )
+                result = trained[iid]
                 artifacts = save_artifacts(iid, result, version=version)
                 self.stdout.write(
                     f"  iphone={iid}: OK ({len(artifacts)} artifacts saved)"
@@ -72,7 +78,7 @@ class Command(BaseCommand):
                     )
                 ok += 1
             except Exception as e:
-                logger.exception("Failed training iphone=%d", iid)
+                logger.exception("Failed saving artifacts iphone=%d", iid)
                 self.stderr.write(f"  iphone={iid}: FAILED - {e}")
                 fail += 1
 
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AppleStockChecker', '0014_forecastsnapshot_add_iphone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PipelineLiveState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run_id', models.CharField(max_length=64, unique=True)),
+                ('last_bucket', models.DateTimeField(blank=True, null=True)),
+                ('state_blob', models.BinaryField(blank=True, null=True)),
+                ('meta_json', models.JSONField(blank=True, default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
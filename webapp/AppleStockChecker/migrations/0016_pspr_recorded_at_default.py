@@ -0,0 +1,17 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AppleStockChecker', '0015_pipelinelivestate'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='purchasingshoppricerecord',
+            name='recorded_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False, verbose_name='记录时间'),
+        ),
+    ]
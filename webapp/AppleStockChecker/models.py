@@ -1,6 +1,7 @@
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
 from django.db.models import Q, F
+from django.utils import timezone
 from django.core.validators import RegexValidator
 
 
@@ -197,7 +198,8 @@ class PurchasingShopPriceRecord(models.Model):
     price_grade_a = models.PositiveIntegerField("A品卖取价格(円)", null=True, blank=True)
     price_grade_b = models.PositiveIntegerField("B品卖取价格(円)", null=True, blank=True)
 
-    recorded_at = models.DateTimeField("记录时间", auto_now_add=True, db_index=True)
+    # 不用 auto_now_add：清洗批量写入带显式的采集时间，bulk_create 需要原样保留
+    recorded_at = models.DateTimeField("记录时间", default=timezone.now, editable=False, db_index=True)
 
     class Meta:
         verbose_name = "二手店回收价格记录"
@@ -342,6 +344,15 @@ class ForecastSnapshot(models.Model):
         indexes = [models.Index(fields=['bucket', 'model_name', 'version'])]
 
 
+class PipelineLiveState(models.Model):
+    # 增量 live-tail pipeline 的段间递推状态 (engine.live)
+    run_id = models.CharField(max_length=64, unique=True)
+    last_bucket = models.DateTimeField(null=True, blank=True)  # 已处理到的最后一个桶 (含)
+    state_blob = models.BinaryField(null=True, blank=True)  # npz (无 pickle): 全局轴 / 过滤尾部 / 各 scope FeatureState
+    meta_json = models.JSONField(default=dict, blank=True)  # nan_mode、scope 数、最近一次 tick 统计
+    updated_at = models.DateTimeField(auto_now=True)
+
+
 class ShopWeightProfile(models.Model):
     slug = models.SlugField(max_length=64, unique=True)
     title = models.CharField(max_length=128, blank=True, default="")
@@ -5,14 +5,15 @@ ClickHouse 读写服务层。
 from __future__ import annotations
 
 import logging
+import os
+import queue
+import threading
 from datetime import datetime
+from typing import Iterator
 
 import numpy as np
 from django.conf import settings
 
-# numpy 整型的基类，用于 insert_features 类型判断
-_NP_INT_TYPES = np.integer
-
 logger = logging.getLogger(__name__)
 
 
@@ -34,6 +35,8 @@ class ClickHouseService:
 
     def __init__(self):
         self._client = None
+        # 最近一次 insert_* 的分块耗时统计, 见 _insert_columns
+        self.last_insert_stats: dict = {}
 
     @property
     def client(self):
@@ -43,7 +46,7 @@ class ClickHouseService:
 
     # ── 写入 ──────────────────────────────────────────────────────────────
 
-    def insert_price_aligned(self, df, run_id: str) -> int:
+    def insert_price_aligned(self, df, run_id: str, *, columnar: bool | None = None) -> int:
         """将 DataFrame 批量写入 price_aligned。
 
         Parameters
@@ -52,38 +55,35 @@ class ClickHouseService:
             columns: bucket, shop_id, iphone_id, price_new, price_a, price_b,
                      alignment_diff_sec, record_time
         run_id : str
+        columnar : bool | None
+            True=列式 NumPy 分块写入, False=逐行 tuple 写入,
+            None=settings.CLICKHOUSE_COLUMNAR_INSERT (默认 True)
 
         Returns
         -------
-        int  写入行数
+        int  写入行数 (分块耗时见 self.last_insert_stats)
         """
         if df.empty:
+            self.last_insert_stats = {}
             return 0
 
-        rows = []
-        for row in df.itertuples(index=False):
-            rows.append({
-                "run_id": run_id,
-                "bucket": _to_naive(row.bucket),
-                "shop_id": int(row.shop_id),
-                "iphone_id": int(row.iphone_id),
-                "price_new": int(row.price_new),
-                "price_a": _nullable_int(row.price_a),
-                "price_b": _nullable_int(row.price_b),
-                "alignment_diff_sec": int(row.alignment_diff_sec),
-                "record_time": _to_naive(row.record_time),
-            })
-
-        self.client.execute(
-            "INSERT INTO price_aligned "
-            "(run_id, bucket, shop_id, iphone_id, price_new, price_a, price_b, "
-            " alignment_diff_sec, record_time) VALUES",
-            rows,
-        )
-        logger.info("insert_price_aligned: run_id=%s  rows=%d", run_id, len(rows))
-        return len(rows)
-
-    def insert_features(self, df, run_id: str) -> int:
+        columns = {
+            "run_id": np.full(len(df), run_id, dtype=object),
+            "bucket": _naive_datetime_column(df["bucket"]),
+            "shop_id": df["shop_id"].to_numpy().astype(np.int64),
+            "iphone_id": df["iphone_id"].to_numpy().astype(np.int64),
+            "price_new": df["price_new"].to_numpy().astype(np.int64),
+            "price_a": _nullable_int_column(df["price_a"]),
+            "price_b": _nullable_int_column(df["price_b"]),
+            "alignment_diff_sec": df["alignment_diff_sec"].to_numpy().astype(np.int64),
+            "record_time": _naive_datetime_column(df["record_time"]),
+        }
+        n = self._insert_columns("price_aligned", columns, columnar=columnar)
+        logger.info("insert_price_aligned: run_id=%s  rows=%d  %.0f rows/s",
+                    run_id, n, self.last_insert_stats.get("rows_per_sec", 0))
+        return n
+
+    def insert_features(self, df, run_id: str, *, columnar: bool | None = None) -> int:
         """将 DataFrame 批量写入 features_wide。
 
         Parameters
@@ -91,35 +91,79 @@ class ClickHouseService:
         df : pd.DataFrame
             必须包含 bucket, scope 以及各特征列
         run_id : str
+        columnar : bool | None
+            同 insert_price_aligned
 
         Returns
         -------
-        int  写入行数
+        int  写入行数 (分块耗时见 self.last_insert_stats)
         """
         if df.empty:
+            self.last_insert_stats = {}
             return 0
 
         # 动态获取列 (排除 bucket, scope, 这两个必填)
         feature_cols = [c for c in df.columns if c not in ("bucket", "scope")]
-        ch_cols = ["run_id", "bucket", "scope"] + feature_cols
-        col_list = ", ".join(ch_cols)
-
-        rows = []
-        for row in df.itertuples(index=False):
-            d = {"run_id": run_id, "bucket": _to_naive(row.bucket), "scope": row.scope}
-            for c in feature_cols:
-                v = getattr(row, c)
-                if _is_nan(v):
-                    d[c] = None
-                elif isinstance(v, (int, _NP_INT_TYPES)):
-                    d[c] = int(v)
-                else:
-                    d[c] = float(v)
-            rows.append(d)
-
-        self.client.execute(f"INSERT INTO features_wide ({col_list}) VALUES", rows)
-        logger.info("insert_features: run_id=%s  rows=%d", run_id, len(rows))
-        return len(rows)
+        columns = {
+            "run_id": np.full(len(df), run_id, dtype=object),
+            "bucket": _naive_datetime_column(df["bucket"]),
+            "scope": df["scope"].to_numpy(dtype=object),
+        }
+        for c in feature_cols:
+            columns[c] = _nullable_column(df[c])
+
+        n = self._insert_columns("features_wide", columns, columnar=columnar)
+        logger.info("insert_features: run_id=%s  rows=%d  %.0f rows/s",
+                    run_id, n, self.last_insert_stats.get("rows_per_sec", 0))
+        return n
+
+    def _insert_columns(
+        self,
+        table: str,
+        columns: dict[str, np.ndarray],
+        *,
+        columnar: bool | None = None,
+        block_rows: int | None = None,
+    ) -> int:
+        """按 block_rows 分块写入, 记录每块耗时到 self.last_insert_stats。
+
+        列式模式直接把 NumPy 列交给 clickhouse_driver (use_numpy), 由驱动按
+        pd.isnull 生成 Nullable 列的 NULL 掩码; 逐行模式先把 NaN 转 None 再 zip 成 tuple。
+        """
+        import time
+
+        if columnar is None:
+            columnar = bool(getattr(settings, "CLICKHOUSE_COLUMNAR_INSERT", True))
+        if block_rows is None:
+            block_rows = int(getattr(settings, "CLICKHOUSE_INSERT_BLOCK_ROWS", 100_000))
+        block_rows = max(1, block_rows)
+
+        names = list(columns)
+        query = f"INSERT INTO {table} ({', '.join(names)}) VALUES"
+        n_rows = len(columns[names[0]])
+
+        chunks = []
+        t_total = time.perf_counter()
+        for start in range(0, n_rows, block_rows):
+            block = [columns[name][start:start + block_rows] for name in names]
+            t = time.perf_counter()
+            if columnar:
+                self.client.execute(query, block, columnar=True, settings={"use_numpy": True})
+            else:
+                self.client.execute(query, list(zip(*(_to_python_values(col) for col in block))))
+            elapsed = time.perf_counter() - t
+            chunks.append({"rows": len(block[0]), "seconds": round(elapsed, 4)})
+
+        elapsed_total = time.perf_counter() - t_total
+        self.last_insert_stats = {
+            "table": table,
+            "mode": "columnar" if columnar else "rows",
+            "rows": n_rows,
+            "seconds": round(elapsed_total, 4),
+            "rows_per_sec": round(n_rows / elapsed_total, 1) if elapsed_total > 0 else 0.0,
+            "chunks": chunks,
+        }
+        return n_rows
 
     # ── 管理 ──────────────────────────────────────────────────────────────
 
@@ -329,26 +373,10 @@ class ClickHouseService:
         need_total : bool
             是否执行 COUNT 查询, False 时 total 返回 -1
         """
-        wheres = ["run_id = %(run_id)s"]
-        params: dict = {"run_id": run_id}
-
-        if scope:
-            wheres.append("scope = %(scope)s")
-            params["scope"] = scope
-        if scope_prefix:
-            wheres.append("scope LIKE %(scope_prefix)s")
-            params["scope_prefix"] = f"{scope_prefix}%"
-        if scope_in:
-            wheres.append("scope IN %(scope_in)s")
-            params["scope_in"] = scope_in
-        if bucket_gte:
-            wheres.append("bucket >= %(b_gte)s")
-            params["b_gte"] = _to_naive(bucket_gte)
-        if bucket_lte:
-            wheres.append("bucket <= %(b_lte)s")
-            params["b_lte"] = _to_naive(bucket_lte)
-
-        where_clause = " AND ".join(wheres)
+        where_clause, params = _features_where(
+            run_id=run_id, scope=scope, scope_prefix=scope_prefix, scope_in=scope_in,
+            bucket_gte=bucket_gte, bucket_lte=bucket_lte,
+        )
 
         if ordering.startswith("-"):
             order_sql = f"{ordering[1:]} DESC"
@@ -388,6 +416,106 @@ class ClickHouseService:
 
         return result, total
 
+    def query_latest_features(
+        self,
+        *,
+        scopes: list[str],
+        run_id: str = "live",
+        bucket_gte: datetime | None = None,
+        bucket_lte: datetime | None = None,
+        columns: list[str] | None = None,
+    ) -> dict[str, dict]:
+        """一次查询取多个 scope 各自最新的一行 features_wide, 返回 {scope: row}。
+
+        用 LIMIT 1 BY scope 代替逐 scope 的 query_features; 区间内没有数据的 scope 不出现在结果中。
+        """
+        if not scopes:
+            return {}
+        where_clause, params = _features_where(
+            run_id=run_id, scope_in=list(scopes), bucket_gte=bucket_gte, bucket_lte=bucket_lte,
+        )
+        if columns:
+            safe_cols = [c for c in columns if c.isidentifier()]
+            col_expr = ", ".join(["bucket", "scope"] + safe_cols)
+        else:
+            col_expr = "*"
+
+        data_rows, col_types = self.client.execute(
+            f"SELECT {col_expr} FROM features_wide "
+            f"WHERE {where_clause} "
+            f"ORDER BY scope ASC, bucket DESC "
+            f"LIMIT 1 BY scope",
+            params,
+            with_column_types=True,
+        )
+        col_names = [c[0] for c in col_types]
+        return {row["scope"]: row for row in (dict(zip(col_names, r)) for r in data_rows)}
+
+    def iter_features_tall(
+        self,
+        *,
+        columns: list[str],
+        run_id: str = "live",
+        scope: str | None = None,
+        scope_in: list[str] | None = None,
+        bucket_gte: datetime | None = None,
+        bucket_lte: datetime | None = None,
+        ordering: str = "bucket",
+        chunk_rows: int | None = None,
+    ) -> Iterator[list[tuple]]:
+        """features_wide 在 CH 内 ARRAY JOIN 转长表, 按块流式返回。
+
+        每行为 (bucket, scope, name, value), 空值 / NaN 已在 CH 内过滤;
+        结果经 execute_iter 分块读取, 内存占用与时间范围无关。
+
+        Parameters
+        ----------
+        columns : list[str]
+            要展开的特征列 (非标识符的列名被忽略)
+        chunk_rows : int | None
+            每块行数, 默认 settings.FEATURE_STREAM_CHUNK_ROWS
+
+        Yields
+        ------
+        list[tuple]
+            至多 chunk_rows 行
+        """
+        safe_cols = [c for c in dict.fromkeys(columns) if c.isidentifier()]
+        if not safe_cols:
+            return
+        chunk_rows = int(chunk_rows or getattr(settings, "FEATURE_STREAM_CHUNK_ROWS", 5000))
+
+        where_clause, params = _features_where(
+            run_id=run_id, scope=scope, scope_in=scope_in,
+            bucket_gte=bucket_gte, bucket_lte=bucket_lte,
+        )
+        field = ordering.lstrip("-")
+        if not field.isidentifier():
+            field = "bucket"
+        order_sql = f"{field} {'DESC' if ordering.startswith('-') else 'ASC'}, scope ASC"
+
+        pairs = ", ".join(f"('{c}', CAST(`{c}`, 'Nullable(Float64)'))" for c in safe_cols)
+        sql = (
+            "SELECT bucket, scope, kv.1 AS name, kv.2 AS value FROM features_wide "
+            f"ARRAY JOIN arrayFilter(x -> x.2 IS NOT NULL AND NOT isNaN(x.2), [{pairs}]) AS kv "
+            f"WHERE {where_clause} "
+            f"ORDER BY {order_sql}"
+        )
+        rows = self.client.execute_iter(
+            sql, params, settings={"max_block_size": chunk_rows}, chunk_size=chunk_rows,
+        )
+        finished = False
+        try:
+            yield from rows
+            finished = True
+        finally:
+            if not finished:
+                # 客户端中途断开: 丢弃未读完的结果流, 下次 execute 时自动重连
+                close = getattr(rows, "close", None)
+                if close is not None:
+                    close()
+                self.client.disconnect()
+
     def count_price_aligned(
         self,
         *,
@@ -449,8 +577,185 @@ class ClickHouseService:
         return [r[0] for r in rows]
 
 
+# ── 进程内复用 ────────────────────────────────────────────────────────────
+
+_shared = threading.local()
+
+
+def get_shared_service() -> ClickHouseService:
+    """进程内复用的 ClickHouseService (按线程各一个), 避免每次调用新建 TCP 连接。
+
+    clickhouse_driver.Client 非线程安全, 因此按线程持有; pid 变化 (Celery prefork
+    fork 出的子进程) 时重建, 不沿用父进程的 socket。连接断开由 Client 在下一次
+    execute 时自动重连。
+    """
+    pid = os.getpid()
+    service = getattr(_shared, "service", None)
+    if service is None or getattr(_shared, "pid", None) != pid:
+        service = ClickHouseService()
+        _shared.service = service
+        _shared.pid = pid
+    return service
+
+
+class PooledClient:
+    """线程安全的 ClickHouse 客户端池, 接口与 clickhouse_driver.Client 的 execute / execute_iter 相同。
+
+    每次调用从池中借出一个 Client, 结束后归还; execute_iter 在结果流读完 (或被关闭) 时归还,
+    中途放弃的流先断开该连接再归还。池满时等待至多 CLICKHOUSE_POOL_TIMEOUT 秒。
+    """
+
+    def __init__(self, max_size: int, timeout: float, factory=None):
+        self.max_size = max(1, int(max_size))
+        self.timeout = timeout
+        self._factory = factory or _get_client
+        self._idle: "queue.LifoQueue" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._counters = {"checkouts": 0, "waits": 0, "timeouts": 0, "max_in_use": 0}
+
+    def _checked_out(self) -> None:
+        self._in_use += 1
+        self._counters["max_in_use"] = max(self._counters["max_in_use"], self._in_use)
+
+    def _acquire(self):
+        with self._lock:
+            self._counters["checkouts"] += 1
+            try:
+                client = self._idle.get_nowait()
+            except queue.Empty:
+                client = None
+            create = client is None and self._created < self.max_size
+            if client is not None or create:
+                self._created += int(create)
+                self._checked_out()
+            else:
+                self._counters["waits"] += 1
+        if client is not None:
+            return client
+        if create:
+            try:
+                return self._factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                    self._in_use -= 1
+                raise
+
+        try:
+            client = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._counters["timeouts"] += 1
+            raise TimeoutError(f"ClickHouse 连接池已满 ({self.max_size}), 等待 {self.timeout}s 超时")
+        with self._lock:
+            self._checked_out()
+        return client
+
+    def _release(self, client) -> None:
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(client)
+
+    def execute(self, *args, **kwargs):
+        client = self._acquire()
+        try:
+            return client.execute(*args, **kwargs)
+        finally:
+            self._release(client)
+
+    def execute_iter(self, *args, **kwargs):
+        client = self._acquire()
+        finished = False
+        try:
+            yield from client.execute_iter(*args, **kwargs)
+            finished = True
+        finally:
+            if not finished:
+                client.disconnect()
+            self._release(client)
+
+    def disconnect(self) -> None:
+        """连接由池管理; 中途放弃的结果流已在 execute_iter 内断开, 这里无需处理。"""
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                **self._counters,
+            }
+
+
+_pool_lock = threading.Lock()
+_pooled_service: ClickHouseService | None = None
+_pooled_pid: int | None = None
+
+
+def get_pooled_service() -> ClickHouseService:
+    """进程内所有线程共用的 ClickHouseService, client 为 PooledClient (供 CH 读取型 ViewSet 使用)。
+
+    与 get_shared_service 不同, 连接数受 CLICKHOUSE_POOL_SIZE 限制, 不随请求线程数增长;
+    pid 变化时重建。last_insert_stats 在线程间共享, 写入任务仍应使用 get_shared_service。
+    """
+    global _pooled_service, _pooled_pid
+    pid = os.getpid()
+    if _pooled_service is None or _pooled_pid != pid:
+        with _pool_lock:
+            if _pooled_service is None or _pooled_pid != pid:
+                service = ClickHouseService()
+                service._client = PooledClient(
+                    max_size=int(getattr(settings, "CLICKHOUSE_POOL_SIZE", 8)),
+                    timeout=float(getattr(settings, "CLICKHOUSE_POOL_TIMEOUT", 10)),
+                )
+                _pooled_service, _pooled_pid = service, pid
+    return _pooled_service
+
+
+def pool_stats() -> dict | None:
+    """当前进程连接池的使用计数 (未创建时为 None)。"""
+    service = _pooled_service
+    if service is None or _pooled_pid != os.getpid():
+        return None
+    return service.client.stats()
+
+
 # ── 辅助函数 ──────────────────────────────────────────────────────────────
 
+def _features_where(
+    *,
+    run_id: str,
+    scope: str | None = None,
+    scope_prefix: str | None = None,
+    scope_in: list[str] | None = None,
+    bucket_gte: datetime | None = None,
+    bucket_lte: datetime | None = None,
+) -> tuple[str, dict]:
+    """features_wide 查询的 WHERE 子句与参数。"""
+    wheres = ["run_id = %(run_id)s"]
+    params: dict = {"run_id": run_id}
+
+    if scope:
+        wheres.append("scope = %(scope)s")
+        params["scope"] = scope
+    if scope_prefix:
+        wheres.append("scope LIKE %(scope_prefix)s")
+        params["scope_prefix"] = f"{scope_prefix}%"
+    if scope_in:
+        wheres.append("scope IN %(scope_in)s")
+        params["scope_in"] = scope_in
+    if bucket_gte:
+        wheres.append("bucket >= %(b_gte)s")
+        params["b_gte"] = _to_naive(bucket_gte)
+    if bucket_lte:
+        wheres.append("bucket <= %(b_lte)s")
+        params["b_lte"] = _to_naive(bucket_lte)
+    return " AND ".join(wheres), params
+
+
 def _to_naive(dt) -> datetime:
     """去掉 tz 信息，clickhouse-driver DateTime 不接受 aware datetime。"""
     import pandas as pd
@@ -461,18 +766,51 @@ def _to_naive(dt) -> datetime:
     return dt
 
 
-def _nullable_int(v):
-    """NaN → None, 否则 int。"""
-    if _is_nan(v):
-        return None
-    return int(v)
+def _naive_datetime_column(series) -> np.ndarray:
+    """整列去掉 tz (保留墙上时间), 等价于逐个 _to_naive。返回 datetime64[ns]。"""
+    import pandas as pd
+    if not pd.api.types.is_datetime64_any_dtype(series.dtype):
+        series = pd.to_datetime(series.map(_to_naive))
+    if series.dt.tz is not None:
+        series = series.dt.tz_localize(None)
+    return series.to_numpy(dtype="datetime64[ns]")
+
+
+def _nullable_column(series) -> np.ndarray:
+    """特征列 → NumPy 数组 (浮点列原样透传)。
+
+    clickhouse_driver 列式写入时按 pd.isnull 生成 Nullable 列的 NULL 掩码,
+    NaN 会写成 NULL, 因此浮点列无需转换; 仅把可整体转成数值的 object 列转成 float64,
+    逐行模式的 NaN → None 由 _to_python_values 处理。
+    """
+    import pandas as pd
+    values = series.to_numpy()
+    if values.dtype.kind == "O":
+        numeric = pd.to_numeric(series, errors="coerce")
+        if numeric.notna().sum() != series.notna().sum():
+            return values
+        values = numeric.to_numpy(dtype=np.float64)
+    return values
+
 
+def _nullable_int_column(series) -> np.ndarray:
+    """整列 NaN → None, 其余转 Python int (object 数组, 列式/逐行两种模式通用)。"""
+    import pandas as pd
+    values = pd.to_numeric(series, errors="coerce").to_numpy(dtype=np.float64)
+    valid = ~np.isnan(values)
+    out = np.full(len(values), None, dtype=object)
+    out[valid] = values[valid].astype(np.int64).tolist()
+    return out
 
-def _is_nan(v) -> bool:
-    if v is None:
-        return True
-    try:
-        import math
-        return math.isnan(v)
-    except (TypeError, ValueError):
-        return False
+
+def _to_python_values(col: np.ndarray) -> list:
+    """逐行写入模式: NumPy 列 → Python 值列表, NaN → None。"""
+    import pandas as pd
+    if col.dtype.kind == "M":
+        return col.astype("datetime64[us]").tolist()
+    nulls = pd.isnull(col)
+    values = col.tolist()
+    if nulls.any():
+        for i in np.flatnonzero(nulls):
+            values[i] = None
+    return values
@@ -11,6 +11,7 @@ from django.utils import timezone
 
 from AppleStockChecker.utils.external_ingest.registry import run_cleaner
 from AppleStockChecker.models import Iphone, SecondHandShop, PurchasingShopPriceRecord
+from AppleStockChecker.services.trend_cache import note_price_records
 
 def ingest_external_dataframe(
     source_name: str,
@@ -51,6 +52,7 @@ def ingest_external_dataframe(
     dedup_skipped = 0
     unmatched = []
     preview_rows = []
+    backfilled = []  # (iphone_id, recorded_at)：create 后再改 recorded_at 的记录
 
     for idx, row in df_clean.iterrows():
         pn = str(row.get("part_number") or "").strip()
@@ -122,6 +124,7 @@ def ingest_external_dataframe(
                     batch_id=batch_uuid,
                 )
                 PurchasingShopPriceRecord.objects.filter(pk=rec.pk).update(recorded_at=recorded_at)
+                backfilled.append((iphone.pk, recorded_at))
                 inserted += 1
                 if len(preview_rows) < 10:
                     preview_rows.append({
@@ -130,6 +133,9 @@ def ingest_external_dataframe(
                         "recorded_at": str(recorded_at), "batch_id": str(batch_uuid),
                     })
 
+    # QuerySet.update 不触发信号：显式通知趋势缓存
+    note_price_records(backfilled)
+
     return {
         "inserted": inserted,
         "updated": updated,
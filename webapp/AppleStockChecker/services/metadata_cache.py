@@ -0,0 +1,121 @@
+# AppleStockChecker/services/metadata_cache.py
+"""
+ClickHouse 读取型 ViewSet 的店铺 / iPhone 元数据缓存（进程级）
+
+price_aligned 的行只带 shop_id / iphone_id，序列化时要展开成名称、型号。
+缓存两个条目，各自整表一次查询：
+  - "shop":   {shop_id: {id, name, website, address}}
+  - "iphone": {iphone_id: {id, part_number, jan, model_name, capacity_gb, color,
+               release_date, capacity_label, label}}
+
+条目按 kind 各有一个版本号：本进程内的 post_save / post_delete 以及不发信号的批量写入
+（如清洗任务 bulk_create 新店铺后调用 invalidate_metadata("shop")）立即使其失效；
+其他进程的改动最多延迟 CH_METADATA_CACHE_TTL 秒（默认 300）才可见。
+店铺 / 机型表很少变化；在此之前新店铺的行仍会返回，只是店名等展开字段为空。
+
+返回的 dict 为多个请求共享，调用方只读。命中率见 metadata_cache_stats()（健康检查接口 ?stats=1）。
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+_lock = threading.Lock()
+_versions = {"shop": 0, "iphone": 0}
+# kind -> (version, built_at, data)
+_entries: Dict[str, Tuple[int, float, Dict[int, dict]]] = {}
+_counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def _capacity_label(capacity_gb: int) -> str:
+    return f"{capacity_gb // 1024}TB" if capacity_gb % 1024 == 0 else f"{capacity_gb}GB"
+
+
+def _load_shops() -> Dict[int, dict]:
+    from AppleStockChecker.models import SecondHandShop
+
+    return {
+        s["id"]: s
+        for s in SecondHandShop.objects.values("id", "name", "website", "address")
+    }
+
+
+def _load_iphones() -> Dict[int, dict]:
+    from AppleStockChecker.models import Iphone
+
+    out = {}
+    for p in Iphone.objects.values("id", "part_number", "jan", "model_name", "capacity_gb", "color", "release_date"):
+        out[p["id"]] = {
+            **p,
+            "release_date": str(p["release_date"]) if p["release_date"] else None,
+            "capacity_label": _capacity_label(p["capacity_gb"]),
+            "label": f"{p['model_name']} {p['color']}",
+        }
+    return out
+
+
+_LOADERS: Dict[str, Callable[[], Dict[int, dict]]] = {"shop": _load_shops, "iphone": _load_iphones}
+
+
+def _get(kind: str) -> Dict[int, dict]:
+    ttl = float(getattr(settings, "CH_METADATA_CACHE_TTL", 300))
+    with _lock:
+        entry = _entries.get(kind)
+        if entry is not None and entry[0] == _versions[kind] and time.monotonic() - entry[1] < ttl:
+            _counters["hits"] += 1
+            return entry[2]
+        _counters["misses"] += 1
+        version = _versions[kind]
+
+    # 在锁外查询数据库；期间若被失效，本次结果只返回、不入缓存
+    data = _LOADERS[kind]()
+    with _lock:
+        if _versions[kind] == version:
+            _entries[kind] = (version, time.monotonic(), data)
+    return data
+
+
+def get_shop_meta() -> Dict[int, dict]:
+    """{shop_id: {id, name, website, address}}"""
+    return _get("shop")
+
+
+def get_iphone_meta() -> Dict[int, dict]:
+    """{iphone_id: {id, part_number, jan, model_name, capacity_gb, color, release_date, capacity_label, label}}"""
+    return _get("iphone")
+
+
+def invalidate_metadata(kind: Optional[str] = None) -> None:
+    """使缓存失效（kind=None 时全部）；下次读取时重建"""
+    with _lock:
+        for k in ([kind] if kind else list(_versions)):
+            _versions[k] += 1
+            _entries.pop(k, None)
+        _counters["invalidations"] += 1
+
+
+def metadata_cache_stats() -> dict:
+    with _lock:
+        total = _counters["hits"] + _counters["misses"]
+        return {
+            **_counters,
+            "hit_ratio": round(_counters["hits"] / total, 4) if total else None,
+            "entries": {k: len(v[2]) for k, v in _entries.items()},
+        }
+
+
+@receiver(post_save, sender="AppleStockChecker.SecondHandShop", dispatch_uid="metadata_cache_shop_post_save")
+@receiver(post_delete, sender="AppleStockChecker.SecondHandShop", dispatch_uid="metadata_cache_shop_post_delete")
+def _on_shop_changed(**kwargs):
+    invalidate_metadata("shop")
+
+
+@receiver(post_save, sender="AppleStockChecker.Iphone", dispatch_uid="metadata_cache_iphone_post_save")
+@receiver(post_delete, sender="AppleStockChecker.Iphone", dispatch_uid="metadata_cache_iphone_post_delete")
+def _on_iphone_changed(**kwargs):
+    invalidate_metadata("iphone")
@@ -0,0 +1,382 @@
+# AppleStockChecker/services/trend_cache.py
+"""
+价格趋势的预聚合缓存（Redis）
+
+趋势接口对每个网格点取"历史最近点"。对落在 15 分钟格上的网格而言，只需知道每个
+(iphone, 店, 15 分钟桶) 内最后一条记录即可得到与原始点完全相同的结果，
+因此这里按 iPhone 缓存压缩后的桶序列，并按水位线增量追加：
+
+    Redis HASH  trend:v1:ip:{iphone_id}
+        lo    已物化的最早时间（ms）：x >= lo 的记录都已反映在桶里
+        wm    水位线（ms，桶边界）：x <= wm 的桶已完整，之后的部分每次从 PG 读尾部
+        gen   代数：回补记录到达时 +1，读者据此放弃写回
+        s:{shop_id}  桶行（bucket_end_ms, x_ms, price）的 numpy 字节
+
+桶 b 覆盖 (b - 15min, b]。水位线滞后 now 一个 settle 窗口（TREND_CACHE_SETTLE_MINUTES），
+晚到的近期记录自然落在尾部；更早的回补由 note_price_records() 把水位线回退到该桶之前。
+
+Redis 不可用时所有入口返回 None，调用方退回直接查 PG。
+"""
+from __future__ import annotations
+
+import logging
+import os
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+BUCKET_MS = 15 * 60 * 1000
+DAY_MS = 24 * 60 * 60 * 1000
+KEY_PREFIX = "trend:v1"
+SHOP_NAMES_KEY = f"{KEY_PREFIX}:shop_names"
+STATS_KEY = f"{KEY_PREFIX}:stats"
+
+# 桶行：桶结束时间、桶内最后一条记录的时间与价格
+ROW_DTYPE = np.dtype([("b", "<i8"), ("x", "<i8"), ("y", "<f8")])
+
+_pool: Optional[redis.ConnectionPool] = None
+_pool_pid: Optional[int] = None
+
+
+def _get_redis_client() -> redis.Redis:
+    """获取 Redis 客户端（进程内复用连接池，返回 bytes）"""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        redis_url = (
+            getattr(settings, "TREND_CACHE_REDIS_URL", "")
+            or getattr(settings, "CELERY_BROKER_URL", "redis://127.0.0.1:6379/0")
+        )
+        _pool = redis.ConnectionPool.from_url(redis_url, socket_timeout=2, socket_connect_timeout=1)
+        _pool_pid = os.getpid()
+    return redis.Redis(connection_pool=_pool)
+
+
+def cache_enabled() -> bool:
+    return bool(getattr(settings, "TREND_CACHE_ENABLED", True))
+
+
+def grid_is_cacheable(step_minutes: int, offset_minute: int) -> bool:
+    """网格点全部落在 15 分钟格上时才能由桶序列精确还原"""
+    return step_minutes % 15 == 0 and offset_minute % 15 == 0
+
+
+def _iphone_key(iphone_id: int) -> str:
+    return f"{KEY_PREFIX}:ip:{iphone_id}"
+
+
+def _to_ms(dt: datetime) -> int:
+    return int(dt.timestamp() * 1000)
+
+
+def _bucket_end(x_ms):
+    """所在 15 分钟桶的结束时间（向上取整；标量或数组）"""
+    return -(-x_ms // BUCKET_MS) * BUCKET_MS
+
+
+# ----------------------------------------------------------------------
+# 桶行工具
+# ----------------------------------------------------------------------
+
+def compress_points(xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    """按 x 升序的原始点 → 每个 15 分钟桶内最后一条（桶行）"""
+    if xs.size == 0:
+        return np.empty(0, dtype=ROW_DTYPE)
+    b = _bucket_end(xs)
+    last = np.flatnonzero(np.r_[b[1:] != b[:-1], True])
+    rows = np.empty(last.size, dtype=ROW_DTYPE)
+    rows["b"], rows["x"], rows["y"] = b[last], xs[last], ys[last]
+    return rows
+
+
+def merge_rows(parts: List[np.ndarray]) -> np.ndarray:
+    """合并多组桶行（多个 PN / 同名店），同一桶保留 x 最大的一条"""
+    parts = [p for p in parts if p.size]
+    if not parts:
+        return np.empty(0, dtype=ROW_DTYPE)
+    rows = parts[0] if len(parts) == 1 else np.concatenate(parts)
+    rows = rows[np.lexsort((rows["x"], rows["b"]))]
+    return rows[np.r_[rows["b"][1:] != rows["b"][:-1], True]]
+
+
+# ----------------------------------------------------------------------
+# 统计
+# ----------------------------------------------------------------------
+
+@dataclass
+class TrendCacheStats:
+    """一次请求的缓存统计（按 iPhone 计）"""
+    hits: int = 0
+    misses: int = 0
+    tail_rows: int = 0
+    build_ms: float = 0.0
+
+    @property
+    def hit_ratio(self) -> Optional[float]:
+        total = self.hits + self.misses
+        return round(self.hits / total, 4) if total else None
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), "build_ms": round(self.build_ms, 1), "hit_ratio": self.hit_ratio}
+
+
+def get_cache_stats() -> Optional[dict]:
+    """进程外累计的命中率 / 构建耗时（供监控或管理命令展示）"""
+    try:
+        raw = _get_redis_client().hgetall(STATS_KEY)
+    except redis.RedisError as e:
+        logger.warning(f"读取趋势缓存统计失败: {e}")
+        return None
+    data = {k.decode(): float(v) for k, v in raw.items()}
+    hits, misses = data.get("hits", 0.0), data.get("misses", 0.0)
+    return {
+        "requests": int(data.get("requests", 0)),
+        "hits": int(hits),
+        "misses": int(misses),
+        "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None,
+        "avg_build_ms": round(data.get("build_ms", 0.0) / data["requests"], 1) if data.get("requests") else None,
+    }
+
+
+# ----------------------------------------------------------------------
+# 读取（带尾部增量刷新）
+# ----------------------------------------------------------------------
+
+def load_points(
+    iphone_ids: Iterable[int],
+    history_after: datetime,
+    now: datetime,
+) -> Optional[Tuple[Dict[int, Dict[int, np.ndarray]], TrendCacheStats]]:
+    """
+    取各 iPhone 在 history_after 之后的桶行；缓存缺失 / 覆盖不足时从 PG 全量构建，
+    命中时只从 PG 读水位线之后的尾部，只把有新完整桶的店写回（水位线未前进且无新桶时不写）。
+
+    Returns
+    -------
+    ({iphone_id: {shop_id: 桶行}}, stats)；Redis 不可用时返回 None
+    """
+    from AppleStockChecker.models import PurchasingShopPriceRecord
+    from django.db.models import Q
+
+    t0 = time.perf_counter()
+    iphone_ids = sorted(set(int(i) for i in iphone_ids))
+    stats = TrendCacheStats()
+    if not iphone_ids:
+        return {}, stats
+
+    ha_ms, now_ms = _to_ms(history_after), _to_ms(now)
+    settle_ms = int(getattr(settings, "TREND_CACHE_SETTLE_MINUTES", 15)) * 60 * 1000
+    new_wm = (now_ms - settle_ms) // BUCKET_MS * BUCKET_MS
+    keep_after = now_ms - (int(getattr(settings, "TREND_MAX_LOOKBACK_DAYS", 90)) + 1) * DAY_MS
+
+    try:
+        client = _get_redis_client()
+        with client.pipeline(transaction=False) as pipe:
+            for iid in iphone_ids:
+                pipe.hgetall(_iphone_key(iid))
+            cached_raw = pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"趋势缓存不可用，改为直接查询: {e}")
+        return None
+
+    # 1) 判定命中 / 缺失，确定每个 iPhone 需要从 PG 读取的起点
+    state = {}
+    cond = Q()
+    for iid, h in zip(iphone_ids, cached_raw):
+        h = {k.decode(): v for k, v in h.items()}
+        lo = int(h["lo"]) if "lo" in h else None
+        wm = int(h["wm"]) if "wm" in h else None
+        if lo is not None and wm is not None and lo <= ha_ms and wm >= lo:
+            stats.hits += 1
+            rows = {int(k[2:]): np.frombuffer(v, dtype=ROW_DTYPE) for k, v in h.items() if k.startswith("s:")}
+            # 水位线被回补回退过：水位线之后的旧桶行作废，这些店即使尾部为空也要重写
+            stale = {sid for sid, r in rows.items() if r.size and r["b"][-1] > wm}
+            rows = {sid: r[r["b"] <= wm] for sid, r in rows.items()}
+            cond |= Q(iphone_id=iid, recorded_at__gt=datetime.fromtimestamp(wm / 1000, tz=history_after.tzinfo))
+            state[iid] = (h.get("gen"), lo, wm, rows, stale)
+        else:
+            stats.misses += 1
+            cond |= Q(iphone_id=iid, recorded_at__gte=history_after)
+            state[iid] = (h.get("gen"), ha_ms, None, {}, set())
+
+    # 2) 一次查询取全部尾部（或全量）
+    cols: Dict[Tuple[int, int], Tuple[List[int], List[float]]] = defaultdict(lambda: ([], []))
+    qs = (PurchasingShopPriceRecord.objects.filter(cond).order_by("recorded_at")
+          .values_list("iphone_id", "shop_id", "recorded_at", "price_new"))
+    for iid, sid, recorded_at, price in qs.iterator():
+        xs, ys = cols[(iid, sid)]
+        xs.append(_to_ms(recorded_at))
+        ys.append(price)
+        stats.tail_rows += 1
+
+    result: Dict[int, Dict[int, np.ndarray]] = {}
+    for iid, (gen, lo, wm, rows, stale) in state.items():
+        rows = dict(rows)
+        target_wm = max(new_wm, wm or new_wm)
+        changed = set(stale)
+        for (tiid, sid), (xs, ys) in cols.items():
+            if tiid != iid:
+                continue
+            x = np.asarray(xs, dtype=np.int64)
+            order = np.argsort(x, kind="stable")
+            tail = compress_points(x[order], np.asarray(ys, dtype=np.float64)[order])
+            rows[sid] = merge_rows([rows.get(sid, np.empty(0, dtype=ROW_DTYPE)), tail])
+            if tail.size and tail["b"][0] <= target_wm:
+                changed.add(sid)
+        result[iid] = {sid: r[r["x"] >= ha_ms] for sid, r in rows.items()}
+        if wm is None:
+            _write_back(client, iid, gen, rows, lo=max(lo, keep_after), wm=target_wm, keep_after=keep_after)
+        elif target_wm > wm or changed:
+            _write_back(client, iid, gen, {sid: rows[sid] for sid in changed}, lo=lo, wm=target_wm,
+                        keep_after=keep_after, partial=True)
+
+    stats.build_ms = (time.perf_counter() - t0) * 1000
+    try:
+        with client.pipeline(transaction=False) as pipe:
+            pipe.hincrby(STATS_KEY, "requests", 1)
+            pipe.hincrby(STATS_KEY, "hits", stats.hits)
+            pipe.hincrby(STATS_KEY, "misses", stats.misses)
+            pipe.hincrbyfloat(STATS_KEY, "build_ms", stats.build_ms)
+            pipe.execute()
+    except redis.RedisError:
+        pass
+    logger.info("trend cache load", extra={"event_type": "trend_cache_load", **stats.as_dict()})
+    return result, stats
+
+
+def _write_back(
+    client, iphone_id: int, gen, rows: Dict[int, np.ndarray], *,
+    lo: int, wm: int, keep_after: int, partial: bool = False,
+) -> None:
+    """
+    把 <= wm 的完整桶写回；期间若有回补（gen 变化）则放弃，由下次读取重建。
+
+    partial=False 时整键重建（缓存缺失）；partial=True 时 rows 只含有新完整桶的店，
+    只 HSET 这些店和水位线，其余店的桶行原样保留。
+    """
+    key = _iphone_key(iphone_id)
+    mapping = {"lo": lo, "wm": wm}
+    for sid, r in rows.items():
+        r = r[(r["b"] <= wm) & (r["b"] >= keep_after)]
+        if r.size:
+            mapping[f"s:{sid}"] = r.tobytes()
+    emptied = [f"s:{sid}" for sid in rows if f"s:{sid}" not in mapping] if partial else []
+    ttl = int(getattr(settings, "TREND_CACHE_TTL", 3 * 24 * 3600))
+    try:
+        with client.pipeline() as pipe:
+            pipe.watch(key)
+            if pipe.hget(key, "gen") != gen:
+                return
+            pipe.multi()
+            if not partial:
+                pipe.delete(key)
+                if gen is not None:
+                    mapping["gen"] = gen
+            elif emptied:
+                pipe.hdel(key, *emptied)
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, ttl)
+            pipe.execute()
+    except redis.WatchError:
+        logger.debug(f"趋势缓存写回放弃（并发回补）: iphone={iphone_id}")
+    except redis.RedisError as e:
+        logger.warning(f"趋势缓存写回失败: {e}")
+
+
+# ----------------------------------------------------------------------
+# 写入侧：回补失效
+# ----------------------------------------------------------------------
+
+def note_price_records(records: Iterable[Tuple[int, datetime]]) -> int:
+    """
+    PurchasingShopPriceRecord 写入 / 更新后调用，参数为 (iphone_id, recorded_at)。
+
+    recorded_at 落在某 iPhone 已完整缓存的桶里（<= 水位线）即为回补：
+    把水位线回退到该桶之前，下次读取时从那里重新读尾部；同时 gen +1 使并发中的写回作废。
+    返回回退了水位线的 iPhone 数。
+    """
+    if not cache_enabled():
+        return 0
+    settle_ms = int(getattr(settings, "TREND_CACHE_SETTLE_MINUTES", 15)) * 60 * 1000
+    horizon = _to_ms(timezone.now()) - settle_ms  # 水位线不会超过它，之后的记录无需失效
+    earliest: Dict[int, int] = {}
+    for iid, recorded_at in records:
+        if iid is None or recorded_at is None:
+            continue
+        x = _to_ms(recorded_at)
+        if _bucket_end(x) - BUCKET_MS >= horizon:
+            continue
+        earliest[int(iid)] = min(x, earliest.get(int(iid), x))
+    if not earliest:
+        return 0
+
+    rolled = 0
+    ttl = int(getattr(settings, "TREND_CACHE_TTL", 3 * 24 * 3600))
+    try:
+        client = _get_redis_client()
+        for iid, x in earliest.items():
+            key = _iphone_key(iid)
+            cutoff = _bucket_end(x) - BUCKET_MS
+            with client.pipeline() as pipe:
+                while True:
+                    try:
+                        pipe.watch(key)
+                        wm = pipe.hget(key, "wm")
+                        pipe.multi()
+                        if wm is not None and int(wm) > cutoff:
+                            pipe.hset(key, "wm", cutoff)
+                            rolled += 1
+                        pipe.hincrby(key, "gen", 1)
+                        pipe.expire(key, ttl)
+                        pipe.execute()
+                        break
+                    except redis.WatchError:
+                        continue
+    except redis.RedisError as e:
+        logger.warning(f"趋势缓存失效失败: {e}")
+    return rolled
+
+
+@receiver(post_save, sender="AppleStockChecker.PurchasingShopPriceRecord", dispatch_uid="trend_cache_post_save")
+@receiver(post_delete, sender="AppleStockChecker.PurchasingShopPriceRecord", dispatch_uid="trend_cache_post_delete")
+def _on_price_record_changed(instance, **kwargs):
+    """逐条 save()/delete()（admin、旧导入路径）；bulk_create / QuerySet.update 不触发，由调用方显式通知"""
+    rec = (instance.iphone_id, instance.recorded_at)
+    transaction.on_commit(lambda: note_price_records([rec]))
+
+
+# ----------------------------------------------------------------------
+# 店名列表
+# ----------------------------------------------------------------------
+
+def distinct_shop_names(loader: Callable[[], List[str]]) -> List[str]:
+    """有报价记录的店名（去重）；缓存 TREND_CACHE_SHOP_NAMES_TTL 秒，Redis 不可用时直接调用 loader"""
+    if not cache_enabled():
+        return loader()
+    try:
+        client = _get_redis_client()
+        cached = client.lrange(SHOP_NAMES_KEY, 0, -1)
+        if cached:
+            return [n.decode() for n in cached]
+        names = loader()
+        if names:
+            with client.pipeline() as pipe:
+                pipe.delete(SHOP_NAMES_KEY)
+                pipe.rpush(SHOP_NAMES_KEY, *names)
+                pipe.expire(SHOP_NAMES_KEY, int(getattr(settings, "TREND_CACHE_SHOP_NAMES_TTL", 600)))
+                pipe.execute()
+        return names
+    except redis.RedisError as e:
+        logger.warning(f"趋势缓存不可用（店名）: {e}")
+        return loader()
@@ -0,0 +1,8 @@
+# Celery autodiscover 只导入 AppleStockChecker.tasks 本身, 各任务模块须在此显式导入才会在 worker 中注册
+from . import (  # noqa: F401
+    automl_tasks,
+    pipeline_tasks,
+    prediction_tasks,
+    timestamp_alignment_task,
+    webscraper_tasks,
+)
@@ -95,28 +95,11 @@ def schedule_automl_jobs():
 # ============================================================================
 # 阶段 1: 预处理 (Preprocessing-Rapid)
 # ============================================================================
+# 计算在 utils/automl_tasks/preprocess.py（列式 NumPy）；这里只负责 Job 状态流转与写库
 
-@shared_task(
-    bind=True,
-    name="automl.preprocessing_rapid",
-    queue="automl_preprocessing",
-    acks_late=True,
-    autoretry_for=(Exception,),
-    retry_backoff=True,
-    max_retries=3,
-)
-def run_preprocessing_for_job(self, job_id: int):
-    """
-    Preprocessing-Rapid Task
-    从 PurchasingShopTimeAnalysis 读取数据 → 生成预处理序列
-    """
-    from AppleStockChecker.models import (
-        AutomlCausalJob,
-        AutomlPreprocessedSeries,
-        PurchasingShopTimeAnalysis,
-    )
-
-    logger.info(f"[Job {job_id}] Starting preprocessing...")
+def _claim_preprocessing(job_id: int):
+    """加锁并把 Job 置为 RUNNING；已成功的 Job 返回 None"""
+    from AppleStockChecker.models import AutomlCausalJob
 
     with transaction.atomic():
         job = AutomlCausalJob.objects.select_for_update().get(pk=job_id)
@@ -124,170 +107,83 @@ def run_preprocessing_for_job(self, job_id: int):
         # 如果已经成功,跳过
         if job.preprocessing_status == AutomlCausalJob.StageStatus.SUCCESS:
             logger.info(f"[Job {job_id}] Already preprocessed, skipping")
-            return {"status": "already_done", "job_id": job_id}
+            return None
 
-        # 更新状态为运行中
         job.preprocessing_status = AutomlCausalJob.StageStatus.RUNNING
         job.preprocessing_started_at = timezone.now()
         job.last_error = None
         job.save(update_fields=["preprocessing_status", "preprocessing_started_at", "last_error"])
+    return job
 
-    try:
-        # 1) 从 PSTA 读取原始对齐记录
-        qs = PurchasingShopTimeAnalysis.objects.filter(
-            iphone=job.iphone,
-            Timestamp_Time__gte=job.window_start,
-            Timestamp_Time__lt=job.window_end,
-        ).select_related("shop")
-
-        if not qs.exists():
-            logger.warning(f"[Job {job_id}] No PSTA data found, skipping")
-            job.preprocessing_status = AutomlCausalJob.StageStatus.SKIPPED
-            job.preprocessing_finished_at = timezone.now()
-            job.save(update_fields=["preprocessing_status", "preprocessing_finished_at"])
-            return {"status": "skipped", "reason": "no_data"}
-
-        logger.info(f"[Job {job_id}] Found {qs.count()} PSTA records")
-
-        # 2) 转换为 DataFrame
-        df = pd.DataFrame.from_records(
-            qs.values(
-                "shop_id",
-                "iphone_id",
-                "Timestamp_Time",
-                "New_Product_Price",
-                "Price_A",
-                "Price_B",
-            )
-        )
-        df.rename(columns={"Timestamp_Time": "timestamp"}, inplace=True)
-
-        # 3) 选定价格：优先 A品 > B品 > 新品价
-        df["price"] = df["Price_A"].fillna(df["Price_B"]).fillna(df["New_Product_Price"])
-        df["price_source"] = "A"
-        df.loc[df["Price_A"].isna() & df["Price_B"].notna(), "price_source"] = "B"
-        df.loc[df["Price_A"].isna() & df["Price_B"].isna(), "price_source"] = "NEW"
 
-        # 4) 按时间桶聚合
-        df["bucket_ts"] = df["timestamp"].dt.floor(job.bucket_freq)
+def _finish_preprocessing(job, series, trigger_next: bool = True) -> dict:
+    """写入预处理序列并更新状态；有数据且 trigger_next 时触发 VAR 阶段"""
+    from AppleStockChecker.models import AutomlCausalJob
+    from AppleStockChecker.utils.automl_tasks.preprocess import write_preprocessed_series
 
-        # 5) 去除异常价格
-        df = df[(df["price"] >= 10000) & (df["price"] <= 350000)]
-
-        # 6) 对每个 (shop, bucket_ts) 聚合价格
-        df_agg = (
-            df.groupby(["shop_id", "iphone_id", "bucket_ts", "price_source"], as_index=False)
-              .agg(price=("price", "mean"))
-        )
+    if series.size == 0:
+        logger.warning(f"[Job {job.id}] No PSTA data found, skipping")
+        job.preprocessing_status = AutomlCausalJob.StageStatus.SKIPPED
+        job.preprocessing_finished_at = timezone.now()
+        job.save(update_fields=["preprocessing_status", "preprocessing_finished_at"])
+        return {"status": "skipped", "reason": "no_data", "job_id": job.id}
 
-        # 7) 计算 log_price / dlog / z-score (GPU 加速)
-        df_agg = df_agg.sort_values(["shop_id", "bucket_ts"])
+    # 幂等：先删旧、再写新
+    with transaction.atomic():
+        created_count = write_preprocessed_series(job, series)
+        job.preprocessing_status = AutomlCausalJob.StageStatus.SUCCESS
+        job.preprocessing_finished_at = timezone.now()
+        job.save(update_fields=["preprocessing_status", "preprocessing_finished_at"])
 
-        try:
-            # 尝试使用 GPU 加速 numpy 运算
-            if GPU_AVAILABLE:
-                logger.info(f"[Job {job_id}] Using GPU for preprocessing calculations")
+    logger.info(f"[Job {job.id}] Preprocessing complete, created {created_count} series")
 
-                # 转换到 GPU
-                xp = get_array_module()
-                prices_gpu = to_gpu(df_agg["price"].values)
+    # 触发 VAR 阶段任务
+    if trigger_next:
+        run_var_for_job.apply_async(args=[job.id], queue="automl_cause_effect")
+    return {"status": "success", "job_id": job.id, "series_count": created_count}
 
-                # GPU 加速的 log 运算
-                log_prices_gpu = xp.log(prices_gpu)
-                df_agg["log_price"] = ensure_cpu_for_pandas(log_prices_gpu)
-            else:
-                # CPU 版本
-                df_agg["log_price"] = np.log(df_agg["price"])
 
-        except Exception as e:
-            logger.warning(f"[Job {job_id}] GPU calculation failed: {e}, falling back to CPU")
-            df_agg["log_price"] = np.log(df_agg["price"])
-
-        # diff 运算（pandas groupby，保持在 CPU）
-        df_agg["dlog_price"] = df_agg.groupby("shop_id", group_keys=False)["log_price"].diff()
-
-        # 计算每个店铺的均值和标准差
-        stats = (
-            df_agg
-            .groupby("shop_id")["dlog_price"]
-            .agg(["mean", "std"])
-            .rename(columns={"mean": "dlog_mean", "std": "dlog_std"})
-        )
-        df_agg = df_agg.join(stats, on="shop_id")
+def _fail_preprocessing(job, exc: Exception) -> None:
+    from AppleStockChecker.models import AutomlCausalJob
 
-        # 标准化 (GPU 加速)
-        try:
-            if GPU_AVAILABLE:
-                xp = get_array_module()
+    logger.error(f"[Job {job.id}] Preprocessing failed: {exc}", exc_info=True)
+    job.preprocessing_status = AutomlCausalJob.StageStatus.FAILED
+    job.last_error = str(exc)[:2000]
+    job.retry_count += 1
+    job.preprocessing_finished_at = timezone.now()
+    job.save(update_fields=[
+        "preprocessing_status", "last_error",
+        "retry_count", "preprocessing_finished_at"
+    ])
 
-                # 转换到 GPU
-                dlog_gpu = to_gpu(df_agg["dlog_price"].fillna(0).values)
-                mean_gpu = to_gpu(df_agg["dlog_mean"].fillna(0).values)
-                std_gpu = to_gpu(df_agg["dlog_std"].fillna(1).values)
 
-                # GPU 加速的标准化
-                z_dlog_gpu = (dlog_gpu - mean_gpu) / xp.where(std_gpu > 0, std_gpu, 1.0)
-                df_agg["z_dlog_price"] = ensure_cpu_for_pandas(z_dlog_gpu)
-                df_agg.loc[df_agg["dlog_std"] == 0, "z_dlog_price"] = 0.0
-            else:
-                # CPU 版本
-                df_agg["z_dlog_price"] = (df_agg["dlog_price"] - df_agg["dlog_mean"]) / df_agg["dlog_std"]
-                df_agg.loc[df_agg["dlog_std"] == 0, "z_dlog_price"] = 0.0
+@shared_task(
+    bind=True,
+    name="automl.preprocessing_rapid",
+    queue="automl_preprocessing",
+    acks_late=True,
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    max_retries=3,
+)
+def run_preprocessing_for_job(self, job_id: int):
+    """
+    Preprocessing-Rapid Task
+    从 PurchasingShopTimeAnalysis 读取数据 → 生成预处理序列
+    """
+    from AppleStockChecker.utils.automl_tasks.preprocess import preprocess_jobs
 
-        except Exception as e:
-            logger.warning(f"[Job {job_id}] GPU normalization failed: {e}, falling back to CPU")
-            df_agg["z_dlog_price"] = (df_agg["dlog_price"] - df_agg["dlog_mean"]) / df_agg["dlog_std"]
-            df_agg.loc[df_agg["dlog_std"] == 0, "z_dlog_price"] = 0.0
+    logger.info(f"[Job {job_id}] Starting preprocessing...")
 
-        # 8) 写入 AutomlPreprocessedSeries（幂等：先删旧、再写新）
-        with transaction.atomic():
-            AutomlPreprocessedSeries.objects.filter(job=job).delete()
-
-            objs = [
-                AutomlPreprocessedSeries(
-                    job=job,
-                    shop_id=row["shop_id"],
-                    iphone_id=row["iphone_id"],
-                    bucket_ts=row["bucket_ts"],
-                    raw_price=row["price"],
-                    log_price=row["log_price"],
-                    dlog_price=row["dlog_price"] if pd.notna(row["dlog_price"]) else None,
-                    z_dlog_price=row["z_dlog_price"] if pd.notna(row["z_dlog_price"]) else None,
-                    price_source=row["price_source"],
-                )
-                for _, row in df_agg.iterrows()
-            ]
-
-            created_count = 0
-            if objs:
-                AutomlPreprocessedSeries.objects.bulk_create(objs, batch_size=1000)
-                created_count = len(objs)
-
-            job.preprocessing_status = AutomlCausalJob.StageStatus.SUCCESS
-            job.preprocessing_finished_at = timezone.now()
-            job.save(update_fields=["preprocessing_status", "preprocessing_finished_at"])
-
-            logger.info(f"[Job {job_id}] Preprocessing complete, created {created_count} series")
-
-        # 9) 触发 VAR 阶段任务
-        run_var_for_job.apply_async(args=[job.id], queue="automl_cause_effect")
-
-        return {
-            "status": "success",
-            "job_id": job_id,
-            "series_count": created_count,
-        }
+    job = _claim_preprocessing(job_id)
+    if job is None:
+        return {"status": "already_done", "job_id": job_id}
 
+    try:
+        series = preprocess_jobs([job])[job.id]
+        return _finish_preprocessing(job, series)
     except Exception as exc:
-        logger.error(f"[Job {job_id}] Preprocessing failed: {exc}", exc_info=True)
-        job.preprocessing_status = AutomlCausalJob.StageStatus.FAILED
-        job.last_error = str(exc)[:2000]
-        job.retry_count += 1
-        job.preprocessing_finished_at = timezone.now()
-        job.save(update_fields=[
-            "preprocessing_status", "last_error",
-            "retry_count", "preprocessing_finished_at"
-        ])
+        _fail_preprocessing(job, exc)
         raise
 
 
@@ -720,6 +616,211 @@ def run_impact_for_job(self, job_id: int):
         raise
 
 
+# ============================================================================
+# 滑动窗口分析：阶段 1-3 合并执行，窗口间共享 PSTA 读取与 VAR 充分统计量
+# ============================================================================
+
+def _claim_sliding_var(job_id: int):
+    """预处理已成功、影响量化未完成的 Job 置为 VAR RUNNING；否则返回 None"""
+    from AppleStockChecker.models import AutomlCausalJob
+
+    with transaction.atomic():
+        job = AutomlCausalJob.objects.select_for_update().get(pk=job_id)
+        if job.preprocessing_status != AutomlCausalJob.StageStatus.SUCCESS:
+            return None
+        if job.impact_status == AutomlCausalJob.StageStatus.SUCCESS:
+            return None
+
+        job.cause_effect_status = AutomlCausalJob.StageStatus.RUNNING
+        job.cause_effect_started_at = timezone.now()
+        job.last_error = None
+        job.save(update_fields=["cause_effect_status", "cause_effect_started_at", "last_error"])
+    return job
+
+
+def _write_sliding_result(job, result: dict) -> dict:
+    """把单个窗口的引擎结果写入 AutomlVarModel / AutomlGrangerResult / AutomlCausalEdge"""
+    from AppleStockChecker.models import (
+        AutomlCausalEdge,
+        AutomlCausalJob,
+        AutomlGrangerResult,
+        AutomlVarModel,
+    )
+
+    now = timezone.now()
+    if result["status"] == "skipped":
+        job.cause_effect_status = AutomlCausalJob.StageStatus.SKIPPED
+        job.cause_effect_finished_at = now
+        job.save(update_fields=["cause_effect_status", "cause_effect_finished_at"])
+        return {"status": "skipped", "job_id": job.id, "reason": result["reason"]}
+    if result["status"] != "success":
+        job.cause_effect_status = AutomlCausalJob.StageStatus.FAILED
+        job.cause_effect_finished_at = now
+        job.last_error = str(result.get("error"))[:2000]
+        job.retry_count += 1
+        job.save(update_fields=["cause_effect_status", "cause_effect_finished_at", "last_error", "retry_count"])
+        return {"status": "failed", "job_id": job.id, "error": job.last_error}
+
+    coefs = result["coefs"]
+    granger_rows = [
+        AutomlGrangerResult(
+            job=job,
+            cause_shop_id=g["cause"],
+            effect_shop_id=g["effect"],
+            maxlag=g["maxlag"],
+            pvalues_by_lag=g["pvalues_by_lag"],
+            min_pvalue=g["min_pvalue"],
+            best_lag=g["best_lag"],
+            is_significant=g["is_significant"],
+        )
+        for g in result["granger"]
+    ]
+    edges_rows = [
+        AutomlCausalEdge(
+            job=job,
+            cause_shop_id=g["cause"],
+            effect_shop_id=g["effect"],
+            main_lag=g["best_lag"] or 1,
+            weight=g["weight"],
+            min_pvalue=g["min_pvalue"],
+            confidence=max(0.0, min(1.0, 1.0 - g["min_pvalue"])),
+            enabled=True,
+        )
+        for g in result["granger"] if g["is_significant"]
+    ]
+
+    with transaction.atomic():
+        AutomlVarModel.objects.filter(job=job).delete()
+        AutomlVarModel.objects.create(
+            job=job,
+            shop_ids=result["shop_ids"],
+            lag_order=result["lag_order"],
+            coefs={"shape": list(coefs.shape), "data": coefs.tolist()},
+            aic=result["aic"],
+            bic=result["bic"],
+            sample_size=result["sample_size"],
+        )
+        AutomlGrangerResult.objects.filter(job=job).delete()
+        AutomlCausalEdge.objects.filter(job=job).delete()
+        if granger_rows:
+            AutomlGrangerResult.objects.bulk_create(granger_rows, batch_size=500)
+        if edges_rows:
+            AutomlCausalEdge.objects.bulk_create(edges_rows, batch_size=500)
+
+        job.cause_effect_status = AutomlCausalJob.StageStatus.SUCCESS
+        job.cause_effect_finished_at = now
+        job.impact_status = AutomlCausalJob.StageStatus.SUCCESS
+        job.impact_started_at = job.impact_started_at or now
+        job.impact_finished_at = now
+        job.save(update_fields=[
+            "cause_effect_status", "cause_effect_finished_at",
+            "impact_status", "impact_started_at", "impact_finished_at",
+        ])
+
+    return {
+        "status": "success",
+        "job_id": job.id,
+        "lag_order": result["lag_order"],
+        "granger_tests": len(granger_rows),
+        "significant_edges": len(edges_rows),
+    }
+
+
+@shared_task(
+    name="automl.sliding_window_analysis",
+    queue="automl_cause_effect",
+    acks_late=True,
+)
+def run_sliding_window_analysis(job_ids: list):
+    """
+    滑动窗口分析（同一 iPhone、同一 bucket_freq 的一组 Job）：
+
+      1. PSTA 只读一次，未完成预处理的窗口在共享数组上预处理并写库；
+      2. 整个区间构建一次 z-dlog 面板，窗口滑动时增量维护 VAR 正规方程的叉积，
+         在线程池中逐窗口定阶 / 拟合 VAR 并做两两 Granger 检验；
+      3. 结果写入各 Job 的 AutomlVarModel / AutomlGrangerResult / AutomlCausalEdge。
+
+    单个窗口失败只影响该 Job 的状态。
+    """
+    from AppleStockChecker.models import AutomlCausalJob
+    from AppleStockChecker.utils.automl_tasks.preprocess import (
+        bucket_ns_of,
+        load_psta_arrays,
+        preprocess_jobs,
+        preprocess_window,
+    )
+    from AppleStockChecker.utils.automl_tasks.sliding_var import analyze_windows, build_panel
+
+    jobs = list(AutomlCausalJob.objects.filter(pk__in=job_ids).order_by("window_start"))
+    if not jobs:
+        return {"status": "skipped", "reason": "no_jobs"}
+    if len({(j.iphone_id, j.bucket_freq) for j in jobs}) != 1:
+        raise ValueError("run_sliding_window_analysis: jobs must share one iphone and bucket_freq")
+
+    horizon_start = min(j.window_start for j in jobs)
+    horizon_end = max(j.window_end for j in jobs)
+    logger.info(
+        f"Sliding window analysis: {len(jobs)} windows, iphone={jobs[0].iphone_id}, "
+        f"{horizon_start} ~ {horizon_end}"
+    )
+    data = load_psta_arrays(jobs[0].iphone_id, horizon_start, horizon_end)
+
+    # 1) 预处理
+    preprocessing = []
+    pending = [job for job in (_claim_preprocessing(j.id) for j in jobs) if job is not None]
+    if pending:
+        try:
+            all_series = preprocess_jobs(pending, data=data)
+        except Exception as exc:
+            for job in pending:
+                _fail_preprocessing(job, exc)
+            raise
+        for job in pending:
+            try:
+                preprocessing.append(_finish_preprocessing(job, all_series[job.id], trigger_next=False))
+            except Exception as exc:
+                _fail_preprocessing(job, exc)
+                preprocessing.append({"status": "failed", "job_id": job.id, "error": str(exc)[:200]})
+
+    # 2) VAR + Granger
+    targets = [job for job in (_claim_sliding_var(j.id) for j in jobs) if job is not None]
+    results = []
+    if targets:
+        horizon = preprocess_window(
+            data,
+            pd.Timestamp(horizon_start).as_unit("ns").value,
+            pd.Timestamp(horizon_end).as_unit("ns").value,
+            bucket_ns_of(jobs[0].bucket_freq),
+        )
+        panel = build_panel(horizon)
+        logger.info(f"Sliding panel shape: {panel.values.shape} (T, S), {len(targets)} windows to fit")
+        windows = [
+            (pd.Timestamp(job.window_start).as_unit("ns").value, pd.Timestamp(job.window_end).as_unit("ns").value)
+            for job in targets
+        ]
+        try:
+            fitted = analyze_windows(panel, windows)
+        except Exception as exc:
+            fitted = [{"status": "failed", "error": f"{type(exc).__name__}: {exc}"}] * len(targets)
+            logger.error(f"Sliding window engine failed: {exc}", exc_info=True)
+
+        # 3) 写库
+        for job, res in zip(targets, fitted):
+            try:
+                results.append(_write_sliding_result(job, res))
+            except Exception as exc:
+                logger.error(f"[Job {job.id}] Writing sliding window result failed: {exc}", exc_info=True)
+                results.append(_write_sliding_result(job, {"status": "failed", "error": str(exc)[:2000]}))
+
+    return {
+        "status": "success",
+        "jobs": len(jobs),
+        "preprocessed": len(preprocessing),
+        "fitted": sum(1 for r in results if r["status"] == "success"),
+        "results": results,
+    }
+
+
 # ============================================================================
 # 向后兼容的简单任务（保持原API不变）
 # ============================================================================
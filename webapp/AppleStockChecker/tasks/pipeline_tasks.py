@@ -0,0 +1,25 @@
+"""
+Celery tasks for the GPU engine pipeline: incremental live tail.
+"""
+from __future__ import annotations
+
+import logging
+
+from celery import shared_task
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True, name="pipeline.live_tail", max_retries=0)
+def pipeline_live_tail_task(self, run_id: str = "live", nan_mode: str = "ffill"):
+    """每 15 分钟一次: 只处理新封口的桶, 全部 scope 从保存的递推状态续算。"""
+    from django.conf import settings
+    from AppleStockChecker.engine.live import run_live_tail
+
+    device = getattr(settings, "PIPELINE_DEVICE", "cpu")
+    stats = run_live_tail(run_id, device=device, nan_mode=nan_mode)
+    logger.info(
+        "pipeline_live_tail_task done: run_id=%s status=%s last_bucket=%s",
+        run_id, stats.get("status"), stats.get("last_bucket"),
+    )
+    return stats
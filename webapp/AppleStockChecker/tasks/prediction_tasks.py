@@ -12,20 +12,24 @@ logger = logging.getLogger(__name__)
 
 @shared_task(bind=True, name="prediction.train_models", max_retries=1)
 def train_price_models_task(self, iphone_ids: list[int], days: int = 14, run_id: str = "live", version: str = "v1"):
-    """异步训练 LightGBM 价格预测模型。"""
-    from AppleStockChecker.engine.prediction import train_models_for_iphone, save_artifacts
+    """异步训练 LightGBM 价格预测模型 (一次特征查询, 进程池并行训练)。"""
+    from AppleStockChecker.engine.prediction import train_models_for_iphones, save_artifacts
     from AppleStockChecker.services.clickhouse_service import ClickHouseService
 
     ch = ClickHouseService()
     results = {"ok": 0, "fail": 0, "details": {}}
 
+    trained, errors = train_models_for_iphones(ch, iphone_ids, run_id=run_id, train_days=days)
     for iid in iphone_ids:
+        if iid in errors:
+            results["details"][iid] = {"status": "error", "error": errors[iid]}
+            results["fail"] += 1
+            continue
         try:
-            result = train_models_for_iphone(ch, iid, run_id=run_id, train_days=days)
-            save_artifacts(iid, result, version=version)
+            save_artifacts(iid, trained[iid], version=version)
             results["details"][iid] = {
                 "status": "ok",
-                "metrics": result["metrics"],
+                "metrics": trained[iid]["metrics"],
             }
             results["ok"] += 1
         except Exception as e:
@@ -39,28 +43,36 @@ def train_price_models_task(self, iphone_ids: list[int], days: int = 14, run_id:
 
 @shared_task(bind=True, name="prediction.predict_prices", max_retries=1)
 def predict_prices_task(self, iphone_ids: list[int], run_id: str = "live", version: str = "v1"):
-    """异步推理: 对指定机型做价格预测。"""
-    from AppleStockChecker.engine.prediction import predict_for_iphone, save_forecasts
+    """异步推理: 对指定机型做价格预测 (一次特征查询, booster LRU, 批量 upsert)。"""
+    from AppleStockChecker.engine.prediction import booster_cache_stats, predict_for_iphones, upsert_forecasts
     from AppleStockChecker.services.clickhouse_service import ClickHouseService
 
     ch = ClickHouseService()
     results = {"ok": 0, "fail": 0, "total_forecasts": 0, "details": {}}
 
+    preds, errors = predict_for_iphones(ch, iphone_ids, run_id=run_id, version=version)
+    created = upsert_forecasts(preds)
+
+    per_iphone: dict[int, list[int]] = {}
+    for p, was_created in zip(preds, created):
+        counts = per_iphone.setdefault(p["iphone_id"], [0, 0])
+        counts[0] += 1
+        counts[1] += int(was_created)
+
     for iid in iphone_ids:
-        try:
-            preds = predict_for_iphone(ch, iid, run_id=run_id, version=version)
-            n_new = save_forecasts(preds)
-            results["details"][iid] = {
-                "status": "ok",
-                "predictions": len(preds),
-                "new": n_new,
-            }
-            results["total_forecasts"] += len(preds)
-            results["ok"] += 1
-        except Exception as e:
-            logger.exception("predict_prices_task: failed iphone=%d", iid)
-            results["details"][iid] = {"status": "error", "error": str(e)}
+        if iid in errors:
+            results["details"][iid] = {"status": "error", "error": errors[iid]}
             results["fail"] += 1
+            continue
+        n_preds, n_new = per_iphone.get(iid, (0, 0))
+        results["details"][iid] = {
+            "status": "ok",
+            "predictions": n_preds,
+            "new": n_new,
+        }
+        results["total_forecasts"] += n_preds
+        results["ok"] += 1
 
+    results["booster_cache"] = booster_cache_stats()
     logger.info("predict_prices_task done: %d ok, %d fail", results["ok"], results["fail"])
     return results
@@ -20,6 +20,7 @@ from django.db import transaction, IntegrityError
 from decimal import Decimal, ROUND_HALF_UP
 import os
 import logging
+import threading
 from typing import Any, Callable, Dict, Iterable, Tuple, Optional, Union
 from typing import Optional, Dict, Any, List
 
@@ -375,6 +376,9 @@ def _agg_overallbar(
             if not bucket_iphone_ids:
                 overallbar_debug["skipped"] = True
 
+            # 一次查询取回本桶所有型号的动态价格区间
+            price_ranges = get_dynamic_price_ranges(bucket_iphone_ids, bucket_end if use_window else ts_dt)
+
             for ipid in bucket_iphone_ids:
                 if use_window:
                     # 窗口内：每店最后一条
@@ -420,7 +424,7 @@ def _agg_overallbar(
                     continue
 
                 # 第一步：使用动态价格区间过滤明显错误的数据
-                price_min, price_max = get_dynamic_price_range(ipid, reference_time)
+                price_min, price_max = price_ranges[ipid]
                 prices = [p for p in prices_raw if price_min <= p <= price_max]
 
                 if not prices:
@@ -706,10 +710,8 @@ def _agg_feature_combos(
             )
             reference_time = ts_dt
 
-        # 为每个 iphone_id 计算动态价格区间
-        price_ranges = {}
-        for iphone_id in iphones_seen:
-            price_ranges[iphone_id] = get_dynamic_price_range(iphone_id, reference_time)
+        # 一次查询计算所有 iphone_id 的动态价格区间（与写入阶段共享缓存）
+        price_ranges = get_dynamic_price_ranges(iphones_seen, reference_time)
 
         # (shop, iphone) -> (last_price, last_ts)
         data_by_si: Dict[tuple, tuple] = {}
@@ -987,23 +989,43 @@ _BUCKET_MIN = 15
 _EMA_HL_WINDOWS = [30, 60]
 
 
+# 时间序列/布林带需要的最长历史 (最大窗口桶数 - 1, 当前桶来自 wide_rows)
+_HISTORY_BUCKETS = max(_FEATURE_WINDOWS) // _BUCKET_MIN - 1
+
+
 def _fetch_prev_base(scope: str, column: str, limit: int, anchor_dt):
     """从 CH features_wide 读取历史基值序列（新→旧），limit 为桶数。
     返回 [float | None, ...] 保留等间距。
     """
-    from AppleStockChecker.services.clickhouse_service import ClickHouseService
-    ch = ClickHouseService()
+    return _fetch_prev_base_batch([scope], column, limit, anchor_dt).get(scope, [])
+
+
+def _fetch_prev_base_batch(scopes, column: str, limit: int, anchor_dt) -> Dict[str, list]:
+    """一次查询读取多个 scope 的历史基值序列（各自新→旧，最多 limit 桶）。
+
+    LIMIT n BY scope 与逐 scope 的 ORDER BY bucket DESC LIMIT n 结果相同；
+    较短窗口直接取前 W-1 个即可，所有窗口共用这一份历史。
+    返回 {scope: [float | None, ...]}，无历史的 scope 不在结果中。
+    """
+    from AppleStockChecker.services.clickhouse_service import get_shared_service
+
+    scopes = list(scopes)
+    if not scopes or limit <= 0:
+        return {}
     sql = (
-        f"SELECT {column} FROM features_wide FINAL "
-        f"WHERE run_id = 'live' AND scope = %(scope)s AND bucket < %(dt)s "
-        f"ORDER BY bucket DESC LIMIT %(lim)s"
+        f"SELECT scope, {column} FROM features_wide FINAL "
+        f"WHERE run_id = 'live' AND scope IN %(scopes)s AND bucket < %(dt)s "
+        f"ORDER BY scope, bucket DESC LIMIT %(lim)s BY scope"
     )
-    rows = ch.client.execute(sql, {
-        "scope": scope,
+    rows = get_shared_service().client.execute(sql, {
+        "scopes": tuple(scopes),
         "dt": anchor_dt.replace(tzinfo=None) if hasattr(anchor_dt, 'tzinfo') and anchor_dt.tzinfo else anchor_dt,
         "lim": limit,
     })
-    return [float(r[0]) if r[0] is not None else None for r in rows]
+    history: Dict[str, list] = {}
+    for scope, v in rows:
+        history.setdefault(scope, []).append(float(v) if v is not None else None)
+    return history
 
 
 def _ema_from_series_with_none(series_old_to_new, alpha):
@@ -1059,11 +1081,13 @@ def _agg_time_series_features(
     ts_iso: str,
     anchor_bucket,
     wide_rows: Dict[str, dict],
+    history: Optional[Dict[str, list]] = None,
 ) -> Dict[str, float]:
     """
     4) 时间序列派生指标：EMA / SMA / WMA / EMA half-life（硬编码窗口）
 
     从 wide_rows 中读取 base_now (mean)，写回 wide_rows。
+    history 为 _fetch_prev_base_batch 的结果（未给出时在此批量读取一次）。
     返回 base_now: scope -> 当前 x_t 基值（给 Bollinger 复用）
     """
     import math as _math
@@ -1077,12 +1101,15 @@ def _agg_time_series_features(
             if row.get("mean") is not None:
                 base_now[scope] = float(row["mean"])
 
+        if history is None:
+            history = _fetch_prev_base_batch(base_now, "mean", _HISTORY_BUCKETS, anchor_bucket)
+
         for W in _FEATURE_WINDOWS:
             W_buckets = W // _BUCKET_MIN
             alpha_ema = 2.0 / (W_buckets + 1.0)
 
             for scope, x_t in base_now.items():
-                prev_vals = _fetch_prev_base(scope, "mean", W_buckets - 1, anchor_bucket)
+                prev_vals = history.get(scope, [])[:W_buckets - 1]
                 series = list(reversed(prev_vals)) + [float(x_t)]
 
                 try:
@@ -1108,7 +1135,7 @@ def _agg_time_series_features(
             alpha_hl = 1.0 - _math.exp(-_math.log(2) / W_buckets)
 
             for scope, x_t in base_now.items():
-                prev_vals = _fetch_prev_base(scope, "mean", W_buckets - 1, anchor_bucket)
+                prev_vals = history.get(scope, [])[:W_buckets - 1]
                 series = list(reversed(prev_vals)) + [float(x_t)]
                 try:
                     ema_hl_val = _ema_from_series_with_none(series, alpha_hl)
@@ -1145,20 +1172,25 @@ def _agg_bollinger_bands(
     anchor_bucket,
     base_now: Dict[str, float],
     wide_rows: Dict[str, dict],
+    history: Optional[Dict[str, list]] = None,
 ):
     """
     5) Bollinger Bands（硬编码窗口, SMA 中轨, rolling std ddof=1）
     写入 wide_rows[scope][boll_mid_{W}] 等。
+    history 与 _agg_time_series_features 共用同一份批量历史。
     """
     boll_debug = {"bucket": ts_iso, "computed": 0, "skipped": [], "samples": []}
     k = 2.0
 
     try:
+        if history is None:
+            history = _fetch_prev_base_batch(base_now, "mean", _HISTORY_BUCKETS, anchor_bucket)
+
         for W in _FEATURE_WINDOWS:
             W_buckets = W // _BUCKET_MIN
 
             for scope, x_t in base_now.items():
-                prev_vals = _fetch_prev_base(scope, "mean", W_buckets - 1, anchor_bucket)
+                prev_vals = history.get(scope, [])[:W_buckets - 1]
                 series_raw = list(reversed(prev_vals)) + [float(x_t)]
 
                 # ffill: 与 GPU _forward_fill_1d 一致
@@ -1320,65 +1352,120 @@ PRICE_FALLBACK_MIN = 100000  # 数据不足时的后备最小值
 PRICE_FALLBACK_MAX = 350000  # 数据不足时的后备最大值
 
 
-def get_dynamic_price_range(
-    iphone_id: int,
+# 动态价格区间的进程内短期缓存：写入阶段与聚合阶段在同一参考时间点共享结果。
+# 本进程写入 PSTA 后由 invalidate_price_ranges 立即剔除受影响的型号；
+# 其他进程写入的 PSTA 最多延迟 PRICE_RANGE_CACHE_TTL 秒才反映到区间上。
+PRICE_RANGE_CACHE_TTL = float(os.getenv("PSTA_PRICE_RANGE_CACHE_TTL", "120"))  # 秒，0 表示不缓存
+_price_range_cache: Dict[tuple, Tuple[float, Dict[int, tuple]]] = {}
+_price_range_lock = threading.Lock()
+_price_range_gen = 0  # 每次失效 +1；查询期间发生过失效的结果不入缓存
+
+
+def get_dynamic_price_ranges(
+    iphone_ids: Iterable[int],
     reference_time,
     lookback_minutes: int = PRICE_LOOKBACK_MINUTES,
     tolerance_ratio: float = PRICE_TOLERANCE_RATIO,
     min_samples: int = PRICE_MIN_SAMPLES,
-) -> tuple[float, float]:
+) -> Dict[int, tuple]:
     """
-    根据指定 iPhone 型号在参考时间点前 N 分钟内的历史价格，
-    动态计算该型号的合理价格区间。
+    批量版 get_dynamic_price_range：一条窗口函数查询算出所有 iphone_id 的价格区间。
 
-    逻辑：
-    1. 查询该 iphone_id 在 [reference_time - lookback_minutes, reference_time) 时间窗口内
-       所有不同店铺的最新价格记录
-    2. 计算这些价格的平均值作为参考价格
-    3. 基于参考价格和容差比例，计算价格区间：
-       - price_min = reference_price * (1 - tolerance_ratio)
-       - price_max = reference_price * (1 + tolerance_ratio)
-    4. 如果样本数不足，返回后备的固定区间
+    每个 (iphone_id, shop_id) 用 ROW_NUMBER() 取窗口内最新一条，再按 iphone_id
+    求均值；结果按 (reference_time, lookback_minutes, tolerance_ratio, min_samples)
+    缓存 PRICE_RANGE_CACHE_TTL 秒，缓存里缺的 iphone_id 才会去查库；
+    本进程的 PSTA 写入经 invalidate_price_ranges 使对应型号失效。
 
     参数：
-        iphone_id: iPhone 型号 ID
+        iphone_ids: iPhone 型号 ID 集合
         reference_time: 参考时间点（datetime 对象）
-        lookback_minutes: 向前查询的时间窗口（分钟）
-        tolerance_ratio: 价格容差比例（0.5 表示 ±50%）
-        min_samples: 计算参考价格所需的最少样本数
+        其余参数同 get_dynamic_price_range
 
     返回：
-        (price_min, price_max): 动态计算的价格区间
+        {iphone_id: (price_min, price_max)}，样本不足的型号返回后备区间
     """
-    from django.db.models import Avg, Count
+    import time
+
+    wanted = {int(i) for i in iphone_ids if i is not None}
+    key = (reference_time, lookback_minutes, tolerance_ratio, min_samples)
+    now = time.monotonic()
+
+    with _price_range_lock:
+        for k in [k for k, (exp, _) in _price_range_cache.items() if exp <= now]:
+            del _price_range_cache[k]
+        cached = dict(_price_range_cache[key][1]) if key in _price_range_cache else {}
+        gen = _price_range_gen
+
+    missing = wanted - cached.keys()
+    if missing:
+        fresh = _query_price_ranges(missing, reference_time, lookback_minutes, tolerance_ratio, min_samples)
+        cached.update(fresh)
+        if PRICE_RANGE_CACHE_TTL > 0:
+            with _price_range_lock:
+                if gen != _price_range_gen:
+                    return {i: cached[i] for i in wanted}
+                exp, ranges = _price_range_cache.get(key, (now + PRICE_RANGE_CACHE_TTL, {}))
+                ranges.update(fresh)
+                _price_range_cache[key] = (exp, ranges)
+
+    return {i: cached[i] for i in wanted}
+
+
+def invalidate_price_ranges(iphone_ids: Iterable[int], written_at) -> int:
+    """
+    PSTA 写入 Timestamp_Time=written_at 的行后调用：
+    回看窗口 [reference_time - lookback, reference_time) 覆盖 written_at 的缓存条目里剔除这些型号。
+    返回剔除的 (条目, 型号) 数。
+    """
+    global _price_range_gen
+    ids = {int(i) for i in iphone_ids if i is not None}
+    dropped = 0
+    with _price_range_lock:
+        _price_range_gen += 1
+        for (reference_time, lookback_minutes, *_), (_, ranges) in _price_range_cache.items():
+            if reference_time - timedelta(minutes=lookback_minutes) <= written_at < reference_time:
+                for i in ids & ranges.keys():
+                    del ranges[i]
+                    dropped += 1
+    return dropped
+
+
+def _query_price_ranges(iphone_ids, reference_time, lookback_minutes, tolerance_ratio, min_samples) -> Dict[int, tuple]:
+    from django.db.models import F, Window
+    from django.db.models.functions import RowNumber
     from AppleStockChecker.models import PurchasingShopTimeAnalysis
 
-    # 计算查询时间窗口
     start_time = reference_time - timedelta(minutes=lookback_minutes)
-
-    # 查询该时间窗口内不同店铺的最新价格（每个店铺取最新一条）
-    # 使用子查询获取每个店铺的最新记录
-    subquery = (
+    latest = (
         PurchasingShopTimeAnalysis.objects
         .filter(
-            iphone_id=iphone_id,
+            iphone_id__in=iphone_ids,
             Timestamp_Time__gte=start_time,
             Timestamp_Time__lt=reference_time,
             New_Product_Price__isnull=False,
         )
-        .order_by("shop_id", "-Timestamp_Time")
-        .distinct("shop_id")
-        .values_list("New_Product_Price", flat=True)
+        .annotate(rn=Window(
+            RowNumber(),
+            partition_by=[F("iphone_id"), F("shop_id")],
+            order_by=F("Timestamp_Time").desc(),
+        ))
+        .filter(rn=1)
+        .values_list("iphone_id", "New_Product_Price")
     )
 
-    prices = list(subquery)
+    prices: Dict[int, list] = defaultdict(list)
+    for iphone_id, price in latest:
+        prices[iphone_id].append(price)
+
+    return {
+        i: _price_range_from_samples(prices.get(i, []), tolerance_ratio, min_samples)
+        for i in iphone_ids
+    }
 
+
+def _price_range_from_samples(prices, tolerance_ratio: float, min_samples: int) -> tuple:
     # 如果样本数不足，返回后备区间
     if len(prices) < min_samples:
-        # logger.warning(
-        #     f"动态价格区间: iphone_id={iphone_id}, 样本数不足({len(prices)}/{min_samples}), "
-        #     f"使用后备区间 [{PRICE_FALLBACK_MIN}, {PRICE_FALLBACK_MAX}]"
-        # )
         return PRICE_FALLBACK_MIN, PRICE_FALLBACK_MAX
 
     # 计算平均价格作为参考价格
@@ -1394,14 +1481,44 @@ def get_dynamic_price_range(
         price_min = reference_price * 0.9
         price_max = reference_price * 1.1
 
-    # logger.info(
-    #     f"动态价格区间: iphone_id={iphone_id}, 样本数={len(prices)}, "
-    #     f"参考价格={reference_price:.0f}, 区间=[{price_min:.0f}, {price_max:.0f}]"
-    # )
-
     return price_min, price_max
 
 
+def get_dynamic_price_range(
+    iphone_id: int,
+    reference_time,
+    lookback_minutes: int = PRICE_LOOKBACK_MINUTES,
+    tolerance_ratio: float = PRICE_TOLERANCE_RATIO,
+    min_samples: int = PRICE_MIN_SAMPLES,
+) -> tuple[float, float]:
+    """
+    根据指定 iPhone 型号在参考时间点前 N 分钟内的历史价格，
+    动态计算该型号的合理价格区间。
+
+    逻辑：
+    1. 查询该 iphone_id 在 [reference_time - lookback_minutes, reference_time) 时间窗口内
+       所有不同店铺的最新价格记录
+    2. 计算这些价格的平均值作为参考价格
+    3. 基于参考价格和容差比例，计算价格区间：
+       - price_min = reference_price * (1 - tolerance_ratio)
+       - price_max = reference_price * (1 + tolerance_ratio)
+    4. 如果样本数不足，返回后备的固定区间
+
+    参数：
+        iphone_id: iPhone 型号 ID
+        reference_time: 参考时间点（datetime 对象）
+        lookback_minutes: 向前查询的时间窗口（分钟）
+        tolerance_ratio: 价格容差比例（0.5 表示 ±50%）
+        min_samples: 计算参考价格所需的最少样本数
+
+    返回：
+        (price_min, price_max): 动态计算的价格区间
+    """
+    return get_dynamic_price_ranges(
+        [iphone_id], reference_time, lookback_minutes, tolerance_ratio, min_samples,
+    )[int(iphone_id)]
+
+
 def is_price_valid(
     price: float,
     iphone_id: int,
@@ -1442,18 +1559,21 @@ def is_price_valid(
 TASK_VER_PSTA = 3
 
 
+_PSTA_UPSERT_CHUNK = 500  # 单条 INSERT ... ON CONFLICT 的行数上限 (参数个数 = 行数 × 11)
+
+
 def _process_minute_rows(*, ts_iso: str, ts_dt, rows, job_id: str):
     """
     模块一：分钟对齐数据写入 PurchasingShopTimeAnalysis，并收集 chart_points。
 
+    先一次性预取合法的 shop / iphone id 做外键校验，再把整分钟的有效行
+    用 INSERT ... ON CONFLICT (shop_id, iphone_id, timestamp_time) DO UPDATE
+    批量 upsert（冲突时 Update_Count 递增），替代逐行 get + select_for_update。
+
     返回:
         ok, failed, err_counter, errors, chart_points
     """
-    from django.utils import timezone  # 如果不需要可以去掉
-    from django.core.exceptions import ObjectDoesNotExist, ValidationError
-    from AppleStockChecker.models import (
-        PurchasingShopTimeAnalysis, SecondHandShop, Iphone,
-    )
+    from AppleStockChecker.models import SecondHandShop, Iphone
 
     ok = 0
     failed = 0
@@ -1461,19 +1581,37 @@ def _process_minute_rows(*, ts_iso: str, ts_dt, rows, job_id: str):
     err_counter = Counter()
 
     ts_tz = _tz_offset_str(ts_dt)
-    orig_tz = "+09:00"
     chart_points = []
 
+    def _fail(e, r, with_price=True):
+        nonlocal failed
+        failed += 1
+        err_counter[e.__class__.__name__] += 1
+        if len(errors) < MAX_BUCKET_ERROR_SAMPLES:
+            item = {
+                "shop_id": r.get("shop_id"),
+                "iphone_id": r.get("iphone_id"),
+                "recorded_at": r.get("recorded_at"),
+            }
+            if with_price:
+                item["New_Product_Price"] = r.get("price_new") or r.get("New_Product_Price")
+            errors.append({"exc": e.__class__.__name__, "msg": str(e), "item": item})
+
     # 预计算所有 iphone_id 的动态价格区间（优化性能，避免重复查询）
     unique_iphone_ids = {r.get("iphone_id") for r in rows if r.get("iphone_id")}
-    price_ranges_cache = {}
-    for iphone_id in unique_iphone_ids:
-        try:
-            price_ranges_cache[iphone_id] = get_dynamic_price_range(iphone_id, ts_dt)
-        except Exception as e:
-            logger.warning(f"计算动态价格区间失败: iphone_id={iphone_id}, error={e}, 使用后备区间")
-            price_ranges_cache[iphone_id] = (PRICE_FALLBACK_MIN, PRICE_FALLBACK_MAX)
+    try:
+        price_ranges_cache = get_dynamic_price_ranges(unique_iphone_ids, ts_dt)
+    except Exception as e:
+        logger.warning(f"计算动态价格区间失败: error={e}, 使用后备区间")
+        price_ranges_cache = {}
 
+    # 外键存在性：一次取回整分钟涉及的合法 id
+    shop_ids = {r.get("shop_id") for r in rows if r.get("shop_id")}
+    valid_shops = set(SecondHandShop.objects.filter(pk__in=shop_ids).values_list("id", flat=True))
+    valid_iphones = set(Iphone.objects.filter(pk__in=unique_iphone_ids).values_list("id", flat=True))
+
+    # 校验通过的行：(原始行, shop_id, iphone_id, rec_dt, price, align_diff)
+    accepted = []
     for r in rows:
         try:
             # 轻量校验
@@ -1482,9 +1620,10 @@ def _process_minute_rows(*, ts_iso: str, ts_dt, rows, job_id: str):
             if not shop_id or not iphone_id:
                 raise ValueError("missing shop_id/iphone_id")
 
-            # 外键存在性
-            SecondHandShop.objects.only("id").get(pk=shop_id)
-            Iphone.objects.only("id").get(pk=iphone_id)
+            if shop_id not in valid_shops:
+                raise SecondHandShop.DoesNotExist("SecondHandShop matching query does not exist.")
+            if iphone_id not in valid_iphones:
+                raise Iphone.DoesNotExist("Iphone matching query does not exist.")
 
             rec_dt = _to_aware(r.get("recorded_at"))
             new_price = r.get("price_new") or r.get("New_Product_Price")
@@ -1506,94 +1645,122 @@ def _process_minute_rows(*, ts_iso: str, ts_dt, rows, job_id: str):
                 continue
 
             align_diff = int((rec_dt - ts_dt).total_seconds())
+            accepted.append((r, shop_id, iphone_id, rec_dt, price, align_diff))
 
-            from django.db import transaction
-            from django.db.utils import IntegrityError as DjangoIntegrityError
+        except (ObjectDoesNotExist, ValidationError, IntegrityError, TypeError, ValueError) as e:
+            _fail(e, r)
+        except Exception as e:
+            _fail(e, r, with_price=False)
+
+    if not accepted:
+        return ok, failed, err_counter, errors, chart_points
+
+    # 同一 (shop, iphone) 在一分钟内出现多次：以最后一行为准，次数折算进 Update_Count
+    merged: Dict[tuple, list] = {}
+    for a in accepted:
+        key = (a[1], a[2])
+        if key in merged:
+            merged[key][0] = a
+            merged[key][1] += 1
+        else:
+            merged[key] = [a, 1]
 
-            with transaction.atomic():
-                inst = (
-                    PurchasingShopTimeAnalysis.objects
-                    .select_for_update()
-                    .filter(
-                        shop_id=shop_id,
-                        iphone_id=iphone_id,
-                        Timestamp_Time=ts_dt,
-                    )
-                    .first()
-                )
+    try:
+        ids = _upsert_psta_minute(merged, ts_dt=ts_dt, ts_tz=ts_tz, job_id=job_id)
+    except Exception as e:
+        # 整批失败时逐键重试，把失败范围缩小到具体的行
+        logger.warning(f"PSTA 批量 upsert 失败, 改为逐行写入: ts={ts_iso}, error={e}")
+        ids = {}
+        for key, entry in merged.items():
+            try:
+                ids.update(_upsert_psta_minute({key: entry}, ts_dt=ts_dt, ts_tz=ts_tz, job_id=job_id))
+            except Exception as e_row:
+                ids[key] = e_row
+
+    for r, shop_id, iphone_id, rec_dt, price, _ in accepted:
+        pk = ids.get((shop_id, iphone_id))
+        if isinstance(pk, Exception):
+            _fail(pk, r)
+            continue
+        ok += 1
+
+        # 收集图表增量（前端去重）
+        if len(chart_points) < MAX_BUCKET_CHART_POINTS:
+            chart_points.append({
+                "id": pk,
+                "t": ts_iso,
+                "iphone_id": iphone_id,
+                "shop_id": shop_id,
+                "price": price,
+                "recorded_at": rec_dt.isoformat(),
+            })
 
-                if inst:
-                    inst.Job_ID = job_id
-                    inst.Original_Record_Time_Zone = orig_tz
-                    inst.Timestamp_Time_Zone = ts_tz
-                    inst.Record_Time = rec_dt
-                    inst.Alignment_Time_Difference = align_diff
-                    inst.New_Product_Price = int(new_price)
-                    inst.Update_Count = (inst.Update_Count or 0) + 1
-                    inst.save()
-                else:
-                    inst = PurchasingShopTimeAnalysis.objects.create(
-                        Batch_ID=None,
-                        Job_ID=job_id,
-                        Original_Record_Time_Zone=orig_tz,
-                        Timestamp_Time_Zone=ts_tz,
-                        Record_Time=rec_dt,
-                        Timestamp_Time=ts_dt,
-                        Alignment_Time_Difference=align_diff,
-                        Update_Count=0,
-                        shop_id=shop_id,
-                        iphone_id=iphone_id,
-                        New_Product_Price=int(new_price),
-                    )
+    return ok, failed, err_counter, errors, chart_points
 
-            ok += 1
-
-            # 收集图表增量（前端去重）
-            if len(chart_points) < MAX_BUCKET_CHART_POINTS:
-                chart_points.append({
-                    "id": inst.pk,
-                    "t": ts_iso,
-                    "iphone_id": iphone_id,
-                    "shop_id": shop_id,
-                    "price": int(new_price),
-                    "recorded_at": rec_dt.isoformat(),
-                })
 
-        except (ObjectDoesNotExist, ValidationError, IntegrityError, TypeError, ValueError) as e:
-            failed += 1
-            err_counter[e.__class__.__name__] += 1
-            if len(errors) < MAX_BUCKET_ERROR_SAMPLES:
-                errors.append({
-                    "exc": e.__class__.__name__,
-                    "msg": str(e),
-                    "item": {
-                        "shop_id": r.get("shop_id"),
-                        "iphone_id": r.get("iphone_id"),
-                        "recorded_at": r.get("recorded_at"),
-                        "New_Product_Price": r.get("price_new") or r.get("New_Product_Price"),
-                    },
-                })
-        except Exception as e:
-            failed += 1
-            err_counter[e.__class__.__name__] += 1
-            if len(errors) < MAX_BUCKET_ERROR_SAMPLES:
-                errors.append({
-                    "exc": e.__class__.__name__,
-                    "msg": str(e),
-                    "item": {
-                        "shop_id": r.get("shop_id"),
-                        "iphone_id": r.get("iphone_id"),
-                        "recorded_at": r.get("recorded_at"),
-                    },
-                })
+def _upsert_psta_minute(merged: Dict[tuple, list], *, ts_dt, ts_tz: str, job_id: str) -> Dict[tuple, int]:
+    """
+    把 {(shop_id, iphone_id): [最后一行, 出现次数]} 以 INSERT ... ON CONFLICT DO UPDATE
+    写入 PurchasingShopTimeAnalysis，返回 {(shop_id, iphone_id): pk}。
 
-    return ok, failed, err_counter, errors, chart_points
+    新插入的行 Update_Count = 出现次数 - 1；已存在的行 Update_Count += 出现次数，
+    与逐行 select_for_update + save 的计数一致。
+    """
+    from django.db import connection
+    from AppleStockChecker.models import PurchasingShopTimeAnalysis
+
+    opts = PurchasingShopTimeAnalysis._meta
+    qn = connection.ops.quote_name
+    col = {f.name: qn(f.column) for f in opts.concrete_fields}
+    table = qn(opts.db_table)
+    adapt_dt = connection.ops.adapt_datetimefield_value
+
+    insert_cols = [
+        "Job_ID", "Original_Record_Time_Zone", "Timestamp_Time_Zone", "Record_Time",
+        "Timestamp_Time", "Alignment_Time_Difference", "Update_Count", "shop",
+        "iphone", "New_Product_Price", "Warehouse_Receipt_Time",
+    ]
+    overwrite = [
+        "Job_ID", "Original_Record_Time_Zone", "Timestamp_Time_Zone", "Record_Time",
+        "Alignment_Time_Difference", "New_Product_Price",
+    ]
+    uc = col["Update_Count"]
+    sql_head = (
+        f"INSERT INTO {table} ({', '.join(col[c] for c in insert_cols)}) VALUES "
+    )
+    sql_tail = (
+        f" ON CONFLICT ({col['shop']}, {col['iphone']}, {col['Timestamp_Time']}) DO UPDATE SET "
+        + ", ".join(f"{col[c]} = EXCLUDED.{col[c]}" for c in overwrite)
+        + f", {uc} = COALESCE({table}.{uc}, 0) + EXCLUDED.{uc} + 1"
+        + f" RETURNING {col['shop']}, {col['iphone']}, {col['id']}"
+    )
+    row_ph = "(" + ", ".join(["%s"] * len(insert_cols)) + ")"
+
+    ts_db = adapt_dt(ts_dt)
+    now_db = adapt_dt(timezone.now())
+    items = list(merged.items())
+    ids: Dict[tuple, int] = {}
+    with transaction.atomic(), connection.cursor() as cur:
+        for i in range(0, len(items), _PSTA_UPSERT_CHUNK):
+            chunk = items[i:i + _PSTA_UPSERT_CHUNK]
+            params = []
+            for (shop_id, iphone_id), ((_, _, _, rec_dt, price, align_diff), n) in chunk:
+                params.extend([
+                    job_id, "+09:00", ts_tz, adapt_dt(rec_dt), ts_db, align_diff, n - 1,
+                    shop_id, iphone_id, price, now_db,
+                ])
+            cur.execute(sql_head + ", ".join([row_ph] * len(chunk)) + sql_tail, params)
+            for shop_id, iphone_id, pk in cur.fetchall():
+                ids[(shop_id, iphone_id)] = pk
+    # 新价格落在之后参考时间点的回看窗口里，已缓存的动态区间作废
+    invalidate_price_ranges({iphone_id for _, iphone_id in ids}, ts_dt)
+    return ids
 
 
 def _write_wide_rows_to_ch(wide_rows: Dict[str, dict], anchor_bucket, run_id: str = "live"):
     """将 wide_rows 累积器批量写入 CH features_wide。"""
     import pandas as pd
-    from AppleStockChecker.services.clickhouse_service import ClickHouseService
+    from AppleStockChecker.services.clickhouse_service import get_shared_service
 
     if not wide_rows:
         return 0
@@ -1605,8 +1772,7 @@ def _write_wide_rows_to_ch(wide_rows: Dict[str, dict], anchor_bucket, run_id: st
         records.append(row)
 
     df = pd.DataFrame(records)
-    ch = ClickHouseService()
-    n = ch.insert_features(df, run_id=run_id)
+    n = get_shared_service().insert_features(df, run_id=run_id)
     logger.info("_write_wide_rows_to_ch: %d rows written (run_id=%s)", n, run_id)
     return n
 
@@ -1629,6 +1795,8 @@ def _run_aggregation(
     5) Bollinger Bands → wide_rows
     6) Market Log Premium → wide_rows
     7) CH 批量写入
+
+    4)~7) 仅在 settings.PSTA_MINUTE_CH_FEATURES 打开时执行；默认由 pipeline.live_tail 写 features_wide。
     """
     logger.info(
         f"[聚合] 进入聚合流程 | ts={ts_iso}"
@@ -1676,11 +1844,28 @@ def _run_aggregation(
         f"[聚合] 四类组合完成 | scopes={len(wide_rows)}"
     )
 
+    # 4)~7) 的 features_wide 由 pipeline.live_tail 派生并写入，默认不在这里重复
+    from django.conf import settings
+    if not getattr(settings, "PSTA_MINUTE_CH_FEATURES", False):
+        return
+
+    # 4)/5) 共用的历史 mean：一次查询取全部 scope 最近 _HISTORY_BUCKETS 桶
+    #       (失败时 history=None，由 4)/5) 各自重试并按原方式上报错误)
+    history = None
+    try:
+        history = _fetch_prev_base_batch(
+            [scope for scope, row in wide_rows.items() if row.get("mean") is not None],
+            "mean", _HISTORY_BUCKETS, anchor_bucket,
+        )
+    except Exception as e:
+        logger.warning(f"[聚合] 批量读取历史 mean 失败: {repr(e)}")
+
     # 4) 时间序列（返回 base_now 给 Bollinger 用）
     base_now = _agg_time_series_features(
         ts_iso=ts_iso,
         anchor_bucket=anchor_bucket,
         wide_rows=wide_rows,
+        history=history,
     )
 
     # 5) Bollinger Bands
@@ -1689,6 +1874,7 @@ def _run_aggregation(
         anchor_bucket=anchor_bucket,
         base_now=base_now,
         wide_rows=wide_rows,
+        history=history,
     )
 
     # 6) Market Log Premium
@@ -226,6 +226,63 @@ def _to_int_or_none(v):
         return None
 
 
+def _parse_recorded_at(rec_at):
+    """recorded_at → aware datetime；缺失或无法解析时取当前时间"""
+    if not rec_at:
+        return timezone.now()
+    try:
+        recorded_at = pd.to_datetime(rec_at, utc=True, errors="coerce")
+        if pd.isna(recorded_at):
+            return timezone.now()
+        return recorded_at.to_pydatetime()
+    except Exception:
+        return timezone.now()
+
+
+def _resolve_shops(keys) -> Dict[tuple, SecondHandShop]:
+    """(name, address) 集合 → SecondHandShop；一次 IN 查询，缺失的批量创建"""
+    if not keys:
+        return {}
+    names = {name for name, _ in keys}
+
+    def _load():
+        return {
+            (s.name, s.address): s
+            for s in SecondHandShop.objects.filter(name__in=names)
+            if (s.name, s.address) in keys
+        }
+
+    shops = _load()
+    missing = [SecondHandShop(name=n, address=a) for n, a in keys if (n, a) not in shops]
+    if missing:
+        # 并发清洗任务可能同时创建同一家店：忽略冲突后重新读取
+        SecondHandShop.objects.bulk_create(missing, ignore_conflicts=True)
+        shops = _load()
+        # bulk_create 不发 post_save，店铺元数据缓存需手动失效
+        from AppleStockChecker.services.metadata_cache import invalidate_metadata
+        invalidate_metadata("shop")
+    return shops
+
+
+_PRICE_FIELDS = ["price_new", "price_grade_a", "price_grade_b", "batch_id"]
+
+
+def _bulk_insert_price_records(objs, batch_size: int = 1000) -> None:
+    """
+    批量插入 PurchasingShopPriceRecord（保留显式的 recorded_at）。
+
+    并发任务先一步写入同一 (shop, iphone, recorded_at) 时按 upsert 覆盖价格，而不是整批失败。
+    bulk_create 不发 post_save，趋势缓存由调用方 note_price_records 处理。
+    """
+    PurchasingShopPriceRecord.objects.bulk_create(
+        objs,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=["shop", "iphone", "recorded_at"],
+        update_fields=_PRICE_FIELDS,
+    )
+
+
 def _write_records_to_db(
     df_clean: pd.DataFrame,
     source_name: str,
@@ -237,6 +294,12 @@ def _write_records_to_db(
     """
     将清洗后的 DataFrame 写入数据库
 
+    集合化写入：part_number / 店铺各一次 IN 查询解析，已存在的
+    (shop, iphone, recorded_at) 一次查询取回，新记录 bulk 插入、upsert 用 bulk_update；
+    批内按行顺序处理，统计结果与逐行写入一致。
+    dedupe=False 时同键的行不跳过而是覆盖价格：批内按键合并（后到的行为准），
+    库内已存在的键由 bulk upsert 覆盖，二者都计入 updated 而非 inserted。
+
     Returns:
         统计结果字典
     """
@@ -256,112 +319,147 @@ def _write_records_to_db(
     except Exception:
         batch_uuid = uuid.uuid4()
 
-    for idx, row in df_clean.iterrows():
+    # 1) 行级规范化
+    records = []
+    for idx, row in enumerate(df_clean.to_dict("records")):
         pn = str(row.get("part_number") or "").strip()
         shop_name = str(row.get("shop_name") or "").strip()
+        shop_address = row.get("shop_address")
+        shop_address = (shop_address or "").strip() if isinstance(shop_address, str) else ""
+        records.append((df_clean.index[idx], row, pn, shop_name, shop_address))
+
+    # 2) part_number / 店铺各一次 IN 查询
+    pns = {pn for _, _, pn, shop_name, _ in records if pn and shop_name}
+    iphones = {ip.part_number: ip for ip in Iphone.objects.filter(part_number__in=pns)}
+    shop_keys = {
+        (shop_name, addr) for _, _, pn, shop_name, addr in records if pn in iphones and shop_name
+    }
+    shops = _resolve_shops(shop_keys)
+
+    # 3) 逐行判定（纯内存）
+    rows = []
+    for idx, row, pn, shop_name, shop_address in records:
         if not pn or not shop_name:
             unmatched.append({
                 "row": int(idx),
                 "reason": "缺少 part_number 或 shop_name",
-                "data": row.to_dict()
+                "data": row
             })
             continue
 
-        iphone = Iphone.objects.filter(part_number=pn).first()
+        iphone = iphones.get(pn)
         if not iphone:
             unmatched.append({
                 "row": int(idx),
                 "reason": f"未找到 iPhone(PN={pn})",
-                "data": row.to_dict()
+                "data": row
             })
             continue
 
-        shop_address = row.get("shop_address")
-        shop_address = (shop_address or "").strip() if isinstance(shop_address, str) else ""
-        shop = SecondHandShop.objects.filter(name=shop_name, address=shop_address).first()
-        if not shop:
-            shop = SecondHandShop.objects.create(name=shop_name, address=shop_address)
-
-        price_new = _to_int_or_none(row.get("price_new"))
-        price_a = _to_int_or_none(row.get("price_grade_a"))
-        price_b = _to_int_or_none(row.get("price_grade_b"))
-
-        rec_at = row.get("recorded_at")
-        if not rec_at:
-            recorded_at = timezone.now()
-        else:
-            try:
-                recorded_at = pd.to_datetime(rec_at, utc=True, errors="coerce")
-                if pd.isna(recorded_at):
-                    recorded_at = timezone.now()
-                else:
-                    recorded_at = recorded_at.to_pydatetime()
-            except Exception:
-                recorded_at = timezone.now()
-
+        rows.append((
+            shops[(shop_name, shop_address)], iphone, pn, shop_name,
+            _to_int_or_none(row.get("price_new")),
+            _to_int_or_none(row.get("price_grade_a")),
+            _to_int_or_none(row.get("price_grade_b")),
+            _parse_recorded_at(row.get("recorded_at")),
+        ))
+
+    # 已存在记录：一次查询取回本批涉及的 (shop, iphone, recorded_at)
+    existing: Dict[tuple, PurchasingShopPriceRecord] = {}
+    if rows and not dry_run:
+        keys = {(s.pk, ip.pk, t) for s, ip, *_, t in rows}
+        times = [k[2] for k in keys]
+        qs = PurchasingShopPriceRecord.objects.filter(
+            shop_id__in={k[0] for k in keys},
+            iphone_id__in={k[1] for k in keys},
+            recorded_at__gte=min(times),
+            recorded_at__lte=max(times),
+        )
+        for rec in qs:
+            key = (rec.shop_id, rec.iphone_id, rec.recorded_at)
+            if key in keys:
+                existing[key] = rec
+
+    to_create: Dict[tuple, PurchasingShopPriceRecord] = {}
+    to_update: Dict[int, PurchasingShopPriceRecord] = {}
+    for shop, iphone, pn, shop_name, price_new, price_a, price_b, recorded_at in rows:
+        preview = {
+            "shop_name": shop_name,
+            "part_number": pn,
+            "price_new": price_new,
+            "price_grade_a": price_a,
+            "price_grade_b": price_b,
+            "recorded_at": str(recorded_at),
+            "batch_id": str(batch_uuid),
+        }
         if dry_run:
             inserted += 1
             if len(preview_rows) < 10:
-                preview_rows.append({
-                    "shop_name": shop_name,
-                    "part_number": pn,
-                    "price_new": price_new,
-                    "price_grade_a": price_a,
-                    "price_grade_b": price_b,
-                    "recorded_at": str(recorded_at),
-                    "batch_id": str(batch_uuid),
-                })
+                preview_rows.append(preview)
             continue
 
-        with transaction.atomic():
-            existed = None
-            if dedupe:
-                existed = PurchasingShopPriceRecord.objects.filter(
-                    shop=shop, iphone=iphone, recorded_at=recorded_at
-                ).first()
-
-            if existed:
-                if upsert:
-                    changed = False
-                    if price_new is not None and existed.price_new != price_new:
-                        existed.price_new = price_new
-                        changed = True
-                    if price_a is not None and existed.price_grade_a != price_a:
-                        existed.price_grade_a = price_a
-                        changed = True
-                    if price_b is not None and existed.price_grade_b != price_b:
-                        existed.price_grade_b = price_b
-                        changed = True
-                    if changed:
-                        existed.batch_id = batch_uuid
-                        existed.save(update_fields=["price_new", "price_grade_a", "price_grade_b", "batch_id"])
-                        updated += 1
-                    else:
-                        dedup_skipped += 1
+        key = (shop.pk, iphone.pk, recorded_at)
+        existed = None
+        if dedupe:
+            existed = existing.get(key) or to_create.get(key)
+
+        if existed:
+            if upsert:
+                changed = False
+                if price_new is not None and existed.price_new != price_new:
+                    existed.price_new = price_new
+                    changed = True
+                if price_a is not None and existed.price_grade_a != price_a:
+                    existed.price_grade_a = price_a
+                    changed = True
+                if price_b is not None and existed.price_grade_b != price_b:
+                    existed.price_grade_b = price_b
+                    changed = True
+                if changed:
+                    existed.batch_id = batch_uuid
+                    if existed.pk is not None:
+                        to_update[existed.pk] = existed
+                    updated += 1
                 else:
                     dedup_skipped += 1
             else:
-                rec = PurchasingShopPriceRecord.objects.create(
-                    shop=shop,
-                    iphone=iphone,
-                    price_new=price_new or 0,
-                    price_grade_a=price_a,
-                    price_grade_b=price_b,
-                    batch_id=batch_uuid,
-                )
-                PurchasingShopPriceRecord.objects.filter(pk=rec.pk).update(recorded_at=recorded_at)
+                dedup_skipped += 1
+        else:
+            rec = PurchasingShopPriceRecord(
+                shop=shop,
+                iphone=iphone,
+                price_new=price_new or 0,
+                price_grade_a=price_a,
+                price_grade_b=price_b,
+                recorded_at=recorded_at,
+                batch_id=batch_uuid,
+            )
+            if not dedupe and (key in existing or key in to_create):
+                # 同一 INSERT ... ON CONFLICT 里不能出现重复键，按键合并；覆盖的是已有记录
+                updated += 1
+            else:
                 inserted += 1
+            to_create[key] = rec
 
-                if len(preview_rows) < 10:
-                    preview_rows.append({
-                        "shop_name": shop_name,
-                        "part_number": pn,
-                        "price_new": price_new,
-                        "price_grade_a": price_a,
-                        "price_grade_b": price_b,
-                        "recorded_at": str(recorded_at),
-                        "batch_id": str(batch_uuid),
-                    })
+            if len(preview_rows) < 10:
+                preview_rows.append(preview)
+
+    # 4) 集合化落库
+    if not dry_run and (to_create or to_update):
+        with transaction.atomic():
+            _bulk_insert_price_records(list(to_create.values()))
+            if to_update:
+                PurchasingShopPriceRecord.objects.bulk_update(
+                    list(to_update.values()),
+                    _PRICE_FIELDS,
+                    batch_size=1000,
+                )
+        # 回补的历史记录使趋势缓存中已物化的桶失效
+        from AppleStockChecker.services.trend_cache import note_price_records
+        note_price_records(
+            (r.iphone_id, r.recorded_at)
+            for r in [*to_create.values(), *to_update.values()]
+        )
 
     return {
         "source": source_name,
@@ -0,0 +1,25 @@
+"""
+Minimal Django settings for the AppleStockChecker unit tests.
+
+Registers the app itself (models are importable) on an in-memory SQLite
+database.
+"""
+from __future__ import annotations
+
+import django
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(
+        DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+        INSTALLED_APPS=[
+            "django.contrib.contenttypes",
+            "django.contrib.auth",
+            "AppleStockChecker.apps.ApplestockcheckerConfig",
+        ],
+        DEFAULT_AUTO_FIELD="django.db.models.BigAutoField",
+        USE_TZ=True,
+        TIME_ZONE="Asia/Tokyo",
+        TREND_CACHE_ENABLED=False,
+    )
+    django.setup()
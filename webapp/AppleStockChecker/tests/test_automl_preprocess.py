@@ -0,0 +1,162 @@
+"""
+Tests for the columnar AutoML preprocessing engine (utils.automl_tasks.preprocess).
+
+With one price source per (shop, bucket) the engine must reproduce the
+per-job pandas implementation exactly; with mixed sources it keeps only
+the best source so (job, shop, bucket) stays unique.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from django.db import connection
+
+from AppleStockChecker.models import (
+    AutomlCausalJob,
+    AutomlPreprocessedSeries,
+    Iphone,
+    PurchasingShopTimeAnalysis,
+    SecondHandShop,
+)
+from AppleStockChecker.utils.automl_tasks import preprocess
+
+T0 = datetime(2025, 3, 1, tzinfo=timezone.utc)
+MODELS = [Iphone, SecondHandShop, PurchasingShopTimeAnalysis, AutomlCausalJob, AutomlPreprocessedSeries]
+
+
+def _synthetic(n=2000, seed=3):
+    rng = np.random.default_rng(seed)
+    shop = rng.integers(1, 5, n)
+    ts = T0 + pd.to_timedelta(rng.integers(0, 3 * 24 * 3600, n), unit="s")
+    new_price = rng.integers(100, 200, n) * 1000.0
+    new_price[rng.random(n) < 0.02] = 5000.0          # 异常价格
+    # 每家店固定一种来源：1→A 2→B 其余→NEW
+    price_a = np.where(shop == 1, new_price - 3000, np.nan)
+    price_b = np.where(shop == 2, new_price - 8000, np.nan)
+    return pd.DataFrame({
+        "shop_id": shop, "iphone_id": 1, "timestamp": ts,
+        "New_Product_Price": new_price, "Price_A": price_a, "Price_B": price_b,
+    })
+
+
+def _legacy(df: pd.DataFrame, bucket_freq: str) -> pd.DataFrame:
+    """原 run_preprocessing_for_job 的 CPU 路径"""
+    df = df.copy()
+    df["price"] = df["Price_A"].fillna(df["Price_B"]).fillna(df["New_Product_Price"])
+    df["price_source"] = "A"
+    df.loc[df["Price_A"].isna() & df["Price_B"].notna(), "price_source"] = "B"
+    df.loc[df["Price_A"].isna() & df["Price_B"].isna(), "price_source"] = "NEW"
+    df["bucket_ts"] = df["timestamp"].dt.floor(bucket_freq)
+    df = df[(df["price"] >= 10000) & (df["price"] <= 350000)]
+    agg = (
+        df.groupby(["shop_id", "iphone_id", "bucket_ts", "price_source"], as_index=False)
+          .agg(price=("price", "mean"))
+          .sort_values(["shop_id", "bucket_ts"])
+    )
+    agg["log_price"] = np.log(agg["price"])
+    agg["dlog_price"] = agg.groupby("shop_id", group_keys=False)["log_price"].diff()
+    stats = agg.groupby("shop_id")["dlog_price"].agg(["mean", "std"])
+    agg = agg.join(stats, on="shop_id")
+    agg["z_dlog_price"] = (agg["dlog_price"] - agg["mean"]) / agg["std"]
+    agg.loc[agg["std"] == 0, "z_dlog_price"] = 0.0
+    return agg.reset_index(drop=True)
+
+
+def _arrays(df: pd.DataFrame) -> preprocess.PstaArrays:
+    return preprocess.PstaArrays.from_columns(
+        pd.DatetimeIndex(df["timestamp"]).as_unit("ns").asi8, df["shop_id"],
+        df["New_Product_Price"], df["Price_A"], df["Price_B"],
+    )
+
+
+@pytest.mark.parametrize("bucket_freq", ["10min", "1h"])
+def test_windows_match_legacy(bucket_freq):
+    df = _synthetic()
+    data = _arrays(df)
+    for start_h, end_h in [(0, 72), (6, 30), (40, 41)]:
+        start, end = T0 + timedelta(hours=start_h), T0 + timedelta(hours=end_h)
+        window = df[(df["timestamp"] >= start) & (df["timestamp"] < end)]
+        expected = _legacy(window, bucket_freq)
+        got = preprocess.preprocess_window(
+            data, pd.Timestamp(start).value, pd.Timestamp(end).value, preprocess.bucket_ns_of(bucket_freq))
+
+        assert got.shop_id.tolist() == expected["shop_id"].tolist()
+        assert got.bucket_datetimes() == list(pd.DatetimeIndex(expected["bucket_ts"]).to_pydatetime())
+        assert got.source_labels().tolist() == expected["price_source"].tolist()
+        for ours, col in [(got.price, "price"), (got.log_price, "log_price"),
+                          (got.dlog_price, "dlog_price"), (got.z_dlog_price, "z_dlog_price")]:
+            np.testing.assert_allclose(ours, expected[col].to_numpy(), rtol=1e-10, atol=1e-12, equal_nan=True)
+
+
+def test_mixed_sources_keep_best_per_bucket():
+    ts = pd.DatetimeIndex([T0, T0 + timedelta(minutes=1), T0 + timedelta(minutes=2), T0 + timedelta(minutes=12)])
+    data = preprocess.PstaArrays.from_columns(
+        ts.as_unit("ns").asi8, [7, 7, 7, 7],
+        [150_000, 150_000, 150_000, 160_000],
+        [np.nan, 140_000, 142_000, np.nan],
+        [130_000, np.nan, np.nan, np.nan],
+    )
+    got = preprocess.preprocess_window(data, ts[0].value, ts[-1].value + 1, preprocess.bucket_ns_of("10min"))
+    assert got.source_labels().tolist() == ["A", "NEW"]
+    assert got.price.tolist() == [141_000.0, 160_000.0]
+    assert np.isnan(got.dlog_price[0]) and np.isnan(got.z_dlog_price[1])
+
+
+@pytest.fixture
+def db(monkeypatch):
+    from AppleStockChecker.tasks import automl_tasks
+
+    queued = []
+    monkeypatch.setattr(automl_tasks.run_var_for_job, "apply_async", lambda args, **kw: queued.append(args[0]))
+    with connection.schema_editor() as editor:
+        for model in MODELS:
+            editor.create_model(model)
+    yield queued
+    with connection.schema_editor() as editor:
+        for model in reversed(MODELS):
+            editor.delete_model(model)
+
+
+def test_preprocessing_task_writes_series(db):
+    from AppleStockChecker.tasks import automl_tasks
+
+    phone = Iphone.objects.create(part_number="P1", model_name="iPhone 16", capacity_gb=128,
+                                  color="Black", release_date=date(2024, 9, 20))
+    shops = [SecondHandShop.objects.create(name=f"s{i}", address="a") for i in range(2)]
+    for i in range(48):
+        for k, shop in enumerate(shops):
+            PurchasingShopTimeAnalysis.objects.create(
+                Job_ID="j", Original_Record_Time_Zone="+09:00", Timestamp_Time_Zone="+09:00",
+                Record_Time=T0, Timestamp_Time=T0 + timedelta(minutes=30 * i), Alignment_Time_Difference=0,
+                shop=shop, iphone=phone, New_Product_Price=150_000 + 500 * ((i * (k + 2)) % 7),
+                Price_A=140_000 if k == 0 else None,
+            )
+    jobs = [
+        AutomlCausalJob.objects.create(iphone=phone, window_start=T0 + timedelta(hours=h),
+                                       window_end=T0 + timedelta(hours=h + 12), bucket_freq="1h")
+        for h in (0, 6, 12)
+    ]
+    empty = AutomlCausalJob.objects.create(iphone=phone, window_start=T0 + timedelta(days=5),
+                                           window_end=T0 + timedelta(days=6), bucket_freq="1h")
+
+    out = [automl_tasks.run_preprocessing_for_job(j.pk) for j in jobs + [empty]]
+
+    # 有数据的 Job 各自触发 VAR 阶段
+    assert sorted(db) == [j.pk for j in jobs]
+    assert [r["status"] for r in out] == ["success"] * 3 + ["skipped"]
+    for job in jobs:
+        job.refresh_from_db()
+        assert job.preprocessing_status == AutomlCausalJob.StageStatus.SUCCESS
+        rows = AutomlPreprocessedSeries.objects.filter(job=job)
+        assert rows.count() == 24
+        assert set(rows.values_list("price_source", flat=True)) == {"A", "NEW"}
+    empty.refresh_from_db()
+    assert empty.preprocessing_status == AutomlCausalJob.StageStatus.SKIPPED
+
+    # 已成功的 Job 不会重算
+    again = automl_tasks.run_preprocessing_for_job(jobs[0].pk)
+    assert again == {"status": "already_done", "job_id": jobs[0].pk}
@@ -0,0 +1,80 @@
+"""
+Tests for the multi-shop batch entry point run_cleaners_parallel.
+"""
+from __future__ import annotations
+
+import os
+import time
+
+import pandas as pd
+import pytest
+
+from AppleStockChecker.utils.external_ingest import cleaner_tools, iphone_catalog, registry
+
+
+def _probe(df):
+    cat = iphone_catalog.get_iphone_catalog()
+    # 一半的行被正则匹配；同一行重复上报只计一次
+    for i in range(len(df) // 2):
+        cleaner_tools.note_regex_hit("probe", i)
+        cleaner_tools.note_regex_hit("probe", i)
+    return pd.DataFrame({
+        "part_number": [f"PN{i}" for i in range(len(df) // 2)],
+        "recorded_at": pd.Timestamp("2025-03-01", tz="UTC"),
+        "pid": os.getpid(),
+        "catalog_built_at": cat.built_at,
+    })
+
+
+def _boom(df):
+    raise ValueError("bad sheet")
+
+
+@pytest.fixture
+def fake_registry(monkeypatch):
+    empty = pd.DataFrame()
+    cat = iphone_catalog.IphoneCatalog(
+        version=iphone_catalog._version, built_at=time.monotonic(), info_df=empty, info_df_norm=empty,
+        jan_map={}, color_map={}, groups={}, synonyms={},
+    )
+    monkeypatch.setattr(iphone_catalog, "_catalog", cat)
+    monkeypatch.setattr(registry, "CLEANERS", {"shop_a": _probe, "shop_b": _probe, "shop_c": _boom})
+    return cat
+
+
+@pytest.mark.skipif(not registry._can_fork_pool(), reason="需要 fork")
+def test_parallel_workers_share_catalog(fake_registry):
+    jobs = [("shop_a", pd.DataFrame({"x": range(10)})),
+            ("shop-b", pd.DataFrame({"x": range(6)})),
+            ("shop_c", pd.DataFrame({"x": range(3)})),
+            ("shop_a", pd.DataFrame({"x": range(4)}))]
+
+    results, metrics = registry.run_cleaners_parallel(jobs, max_workers=3)
+
+    assert [m["cleaner"] for m in metrics] == ["shop_a", "shop-b", "shop_c", "shop_a"]
+    assert [(m["rows_in"], m["rows_out"]) for m in metrics] == [(10, 5), (6, 3), (3, 0), (4, 2)]
+    assert results[2] is None and metrics[2]["error"] == "ValueError: bad sheet"
+    assert [m["regex_hits"] for m in metrics] == [5, 3, 0, 2]
+    assert all(m["seconds"] >= 0 for m in metrics)
+
+    ok = [r for r in results if r is not None]
+    assert all(os.getpid() not in set(r["pid"]) for r in ok)
+    # 子进程继承父进程构建好的目录，没有各自重建
+    assert {float(r["catalog_built_at"].iat[0]) for r in ok} == {fake_registry.built_at}
+
+
+def test_single_worker_runs_in_process(fake_registry):
+    results, metrics = registry.run_cleaners_parallel([("shop_a", pd.DataFrame({"x": range(4)}))])
+    assert list(results[0]["pid"].unique()) == [os.getpid()]
+    assert metrics[0]["rows_out"] == 2 and metrics[0]["error"] is None
+    assert metrics[0]["regex_hits"] == 2
+
+
+def test_bench_command_matches_file_names():
+    from AppleStockChecker.management.commands.bench_cleaners import _match_cleaner
+
+    names = list(registry.CLEANERS)
+    assert _match_cleaner("shop5_2_20250301", names) == "shop5_2"
+    assert _match_cleaner("shop11-latest", names) == "shop11"
+    assert _match_cleaner("shop1", names) == "shop1"
+    assert _match_cleaner("shop19", names) is None
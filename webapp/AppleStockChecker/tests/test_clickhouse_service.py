@@ -0,0 +1,219 @@
+"""
+Tests for ClickHouseService columnar / row insert paths.
+
+A fake client records execute() calls, so no ClickHouse server is needed.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from AppleStockChecker.services.clickhouse_service import ClickHouseService
+
+
+class FakeClient:
+    def __init__(self, rows=()):
+        self.calls = []
+        self.rows = list(rows)
+        self.disconnected = False
+
+    def execute(self, query, data=None, **kwargs):
+        self.calls.append((query, data, kwargs))
+
+    def execute_iter(self, query, params=None, *, settings=None, chunk_size=1):
+        self.calls.append((query, params, {"settings": settings, "chunk_size": chunk_size}))
+        return (self.rows[i:i + chunk_size] for i in range(0, len(self.rows), chunk_size))
+
+    def disconnect(self):
+        self.disconnected = True
+
+
+def _service() -> ClickHouseService:
+    svc = ClickHouseService()
+    svc._client = FakeClient()
+    return svc
+
+
+@pytest.fixture
+def features_df() -> pd.DataFrame:
+    buckets = pd.date_range("2025-03-01 09:00", periods=5, freq="15min", tz="Asia/Tokyo")
+    return pd.DataFrame({
+        "bucket": buckets,
+        "scope": ["iphone:1"] * 5,
+        "mean": [1.0, 2.0, 3.0, 4.0, 5.0],
+        "std": [0.5, np.nan, 0.1, np.nan, 0.2],
+        "shop_count": np.array([3, 4, 5, 6, 7], dtype=np.int64),
+    })
+
+
+def test_features_columnar_chunks(features_df):
+    svc = _service()
+    n = svc._insert_columns("features_wide", {
+        "a": np.arange(5), "b": np.arange(5) * 2,
+    }, columnar=True, block_rows=2)
+    assert n == 5
+    calls = svc.client.calls
+    assert [len(c[1][0]) for c in calls] == [2, 2, 1]
+    assert all(c[2] == {"columnar": True, "settings": {"use_numpy": True}} for c in calls)
+    stats = svc.last_insert_stats
+    assert stats["rows"] == 5 and stats["mode"] == "columnar"
+    assert [c["rows"] for c in stats["chunks"]] == [2, 2, 1]
+
+
+def test_features_columnar_nulls_and_tz(features_df):
+    svc = _service()
+    assert svc.insert_features(features_df, "live", columnar=True) == 5
+    query, block, _ = svc.client.calls[0]
+    assert query == "INSERT INTO features_wide (run_id, bucket, scope, mean, std, shop_count) VALUES"
+    run_id, bucket, scope, mean, std, shop_count = block
+    assert list(run_id) == ["live"] * 5
+    # tz 去掉后保留东京墙上时间
+    assert bucket[0] == np.datetime64("2025-03-01T09:00:00")
+    assert mean.dtype == np.float64
+    # 浮点列不转 object, NaN 由驱动按 pd.isnull 写成 NULL
+    assert std.dtype == np.float64
+    assert list(pd.isnull(std)) == [False, True, False, True, False]
+    assert shop_count.dtype == np.int64
+
+
+def test_row_mode_matches_legacy_dicts(features_df):
+    svc = _service()
+    svc.insert_features(features_df, "live", columnar=False)
+    _, rows, kwargs = svc.client.calls[0]
+    assert kwargs == {}
+    assert rows[1] == ("live", datetime(2025, 3, 1, 9, 15), "iphone:1", 2.0, None, 4)
+    assert all(type(r[5]) is int for r in rows)
+
+
+def test_price_aligned_nullable_ints():
+    df = pd.DataFrame({
+        "bucket": pd.date_range("2025-03-01", periods=3, freq="15min", tz="Asia/Tokyo"),
+        "shop_id": [1, 1, 2],
+        "iphone_id": [7, 8, 7],
+        "price_new": [150000.0, 160000.0, 170000.0],
+        "price_a": [149000.0, np.nan, 168000.0],
+        "price_b": [np.nan, np.nan, np.nan],
+        "alignment_diff_sec": [10, 20, 30],
+        "record_time": pd.date_range("2025-03-01 00:00:10", periods=3, freq="15min", tz="Asia/Tokyo"),
+    })
+    for columnar in (True, False):
+        svc = _service()
+        assert svc.insert_price_aligned(df, "r1", columnar=columnar) == 3
+        data = svc.client.calls[0][1]
+        if columnar:
+            price_a = list(data[5])
+        else:
+            price_a = [r[5] for r in data]
+        assert price_a == [149000, None, 168000]
+        assert all(v is None or type(v) is int for v in price_a)
+
+
+def test_empty_frame():
+    svc = _service()
+    assert svc.insert_features(pd.DataFrame(), "live") == 0
+    assert svc.client.calls == []
+
+
+def test_iter_features_tall_pivots_in_clickhouse():
+    rows = [(datetime(2025, 3, 1, 9, 0), "iphone:1", "ema_30", float(i)) for i in range(5)]
+    svc = _service()
+    svc._client = FakeClient(rows)
+
+    chunks = list(svc.iter_features_tall(
+        columns=["ema_30", "mean", "ema_30", "bad col;"], scope_in=["iphone:1"],
+        bucket_gte=pd.Timestamp("2025-03-01 09:00", tz="Asia/Tokyo"), ordering="-bucket", chunk_rows=2,
+    ))
+
+    assert [len(c) for c in chunks] == [2, 2, 1]
+    query, params, kwargs = svc.client.calls[0]
+    assert "ARRAY JOIN arrayFilter(" in query
+    assert "[('ema_30', CAST(`ema_30`, 'Nullable(Float64)')), ('mean', CAST(`mean`, 'Nullable(Float64)'))]" in query
+    assert "bad col" not in query
+    assert query.endswith("ORDER BY bucket DESC, scope ASC")
+    assert params == {"run_id": "live", "scope_in": ["iphone:1"], "b_gte": datetime(2025, 3, 1, 9, 0)}
+    assert kwargs == {"settings": {"max_block_size": 2}, "chunk_size": 2}
+    assert not svc.client.disconnected
+
+
+def test_iter_features_tall_disconnects_when_abandoned():
+    svc = _service()
+    svc._client = FakeClient([(datetime(2025, 3, 1), "iphone:1", "mean", 1.0)] * 10)
+    chunks = svc.iter_features_tall(columns=["mean"], chunk_rows=3)
+    next(chunks)
+    chunks.close()
+    assert svc.client.disconnected
+    assert list(svc.iter_features_tall(columns=["1x"])) == []
+
+
+def test_query_latest_features_one_round_trip():
+    class LatestClient(FakeClient):
+        def execute(self, query, data=None, **kwargs):
+            super().execute(query, data, **kwargs)
+            return (
+                [(datetime(2025, 3, 1, 9, 45), "iphone:1", 1.5), (datetime(2025, 3, 1, 9, 30), "iphone:2", 2.5)],
+                [("bucket", "DateTime"), ("scope", "String"), ("mean", "Float64")],
+            )
+
+    svc = _service()
+    svc._client = LatestClient()
+    assert svc.query_latest_features(scopes=[]) == {}
+    out = svc.query_latest_features(scopes=["iphone:1", "iphone:2", "iphone:3"], columns=["mean"])
+
+    assert out["iphone:2"] == {"bucket": datetime(2025, 3, 1, 9, 30), "scope": "iphone:2", "mean": 2.5}
+    assert set(out) == {"iphone:1", "iphone:2"}
+    (query, params, _), = svc.client.calls
+    assert query.endswith("ORDER BY scope ASC, bucket DESC LIMIT 1 BY scope")
+    assert params["scope_in"] == ["iphone:1", "iphone:2", "iphone:3"]
+
+
+def test_pooled_client_bounds_connections():
+    import threading
+    import time
+
+    from AppleStockChecker.services.clickhouse_service import PooledClient
+
+    made = []
+
+    class SlowClient(FakeClient):
+        def execute(self, query, data=None, **kwargs):
+            time.sleep(0.02)
+            return [(len(made),)]
+
+    def factory():
+        made.append(SlowClient())
+        return made[-1]
+
+    pool = PooledClient(max_size=2, timeout=5, factory=factory)
+    threads = [threading.Thread(target=pool.execute, args=("SELECT 1",)) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    stats = pool.stats()
+    assert len(made) == 2 and stats["created"] == 2
+    assert stats["checkouts"] == 6 and stats["waits"] >= 1
+    assert stats["max_in_use"] == 2 and stats["in_use"] == 0 and stats["idle"] == 2
+
+
+def test_pooled_client_releases_abandoned_stream():
+    from AppleStockChecker.services.clickhouse_service import PooledClient
+
+    conn = FakeClient([(datetime(2025, 3, 1), "iphone:1", "mean", 1.0)] * 10)
+    pool = PooledClient(max_size=1, timeout=0.01, factory=lambda: conn)
+    svc = ClickHouseService()
+    svc._client = pool
+
+    chunks = svc.iter_features_tall(columns=["mean"], chunk_rows=4)
+    next(chunks)
+    assert pool.stats()["in_use"] == 1
+    with pytest.raises(TimeoutError):
+        pool.execute("SELECT 1")
+    chunks.close()
+
+    assert conn.disconnected
+    assert pool.stats()["in_use"] == 0 and pool.stats()["timeouts"] == 1
+    pool.execute("SELECT 1")  # 连接已归还
@@ -0,0 +1,120 @@
+"""
+Tests for engine.aggregate vectorized kernels.
+
+Each kernel is checked against the original per-element loop in
+engine.reference on synthetic integer-yen price tensors.
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from AppleStockChecker.engine import reference
+from AppleStockChecker.engine.aggregate import (
+    PriceTensor,
+    _mad_filter_median_dim1,
+    _nanmedian_dim1,
+    aggregate_cross_shop,
+    apply_dynamic_price_filter,
+)
+
+
+def _make_tensor(n_i=6, n_s=9, n_b=80, *, nan_ratio=0.3, outlier_ratio=0.05, seed=0) -> PriceTensor:
+    rng = np.random.default_rng(seed)
+    base = rng.uniform(110_000, 300_000, size=(n_i, 1, 1))
+    walk = rng.normal(0, 2_000, size=(n_i, 1, n_b)).cumsum(axis=2)
+    prices = np.round(base + walk + rng.normal(0, 3_000, size=(n_i, n_s, n_b)), -2)
+    outliers = rng.random(prices.shape) < outlier_ratio
+    prices[outliers] *= rng.choice([0.5, 0.85, 1.15, 1.6], size=int(outliers.sum()))
+    prices[rng.random(prices.shape) < nan_ratio] = np.nan
+    return PriceTensor(
+        data=torch.tensor(prices, dtype=torch.float64),
+        iphone_ids=np.arange(n_i),
+        shop_ids=np.arange(n_s),
+        bucket_index=pd.date_range("2025-01-01", periods=n_b, freq="15min"),
+    )
+
+
+def _same(a: torch.Tensor, b: torch.Tensor) -> bool:
+    return torch.equal(torch.isnan(a), torch.isnan(b)) and torch.equal(
+        torch.nan_to_num(a), torch.nan_to_num(b),
+    )
+
+
+# ── apply_dynamic_price_filter ───────────────────────────────────────
+
+class TestDynamicPriceFilter:
+    @pytest.mark.parametrize("seed", range(5))
+    def test_matches_loop(self, seed):
+        t = _make_tensor(seed=seed)
+        out = apply_dynamic_price_filter(t).data
+        assert _same(out, reference.apply_dynamic_price_filter_loop(t.data))
+
+    @pytest.mark.parametrize("lookback,min_samples", [(0, 3), (1, 1), (3, 5), (4, 50)])
+    def test_matches_loop_params(self, lookback, min_samples):
+        t = _make_tensor(seed=7, nan_ratio=0.6)
+        kw = dict(lookback_buckets=lookback, min_samples=min_samples, tolerance=0.05)
+        out = apply_dynamic_price_filter(t, **kw).data
+        assert _same(out, reference.apply_dynamic_price_filter_loop(t.data, **kw))
+
+    def test_sequential_fallback(self):
+        """max_sweeps 不足时从首个未收敛桶串行补算, 结果仍一致。"""
+        t = _make_tensor(seed=3, outlier_ratio=0.2)
+        out = apply_dynamic_price_filter(t, tolerance=0.03, max_sweeps=1).data
+        assert _same(out, reference.apply_dynamic_price_filter_loop(t.data, tolerance=0.03))
+
+    def test_fallback_range_when_few_samples(self):
+        data = torch.full((1, 2, 2), float("nan"), dtype=torch.float64)
+        data[0, :, 0] = torch.tensor([90_000.0, 200_000.0])
+        data[0, :, 1] = torch.tensor([400_000.0, 210_000.0])
+        t = PriceTensor(data=data, iphone_ids=np.array([1]), shop_ids=np.array([1, 2]),
+                        bucket_index=pd.date_range("2025-01-01", periods=2, freq="15min"))
+        out = apply_dynamic_price_filter(t).data
+        assert torch.isnan(out[0, 0, 0]) and torch.isnan(out[0, 0, 1])
+        assert out[0, 1, 0] == 200_000.0 and out[0, 1, 1] == 210_000.0
+
+    def test_input_not_modified(self):
+        t = _make_tensor(seed=1)
+        before = t.data.clone()
+        apply_dynamic_price_filter(t)
+        assert _same(t.data, before)
+
+
+# ── MAD filter + nanmedian ───────────────────────────────────────────
+
+class TestMadFilterMedian:
+    @pytest.mark.parametrize("seed", range(5))
+    def test_matches_loop(self, seed):
+        data = _make_tensor(n_s=11, seed=seed, nan_ratio=0.4, outlier_ratio=0.1).data
+        filtered, median = _mad_filter_median_dim1(data)
+        expected = reference.mad_filter_dim1_loop(data)
+        assert _same(filtered, expected)
+        assert _same(median, reference.nanmedian_dim1_loop(expected))
+
+    def test_small_counts_and_zero_mad(self):
+        nan = float("nan")
+        data = torch.tensor([[
+            [nan, 5.0, 1.0, 1.0, 7.0],
+            [nan, nan, 1.0, 1.0, 7.0],
+            [nan, nan, 1.0, 1.0, 9.0],
+            [nan, nan, nan, 1.0, 8.0],
+            [nan, nan, nan, 90.0, 400.0],
+        ]], dtype=torch.float64)
+        filtered, median = _mad_filter_median_dim1(data)
+        expected = reference.mad_filter_dim1_loop(data)
+        assert _same(filtered, expected)
+        assert _same(median, reference.nanmedian_dim1_loop(expected))
+
+    def test_nanmedian_matches_loop(self):
+        data = _make_tensor(n_s=10, seed=11, nan_ratio=0.5).data
+        assert _same(_nanmedian_dim1(data), reference.nanmedian_dim1_loop(data))
+
+    def test_aggregate_cross_shop_median(self):
+        t = _make_tensor(n_s=12, seed=2, outlier_ratio=0.1)
+        agg = aggregate_cross_shop(t)
+        filtered = reference.mad_filter_dim1_loop(t.data)
+        assert _same(agg.median, reference.nanmedian_dim1_loop(filtered))
+        assert torch.equal(agg.shop_count, (~torch.isnan(filtered)).sum(dim=1))
@@ -0,0 +1,122 @@
+"""
+Tests for engine.features vectorized kernels (EMA scan, forward-fill).
+
+Compared against the original per-bucket recurrences in engine.reference.
+"""
+from __future__ import annotations
+
+import math
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from AppleStockChecker.engine import reference
+from AppleStockChecker.engine.features import (
+    FeatureState,
+    _ema_scan,
+    _forward_fill_1d,
+    compute_all_features,
+    compute_all_features_skipnan,
+    compute_ema_batch,
+    compute_ema_batch_skipnan,
+    compute_ema_halflife_batch,
+    compute_ema_halflife_batch_skipnan,
+)
+
+
+def _series(n_rows=7, n_cols=300, *, nan_ratio=0.2, leading_nan=True, seed=0) -> torch.Tensor:
+    rng = np.random.default_rng(seed)
+    vals = np.round(150_000 + rng.normal(0, 800, size=(n_rows, n_cols)).cumsum(axis=1), -1)
+    vals[rng.random(vals.shape) < nan_ratio] = np.nan
+    if leading_nan:
+        vals[0, :5] = np.nan
+        vals[1, :] = np.nan
+    return torch.tensor(vals, dtype=torch.float64)
+
+
+def _close(a: torch.Tensor, b: torch.Tensor) -> bool:
+    return torch.equal(torch.isnan(a), torch.isnan(b)) and torch.allclose(
+        torch.nan_to_num(a), torch.nan_to_num(b), rtol=1e-12, atol=1e-6,
+    )
+
+
+# ── _forward_fill_1d ─────────────────────────────────────────────────
+
+def test_forward_fill_matches_loop():
+    s = _series(nan_ratio=0.5)
+    assert torch.equal(
+        torch.nan_to_num(_forward_fill_1d(s), nan=-1.0),
+        torch.nan_to_num(reference.forward_fill_1d_loop(s), nan=-1.0),
+    )
+
+
+# ── EMA ──────────────────────────────────────────────────────────────
+
+@pytest.mark.parametrize("window", [2, 4, 8, 60, 120])
+def test_ema_matches_loop(window):
+    s = reference.forward_fill_1d_loop(_series(seed=window))
+    alpha = 2.0 / (window + 1.0)
+    assert _close(compute_ema_batch(s, window), reference.ema_loop(s, alpha))
+
+
+@pytest.mark.parametrize("window", [2, 8, 120])
+def test_ema_skipnan_matches_loop(window):
+    s = _series(seed=window, nan_ratio=0.3)
+    alpha = 2.0 / (window + 1.0)
+    assert _close(compute_ema_batch_skipnan(s, window), reference.ema_skipnan_loop(s, alpha))
+
+
+@pytest.mark.parametrize("hl", [2, 4])
+def test_ema_halflife_matches_loop(hl):
+    s = _series(seed=hl, nan_ratio=0.3)
+    alpha = 1.0 - math.exp(-math.log(2) / hl)
+    assert _close(compute_ema_halflife_batch(s, hl), reference.ema_loop(s, alpha))
+    assert _close(compute_ema_halflife_batch_skipnan(s, hl), reference.ema_skipnan_loop(s, alpha))
+
+
+@pytest.mark.parametrize("chunk", [1, 3, 16, 1000])
+def test_ema_chunk_size_invariant(chunk):
+    s = _series(n_cols=97, seed=5)
+    for skipnan, ref in ((False, reference.ema_loop), (True, reference.ema_skipnan_loop)):
+        out = _ema_scan(s, 0.2, skipnan=skipnan, chunk=chunk)
+        assert _close(out, ref(s, 0.2))
+
+
+def test_ema_skipnan_reinit():
+    nan = float("nan")
+    s = torch.tensor([[nan, 10.0, 20.0, nan, 30.0, 40.0]], dtype=torch.float64)
+    out = compute_ema_batch_skipnan(s, 3)  # alpha = 0.5
+    expected = torch.tensor([[nan, 10.0, 15.0, nan, 30.0, 35.0]], dtype=torch.float64)
+    assert _close(out, expected)
+
+
+@pytest.mark.parametrize("fn", [compute_all_features, compute_all_features_skipnan])
+@pytest.mark.parametrize("sizes", [[128] * 5 + [60], [256, 384, 60], [640, 60]])
+def test_stateful_features_bit_identical(fn, sizes):
+    series = _series(n_cols=sum(sizes), seed=3)
+    full = fn(series)
+
+    state, outs, pos = FeatureState(), [], 0
+    for n in sizes:
+        outs.append(fn(series[:, pos:pos + n], state=state))
+        pos += n
+
+    assert state.n_seen == series.shape[1]
+    assert state.tail.shape[1] == 120
+    for name, expected in full.items():
+        got = torch.cat([o[name] for o in outs], dim=1)
+        assert torch.equal(torch.nan_to_num(got, nan=-1.0), torch.nan_to_num(expected, nan=-1.0)), name
+
+
+def test_stateful_features_unaligned_steps_close():
+    series = _series(n_cols=400, seed=5)
+    full = compute_all_features(series)
+
+    state, outs = FeatureState(), []
+    for pos in range(0, 400, 7):
+        outs.append(compute_all_features(series[:, pos:pos + 7], state=state))
+
+    for name, expected in full.items():
+        assert _close(torch.cat([o[name] for o in outs], dim=1), expected), name
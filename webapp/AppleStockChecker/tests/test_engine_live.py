@@ -0,0 +1,97 @@
+"""
+Tests for the incremental live-tail pipeline (engine.live.run_live_tail).
+
+Hourly ticks over synthetic PG records must reproduce the in-memory
+pipeline run over the same range, with state persisted in
+PipelineLiveState between ticks.
+"""
+from __future__ import annotations
+
+import io
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from django.db import connection
+
+from AppleStockChecker.engine import cohorts, pipeline, reader
+from AppleStockChecker.engine.live import run_live_tail
+from AppleStockChecker.models import PipelineLiveState
+from AppleStockChecker.services import clickhouse_service
+
+from .test_engine_pipeline_stream import COHORTS, PROFILES, FakeCH, _records
+
+
+@pytest.fixture
+def live_env(monkeypatch):
+    with connection.schema_editor() as editor:
+        editor.create_model(PipelineLiveState)
+
+    records = _records()
+    sinks = []
+
+    def _utc(value):
+        ts = pd.Timestamp(value)
+        return ts.tz_localize("UTC") if ts.tzinfo is None else ts
+
+    def fake_read(date_from, date_to, *, shop_ids=None, iphone_ids=None):
+        df = records[(records["recorded_at"] >= _utc(date_from)) & (records["recorded_at"] < _utc(date_to))]
+        return df.rename(columns={"price_grade_a": "price_a", "price_grade_b": "price_b"}).reset_index(drop=True)
+
+    def fake_axes(date_from, date_to, *, shop_ids=None, iphone_ids=None):
+        df = fake_read(date_from, date_to)
+        return np.unique(df["iphone_id"].to_numpy()), np.unique(df["shop_id"].to_numpy())
+
+    def fake_service():
+        sinks.append(FakeCH())
+        return sinks[-1]
+
+    monkeypatch.setattr(reader, "read_price_records", fake_read)
+    monkeypatch.setattr(reader, "read_price_axes", fake_axes)
+    monkeypatch.setattr(clickhouse_service, "ClickHouseService", fake_service)
+    monkeypatch.setattr(cohorts, "load_shop_weight_profiles", lambda: PROFILES)
+    monkeypatch.setattr(cohorts, "load_cohort_configs", lambda: COHORTS)
+    yield sinks
+
+    with connection.schema_editor() as editor:
+        editor.delete_model(PipelineLiveState)
+
+
+def test_live_tail_matches_full_run(live_env):
+    start = datetime(2025, 3, 3, 0, 5, tzinfo=timezone.utc)
+    ticks = [run_live_tail(now=start + timedelta(hours=h), bootstrap_days=10) for h in range(25)]
+
+    assert ticks[0]["bootstrap"]
+    assert ticks[0]["last_bucket"] == "2025-03-02T23:45:00+00:00"
+    # iPhone 14 首次出现 (第 200 桶) 时只扩展轴, 不重新 bootstrap; 每个 tick 只处理新桶
+    assert [t["bootstrap"] for t in ticks].count(True) == 1
+    assert [t["new_axes"]["iphones"] for t in ticks if t.get("new_axes", {}).get("iphones")] == [[14]]
+    assert all(t["aligned_rows"] < 200 for t in ticks if not t["bootstrap"])
+    assert run_live_tail(now=start + timedelta(hours=24, minutes=5))["status"] == "up_to_date"
+
+    row = PipelineLiveState.objects.get(run_id="live")
+    # 状态不含 pickle
+    np.load(io.BytesIO(bytes(row.state_blob)), allow_pickle=False)["meta"]
+    assert row.last_bucket == datetime(2025, 3, 3, 23, 45, tzinfo=timezone.utc)
+    assert row.meta_json["n_scope_groups"] > 10
+
+    live = pd.concat([df for sink in live_env for df in sink.features], ignore_index=True)
+    live = live.drop_duplicates(["scope", "bucket"], keep="last")
+    live = live.sort_values(["scope", "bucket"]).reset_index(drop=True)
+
+    pipeline.run("full", date(2025, 3, 1), date(2025, 3, 4), batch_days=1)
+    full = pd.concat(live_env[-1].features, ignore_index=True)
+    full = full.sort_values(["scope", "bucket"]).reset_index(drop=True)
+
+    assert set(live.columns) == set(full.columns)
+    # cohort late 的唯一成员是 iPhone 14: 整段重算时该组从第一桶起就存在 (前段全 NaN,
+    # ffill 模式 EMA 全为 NaN); live tail 扩轴后该组在首个有数据的桶才建立状态
+    late = live["scope"].str.contains("cohort:late")
+    assert live.loc[late, "ema_30"].notna().any()
+    live = live[~late].reset_index(drop=True)
+    full = full[~full["scope"].str.contains("cohort:late")].reset_index(drop=True)
+    pd.testing.assert_frame_equal(live[full.columns], full, check_exact=False, atol=0.011, rtol=0)
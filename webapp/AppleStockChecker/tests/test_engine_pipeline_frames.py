@@ -0,0 +1,121 @@
+"""
+Tests for the columnar features_wide frame assembly in engine.pipeline.
+
+Each writer is compared against the original row-dict assembly kept in
+engine.reference; frames must be identical (values, dtypes, column order).
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from django.test import override_settings
+
+from AppleStockChecker.engine import reference
+from AppleStockChecker.engine.aggregate import PriceTensor, aggregate_cross_shop
+from AppleStockChecker.engine.cohorts import CohortConfig, ShopWeightProfileConfig
+from AppleStockChecker.engine.features import compute_all_features
+from AppleStockChecker.engine.pipeline import (
+    _agg_to_features_df,
+    _per_profile_cohort_features_df,
+    _per_profile_features_df,
+    _per_shop_cohort_features_df,
+    _per_shop_features_df,
+    _round_like_python,
+)
+
+
+@pytest.fixture(scope="module")
+def tensor() -> PriceTensor:
+    rng = np.random.default_rng(42)
+    n_i, n_s, n_b = 4, 5, 150
+    base = rng.uniform(110_000, 300_000, size=(n_i, 1, 1))
+    prices = np.round(base + rng.normal(0, 3_000, size=(n_i, n_s, n_b)), -2)
+    prices[rng.random(prices.shape) < 0.35] = np.nan
+    prices[:, 4, :] = np.nan  # 整店无数据
+    prices[3, :, :20] = np.nan
+    return PriceTensor(
+        data=torch.tensor(prices, dtype=torch.float64),
+        iphone_ids=np.array([11, 12, 13, 14]),
+        shop_ids=np.array([1, 2, 3, 4, 5]),
+        bucket_index=pd.date_range("2025-03-01", periods=n_b, freq="15min", tz="Asia/Tokyo"),
+    )
+
+
+PROFILES = [
+    ShopWeightProfileConfig(slug="full_store", items=[
+        {"shop_id": 1, "weight": 1.0}, {"shop_id": 2, "weight": 2.0}, {"shop_id": 3, "weight": 0.5},
+    ]),
+    ShopWeightProfileConfig(slug="top2", items=[{"shop_id": 2, "weight": 1.0}, {"shop_id": 4, "weight": 1.0}]),
+    ShopWeightProfileConfig(slug="missing", items=[{"shop_id": 99, "weight": 1.0}]),
+]
+
+COHORTS = [
+    CohortConfig(cohort_id=1, slug="pro", members=[{"iphone_id": 11, "weight": 1.0}, {"iphone_id": 13, "weight": 3.0}]),
+    CohortConfig(cohort_id=2, slug="late", members=[{"iphone_id": 14, "weight": 1.0}]),
+    CohortConfig(cohort_id=3, slug="empty", members=[{"iphone_id": 99, "weight": 1.0}]),
+]
+
+
+@pytest.mark.parametrize("skipnan", [False, True])
+def test_per_shop(tensor, skipnan):
+    pd.testing.assert_frame_equal(
+        _per_shop_features_df(tensor, skipnan=skipnan),
+        reference.per_shop_features_df_loop(tensor, skipnan=skipnan),
+        check_exact=True,
+    )
+
+
+def test_agg(tensor):
+    agg = aggregate_cross_shop(tensor)
+    feats = compute_all_features(agg.mean)
+    pd.testing.assert_frame_equal(
+        _agg_to_features_df(agg, feats),
+        reference.agg_to_features_df_loop(agg, feats),
+        check_exact=True,
+    )
+
+
+@override_settings(IPHONE_OFFICIAL_PRICES={11: 159_800, 12: 0, 14: 229_800})
+@pytest.mark.parametrize("skipnan", [False, True])
+def test_per_profile_with_logb(tensor, skipnan):
+    new = _per_profile_features_df(tensor, PROFILES, skipnan=skipnan)
+    assert "logb_30" in new.columns
+    pd.testing.assert_frame_equal(
+        new, reference.per_profile_features_df_loop(tensor, PROFILES, skipnan=skipnan),
+        check_exact=True,
+    )
+
+
+@pytest.mark.parametrize("skipnan", [False, True])
+def test_cohort_frames(tensor, skipnan):
+    pd.testing.assert_frame_equal(
+        _per_shop_cohort_features_df(tensor, COHORTS, skipnan=skipnan),
+        reference.per_shop_cohort_features_df_loop(tensor, COHORTS, skipnan=skipnan),
+        check_exact=True,
+    )
+    pd.testing.assert_frame_equal(
+        _per_profile_cohort_features_df(tensor, PROFILES, COHORTS, skipnan=skipnan),
+        reference.per_profile_cohort_features_df_loop(tensor, PROFILES, COHORTS, skipnan=skipnan),
+        check_exact=True,
+    )
+
+
+def test_empty_inputs(tensor):
+    empty = PriceTensor(
+        data=torch.full((2, 2, 3), float("nan"), dtype=torch.float64),
+        iphone_ids=np.array([1, 2]), shop_ids=np.array([1, 2]),
+        bucket_index=pd.date_range("2025-03-01", periods=3, freq="15min"),
+    )
+    assert _per_shop_features_df(empty).empty
+    assert _per_shop_cohort_features_df(tensor, []).empty
+
+
+def test_round_like_python_ties():
+    vals = np.array([2.675, 1.005, 0.125, 0.375, -2.5, 150_000.005, 1e15 + 0.5, np.nan, 123.456])
+    got = _round_like_python(vals, 2)
+    expected = [round(float(v), 2) for v in vals]
+    np.testing.assert_array_equal(got, np.array(expected))
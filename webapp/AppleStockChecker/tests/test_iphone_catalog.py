@@ -0,0 +1,57 @@
+"""
+Tests for the process-level iPhone catalog shared by the shop cleaners.
+"""
+from __future__ import annotations
+
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from AppleStockChecker.models import Iphone
+from AppleStockChecker.utils.external_ingest import cleaner_tools, iphone_catalog
+
+
+@pytest.fixture
+def catalog_db():
+    with connection.schema_editor() as editor:
+        editor.create_model(Iphone)
+    iphone_catalog.invalidate_iphone_catalog()
+    for i, (color, jan) in enumerate([("ブラック", "4549995536515"), ("ホワイト", None)]):
+        for cap in (256, 512):
+            Iphone.objects.create(part_number=f"PN{cap}{i}", model_name="iPhone 17 Pro", capacity_gb=cap,
+                                  color=color, jan=jan and str(int(jan) + cap), release_date=date(2025, 9, 19))
+    yield
+    with connection.schema_editor() as editor:
+        editor.delete_model(Iphone)
+    iphone_catalog.invalidate_iphone_catalog()
+
+
+def test_catalog_built_once_and_invalidated_on_save(catalog_db):
+    cat = iphone_catalog.get_iphone_catalog()
+    assert sorted(cat.groups[("iPhone 17 Pro", 256)]) == ["PN2560", "PN2561"]
+    assert cat.color_map[("iPhone 17 Pro", 512)]["ホワイト"] == ("PN5121", "ホワイト")
+    assert cat.jan_map == {"4549995536771": "PN2560", "4549995537027": "PN5120"}
+    assert "model_name_norm" in cat.frame(add_model_norm=True).columns
+    assert "model_name_norm" not in cat.info_df.columns
+
+    df = pd.DataFrame({"JAN": ["4549995536771", "0"], "price": ["150,000円", "1"], "time-scraped": [None, None]})
+    with CaptureQueriesContext(connection) as ctx:
+        out = cleaner_tools.clean_with_jan_matching(
+            df, cleaner_name="t", shop_name="t", iter_records_fn=lambda d: d.to_dict("records"),
+        )
+    assert len(ctx.captured_queries) == 0
+    assert out["part_number"].tolist() == ["PN2560"]
+
+    Iphone.objects.filter(part_number="PN5121").update(color="シルバー")
+    assert iphone_catalog.get_iphone_catalog() is cat
+
+    Iphone.objects.create(part_number="PN10240", model_name="iPhone 17 Pro", capacity_gb=1024,
+                          color="ブラック", release_date=date(2025, 9, 19))
+    fresh = iphone_catalog.get_iphone_catalog()
+    assert fresh.version > cat.version
+    assert fresh.groups[("iPhone 17 Pro", 1024)] == ["PN10240"]
+    assert "シルバー" in fresh.color_map[("iPhone 17 Pro", 512)]
@@ -0,0 +1,100 @@
+"""
+Tests for the persistent LLM extraction cache, against a fake local model server.
+"""
+from __future__ import annotations
+
+import json
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+from django.test import override_settings
+
+from AppleStockChecker.utils.external_ingest import cleaner_tools, llm_cache
+
+
+class FakeModel:
+    """只认 /api/generate 的假 Ollama：记录请求数"""
+
+    def __init__(self):
+        self.requests = 0
+        self.lock = threading.Lock()
+        model = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with model.lock:
+                    model.requests += 1
+                label = body["prompt"].split(":")[0]
+                out = json.dumps({"label": label, "delta": -1000 * len(label)}).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/api/generate"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def extract(self, *, text_or_documents, prompt_description, examples, model_id=None, **kw):
+        req = urllib.request.Request(self.url, data=json.dumps({"prompt": text_or_documents}).encode())
+        data = json.loads(urllib.request.urlopen(req, timeout=5).read())
+        return SimpleNamespace(text=text_or_documents, extractions=[SimpleNamespace(
+            extraction_class="color_delta", extraction_text=data["label"],
+            attributes={"delta_yen": data["delta"]}, extraction_index=1,
+            char_interval=SimpleNamespace(start_pos=0, end_pos=len(data["label"])),
+        )])
+
+
+@pytest.fixture
+def model(monkeypatch, tmp_path):
+    fake = FakeModel()
+    monkeypatch.setattr(cleaner_tools, "lx", SimpleNamespace(extract=fake.extract))
+    with override_settings(LLM_EXTRACTION_CACHE_PATH=str(tmp_path / "llm.sqlite3")):
+        yield fake
+    fake.server.shutdown()
+
+
+def _core(text, prompt="P1"):
+    res = llm_cache.cached_lx_extract(
+        "shop3", text_or_documents=text, prompt_description=prompt, examples=["ex"], model_id="m",
+    )
+    e = res.extractions[0]
+    return e.extraction_text, e.attributes["delta_yen"], e.char_interval.end_pos
+
+
+def test_rows_hit_persistent_cache(model):
+    texts = [f"{c}:-1000円" for c in ["ブルー", "ブラック", "シルバー", "ゴールド", "白", "黒"]]
+
+    first = [_core(t) for t in texts]
+    assert model.requests == len(texts)
+    assert first[1] == ("ブラック", -4000, 4)
+
+    # 重复出现的文本全部命中缓存；行尾空白归一化后同一个键
+    assert [_core(t) for t in texts * 2] == first * 2
+    assert _core(texts[0] + "  \n") == first[0]
+    assert model.requests == len(texts)
+
+    # prompt 改版后重新请求模型; 缓存跨进程持久 (重建连接后依然命中)
+    _core(texts[0], prompt="P2")
+    assert model.requests == len(texts) + 1
+    llm_cache._store = None
+    assert _core(texts[1]) == first[1]
+    assert model.requests == len(texts) + 1
+
+
+def test_prompt_version_memo_is_bounded():
+    llm_cache._prompt_versions.clear()
+    versions = {llm_cache.prompt_version("P", [f"ex{i}"]) for i in range(llm_cache._PROMPT_MEMO_SIZE * 3)}
+    assert len(versions) == llm_cache._PROMPT_MEMO_SIZE * 3
+    assert len(llm_cache._prompt_versions) == llm_cache._PROMPT_MEMO_SIZE
+
+    # 内容相同的新列表得到同一个指纹
+    assert llm_cache.prompt_version("P", ["ex0"]) == llm_cache.prompt_version("P", ["ex0"])
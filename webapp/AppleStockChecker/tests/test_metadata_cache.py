@@ -0,0 +1,60 @@
+"""
+Tests for the process-wide shop / iPhone metadata cache used by the
+ClickHouse-backed PSTA viewsets.
+"""
+from __future__ import annotations
+
+from datetime import date
+
+import pytest
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from AppleStockChecker.models import Iphone, SecondHandShop
+from AppleStockChecker.services import metadata_cache
+
+MODELS = [Iphone, SecondHandShop]
+
+
+@pytest.fixture
+def meta_db():
+    with connection.schema_editor() as editor:
+        for model in MODELS:
+            editor.create_model(model)
+    metadata_cache.invalidate_metadata()
+    yield
+    with connection.schema_editor() as editor:
+        for model in reversed(MODELS):
+            editor.delete_model(model)
+    metadata_cache.invalidate_metadata()
+
+
+def test_metadata_cached_until_model_changes(meta_db):
+    shop = SecondHandShop.objects.create(name="shopA", address="東京", website="")
+    phone = Iphone.objects.create(part_number="MG8A4J/A", model_name="iPhone 17 Pro", capacity_gb=1024,
+                                  color="Silver", release_date=date(2025, 9, 19))
+    before = metadata_cache.metadata_cache_stats()
+
+    iphones = metadata_cache.get_iphone_meta()
+    assert iphones[phone.pk]["capacity_label"] == "1TB"
+    assert iphones[phone.pk]["label"] == "iPhone 17 Pro Silver"
+    assert iphones[phone.pk]["release_date"] == "2025-09-19"
+    assert metadata_cache.get_shop_meta()[shop.pk] == {"id": shop.pk, "name": "shopA", "website": "", "address": "東京"}
+
+    # 第二次直接命中，不查库
+    with CaptureQueriesContext(connection) as ctx:
+        assert metadata_cache.get_iphone_meta() is iphones
+        metadata_cache.get_shop_meta()
+    assert len(ctx.captured_queries) == 0
+
+    # 保存店铺只使店铺缓存失效
+    shop.name = "shopB"
+    shop.save()
+    assert metadata_cache.get_shop_meta()[shop.pk]["name"] == "shopB"
+    assert metadata_cache.get_iphone_meta() is iphones
+
+    stats = metadata_cache.metadata_cache_stats()
+    assert stats["misses"] - before["misses"] == 3
+    assert stats["hits"] - before["hits"] == 3
+    assert stats["entries"] == {"iphone": 1, "shop": 1}
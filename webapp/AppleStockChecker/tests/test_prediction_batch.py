@@ -0,0 +1,166 @@
+"""
+Tests for batched price prediction (engine.prediction).
+
+Inference for many iPhones is one ClickHouse query, boosters are only
+unpickled on LRU misses, and ForecastSnapshot rows are upserted in bulk
+with the same created/updated accounting as update_or_create.
+"""
+from __future__ import annotations
+
+import pickle
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+pytest.importorskip("lightgbm")
+pytest.importorskip("sklearn")
+
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from AppleStockChecker.engine import prediction
+from AppleStockChecker.models import ForecastSnapshot, Iphone, ModelArtifact
+
+MODELS = [Iphone, ModelArtifact, ForecastSnapshot]
+BUCKET = datetime(2025, 3, 1, 9, 45)
+
+
+class ConstBooster:
+    def __init__(self, value):
+        self.value = value
+
+    def predict(self, X):
+        return np.full(len(X), self.value + X["mean"].to_numpy())
+
+
+class FakeCH:
+    def __init__(self, rows=None, latest=None):
+        self.rows = rows or []
+        self.latest = latest or {}
+        self.calls = []
+
+    def query_features(self, **kwargs):
+        self.calls.append(("query_features", kwargs))
+        return self.rows, -1
+
+    def query_latest_features(self, **kwargs):
+        self.calls.append(("query_latest_features", kwargs))
+        return {s: r for s, r in self.latest.items() if s in kwargs["scopes"]}
+
+
+@pytest.fixture
+def db():
+    with connection.schema_editor() as editor:
+        for model in MODELS:
+            editor.create_model(model)
+    phones = [
+        Iphone.objects.create(part_number=f"P{i}", model_name="iPhone 16", capacity_gb=128 * (i + 1),
+                              color="Black", release_date=date(2024, 9, 20))
+        for i in range(3)
+    ]
+    prediction.clear_booster_cache()
+    yield [p.pk for p in phones]
+    prediction.clear_booster_cache()
+    with connection.schema_editor() as editor:
+        for model in reversed(MODELS):
+            editor.delete_model(model)
+
+
+def _artifact(iid, horizon, value, trained_at=BUCKET.replace(tzinfo=timezone.utc)):
+    ModelArtifact.objects.update_or_create(
+        model_name=prediction._model_name(iid, horizon), version="v1",
+        defaults={
+            "trained_at": trained_at,
+            "params_blob": pickle.dumps({"booster": ConstBooster(value), "feature_columns": ["mean", "std"]}),
+            "metrics_json": {},
+        },
+    )
+
+
+def test_batched_predict_and_upsert(db):
+    p1, p2, p3 = db
+    for iid in (p1, p2):
+        for h in prediction.HORIZONS:
+            _artifact(iid, h, value=h)
+    ch = FakeCH(latest={
+        f"iphone:{p1}": {"bucket": BUCKET, "scope": f"iphone:{p1}", "mean": 100.0, "std": None},
+        f"iphone:{p2}": {"bucket": BUCKET, "scope": f"iphone:{p2}", "mean": 200.0, "std": 1.0},
+    })
+
+    preds, errors = prediction.predict_for_iphones(ch, [p1, p2, p3], bucket=BUCKET)
+    assert [c[0] for c in ch.calls] == ["query_latest_features"]
+    assert set(errors) == {p3}
+    assert [p["yhat"] for p in preds if p["iphone_id"] == p2] == [215.0, 230.0, 245.0, 260.0]
+
+    assert prediction.upsert_forecasts(preds) == [True] * 8
+    again = [{**p, "yhat": p["yhat"] + 1} for p in preds[:2]]
+    assert prediction.upsert_forecasts(again + again[:1]) == [False, False, False]
+    assert ForecastSnapshot.objects.count() == 8
+    assert ForecastSnapshot.objects.get(iphone_id=p1, horizon_min=15).yhat == 116.0
+
+    # 第二个 tick: 全部命中 LRU, 不再读取 params_blob
+    with CaptureQueriesContext(connection) as ctx:
+        prediction.predict_for_iphones(ch, [p1, p2], bucket=BUCKET)
+    assert len(ctx.captured_queries) == 1
+    assert prediction.booster_cache_stats()["hits"] == 8
+
+    # 重新训练 (trained_at 变化) 后加载新模型
+    _artifact(p1, 15, value=1000, trained_at=BUCKET.replace(tzinfo=timezone.utc) + timedelta(days=1))
+    preds, _ = prediction.predict_for_iphones(ch, [p1], bucket=BUCKET)
+    assert preds[0]["yhat"] == 1100.0
+
+
+@override_settings(PREDICTION_BOOSTER_CACHE_SIZE=4)
+def test_booster_cache_evicts_lru(db):
+    p1, p2, _ = db
+    for iid in (p1, p2):
+        for h in prediction.HORIZONS:
+            _artifact(iid, h, value=h)
+    prediction.load_models([p1, p2])
+    stats = prediction.booster_cache_stats()
+    assert stats["size"] == 4 and stats["evictions"] == 4
+
+
+def test_training_reads_features_once(db):
+    p1, p2, p3 = db
+    t0 = datetime(2025, 3, 1)
+    rng = np.random.default_rng(0)
+    rows = [
+        {"bucket": t0 + timedelta(minutes=15 * i), "scope": f"iphone:{iid}",
+         "mean": 100 + i + rng.normal(), "median": 100.0, "std": 1.0, "shop_count": 3, "dispersion": 0.5}
+        for iid in (p1, p2) for i in range(120)
+    ]
+    ch = FakeCH(rows=rows)
+    results, errors = prediction.train_models_for_iphones(
+        ch, [p1, p2, p3], bucket_lte=t0 + timedelta(days=2), max_workers=2)
+
+    assert [c[0] for c in ch.calls] == ["query_features"]
+    assert ch.calls[0][1]["scope_in"] == [f"iphone:{i}" for i in (p1, p2, p3)]
+    assert set(results) == {p1, p2} and set(errors) == {p3}
+    assert sorted(results[p1]["models"]) == prediction.HORIZONS
+
+
+@pytest.mark.parametrize("max_workers, lgb_threads, expected", [(1, 0, 8), (4, 0, 2), (4, 3, 3)])
+def test_training_caps_lightgbm_threads(monkeypatch, max_workers, lgb_threads, expected):
+    import threading
+
+    seen = []
+
+    def fake_train(df, iphone_id, now, num_threads=None):
+        seen.append((iphone_id, num_threads, threading.get_ident()))
+        return {"iphone_id": iphone_id}
+
+    monkeypatch.setattr(prediction.os, "cpu_count", lambda: 8)
+    monkeypatch.setattr(prediction, "_train_from_frame", fake_train)
+    ch = FakeCH(rows=[{"bucket": BUCKET, "scope": f"iphone:{i}", "mean": 1.0} for i in range(4)])
+
+    with override_settings(PREDICTION_LGB_THREADS=lgb_threads):
+        results, errors = prediction.train_models_for_iphones(ch, list(range(4)), max_workers=max_workers)
+
+    assert sorted(results) == [0, 1, 2, 3] and not errors
+    # 串行与线程池两条路径都显式限制 LightGBM 线程数
+    assert {t for _, t, _ in seen} == {expected}
+    if max_workers == 1:
+        assert {ident for *_, ident in seen} == {threading.get_ident()}
@@ -0,0 +1,140 @@
+"""
+Tests for the set-based PSTA minute writer (_process_minute_rows).
+
+The whole minute is upserted with one INSERT ... ON CONFLICT; Update_Count,
+chart_points and the error histogram must match the per-row writer.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("channels")
+
+from django.db import connection
+
+from AppleStockChecker.models import Iphone, PurchasingShopTimeAnalysis, SecondHandShop
+from AppleStockChecker.tasks import timestamp_alignment_task as psta
+
+TS = datetime(2025, 3, 3, 1, 15, tzinfo=timezone.utc)
+MODELS = [Iphone, SecondHandShop, PurchasingShopTimeAnalysis]
+
+
+@pytest.fixture
+def db():
+    with connection.schema_editor() as editor:
+        for model in MODELS:
+            editor.create_model(model)
+
+    shops = [SecondHandShop.objects.create(name=f"s{i}", address="a") for i in range(2)]
+    phones = [
+        Iphone.objects.create(part_number=f"P{i}", model_name="iPhone 16", capacity_gb=128 * (i + 1),
+                              color="Black", release_date=date(2024, 9, 20))
+        for i in range(2)
+    ]
+    yield [s.pk for s in shops], [p.pk for p in phones]
+
+    with connection.schema_editor() as editor:
+        for model in reversed(MODELS):
+            editor.delete_model(model)
+
+
+def _row(shop_id, iphone_id, price, sec=30):
+    return {
+        "shop_id": shop_id, "iphone_id": iphone_id, "price_new": price,
+        "recorded_at": (TS - timedelta(seconds=sec)).isoformat(),
+    }
+
+
+def _run(rows, job_id="job"):
+    return psta._process_minute_rows(ts_iso=TS.isoformat(), ts_dt=TS, rows=rows, job_id=job_id)
+
+
+def test_upsert_counts_and_chart_points(db, monkeypatch):
+    monkeypatch.setattr(psta, "get_dynamic_price_ranges", lambda ids, ts: {i: (100_000, 300_000) for i in ids})
+    (s1, s2), (p1, p2) = db
+    ok, failed, err_counter, errors, points = _run([
+        _row(s1, p1, 150_000),
+        _row(s2, p1, 151_000),
+        _row(s1, p2, 50_000),        # 超出动态区间, 跳过
+        _row(s1, 999, 150_000),      # iphone 不存在
+        _row(None, p1, 150_000),     # 缺 shop_id
+        _row(s2, p1, 152_000, 10),   # 同一分钟重复, 以最后一行为准
+    ])
+
+    assert (ok, failed) == (3, 2)
+    assert err_counter == {"DoesNotExist": 1, "ValueError": 1}
+    assert errors[0]["item"]["iphone_id"] == 999
+    assert [p["price"] for p in points] == [150_000, 151_000, 152_000]
+    assert points[1]["id"] == points[2]["id"]
+
+    rec = PurchasingShopTimeAnalysis.objects.get(shop_id=s2, iphone_id=p1, Timestamp_Time=TS)
+    assert (rec.New_Product_Price, rec.Update_Count, rec.Alignment_Time_Difference) == (152_000, 1, -10)
+    assert rec.Timestamp_Time_Zone == "+00:00" and rec.Original_Record_Time_Zone == "+09:00"
+    assert PurchasingShopTimeAnalysis.objects.get(pk=points[0]["id"]).Update_Count == 0
+
+    ok, failed, _, _, points2 = _run([_row(s1, p1, 149_000), _row(s2, p1, 153_000)], job_id="job2")
+    assert (ok, failed) == (2, 0)
+    assert [p["id"] for p in points2] == [points[0]["id"], points[1]["id"]]
+    assert PurchasingShopTimeAnalysis.objects.count() == 2
+    rec.refresh_from_db()
+    assert (rec.New_Product_Price, rec.Update_Count, rec.Job_ID) == (153_000, 2, "job2")
+
+
+def test_dynamic_price_ranges_single_query_and_cache(db, monkeypatch):
+    from django.test.utils import CaptureQueriesContext
+
+    monkeypatch.setattr(psta, "_price_range_cache", {})
+    (s1, s2), (p1, p2) = db
+    shop_ids = [s1, s2] + [SecondHandShop.objects.create(name=f"x{i}", address="a").pk for i in range(2)]
+    for k, sid in enumerate(shop_ids):
+        for minutes, price in [(20, 140_000 + 1_000 * k), (5, 150_000 + 1_000 * k), (40, 999_999)]:
+            PurchasingShopTimeAnalysis.objects.create(
+                Job_ID="j", Original_Record_Time_Zone="+09:00", Timestamp_Time_Zone="+00:00",
+                Record_Time=TS, Timestamp_Time=TS - timedelta(minutes=minutes),
+                Alignment_Time_Difference=0, shop_id=sid, iphone_id=p1, New_Product_Price=price,
+            )
+
+    with CaptureQueriesContext(connection) as ctx:
+        ranges = psta.get_dynamic_price_ranges([p1, p2], TS)
+    assert len(ctx.captured_queries) == 1
+    # 每店取窗口内最新一条: 150k..153k, 均值 151.5k
+    assert ranges[p1] == pytest.approx((151_500 * 0.9, 151_500 * 1.1))
+    assert ranges[p2] == (psta.PRICE_FALLBACK_MIN, psta.PRICE_FALLBACK_MAX)
+
+    with CaptureQueriesContext(connection) as ctx:
+        assert psta.get_dynamic_price_range(p1, TS) == ranges[p1]
+    assert len(ctx.captured_queries) == 0
+
+    # 本进程写入回看窗口内的新价格: 缓存的 p1 区间失效, p2 不受影响
+    t = TS - timedelta(minutes=10)
+    ok, *_ = psta._process_minute_rows(
+        ts_iso=t.isoformat(), ts_dt=t, job_id="job",
+        rows=[{"shop_id": s1, "iphone_id": p1, "price_new": 150_000, "recorded_at": t.isoformat()}],
+    )
+    assert ok == 1
+    with CaptureQueriesContext(connection) as ctx:
+        assert psta.get_dynamic_price_ranges([p2], TS)[p2] == ranges[p2]
+    assert len(ctx.captured_queries) == 0
+    with CaptureQueriesContext(connection) as ctx:
+        psta.get_dynamic_price_ranges([p1], TS)
+    assert len(ctx.captured_queries) == 1
+
+
+@pytest.mark.parametrize("enabled", [False, True])
+def test_minute_aggregation_leaves_features_wide_to_live_tail(monkeypatch, enabled):
+    from django.test import override_settings
+
+    written = []
+    monkeypatch.setattr(psta, "_agg_feature_combos", lambda **kw: {"iphone:1": {"mean": 1.0}})
+    monkeypatch.setattr(psta, "_fetch_prev_base_batch", lambda *a: {})
+    monkeypatch.setattr(psta, "_agg_time_series_features", lambda **kw: {})
+    monkeypatch.setattr(psta, "_agg_bollinger_bands", lambda **kw: None)
+    monkeypatch.setattr(psta, "_agg_market_log_premium", lambda **kw: None)
+    monkeypatch.setattr(psta, "_write_wide_rows_to_ch", lambda rows, bucket: written.append(rows) or len(rows))
+
+    with override_settings(PSTA_MINUTE_CH_FEATURES=enabled):
+        psta._run_aggregation(ts_iso=TS.isoformat(), ts_dt=TS, rows=[],
+                              agg_start_iso=TS.isoformat(), agg_minutes=15)
+    assert bool(written) is enabled
@@ -0,0 +1,90 @@
+"""
+Tests for the batched history fetch behind the PSTA time-series features.
+
+_agg_time_series_features and _agg_bollinger_bands must produce the same
+values as the per-scope, per-window _fetch_prev_base path, from a single
+ClickHouse query.
+"""
+from __future__ import annotations
+
+import math
+
+import pytest
+
+pytest.importorskip("channels")
+
+from AppleStockChecker.services import clickhouse_service
+from AppleStockChecker.tasks import timestamp_alignment_task as psta
+
+# scope → 历史 mean (新→旧)
+HISTORY = {
+    "iphone:1": [150_000.0 + 37 * i if i % 11 else None for i in range(150)],
+    "iphone:2": [210_000.0, None, 209_500.0, 209_800.0, 210_100.0],
+    "shop:3|iphone:1": [],
+}
+NOW = {"iphone:1": 151_234.0, "iphone:2": 210_300.0, "shop:3|iphone:1": 149_900.0}
+
+
+class FakeClient:
+    def __init__(self):
+        self.calls = []
+
+    def execute(self, sql, params):
+        self.calls.append(sql)
+        lim = params["lim"]
+        return [(s, v) for s in params["scopes"] for v in HISTORY.get(s, [])[:lim]]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    fake = FakeClient()
+    service = type("Svc", (), {"client": fake})()
+    monkeypatch.setattr(clickhouse_service, "get_shared_service", lambda: service)
+    return fake
+
+
+def _expected(scope: str, W: int) -> dict:
+    W_b = W // 15
+    series = list(reversed(HISTORY[scope][:W_b - 1])) + [NOW[scope]]
+    alpha = 2.0 / (W_b + 1.0)
+    sma = psta._sma_with_none(series, W_b)
+    filled, last = [], None
+    for v in series:
+        last = v if v is not None else last
+        if last is not None:
+            filled.append(last)
+    window = filled[-min(W_b, len(filled)):]
+    mid = sum(window) / len(window)
+    std = psta._sample_std(window)
+    return {
+        f"ema_{W}": round(psta._ema_from_series_with_none(series, alpha), 2),
+        f"sma_{W}": round(sma, 2) if sma is not None else None,
+        f"boll_mid_{W}": round(mid, 2),
+        f"boll_up_{W}": round(mid + 2.0 * std, 2),
+    }
+
+
+def test_single_query_feeds_all_windows(client):
+    wide_rows = {scope: {"mean": x} for scope, x in NOW.items()}
+    history = psta._fetch_prev_base_batch(list(NOW), "mean", psta._HISTORY_BUCKETS, None)
+    base_now = psta._agg_time_series_features(
+        ts_iso="t", anchor_bucket=None, wide_rows=wide_rows, history=history,
+    )
+    psta._agg_bollinger_bands(
+        ts_iso="t", anchor_bucket=None, base_now=base_now, wide_rows=wide_rows, history=history,
+    )
+
+    assert len(client.calls) == 1
+    assert "LIMIT %(lim)s BY scope" in client.calls[0]
+    for scope in NOW:
+        for W in psta._FEATURE_WINDOWS:
+            for name, value in _expected(scope, W).items():
+                got = wide_rows[scope][name]
+                assert got == value or (got is not None and math.isclose(got, value)), (scope, name)
+
+
+def test_fetch_prev_base_matches_batch(client):
+    batch = psta._fetch_prev_base_batch(list(HISTORY), "mean", 7, None)
+    for scope, hist in HISTORY.items():
+        assert psta._fetch_prev_base(scope, "mean", 7, None) == hist[:7]
+        assert batch.get(scope, []) == hist[:7]
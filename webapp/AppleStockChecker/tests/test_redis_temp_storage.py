@@ -0,0 +1,56 @@
+"""
+Tests for the ingest → clean DataFrame handoff (redis_temp_storage).
+"""
+from __future__ import annotations
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+fakeredis = pytest.importorskip("fakeredis")
+
+from django.test import override_settings
+
+from AppleStockChecker.utils.webscraper_tasks import redis_temp_storage as storage
+
+
+@pytest.fixture
+def client(monkeypatch):
+    fake = fakeredis.FakeRedis()
+    monkeypatch.setattr(storage, "_get_redis_client", lambda: fake)
+    return fake
+
+
+def _df():
+    return pd.DataFrame({
+        "part_number": ["MTUW3J/A", "MYMX3J/A", None],
+        "price": [150_000, 151_000, 152_000],
+        "scraped_at": pd.to_datetime(["2025-03-03 01:00", "2025-03-03 01:05", None], utc=True),
+        "note": ["未使用", "", "ｼﾑﾌﾘｰ"],
+    })
+
+
+def test_arrow_roundtrip_keeps_dtypes_and_dedupes(client):
+    df = _df()
+    key = storage.store_dataframe("b1", "shop3", df)
+    assert storage.store_dataframe("b2", "shop3", df.copy()) == key
+    assert key.startswith("ingest:temp:shop3:")
+
+    blob = client.get(key)
+    assert blob.startswith(storage.ARROW_MAGIC)
+    pd.testing.assert_frame_equal(storage.retrieve_dataframe(key), df)
+
+    assert storage.store_dataframe("b3", "shop3", df.iloc[:2]) != key
+    assert storage.retrieve_dataframe("ingest:temp:missing") is None
+
+
+def test_json_fallback_for_mixed_columns_and_setting(client):
+    mixed = pd.DataFrame({"price": [150_000, "15万円"], "pn": ["A", "B"]})
+    key = storage.store_dataframe("b1", "shop3", mixed)
+    assert client.get(key).startswith(b"[")
+    assert storage.retrieve_dataframe(key)["price"].tolist() == [150000, "15万円"]
+
+    with override_settings(INGEST_TEMP_FORMAT="json"):
+        key = storage.store_dataframe("b1", "shop3", _df())
+    assert client.get(key).startswith(b"[")
+    assert storage.retrieve_dataframe(key)["price"].tolist() == [150_000, 151_000, 152_000]
@@ -0,0 +1,37 @@
+"""
+Column-level / memoized text normalization in cleaner_tools must match the
+per-cell functions exactly.
+"""
+from __future__ import annotations
+
+import pandas as pd
+
+from AppleStockChecker.utils.external_ingest import cleaner_tools as ct
+
+CELLS = [
+    "ブルー：－１，０００円➖<br>シルバー 2,000円✨",
+    "ｉＰｈｏｎｅ　17\r\nPro\t256GB",
+    "a\x00b",            # 控制字符: pd.factorize 会把它与 "a" 混为一谈
+    "a",
+    "  全色 -３０００円 ",
+    "é<b>太字</b>️",
+    "",
+    None,
+    float("nan"),
+    12345,
+] * 3
+
+
+def test_stage0_series_matches_per_cell():
+    out = ct.normalize_text_stage0_series(pd.Series(CELLS, dtype=object, index=range(100, 130)))
+    assert list(out.index) == list(range(100, 130))
+    assert out.tolist() == [ct.normalize_text_stage0(v) for v in CELLS]
+    assert out.iat[0] == "ブルー:-1,000円-シルバー 2,000円"
+    assert out.iloc[2:4].tolist() == ["ab", "a"]
+
+
+def test_basic_and_norm_strip_values():
+    assert ct.normalize_text_basic("ｉＰｈｏｎｅ　17\r\nPro") == "ｉＰｈｏｎｅ 17 Pro"
+    assert ct.normalize_text_basic("a\r\nb", collapse_spaces=False) == "a b"
+    assert ct._norm_strip(" ディープ　ブルー ") == "ディープブルー"
+    assert ct.coerce_amount_yen("－3,000円") == -3000 and ct.coerce_amount_yen(" ") is None
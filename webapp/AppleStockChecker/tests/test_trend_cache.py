@@ -0,0 +1,159 @@
+"""
+Tests for the pre-aggregated trend cache (services.trend_cache).
+
+On 15-minute grids the cached bucket series must give exactly the same
+trend as reading raw points from the database, across first build, tail
+refresh and backfill invalidation.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+
+from AppleStockChecker.api.trends import core
+from AppleStockChecker.models import Iphone, PurchasingShopPriceRecord, SecondHandShop
+from AppleStockChecker.services import trend_cache
+
+fakeredis = pytest.importorskip("fakeredis")
+
+MODELS = [Iphone, SecondHandShop, PurchasingShopPriceRecord]
+NOW = datetime(2025, 10, 1, 12, 7, 30, tzinfo=timezone.get_fixed_timezone(0))
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fake = fakeredis.FakeRedis()
+    monkeypatch.setattr(trend_cache, "_get_redis_client", lambda: fake)
+    return fake
+
+
+@pytest.fixture
+def trend_db(monkeypatch):
+    monkeypatch.setattr(timezone, "now", lambda: NOW)
+    # PG 直查路径改为串行（线程里的 sqlite :memory: 是另一个空库）
+    monkeypatch.setattr(core, "_fetch_points_parallel", lambda m, c, colors, after: {
+        color: core._fetch_points_for_color(m, c, color, after) for color in colors
+    })
+    with connection.schema_editor() as editor:
+        for model in MODELS:
+            editor.create_model(model)
+    phones = [
+        Iphone.objects.create(part_number=pn, model_name="iPhone 17", capacity_gb=256,
+                              color=color, release_date=date(2025, 9, 19))
+        for pn, color in [("PN-B", "Black"), ("PN-W", "White"), ("PN-U", "Blue")]
+    ]
+    # 两家 id 不同但规范化后同名，需按桶合并
+    shops = [SecondHandShop.objects.create(name=n, address=a)
+             for n, a in [("shopA", "1"), (" shopA ", "2"), ("shopB", "")]]
+    rng = np.random.default_rng(7)
+    for _ in range(300):
+        _add(phones[rng.integers(3)], shops[rng.integers(3)],
+             NOW - timedelta(minutes=int(rng.integers(20, 4 * 24 * 60))), int(rng.integers(140, 160)) * 1000)
+    yield phones, shops
+    with connection.schema_editor() as editor:
+        for model in reversed(MODELS):
+            editor.delete_model(model)
+
+
+def _add(phone, shop, recorded_at, price):
+    rec = PurchasingShopPriceRecord.objects.create(shop=shop, iphone=phone, price_new=price)
+    PurchasingShopPriceRecord.objects.filter(pk=rec.pk).update(recorded_at=recorded_at)
+
+
+def _trends(enabled: bool, **grid):
+    with override_settings(TREND_CACHE_ENABLED=enabled):
+        return core.compute_trends_for_model_capacity(
+            "iPhone 17", 256, 3, set(), {"B": {"windowMinutes": 60}}, grid or None)
+
+
+def _assert_same(cached: dict, direct: dict):
+    meta = cached.pop("cache")
+    assert "cache" not in direct
+    assert cached == direct
+    return meta
+
+
+def test_cached_trends_match_direct_query(trend_db, fake_redis):
+    phones, shops = trend_db
+
+    meta = _assert_same(_trends(True), _trends(False))
+    assert (meta["hits"], meta["misses"], meta["hit_ratio"]) == (0, 3, 0.0)
+
+    # 尾部新增：命中缓存，PG 只读水位线之后的行
+    _add(phones[0], shops[1], NOW - timedelta(minutes=3), 99_000)
+    meta = _assert_same(_trends(True), _trends(False))
+    assert (meta["hits"], meta["misses"]) == (3, 0)
+    assert meta["tail_rows"] < 10
+
+    # 回补两天前的记录：水位线回退后结果仍与直查一致
+    _add(phones[2], shops[2], NOW - timedelta(days=2, minutes=1), 1_000)
+    with override_settings(TREND_CACHE_ENABLED=True):
+        assert trend_cache.note_price_records([(phones[2].pk, NOW - timedelta(days=2, minutes=1))]) == 1
+    meta = _assert_same(_trends(True), _trends(False))
+    assert meta["hits"] == 3 and meta["tail_rows"] > 10
+
+    stats = trend_cache.get_cache_stats()
+    assert stats["requests"] == 3 and stats["hit_ratio"] == pytest.approx(6 / 9, abs=1e-4)
+
+
+def test_write_back_only_touches_new_buckets(trend_db, fake_redis, monkeypatch):
+    phones, shops = trend_db
+    writes = []
+    real_write_back = trend_cache._write_back
+
+    def spy(client, iid, gen, rows, **kw):
+        writes.append((iid, set(rows), kw.get("partial", False)))
+        real_write_back(client, iid, gen, rows, **kw)
+
+    monkeypatch.setattr(trend_cache, "_write_back", spy)
+    _trends(True)
+    assert len(writes) == 3 and not any(partial for *_, partial in writes)
+
+    # 水位线没有前进、也没有新完整桶：不写 Redis
+    writes.clear()
+    _add(phones[0], shops[1], NOW - timedelta(minutes=3), 99_000)
+    _trends(True)
+    assert writes == []
+
+    # 水位线前进后只 HSET 有新桶的店，其余店的桶行原样保留
+    key = trend_cache._iphone_key(phones[1].pk)
+    before = {k: v for k, v in fake_redis.hgetall(key).items() if k.startswith(b"s:")}
+    later = NOW + timedelta(minutes=30)
+    monkeypatch.setattr(timezone, "now", lambda: later)
+    meta = _assert_same(_trends(True), _trends(False))
+    assert meta["hits"] == 3
+    assert all(partial for *_, partial in writes)
+    by_iphone = {iid: sids for iid, sids, _ in writes}
+    assert shops[1].pk in by_iphone[phones[0].pk]
+    after = fake_redis.hgetall(key)
+    for field, blob in before.items():
+        if int(field[2:]) not in by_iphone.get(phones[1].pk, set()):
+            assert after[field] == blob
+
+
+def test_off_lattice_grid_bypasses_cache(trend_db, fake_redis):
+    data = _trends(True, stepMinutes=10)
+    assert "cache" not in data
+    assert not fake_redis.keys(f"{trend_cache.KEY_PREFIX}:ip:*")
+
+
+def test_recent_records_do_not_invalidate(fake_redis):
+    with override_settings(TREND_CACHE_ENABLED=True):
+        assert trend_cache.note_price_records([(1, timezone.now())]) == 0
+    assert not fake_redis.exists(trend_cache._iphone_key(1))
+
+
+def test_compress_and_merge_keep_last_point_per_bucket():
+    q = trend_cache.BUCKET_MS
+    rows = trend_cache.compress_points(np.array([1, q, q + 1, 2 * q - 5], dtype=np.int64),
+                                       np.array([1.0, 2.0, 3.0, 4.0]))
+    assert rows["b"].tolist() == [q, 2 * q] and rows["y"].tolist() == [2.0, 4.0]
+    other = trend_cache.compress_points(np.array([q - 1, 2 * q], dtype=np.int64), np.array([9.0, 8.0]))
+    merged = trend_cache.merge_rows([rows, other])
+    assert merged["x"].tolist() == [q, 2 * q] and merged["y"].tolist() == [2.0, 8.0]
@@ -0,0 +1,161 @@
+"""
+Tests for the NumPy trend engine in api.trends.core.
+
+The array engine must reproduce the original per-point loops: historical
+nearest resampling, cross-color / cross-shop means and the B/C moving
+averages.
+"""
+from __future__ import annotations
+
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from django.db import connection
+from django.utils import timezone
+
+from AppleStockChecker.api.trends import core
+from AppleStockChecker.models import Iphone, PurchasingShopPriceRecord, SecondHandShop
+
+MIN = 60 * 1000
+MODELS = [Iphone, SecondHandShop, PurchasingShopPriceRecord]
+
+
+# ---- 原版逐点实现（参照） ----
+
+def _legacy_resample(points, grid_ms, fallback_ms=core.FALLBACK_MS):
+    out, i, n = [], 0, len(points)
+    for t in grid_ms:
+        if not n:
+            out.append(None)
+            continue
+        while i + 1 < n and points[i + 1][0] <= t:
+            i += 1
+        ok = points[i][0] <= t and t - points[i][0] <= fallback_ms
+        out.append(points[i][1] if ok else None)
+    return out
+
+
+def _legacy_ma(points, window_minutes):
+    wms, out, head, s = window_minutes * MIN, [], 0, 0.0
+    for i, (x, y) in enumerate(points):
+        s += y
+        while x - points[head][0] > wms:
+            s -= points[head][1]
+            head += 1
+        out.append((x, s / (i + 1 - head)))
+    return out
+
+
+def _legacy_cross_mean(grid, series_list):
+    out = []
+    for idx, x in enumerate(grid):
+        ys = [seq[idx] for seq in series_list if seq[idx] is not None]
+        if ys:
+            out.append((x, sum(ys) / len(ys)))
+    return out
+
+
+def _points(lst):
+    return [(p["x"], p["y"]) for p in lst]
+
+
+def _raw(seed, n_shops=3, colors=("Black", "White")):
+    rng = np.random.default_rng(seed)
+    now_ms = int(timezone.now().timestamp() * 1000)
+    raw = {}
+    for color in colors:
+        raw[color] = {}
+        for s in range(n_shops):
+            if color == "White" and s == 2:
+                continue  # 该店不收白色
+            xs = np.sort(now_ms - rng.integers(0, 3 * 24 * 60, size=40) * MIN)
+            raw[color][f"shop{s}"] = (xs.astype(np.int64), rng.integers(140, 160, size=40).astype(float) * 1000)
+    return raw
+
+
+@pytest.fixture
+def trend_db(monkeypatch):
+    with connection.schema_editor() as editor:
+        for model in MODELS:
+            editor.create_model(model)
+    for color in ("Black", "White"):
+        Iphone.objects.create(part_number=f"PN-{color}", model_name="iPhone 17", capacity_gb=256,
+                              color=color, release_date=date(2025, 9, 19))
+    yield
+    with connection.schema_editor() as editor:
+        for model in reversed(MODELS):
+            editor.delete_model(model)
+
+
+def test_engine_matches_legacy_loops(trend_db, monkeypatch):
+    raw = _raw(seed=3)
+    monkeypatch.setattr(core, "_fetch_points_for_color", lambda m, c, color, after: raw[color])
+    avg_cfg = {"B": {"windowMinutes": 60}, "C": {"windowMinutes": 240}}
+
+    data = core.compute_trends_for_model_capacity("iPhone 17", 256, 2, {"shop0", "shop2"}, avg_cfg)
+
+    assert data["colors"] == ["Black", "White"]
+    assert data["shop_order_present"] == ["shop0", "shop1", "shop2"]
+    grid = [p["x"] for p in data["merged"]["stores"][0]["data"]]
+    assert grid == sorted(grid) and grid[1] - grid[0] == 15 * MIN
+
+    per_color_rs = {
+        color: {shop: _legacy_resample(list(zip(xs.tolist(), ys.tolist())), grid) for shop, (xs, ys) in st.items()}
+        for color, st in raw.items()
+    }
+    # 每色每店: 重采样值保持整数円
+    white = next(c for c in data["per_color"] if c["color"] == "White")
+    assert [s["label"] for s in white["stores"]] == ["shop0", "shop1"]
+    assert [p["y"] for p in white["stores"][1]["data"]] == per_color_rs["White"]["shop1"]
+
+    # merged 每店 = 跨颜色均值
+    merged_rs = {}
+    for shop in data["shop_order_present"]:
+        seqs = [st[shop] for st in per_color_rs.values() if shop in st]
+        merged_rs[shop] = [
+            (sum(v) / len(v) if v else None)
+            for v in ([seq[i] for seq in seqs if seq[i] is not None] for i in range(len(grid)))
+        ]
+        assert [p["y"] for p in next(s for s in data["merged"]["stores"] if s["label"] == shop)["data"]] \
+            == pytest.approx(merged_rs[shop], nan_ok=True)
+
+    # A = 勾选店横向均值（丢弃空点），B/C = 时间窗移动平均
+    a_ref = _legacy_cross_mean(grid, [merged_rs["shop0"], merged_rs["shop2"]])
+    avg = data["merged"]["avg"]
+    assert _points(avg["A"]) == pytest.approx(a_ref)
+    assert _points(avg["B"]) == pytest.approx(_legacy_ma(a_ref, 60))
+    assert _points(avg["C"]) == pytest.approx(_legacy_ma(a_ref, 240))
+
+    # 白色没有 shop2：A 只剩 shop0
+    white_a = _legacy_cross_mean(grid, [per_color_rs["White"]["shop0"]])
+    assert _points(white["avg"]["A"]) == pytest.approx(white_a)
+
+    # avg-only 不生成店铺明细
+    slim = core.compute_trend_arrays("iPhone 17", 256, 2, {"shop0", "shop2"}, avg_cfg).to_dict(include_stores=False)
+    assert "stores" not in slim["merged"] and "stores" not in slim["per_color"][0]
+    assert slim["merged"]["avg"] == avg
+
+
+def test_resample_ignores_future_and_stale_points():
+    xs = np.array([0, 10 * MIN, 10 * MIN, 40 * MIN], dtype=np.int64)
+    ys = np.array([1.0, 2.0, 3.0, 4.0])
+    grid = np.array([-MIN, 0, 15 * MIN, 39 * MIN, 40 * MIN + core.FALLBACK_MS + 1], dtype=np.int64)
+    out = core._resample_nearest(xs, ys, grid)
+    assert out.tolist()[1:4] == [1.0, 3.0, 3.0]
+    assert np.isnan(out[0]) and np.isnan(out[4])
+
+
+def test_fetch_points_for_color_returns_sorted_arrays(trend_db):
+    shop = SecondHandShop.objects.create(name=" shopA ", address="")
+    phone = Iphone.objects.get(color="Black")
+    now = timezone.now().replace(microsecond=0)
+    for minutes, price in [(5, 150_000), (30, 149_000)]:
+        rec = PurchasingShopPriceRecord.objects.create(shop=shop, iphone=phone, price_new=price)
+        PurchasingShopPriceRecord.objects.filter(pk=rec.pk).update(recorded_at=now - timedelta(minutes=minutes))
+
+    store = core._fetch_points_for_color("iPhone 17", 256, "Black", now - timedelta(days=1))
+    xs, ys = store["shopA"]
+    assert xs.tolist() == [int((now - timedelta(minutes=m)).timestamp() * 1000) for m in (30, 5)]
+    assert ys.tolist() == [149_000.0, 150_000.0]
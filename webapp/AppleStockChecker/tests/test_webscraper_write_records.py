@@ -0,0 +1,113 @@
+"""
+Tests for the set-based cleaner writer (webscraper_tasks._write_records_to_db).
+
+Statistics must match the per-row writer: in-batch duplicates dedupe
+against rows inserted earlier in the same batch, and recorded_at is kept.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime, timezone
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("httpx")
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from AppleStockChecker.models import Iphone, PurchasingShopPriceRecord, SecondHandShop
+from AppleStockChecker.tasks.webscraper_tasks import _write_records_to_db
+
+MODELS = [Iphone, SecondHandShop, PurchasingShopPriceRecord]
+T0 = "2025-03-03T01:00:00+09:00"
+T1 = "2025-03-03T02:00:00+09:00"
+
+
+@pytest.fixture
+def db():
+    with connection.schema_editor() as editor:
+        for model in MODELS:
+            editor.create_model(model)
+    for i in range(3):
+        Iphone.objects.create(part_number=f"PN{i}", model_name="iPhone 16", capacity_gb=128 * (i + 1),
+                              color="Black", release_date=date(2024, 9, 20))
+    SecondHandShop.objects.create(name="shopA", address="")
+    yield
+    with connection.schema_editor() as editor:
+        for model in reversed(MODELS):
+            editor.delete_model(model)
+
+
+def _df(rows):
+    return pd.DataFrame(rows, columns=["part_number", "shop_name", "shop_address", "price_new", "recorded_at"])
+
+
+def test_batch_stats_match_row_writer(db):
+    df = _df([
+        ("PN0", "shopA", None, 150_000, T0),
+        ("PN1", "shopA", None, 160_000, T0),
+        ("PN0", "shopB", "Tokyo", 151_000, T0),
+        ("PN0", "shopA", None, 150_500, T0),   # 批内重复: upsert 更新
+        ("PN1", "shopA", None, 160_000, T0),   # 批内重复: 无变化
+        ("PN9", "shopA", None, 150_000, T0),   # 未知 PN
+        ("PN2", None, None, 150_000, T0),      # 缺店名
+    ])
+    with CaptureQueriesContext(connection) as ctx:
+        stats = _write_records_to_db(df, "shopA", "not-a-uuid", upsert=True)
+    assert len(ctx.captured_queries) < 12
+
+    assert (stats["inserted"], stats["updated"], stats["dedup_skipped"]) == (3, 1, 1)
+    assert [u["row"] for u in stats["unmatched"]] == [5, 6]
+    assert len(stats["preview"]) == 3
+    assert SecondHandShop.objects.filter(name="shopB", address="Tokyo").exists()
+
+    rec = PurchasingShopPriceRecord.objects.get(iphone__part_number="PN0", shop__name="shopA")
+    assert rec.price_new == 150_500
+    assert rec.recorded_at == datetime(2025, 3, 2, 16, 0, tzinfo=timezone.utc)
+
+    # 第二批: 与库内记录去重 / 更新, 新时间点插入
+    df2 = _df([
+        ("PN0", "shopA", None, 149_000, T0),
+        ("PN1", "shopA", None, 160_000, T0),
+        ("PN1", "shopA", None, 161_000, T1),
+    ])
+    stats = _write_records_to_db(df2, "shopA", "x", upsert=True)
+    assert (stats["inserted"], stats["updated"], stats["dedup_skipped"]) == (1, 1, 1)
+    rec.refresh_from_db()
+    assert rec.price_new == 149_000 and str(rec.batch_id) == stats["batch_id"]
+    assert PurchasingShopPriceRecord.objects.count() == 4
+
+    stats = _write_records_to_db(df2, "shopA", "x", upsert=False)
+    assert (stats["inserted"], stats["updated"], stats["dedup_skipped"]) == (0, 0, 3)
+
+
+def test_new_shops_invalidate_metadata_cache(db):
+    from AppleStockChecker.services import metadata_cache
+
+    metadata_cache.invalidate_metadata()
+    assert {s["name"] for s in metadata_cache.get_shop_meta().values()} == {"shopA"}
+
+    _write_records_to_db(_df([("PN0", "shopC", "Osaka", 150_000, T0)]), "shopC", "x")
+    assert {s["name"] for s in metadata_cache.get_shop_meta().values()} == {"shopA", "shopC"}
+
+
+def test_concurrent_insert_of_same_key_upserts(db):
+    df = _df([("PN0", "shopA", None, 150_000, T0)])
+    _write_records_to_db(df, "shopA", "x")
+    # 另一任务在本批去重查询之后写入了同一键
+    stats = _write_records_to_db(_df([("PN0", "shopA", None, 152_000, T0)]), "shopA", "y", dedupe=False)
+    assert (stats["inserted"], stats["updated"]) == (0, 1)
+    assert PurchasingShopPriceRecord.objects.get().price_new == 152_000
+
+
+def test_no_dedupe_collapses_in_batch_duplicates(db):
+    df = _df([
+        ("PN0", "shopA", None, 150_000, T0),
+        ("PN1", "shopA", None, 160_000, T0),
+        ("PN0", "shopA", None, 151_000, T0),   # 同键: 后到的行为准
+    ])
+    stats = _write_records_to_db(df, "shopA", "x", dedupe=False)
+    assert (stats["inserted"], stats["updated"], stats["dedup_skipped"]) == (2, 1, 0)
+    assert PurchasingShopPriceRecord.objects.count() == 2
+    assert PurchasingShopPriceRecord.objects.get(iphone__part_number="PN0").price_new == 151_000
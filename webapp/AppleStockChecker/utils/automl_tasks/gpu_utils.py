@@ -157,6 +157,25 @@ def ensure_cpu_for_pandas(arr):
     return to_cpu(arr)
 
 
+def worth_offloading(n_elements: int) -> bool:
+    """
+    数组是否大到值得搬到 GPU 计算
+
+    逐元素运算（log / 差分 / 标准化）在 CPU 上每百万元素只需毫秒级，
+    小数组来回拷贝的开销反而更大；低于 settings.AUTOML_GPU_MIN_ELEMENTS 时留在 CPU。
+
+    Args:
+        n_elements: 元素个数
+
+    Returns:
+        bool: GPU 可用且元素数达到阈值
+    """
+    if not check_gpu_availability():
+        return False
+    from django.conf import settings
+    return n_elements >= int(getattr(settings, "AUTOML_GPU_MIN_ELEMENTS", 5_000_000))
+
+
 class GPUContext:
     """
     GPU 上下文管理器
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+AutoML 预处理引擎（列式 NumPy）
+
+run_preprocessing_for_job 的计算部分：
+  PSTA 记录 → 选定价格（A品 > B品 > 新品价）→ 按 (店, 时间桶) 聚合 → log / dlog / z-score
+
+与逐 Job 的 pandas 实现相比：
+  - PSTA 按 iPhone 只读一次（load_psta_arrays 覆盖所有窗口的并集），各窗口在共享数组上切片；
+  - 聚合、差分、按店统计全部为排序 + bincount，不经过 DataFrame / iterrows；
+  - 写入在 PostgreSQL 上用 unnest 数组一次 INSERT，其他数据库回退 bulk_create。
+"""
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from .gpu_utils import ensure_cpu_for_pandas, get_array_module, to_gpu, worth_offloading
+
+logger = logging.getLogger(__name__)
+
+PRICE_MIN = 10000
+PRICE_MAX = 350000
+
+# 价格来源编码：数值越小优先级越高
+SOURCE_LABELS = np.array(["A", "B", "NEW"], dtype=object)
+
+
+@dataclass
+class PstaArrays:
+    """某 iPhone 在一段时间内的 PSTA 记录（按时间升序，已剔除异常价格）"""
+    ts: np.ndarray        # int64 ns (UTC)
+    shop_id: np.ndarray   # int64
+    price: np.ndarray     # float64 选定价格
+    source: np.ndarray    # int8 0=A 1=B 2=NEW
+
+    @property
+    def size(self) -> int:
+        return int(self.ts.size)
+
+    @classmethod
+    def from_columns(cls, ts, shop_id, new_price, price_a, price_b) -> "PstaArrays":
+        ts = np.asarray(ts, dtype=np.int64)
+        new_price = np.asarray(new_price, dtype=np.float64)
+        price_a = np.asarray(price_a, dtype=np.float64)
+        price_b = np.asarray(price_b, dtype=np.float64)
+
+        has_a, has_b = ~np.isnan(price_a), ~np.isnan(price_b)
+        price = np.where(has_a, price_a, np.where(has_b, price_b, new_price))
+        source = np.where(has_a, 0, np.where(has_b, 1, 2)).astype(np.int8)
+
+        keep = (price >= PRICE_MIN) & (price <= PRICE_MAX)
+        order = np.argsort(ts[keep], kind="stable")
+        return cls(
+            ts=ts[keep][order],
+            shop_id=np.asarray(shop_id, dtype=np.int64)[keep][order],
+            price=price[keep][order],
+            source=source[keep][order],
+        )
+
+
+@dataclass
+class PreprocessedSeries:
+    """一个窗口的预处理结果，按 (shop_id, bucket) 排序"""
+    shop_id: np.ndarray
+    bucket: np.ndarray    # int64 ns (UTC)
+    price: np.ndarray
+    log_price: np.ndarray
+    dlog_price: np.ndarray
+    z_dlog_price: np.ndarray
+    source: np.ndarray    # int8
+
+    @property
+    def size(self) -> int:
+        return int(self.shop_id.size)
+
+    def bucket_datetimes(self) -> list:
+        return list(pd.to_datetime(self.bucket, utc=True).to_pydatetime())
+
+    def source_labels(self) -> np.ndarray:
+        return SOURCE_LABELS[self.source]
+
+
+def load_psta_arrays(iphone_id: int, start, end) -> PstaArrays:
+    """读取 [start, end) 内该 iPhone 的 PSTA（单次查询、只取必要列）"""
+    from AppleStockChecker.models import PurchasingShopTimeAnalysis
+
+    rows = list(
+        PurchasingShopTimeAnalysis.objects
+        .filter(iphone_id=iphone_id, Timestamp_Time__gte=start, Timestamp_Time__lt=end)
+        .values_list("Timestamp_Time", "shop_id", "New_Product_Price", "Price_A", "Price_B")
+    )
+    if not rows:
+        return PstaArrays.from_columns([], [], [], [], [])
+    ts, shop_id, new_price, price_a, price_b = zip(*rows)
+    return PstaArrays.from_columns(
+        pd.DatetimeIndex(ts).as_unit("ns").asi8,
+        shop_id,
+        new_price,
+        [np.nan if v is None else v for v in price_a],
+        [np.nan if v is None else v for v in price_b],
+    )
+
+
+def _log(values: np.ndarray) -> np.ndarray:
+    """log；只有数组足够大（传输开销可摊薄）时才交给 GPU"""
+    if worth_offloading(values.size):
+        try:
+            xp = get_array_module()
+            return np.asarray(ensure_cpu_for_pandas(xp.log(to_gpu(values))), dtype=np.float64)
+        except Exception as e:
+            logger.warning(f"GPU log failed: {e}, falling back to CPU")
+    return np.log(values)
+
+
+def preprocess_window(data: PstaArrays, start_ns: int, end_ns: int, bucket_ns: int) -> PreprocessedSeries:
+    """
+    对 [start_ns, end_ns) 内的记录做桶聚合与 dlog / z-score。
+
+    - 每个 (店, 桶) 只取最优来源（A > B > NEW）的记录求均值；
+    - dlog 为同店相邻桶的 log 差分，首桶为 NaN；
+    - z = (dlog - 店均值) / 店样本标准差；标准差为 0 时 z=0，不足两点时为 NaN。
+    """
+    lo, hi = np.searchsorted(data.ts, [start_ns, end_ns], side="left")
+    ts, shop, price, src = data.ts[lo:hi], data.shop_id[lo:hi], data.price[lo:hi], data.source[lo:hi]
+    if ts.size == 0:
+        empty_i, empty_f = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        return PreprocessedSeries(empty_i, empty_i, empty_f, empty_f, empty_f, empty_f, np.empty(0, dtype=np.int8))
+
+    bucket = ts - np.mod(ts, bucket_ns)
+    order = np.lexsort((src, bucket, shop))
+    shop, bucket, price, src = shop[order], bucket[order], price[order], src[order]
+
+    # (店, 桶) 分组；组内按来源升序，首行即最优来源
+    new_group = np.r_[True, (shop[1:] != shop[:-1]) | (bucket[1:] != bucket[:-1])]
+    group_id = np.cumsum(new_group) - 1
+    best = src[new_group]
+    keep = src == best[group_id]
+    counts = np.bincount(group_id[keep], minlength=best.size)
+    sums = np.bincount(group_id[keep], weights=price[keep], minlength=best.size)
+
+    g_shop, g_bucket = shop[new_group], bucket[new_group]
+    g_price = sums / counts
+    g_log = _log(g_price)
+
+    first_of_shop = np.r_[True, g_shop[1:] != g_shop[:-1]]
+    dlog = np.r_[np.nan, np.diff(g_log)]
+    dlog[first_of_shop] = np.nan
+
+    # 按店统计 dlog 的均值 / 样本标准差（跳过 NaN）
+    shop_idx = np.cumsum(first_of_shop) - 1
+    valid = ~np.isnan(dlog)
+    n = np.bincount(shop_idx[valid], minlength=shop_idx[-1] + 1).astype(np.float64)
+    s1 = np.bincount(shop_idx[valid], weights=dlog[valid], minlength=n.size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = s1 / n
+        dev = np.where(valid, dlog - mean[shop_idx], 0.0)
+        var = np.bincount(shop_idx, weights=dev * dev, minlength=n.size) / (n - 1)
+        std = np.where(n > 1, np.sqrt(var), np.nan)
+        z = (dlog - mean[shop_idx]) / std[shop_idx]
+    z[std[shop_idx] == 0] = 0.0
+
+    return PreprocessedSeries(
+        shop_id=g_shop, bucket=g_bucket, price=g_price, log_price=g_log,
+        dlog_price=dlog, z_dlog_price=z, source=best,
+    )
+
+
+def bucket_ns_of(bucket_freq: str) -> int:
+    return int(pd.Timedelta(pd.tseries.frequencies.to_offset(bucket_freq)).value)
+
+
+def _nullable(arr: np.ndarray) -> list:
+    return [None if v != v else v for v in arr.tolist()]
+
+
+def write_preprocessed_series(job, series: PreprocessedSeries) -> int:
+    """覆盖写入某 Job 的 AutomlPreprocessedSeries（调用方负责事务）"""
+    from django.db import connection
+    from django.utils import timezone
+    from AppleStockChecker.models import AutomlPreprocessedSeries
+
+    AutomlPreprocessedSeries.objects.filter(job=job).delete()
+    if series.size == 0:
+        return 0
+
+    buckets = series.bucket_datetimes()
+    sources = series.source_labels().tolist()
+    dlog, z = _nullable(series.dlog_price), _nullable(series.z_dlog_price)
+
+    if connection.vendor == "postgresql":
+        table = AutomlPreprocessedSeries._meta.db_table
+        with connection.cursor() as cur:
+            cur.execute(
+                f'INSERT INTO "{table}" '
+                "(job_id, shop_id, iphone_id, bucket_ts, raw_price, log_price, dlog_price, z_dlog_price, "
+                "price_source, created_at) "
+                "SELECT %s, s, %s, b, p, l, d, z, src, %s FROM unnest("
+                "%s::bigint[], %s::timestamptz[], %s::float8[], %s::float8[], %s::float8[], %s::float8[], "
+                "%s::varchar[]) AS t(s, b, p, l, d, z, src)",
+                [job.pk, job.iphone_id, timezone.now(),
+                 series.shop_id.tolist(), buckets, series.price.tolist(), series.log_price.tolist(),
+                 dlog, z, sources],
+            )
+    else:
+        AutomlPreprocessedSeries.objects.bulk_create(
+            [
+                AutomlPreprocessedSeries(
+                    job=job, shop_id=s, iphone_id=job.iphone_id, bucket_ts=b, raw_price=p,
+                    log_price=l, dlog_price=d, z_dlog_price=zz, price_source=src,
+                )
+                for s, b, p, l, d, zz, src in zip(
+                    series.shop_id.tolist(), buckets, series.price.tolist(), series.log_price.tolist(),
+                    dlog, z, sources,
+                )
+            ],
+            batch_size=1000,
+        )
+    return series.size
+
+
+def preprocess_jobs(jobs, data: Optional[PstaArrays] = None) -> Dict[int, PreprocessedSeries]:
+    """
+    同一 iPhone 的多个窗口（如滑动窗口分析）共用一次 PSTA 读取。
+
+    Returns
+    -------
+    {job_id: PreprocessedSeries}
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return {}
+    if len({j.iphone_id for j in jobs}) != 1:
+        raise ValueError("preprocess_jobs: jobs must share one iphone")
+    if data is None:
+        data = load_psta_arrays(
+            jobs[0].iphone_id,
+            min(j.window_start for j in jobs),
+            max(j.window_end for j in jobs),
+        )
+    out = {}
+    for job in jobs:
+        out[job.pk] = preprocess_window(
+            data,
+            pd.Timestamp(job.window_start).as_unit("ns").value,
+            pd.Timestamp(job.window_end).as_unit("ns").value,
+            bucket_ns_of(job.bucket_freq),
+        )
+    return out
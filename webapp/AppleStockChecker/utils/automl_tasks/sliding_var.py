@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+滑动窗口 VAR / Granger 引擎（共享充分统计量）
+
+SlidingWindowAnalysisView 的窗口之间重叠通常超过 90%，逐 Job 各自读表、透视、拟合 VAR
+会把同一段数据重复处理几十上百次。这里改为：
+
+  1. 整个分析区间只构建一次 (时间 × 店铺) z-dlog 面板（build_panel）；
+  2. 每行展开为增广向量 u_t = [1, y_t, y_{t-1}, ..., y_{t-P}]，窗口内的叉积和
+     M = Σ u_t u_tᵀ 随窗口滑动增量维护（加入新行、减去移出的行）；
+  3. 每个窗口的 VAR 定阶 / 拟合与两两 Granger F 检验都只是 M 的子矩阵上的正规方程求解，
+     窗口内标准化、去常数列 / 高相关列也由 M 的 0 阶块直接算出（仿射变换 A M Aᵀ）；
+  4. 窗口按连续区段切分给线程池，区段内共享增量统计；计算集中在 NumPy 矩阵运算（释放 GIL），
+     Celery prefork worker（daemon 进程，不能再 fork）里同样能并行。
+
+与逐 Job 实现（statsmodels VAR.fit(ic="aic") + grangercausalitytests 的 ssr_ftest）
+在同一面板上数值一致；差异仅在面板清洗：缺失补齐与行过滤在整个区间上做一次，
+而不是每个窗口各做一次，也不再为条件数注入随机噪声。
+"""
+from __future__ import annotations
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+MAX_VAR_LAGS = 12
+MAX_GRANGER_LAGS = 5
+MIN_ROWS = 20
+SIGNIFICANCE = 0.05
+# 增量更新每隔若干窗口整段重算一次，避免加减累积的舍入误差
+REANCHOR_EVERY = 32
+
+
+@dataclass
+class SlidingPanel:
+    """整个分析区间的 z-dlog 面板（已做缺失补齐与行过滤）"""
+    ts: np.ndarray        # int64 ns，行时间戳（升序）
+    shop_ids: np.ndarray  # int64，列顺序
+    values: np.ndarray    # (T, S) float64
+
+    def window_rows(self, start_ns: int, end_ns: int) -> Tuple[int, int]:
+        lo, hi = np.searchsorted(self.ts, [start_ns, end_ns], side="left")
+        return int(lo), int(hi)
+
+
+def build_panel(series) -> SlidingPanel:
+    """
+    PreprocessedSeries → 面板；清洗规则与逐 Job 实现相同：
+    ffill(limit=2) → 每行至少 70% 店铺有值 → 其余缺失填 0（z-score 的均值）
+    """
+    df = pd.DataFrame({"shop_id": series.shop_id, "bucket": series.bucket, "z": series.z_dlog_price})
+    wide = df.pivot_table(index="bucket", columns="shop_id", values="z").sort_index()
+    wide = wide.ffill(limit=2)
+    min_shops = max(2, int(0.7 * wide.shape[1]))
+    wide = wide.dropna(thresh=min_shops).fillna(0)
+    return SlidingPanel(
+        ts=wide.index.to_numpy(dtype=np.int64),
+        shop_ids=wide.columns.to_numpy(dtype=np.int64),
+        values=wide.to_numpy(dtype=np.float64),
+    )
+
+
+def lagged_design(values: np.ndarray, max_lag: int = MAX_VAR_LAGS) -> np.ndarray:
+    """u_t = [1, y_t, y_{t-1}, ..., y_{t-max_lag}]；面板起点之前的滞后值为 0（只会出现在被减掉的头部行中）"""
+    T, S = values.shape
+    U = np.zeros((T, 1 + S * (max_lag + 1)))
+    U[:, 0] = 1.0
+    for j in range(max_lag + 1):
+        U[j:, 1 + S * j:1 + S * (j + 1)] = values[:T - j]
+    return U
+
+
+def iter_window_moments(U: np.ndarray, bounds: Sequence[Tuple[int, int]]):
+    """
+    依次产出每个窗口 [a, b) 的 M = U[a:b]ᵀ U[a:b]。
+
+    窗口两端单调右移时只对新增 / 移出的行做增量；否则（或每 REANCHOR_EVERY 个窗口）整段重算。
+    产出的数组在下一次迭代时会被原地修改，调用方需要保留时自行 copy。
+    """
+    M = None
+    lo = hi = since = 0
+    for a, b in bounds:
+        if M is None or a < lo or b < hi or a >= hi or since >= REANCHOR_EVERY:
+            M = U[a:b].T @ U[a:b]
+            since = 0
+        else:
+            if b > hi:
+                M += U[hi:b].T @ U[hi:b]
+            if a > lo:
+                M -= U[lo:a].T @ U[lo:a]
+            since += 1
+        lo, hi = a, b
+        yield M
+
+
+def _solve(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    try:
+        return np.linalg.solve(a, b)
+    except np.linalg.LinAlgError:
+        return np.linalg.pinv(a) @ b
+
+
+def _ols(Mz: np.ndarray, k: int, lags: int):
+    """常数 + 1..lags 阶滞后对当期回归；返回 (B, SSR 矩阵)"""
+    x = np.r_[0, 1 + k + np.arange(k * lags)]
+    y = 1 + np.arange(k)
+    xty = Mz[np.ix_(x, y)]
+    B = _solve(Mz[np.ix_(x, x)], xty)
+    return B, Mz[np.ix_(y, y)] - xty.T @ B
+
+
+def _info_criteria(ssr: np.ndarray, nobs: int, k: int, lags: int) -> Tuple[float, float]:
+    """与 statsmodels VARResults.info_criteria 相同：logdet(Σ_mle) + 惩罚项"""
+    sign, ld = np.linalg.slogdet(ssr / nobs)
+    if sign <= 0:
+        ld = -np.inf
+    free = lags * k * k + k
+    return float(ld + 2.0 / nobs * free), float(ld + np.log(nobs) / nobs * free)
+
+
+def granger_fstats(Mz: np.ndarray, nobs: int, k: int, lags: int):
+    """
+    所有有序店铺对的二元 Granger ssr F 统计量（批量正规方程）。
+
+    Returns
+    -------
+    (cause_idx, effect_idx, F, df_denom)
+    """
+    cause, effect = np.nonzero(~np.eye(k, dtype=bool))
+    lag_cols = 1 + k * np.arange(1, lags + 1)
+    x_r = np.column_stack([np.zeros(cause.size, dtype=np.int64), lag_cols[None, :] + effect[:, None]])
+    x_u = np.concatenate([x_r, lag_cols[None, :] + cause[:, None]], axis=1)
+    y = 1 + effect
+
+    def _ssr(x):
+        xtx = Mz[x[:, :, None], x[:, None, :]]
+        xty = Mz[x, y[:, None]]
+        beta = _solve(xtx, xty[..., None])[..., 0]
+        return Mz[y, y] - np.einsum("pq,pq->p", xty, beta)
+
+    ssr_r, ssr_u = _ssr(x_r), _ssr(x_u)
+    df_denom = nobs - 2 * lags - 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        F = (ssr_r - ssr_u) / lags / (ssr_u / df_denom)
+    return cause, effect, F, df_denom
+
+
+def _f_pvalues(F: np.ndarray, dfn: int, dfd: int) -> np.ndarray:
+    from scipy.stats import f as f_dist
+
+    return f_dist.sf(F, dfn, dfd)
+
+
+def _drop_collinear(cov: np.ndarray, std: np.ndarray) -> np.ndarray:
+    """去掉方差≈0 的列与 |corr| > 0.999 的重复列（保留先出现的一列），返回保留列下标"""
+    idx = np.flatnonzero(std >= 1e-8)
+    if idx.size < 2:
+        return idx
+    corr = np.abs(cov[np.ix_(idx, idx)] / np.outer(std[idx], std[idx]))
+    np.fill_diagonal(corr, 0)
+    dropped = set()
+    for i in range(idx.size):
+        if i in dropped:
+            continue
+        dropped.update(int(j) for j in np.flatnonzero(corr[i] > 0.999) if j != i)
+    return np.array([c for i, c in enumerate(idx) if i not in dropped], dtype=np.int64)
+
+
+def fit_window(U: np.ndarray, M: np.ndarray, a: int, b: int, shop_ids: np.ndarray) -> dict:
+    """
+    在窗口 [a, b) 上完成 VAR 定阶 / 拟合与 Granger 检验。
+
+    窗口内标准化与逐 Job 实现一致（每列减均值除以样本标准差），
+    以仿射变换 A 作用在叉积上：M_z = A M Aᵀ，不需要回到原始行。
+    """
+    n = b - a
+    S = shop_ids.size
+    if n < MIN_ROWS or S < 2:
+        return {"status": "skipped", "reason": "insufficient_data"}
+
+    y0 = slice(1, 1 + S)
+    mean = M[0, y0] / n
+    cov = (M[y0, y0] - n * np.outer(mean, mean)) / (n - 1)
+    std = np.sqrt(np.clip(np.diag(cov), 0, None))
+
+    if np.count_nonzero(std >= 1e-8) < 2:
+        return {"status": "skipped", "reason": "insufficient_variance"}
+    cols = _drop_collinear(cov, std)
+    if cols.size < 2:
+        return {"status": "skipped", "reason": "excessive_correlation"}
+
+    k = cols.size
+    p_max = min(MAX_VAR_LAGS, n // 5)
+    A = np.zeros((1 + k * (p_max + 1), M.shape[0]))
+    A[0, 0] = 1.0
+    for j in range(p_max + 1):
+        rows = 1 + k * j + np.arange(k)
+        A[rows, 1 + S * j + cols] = 1.0 / std[cols]
+        A[rows, 0] = -mean[cols] / std[cols]
+
+    def moments(skip: int):
+        # 样本为 [a+skip, b)：减去窗口头部 skip 行
+        head = U[a:a + skip]
+        return A @ (M - head.T @ head) @ A.T, n - skip
+
+    # 定阶：各阶共用同一样本 [a+p_max, b)（同 statsmodels select_order）
+    m_sel, n_sel = moments(p_max)
+    aics = [_info_criteria(_ols(m_sel, k, p)[1], n_sel, k, p)[0] for p in range(p_max + 1)]
+    lag = int(np.argmin(aics))
+
+    m_fit, nobs = moments(lag)
+    B, ssr = _ols(m_fit, k, lag)
+    aic, bic = _info_criteria(ssr, nobs, k, lag)
+    coefs = B[1:].reshape(lag, k, k).transpose(0, 2, 1)
+
+    granger = []
+    maxlag = min(MAX_GRANGER_LAGS, lag)
+    if maxlag >= 1 and n >= maxlag + 5:
+        pvalues = []
+        for L in range(1, maxlag + 1):
+            m_l, n_l = moments(L)
+            cause, effect, F, dfd = granger_fstats(m_l, n_l, k, L)
+            pvalues.append(_f_pvalues(F, L, dfd))
+        for p_idx, (c, e) in enumerate(zip(cause.tolist(), effect.tolist())):
+            by_lag = {str(L): float(pvalues[L - 1][p_idx]) for L in range(1, maxlag + 1)}
+            min_p, best_lag = 1.0, None
+            for L in range(1, maxlag + 1):
+                if by_lag[str(L)] < min_p:
+                    min_p, best_lag = by_lag[str(L)], L
+            granger.append({
+                "cause": int(shop_ids[cols[c]]),
+                "effect": int(shop_ids[cols[e]]),
+                "maxlag": maxlag,
+                "pvalues_by_lag": by_lag,
+                "min_pvalue": min_p,
+                "best_lag": best_lag,
+                "is_significant": min_p < SIGNIFICANCE,
+                "weight": float(np.abs(coefs[:, e, c]).sum()),
+            })
+
+    return {
+        "status": "success",
+        "shop_ids": [int(s) for s in shop_ids[cols]],
+        "lag_order": lag,
+        "coefs": coefs,
+        "aic": aic,
+        "bic": bic,
+        "sample_size": n,
+        "granger": granger,
+    }
+
+
+def _run_chunk(U: np.ndarray, shop_ids: np.ndarray, bounds: List[Tuple[int, int]]) -> List[dict]:
+    out = []
+    for (a, b), M in zip(bounds, iter_window_moments(U, bounds)):
+        try:
+            out.append(fit_window(U, M, a, b, shop_ids))
+        except Exception as e:
+            logger.warning(f"sliding window [{a}, {b}) failed: {e}", exc_info=True)
+            out.append({"status": "failed", "error": f"{type(e).__name__}: {e}"})
+    return out
+
+
+def analyze_windows(
+    panel: SlidingPanel,
+    windows: Sequence[Tuple[int, int]],
+    *,
+    max_workers: Optional[int] = None,
+) -> List[dict]:
+    """
+    对 [(start_ns, end_ns), ...] 逐窗口拟合 VAR + Granger，结果与 windows 顺序一致。
+
+    窗口按起点排序后切成连续区段，每个区段一个线程、区段内共享增量叉积；
+    max_workers 默认 settings.AUTOML_SLIDING_WORKERS（0 = CPU 数），<=1 时串行执行。
+    """
+    from django.conf import settings
+
+    if not windows:
+        return []
+    order = sorted(range(len(windows)), key=lambda i: windows[i])
+    bounds = [panel.window_rows(*windows[i]) for i in order]
+
+    if max_workers is None:
+        max_workers = int(getattr(settings, "AUTOML_SLIDING_WORKERS", 0) or os.cpu_count() or 1)
+    workers = max(1, min(max_workers, len(bounds)))
+
+    U = lagged_design(panel.values)
+    if workers == 1:
+        results = _run_chunk(U, panel.shop_ids, bounds)
+    else:
+        chunks = [[bounds[i] for i in c] for c in np.array_split(np.arange(len(bounds)), workers)]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            parts = pool.map(lambda chunk: _run_chunk(U, panel.shop_ids, chunk), chunks)
+            results = [r for part in parts for r in part]
+
+    out: List[Optional[dict]] = [None] * len(windows)
+    for pos, i in enumerate(order):
+        out[i] = results[pos]
+    return out
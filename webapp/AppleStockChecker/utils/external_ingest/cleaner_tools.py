@@ -4,7 +4,9 @@
 提供数据库访问、数据转换等通用功能
 """
 from __future__ import annotations
+from contextlib import contextmanager
 from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import Any, Callable, Dict, List, Optional, Tuple, Union, Pattern
 import logging
 import os
@@ -17,6 +19,8 @@ import pandas as pd
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime, parse_date
 
+from .iphone_catalog import IphoneCatalog, get_iphone_catalog, invalidate_iphone_catalog  # noqa: F401
+
 
 def to_int_yen(s: object) -> Optional[int]:
     if s is None: return None
@@ -71,6 +75,34 @@ OLLAMA_MODEL_ID = os.getenv("OLLAMA_MODEL_ID") or os.getenv("OLLAMA_MODEL", "qwe
 EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "regex")  # "regex" | "llm" | "auto"
 
 
+# ----------------------------------------------------------------------
+# 正则命中统计（run_cleaners_parallel 的 regex_hits 指标）
+# ----------------------------------------------------------------------
+_regex_rows: Optional[set] = None
+
+
+@contextmanager
+def regex_hit_scope():
+    """
+    在一次清洗内收集正则流水线实际匹配成功的输入行；退出后 yield 的集合即为本次结果。
+
+    Celery prefork worker 同一时刻只跑一个任务，进程级收集器按清洗重置即可。
+    """
+    global _regex_rows
+    prev, _regex_rows = _regex_rows, set()
+    try:
+        yield _regex_rows
+    finally:
+        _regex_rows = prev
+
+
+def note_regex_hit(shop: str, row: Any) -> None:
+    """正则流水线在输入行 row 上匹配成功；同一行多次调用（如分块解析）只计一次。作用域外调用无开销"""
+    rows = _regex_rows
+    if rows is not None:
+        rows.add((shop, row))
+
+
 # ----------------------------------------------------------------------
 # langextract 统一导入（各 shop 共用）
 # ----------------------------------------------------------------------
@@ -345,10 +377,23 @@ def _truncate_for_log(s: str, n: int = 200) -> str:
     return t[:n] + f"... (truncated, total_length={len(t)})"
 
 
+# 文本归一化函数的记忆化容量：标签 / 备注文本在同一文件及相邻批次间大量重复
+_TEXT_MEMO_SIZE = 65536
+
+_WS_ALL_RE = re.compile(r"[\s\u3000]+")
+
+
 def _norm_strip(s: str) -> str:
     """颜色匹配用归一化：去空格 + 转小写（用于 shop3/4/7/9/11/12/14/15/16/17）"""
-    t = (s or "").strip()
-    t = re.sub(r"[\s\u3000]+", "", t)  # 去除所有空白（含全角空格）
+    if not isinstance(s, str):
+        s = s or ""
+    return _norm_strip_cached(s)
+
+
+@lru_cache(maxsize=_TEXT_MEMO_SIZE)
+def _norm_strip_cached(s: str) -> str:
+    t = s.strip()
+    t = _WS_ALL_RE.sub("", t)  # 去除所有空白（含全角空格）
     return t.lower()
 
 
@@ -985,27 +1030,36 @@ _OTHER_EMOJI_PAT = re.compile(
     r"\U0001F300-\U0001F6FF\U0001F900-\U0001F9FF"  # Pictographs, Supplemental
     r"\u2300-\u23FF\u2B50\uFE00-\uFE0F\u200D\u200C]"
 )
+_CONTROL_CHARS_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f\u0080-\u009f]")
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
 
 
 def normalize_text_stage0(text: str) -> str:
     """
     阶段0 公用转换：Unicode 归一化、HTML 清理、emoji 清理、去控制字符。
     各 shop 在取到原始文本后立即调用，再传入全色检测与阶段1。
+    整列处理请用 normalize_text_stage0_series。
     """
     if text is None or not isinstance(text, str):
         return "" if text is None else str(text)
-    s = str(text)
+    return _normalize_text_stage0_cached(text)
+
+
+@lru_cache(maxsize=_TEXT_MEMO_SIZE)
+def _normalize_text_stage0_cached(s: str) -> str:
     # 1. 去控制字符（保留 \\t \\n \\r）
-    s = re.sub(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f\u0080-\u009f]", "", s)
+    s = _CONTROL_CHARS_RE.sub("", s)
+    if s.isascii():
+        # 纯 ASCII：NFKC 不变、不含 emoji，只剩 HTML 清理
+        return _HTML_TAG_RE.sub("", s)
     # 2. Unicode NFKC 归一化
     s = unicodedata.normalize("NFKC", s)
     # 3. HTML 标签清理
-    s = re.sub(r"<[^>]+>", "", s)
+    s = _HTML_TAG_RE.sub("", s)
     # 4. Emoji：减号类 → 标准减号
-    s = _MINUS_EMOJI_PAT.sub("-", s)
+    s = s.replace("\u2796", "-")
     # 5. 其他 emoji → 删除
-    s = _OTHER_EMOJI_PAT.sub("", s)
-    return s
+    return _OTHER_EMOJI_PAT.sub("", s)
 
 
 # 全角→半角 完整变换表（数字、标点、货币、日文符号）
@@ -1025,6 +1079,8 @@ _FZ_TO_HZ_TRANS = str.maketrans({
     # Unicode 变体
     '−': '-',  # U+2212 MINUS SIGN
 })
+_FZ_TO_HZ_NL_TRANS = {**_FZ_TO_HZ_TRANS, ord("\r"): " ", ord("\n"): " "}
+_WS_RE = re.compile(r"\s+")
 
 
 def normalize_text_basic(
@@ -1057,20 +1113,34 @@ def normalize_text_basic(
     """
     if text is None:
         return ""
+    return _normalize_text_basic_cached(
+        str(text), fullwidth_to_halfwidth, remove_newlines, collapse_spaces, strip
+    )
 
-    s = str(text)
 
-    # 1. 全角→半角
-    if fullwidth_to_halfwidth:
-        s = s.translate(_FZ_TO_HZ_TRANS)
+@lru_cache(maxsize=_TEXT_MEMO_SIZE)
+def _normalize_text_basic_cached(
+    s: str,
+    fullwidth_to_halfwidth: bool,
+    remove_newlines: bool,
+    collapse_spaces: bool,
+    strip: bool,
+) -> str:
+    # 默认参数下 全角→半角 与 去换行 合并为一次 translate（\r\n → 两个空格，随后被合并）
+    if fullwidth_to_halfwidth and remove_newlines and collapse_spaces:
+        s = s.translate(_FZ_TO_HZ_NL_TRANS)
+    else:
+        # 1. 全角→半角
+        if fullwidth_to_halfwidth:
+            s = s.translate(_FZ_TO_HZ_TRANS)
 
-    # 2. 去除换行（转为空格，保持单词间隔）
-    if remove_newlines:
-        s = s.replace("\r\n", " ").replace("\r", " ").replace("\n", " ")
+        # 2. 去除换行（转为空格，保持单词间隔）
+        if remove_newlines:
+            s = s.replace("\r\n", " ").replace("\r", " ").replace("\n", " ")
 
     # 3. 合并多个空格
     if collapse_spaces:
-        s = re.sub(r"\s+", " ", s)
+        s = _WS_RE.sub(" ", s)
 
     # 4. Strip
     if strip:
@@ -1079,6 +1149,43 @@ def normalize_text_basic(
     return s
 
 
+# ----------------------------------------------------------------------
+# 列级归一化（整列一次完成，供清洗器在逐行循环前预处理）
+# 只有阶段0 作用于原始单元格；normalize_text_basic / _norm_strip 作用于循环内切出的片段，靠 LRU 记忆化
+# ----------------------------------------------------------------------
+
+def _map_unique(values: pd.Series, transform: Callable[[pd.Series], pd.Series]) -> pd.Series:
+    """只对去重后的取值做 transform，再映射回原列（保留原 index）"""
+    # 不用 pd.factorize：其字符串哈希在遇到 \x00 时会截断，含控制字符的文本会被错误合并
+    items = values.tolist()
+    uniques = list(dict.fromkeys(items))
+    lookup = dict(zip(uniques, transform(pd.Series(uniques, dtype=object)).tolist()))
+    return pd.Series([lookup[v] for v in items], index=values.index, dtype=object)
+
+
+def _as_text_series(values: pd.Series) -> pd.Series:
+    """与逐元素版本一致的字符串化：None → ""，其余非字符串 → str(v)"""
+    return values.map(lambda v: v if isinstance(v, str) else ("" if v is None else str(v)))
+
+
+def normalize_text_stage0_series(values: pd.Series) -> pd.Series:
+    """
+    normalize_text_stage0 的列级版本，结果与逐元素调用完全一致。
+
+    用 pandas .str（normalize / replace）在去重后的取值上一次完成。
+    """
+    def _transform(u: pd.Series) -> pd.Series:
+        return (
+            u.str.replace(_CONTROL_CHARS_RE, "", regex=True)
+            .str.normalize("NFKC")
+            .str.replace(_HTML_TAG_RE, "", regex=True)
+            .str.replace("\u2796", "-", regex=False)
+            .str.replace(_OTHER_EMOJI_PAT, "", regex=True)
+        )
+
+    return _map_unique(_as_text_series(values), _transform)
+
+
 def safe_to_text(value) -> str:
     """
     安全地将任意值转为字符串，处理 NaN/None/空值
@@ -1243,7 +1350,11 @@ def coerce_amount_yen(v) -> Optional[int]:
         except Exception:
             return None
 
-    s = str(v).strip()
+    return _coerce_amount_yen_cached(str(v).strip())
+
+
+@lru_cache(maxsize=_TEXT_MEMO_SIZE)
+def _coerce_amount_yen_cached(s: str) -> Optional[int]:
     if not s:
         return None
 
@@ -1893,6 +2004,8 @@ def resolve_color_prices(
         key=lambda x: 0 if str(x[0]).strip() in _ALL_COLOR_LABELS else 1,
     )
     abs_specs = list(decomp.abs_specs)
+    if extraction_method == "regex" and (delta_specs or abs_specs):
+        note_regex_hit(cleaner_name, row_index)
 
     # ── 1. extraction_result 日志 ─────────────────────────────────────
     if logger:
@@ -2516,12 +2629,13 @@ def clean_with_jan_matching(
     price_ext = price_extractor_fn or extract_price_yen
     ts_ext = ts_extractor_fn or parse_dt_aware
 
-    info_df = _load_iphone17_info_df_from_db()
-    jan_map = _build_jan_map(info_df)
+    catalog = get_iphone_catalog()
+    info_df = catalog.info_df
+    jan_map = catalog.jan_map
 
     rows: List[dict] = []
 
-    for rec in iter_records_fn(df):
+    for i, rec in enumerate(iter_records_fn(df)):
         if row_filter_fn and not row_filter_fn(rec):
             continue
 
@@ -2542,6 +2656,7 @@ def clean_with_jan_matching(
             continue
 
         recorded_at = ts_ext(rec.get("time-scraped"))
+        note_regex_hit(cleaner_name, i)
 
         rows.append({
             "part_number": str(part_number),
@@ -2595,7 +2710,7 @@ def clean_with_model_capacity_matching(
         若提供且返回非 None 且 color_map 匹配成功，输出 1 行（不展开全色）
         优先级高于 pn_extractor_fn
     row_filter_fn : 可选的行级过滤（接收 row Series/dict，返回 True 保留）
-    add_model_norm : 传递给 _load_iphone17_info_df_from_db
+    add_model_norm : 兼容旧参数；(型号, 容量) 分组统一取自 get_iphone_catalog()
     coerce_price : assemble_output_df 的参数
     """
     _logger = logging.getLogger(f"cleaner_tools.{cleaner_name}")
@@ -2614,20 +2729,12 @@ def clean_with_model_capacity_matching(
     model_norm_fn = model_normalizer_fn or _normalize_model_generic
     price_ext = price_extractor_fn or extract_price_yen
 
-    info_df = _load_iphone17_info_df_from_db(add_model_norm=add_model_norm)
-    if not add_model_norm:
-        info_df = info_df.copy()
-        info_df["model_name_norm"] = info_df["model_name"].map(_normalize_model_generic)
-        info_df["capacity_gb"] = pd.to_numeric(info_df["capacity_gb"], errors="coerce").astype("Int64")
-
-    groups = (
-        info_df.groupby(["model_name_norm", "capacity_gb"])["part_number"]
-        .apply(list).to_dict()
-    )
+    catalog = get_iphone_catalog()
+    groups = catalog.groups
 
     color_map: Optional[Dict] = None
     if model_cap_color_extractor_fn:
-        color_map = _build_color_map(info_df)
+        color_map = catalog.color_map
 
     model_norm_series = df[model_col].map(model_norm_fn)
     cap_gb_series = df[model_col].map(_parse_capacity_gb)
@@ -2673,6 +2780,7 @@ def clean_with_model_capacity_matching(
                             break
                 if matched:
                     _method = "model_cap_color"
+                    note_regex_hit(cleaner_name, i)
                     # 这里记录日志并跳过后续匹配
                     _logger.debug(
                         f"Row {i} summary",
@@ -2705,6 +2813,7 @@ def clean_with_model_capacity_matching(
                     "recorded_at": t,
                 })
                 _method = "pn_direct"
+                note_regex_hit(cleaner_name, i)
                 _logger.debug(
                     f"Row {i} summary",
                     extra={
@@ -2732,6 +2841,7 @@ def clean_with_model_capacity_matching(
         pn_list = groups.get((m_norm, int(c_gb)), [])
         if not pn_list:
             continue
+        note_regex_hit(cleaner_name, i)
 
         for pn in pn_list:
             rows.append({
@@ -2822,8 +2932,9 @@ def setup_color_cleaner(
                              start_time=start_time, log_seq=_log_seq)
         return None, pd.DataFrame(columns=_OUTPUT_COLUMNS)
 
-    info_df = _load_iphone17_info_df_from_db()
-    color_map = _build_color_map(info_df)
+    catalog = get_iphone_catalog()
+    info_df = catalog.info_df
+    color_map = catalog.color_map
 
     ctx = ColorCleanerContext(
         cleaner_name=cleaner_name,
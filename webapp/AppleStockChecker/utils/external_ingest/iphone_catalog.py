@@ -0,0 +1,117 @@
+# AppleStockChecker/utils/external_ingest/iphone_catalog.py
+"""
+进程级 iPhone 机型目录缓存（各 shop 清洗器共用）
+
+清洗器每次调用都要读整张 Iphone 表并重建 JAN / 颜色 / (型号, 容量) 查找表；
+这里把它们算一次后缓存在进程内，由以下任一条件失效：
+  - Iphone post_save / post_delete 信号（本进程内立即失效，版本号 +1）
+  - 超过 CLEANER_IPHONE_CATALOG_TTL 秒（其他进程——如 Celery worker——的改动靠它兜底）
+
+缓存的 DataFrame / dict 为多个清洗器共享，调用方只读，需要修改时先 copy()。
+"""
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+
+@dataclass(frozen=True)
+class IphoneCatalog:
+    """iPhone 机型目录快照
+
+    Attributes:
+        version: 构建时的版本号（每次失效 +1）
+        info_df: 同 _load_iphone17_info_df_from_db()
+        info_df_norm: 同 _load_iphone17_info_df_from_db(add_model_norm=True)
+        jan_map: { jan_digits -> part_number }
+        color_map: (model_norm, cap_gb) -> { color_norm: (part_number, color_raw) }
+        groups: (model_norm, cap_gb) -> [part_number, ...]（全色展开用）
+        synonyms: 归一化颜色同义词 lookup（SYNONYM_LOOKUP_NORM）
+    """
+    version: int
+    built_at: float
+    info_df: pd.DataFrame
+    info_df_norm: pd.DataFrame
+    jan_map: Dict[str, str]
+    color_map: Dict[Tuple[str, int], Dict[str, Tuple[str, str]]]
+    groups: Dict[Tuple[str, int], List[str]]
+    synonyms: Dict[str, List[str]]
+
+    def frame(self, add_model_norm: bool = False) -> pd.DataFrame:
+        return self.info_df_norm if add_model_norm else self.info_df
+
+
+_lock = threading.Lock()
+_version = 0
+_catalog: Optional[IphoneCatalog] = None
+
+
+def get_iphone_catalog() -> IphoneCatalog:
+    """
+    取当前进程的 iPhone 目录；缓存缺失、已失效或过期时从数据库重建。
+
+    Raises:
+        ValueError: 数据库中没有 iPhone 数据（同 _load_iphone17_info_df_from_db）
+    """
+    from django.conf import settings
+
+    ttl = float(getattr(settings, "CLEANER_IPHONE_CATALOG_TTL", 300))
+    cat = _catalog
+    if cat is not None and cat.version == _version and time.monotonic() - cat.built_at < ttl:
+        return cat
+
+    with _lock:
+        cat = _catalog
+        if cat is not None and cat.version == _version and time.monotonic() - cat.built_at < ttl:
+            return cat
+        return _rebuild(_version)
+
+
+def invalidate_iphone_catalog() -> int:
+    """使缓存失效，返回新的版本号"""
+    global _version, _catalog
+    with _lock:
+        _version += 1
+        _catalog = None
+        return _version
+
+
+def _rebuild(version: int) -> IphoneCatalog:
+    global _catalog
+    from .cleaner_tools import (
+        SYNONYM_LOOKUP_NORM,
+        _build_color_map,
+        _build_jan_map,
+        _load_iphone17_info_df_from_db,
+    )
+
+    info_df = _load_iphone17_info_df_from_db()
+    info_df_norm = _load_iphone17_info_df_from_db(add_model_norm=True)
+
+    groups: Dict[Tuple[str, int], List[str]] = {}
+    for (m, cap), pns in info_df_norm.groupby(["model_name_norm", "capacity_gb"])["part_number"]:
+        groups[(m, int(cap))] = list(pns)
+
+    _catalog = IphoneCatalog(
+        version=version,
+        built_at=time.monotonic(),
+        info_df=info_df,
+        info_df_norm=info_df_norm,
+        jan_map=_build_jan_map(info_df),
+        color_map=_build_color_map(info_df),
+        groups=groups,
+        synonyms=SYNONYM_LOOKUP_NORM,
+    )
+    return _catalog
+
+
+@receiver(post_save, sender="AppleStockChecker.Iphone", dispatch_uid="iphone_catalog_post_save")
+@receiver(post_delete, sender="AppleStockChecker.Iphone", dispatch_uid="iphone_catalog_post_delete")
+def _on_iphone_changed(**kwargs):
+    invalidate_iphone_catalog()
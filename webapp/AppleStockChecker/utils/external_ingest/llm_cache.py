@@ -0,0 +1,221 @@
+# AppleStockChecker/utils/external_ingest/llm_cache.py
+"""
+LLM（LangExtract / Ollama）抽取结果的持久化缓存
+
+各 llm_shopN 模块逐行调用本地模型，而同一份标签文本每次抓取都会重复出现。
+cached_lx_extract(shop, **kwargs) 替代 lx.extract(**kwargs)，
+以 (shop, 归一化文本, prompt 版本, model_id) 为键把抽取结果存入 SQLite，命中即不再请求模型。
+
+缓存的是 extractions 的可序列化快照（extraction_class / extraction_text / attributes /
+extraction_index / char_interval），命中时还原为只读对象，调用方按 getattr 访问不受影响。
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from types import SimpleNamespace
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# ----------------------------------------------------------------------
+# 缓存键
+# ----------------------------------------------------------------------
+
+# 按 (prompt, id(examples)) 记忆指纹, 省去每次 repr(examples)；有界 LRU，
+# 各店铺的示例构造函数都带 lru_cache，常驻的示例对象始终命中，临时对象也不会无限堆积
+_PROMPT_MEMO_SIZE = 64
+_prompt_versions: "OrderedDict[tuple, tuple]" = OrderedDict()
+_prompt_lock = threading.Lock()
+
+
+def _normalize_text(text: Any) -> str:
+    """NFC + 去尾部空白（不改变前部字符位置，char_interval 仍然有效）"""
+    return unicodedata.normalize("NFC", str(text or "")).rstrip()
+
+
+def prompt_version(prompt: str, examples: Any) -> str:
+    """prompt 文本 + few-shot 示例的指纹；改动任一即视为新版本"""
+    memo_key = (prompt, id(examples))
+    with _prompt_lock:
+        hit = _prompt_versions.get(memo_key)
+        # 保存对象本身再比对身份：id 可能被回收后的新对象复用
+        if hit is not None and hit[0] is examples:
+            _prompt_versions.move_to_end(memo_key)
+            return hit[1]
+    digest = hashlib.sha256((str(prompt) + "\x00" + repr(examples)).encode("utf-8")).hexdigest()[:16]
+    with _prompt_lock:
+        _prompt_versions[memo_key] = (examples, digest)
+        _prompt_versions.move_to_end(memo_key)
+        while len(_prompt_versions) > _PROMPT_MEMO_SIZE:
+            _prompt_versions.popitem(last=False)
+    return digest
+
+
+def _model_id(kwargs: dict) -> str:
+    from .cleaner_tools import OLLAMA_MODEL_ID
+
+    cfg = kwargs.get("config")
+    return str(kwargs.get("model_id") or getattr(cfg, "model_id", None) or OLLAMA_MODEL_ID)
+
+
+def make_cache_key(shop: str, text: Any, prompt: str, examples: Any, model_id: str) -> str:
+    raw = "\x1f".join([shop, _normalize_text(text), prompt_version(prompt, examples), model_id])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# ----------------------------------------------------------------------
+# SQLite 存储
+# ----------------------------------------------------------------------
+
+class _SqliteStore:
+    """每线程一个连接；WAL 模式下多个 worker 进程可以同时读写同一个文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_extraction_cache ("
+                " key TEXT PRIMARY KEY, shop TEXT, prompt_version TEXT, model_id TEXT,"
+                " payload TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._conn().execute(
+            "SELECT payload FROM llm_extraction_cache WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, payload: str, *, shop: str, version: str, model_id: str) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_extraction_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (key, shop, version, model_id, payload, time.time()),
+            )
+
+
+_store: Optional[_SqliteStore] = None
+_store_lock = threading.Lock()
+
+
+def _get_store() -> Optional[_SqliteStore]:
+    global _store
+    from django.conf import settings
+
+    path = getattr(settings, "LLM_EXTRACTION_CACHE_PATH", "")
+    if not path:
+        return None
+    with _store_lock:
+        if _store is None or _store.path != str(path):
+            _store = _SqliteStore(str(path))
+        return _store
+
+
+# ----------------------------------------------------------------------
+# 结果快照
+# ----------------------------------------------------------------------
+
+def _dump_doc(doc: Any) -> dict:
+    exts = []
+    for e in (getattr(doc, "extractions", None) or []):
+        ci = getattr(e, "char_interval", None)
+        exts.append({
+            "extraction_class": getattr(e, "extraction_class", None),
+            "extraction_text": getattr(e, "extraction_text", None),
+            "attributes": dict(getattr(e, "attributes", None) or {}),
+            "extraction_index": getattr(e, "extraction_index", None),
+            "char_interval": None if ci is None else {
+                "start_pos": getattr(ci, "start_pos", None),
+                "end_pos": getattr(ci, "end_pos", None),
+            },
+        })
+    return {"text": getattr(doc, "text", None), "extractions": exts}
+
+
+def _load_doc(d: dict) -> SimpleNamespace:
+    exts = []
+    for e in d["extractions"]:
+        ci = e.get("char_interval")
+        exts.append(SimpleNamespace(**{**e, "char_interval": None if ci is None else SimpleNamespace(**ci)}))
+    return SimpleNamespace(text=d.get("text"), extractions=exts)
+
+
+def dump_result(result: Any) -> Optional[str]:
+    if result is None:
+        return None
+    if isinstance(result, list):
+        return json.dumps({"list": True, "docs": [_dump_doc(d) for d in result]}, ensure_ascii=False)
+    return json.dumps({"list": False, "docs": [_dump_doc(result)]}, ensure_ascii=False)
+
+
+def load_result(payload: str) -> Any:
+    data = json.loads(payload)
+    docs = [_load_doc(d) for d in data["docs"]]
+    return docs if data["list"] else docs[0]
+
+
+# ----------------------------------------------------------------------
+# 入口
+# ----------------------------------------------------------------------
+
+def cached_lx_extract(shop: str, **kwargs) -> Any:
+    """
+    带持久缓存的 lx.extract(**kwargs)。
+
+    Parameters
+    ----------
+    shop : 店铺标识（缓存键的一部分，如 "shop11"）
+    **kwargs : 原样传给 lx.extract；text_or_documents / prompt_description / examples /
+        model_id（或 config.model_id）参与缓存键
+
+    Returns
+    -------
+    lx.extract 的结果；命中缓存时为等价的只读快照。模型调用异常原样抛出且不缓存。
+    """
+    from .cleaner_tools import lx
+
+    store = _get_store()
+    key = version = model_id = None
+    if store is not None:
+        prompt = kwargs.get("prompt_description") or ""
+        examples = kwargs.get("examples")
+        model_id = _model_id(kwargs)
+        version = prompt_version(prompt, examples)
+        key = make_cache_key(shop, kwargs.get("text_or_documents"), prompt, examples, model_id)
+        try:
+            payload = store.get(key)
+        except sqlite3.Error as e:
+            logger.warning(f"LLM 缓存读取失败: {e}")
+            payload = None
+        if payload is not None:
+            return load_result(payload)
+
+    result = lx.extract(**kwargs)
+
+    if store is not None:
+        payload = dump_result(result)
+        if payload is not None:
+            try:
+                store.put(key, payload, shop=shop, version=version, model_id=model_id)
+            except sqlite3.Error as e:
+                logger.warning(f"LLM 缓存写入失败: {e}")
+    return result
+
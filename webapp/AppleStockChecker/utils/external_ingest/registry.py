@@ -1,6 +1,11 @@
 # AppleStockChecker/utils/external_ingest/registry.py
 from __future__ import annotations
-from typing import Dict, Protocol
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Protocol, Tuple
 import pandas as pd
 
 from .shop_cleaners_split.shop1_cleaner import clean_shop1
@@ -24,6 +29,9 @@ from .shop_cleaners_split.shop18_cleaner import clean_shop18
 from .shop_cleaners_split.shop20_cleaner import clean_shop20
 
 
+logger = logging.getLogger(__name__)
+
+
 class Cleaner(Protocol):
     def __call__(self, df: pd.DataFrame) -> pd.DataFrame: ...
 
@@ -100,3 +108,91 @@ def run_cleaner(shop_key: str, df):
     return out
 
 
+# ----------------------------------------------------------------------
+# 批量 / 并行清洗
+# ----------------------------------------------------------------------
+
+def _run_cleaner_timed(shop_key: str, df: pd.DataFrame) -> Tuple[Optional[pd.DataFrame], dict]:
+    """
+    执行一个清洗器并采集指标；异常不外抛，记入 metrics["error"]。
+
+    metrics:
+        cleaner / rows_in / rows_out / seconds / error
+        regex_hits:     正则流水线实际匹配成功的输入行数（颜色/价格规则抽取出条目，或 JAN / 型号容量匹配到 PN）
+    """
+    from .cleaner_tools import regex_hit_scope
+
+    rows_in = int(len(df)) if df is not None else 0
+    metrics = {"cleaner": shop_key, "rows_in": rows_in, "rows_out": 0, "seconds": 0.0, "error": None}
+    out = None
+    t0 = time.perf_counter()
+    with regex_hit_scope() as hits:
+        try:
+            out = run_cleaner(shop_key, df)
+        except Exception as e:
+            logger.exception(f"清洗器执行失败: {shop_key}")
+            metrics["error"] = f"{type(e).__name__}: {e}"
+    metrics["seconds"] = round(time.perf_counter() - t0, 4)
+    metrics["rows_out"] = int(len(out)) if isinstance(out, pd.DataFrame) else 0
+    metrics["regex_hits"] = len(hits)
+    return out, metrics
+
+
+def _can_fork_pool() -> bool:
+    # Celery prefork 子进程是 daemon，不能再派生子进程；非 fork 平台无法共享已构建的目录
+    if multiprocessing.current_process().daemon:
+        return False
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def run_cleaners_parallel(
+    jobs: Iterable[Tuple[str, pd.DataFrame]],
+    *,
+    max_workers: Optional[int] = None,
+) -> Tuple[List[Optional[pd.DataFrame]], List[dict]]:
+    """
+    在进程池中批量执行多个 (shop_key, DataFrame) 清洗任务。
+
+    父进程先构建 iPhone 目录（get_iphone_catalog），再以 fork 方式启动进程池，
+    子进程直接继承同一份目录（写时复制），不再各自查库。
+    fork 前关闭父进程的数据库连接，避免子进程共用同一个 socket。
+
+    Parameters
+    ----------
+    jobs : [(shop_key, df), ...]，同一清洗器可出现多次
+    max_workers : 进程数，默认 settings.CLEANER_MAX_WORKERS；<=1、任务只有一个、
+        当前进程是 daemon（Celery prefork worker）或平台不支持 fork 时在本进程串行执行
+
+    Returns
+    -------
+    (results, metrics)：与 jobs 顺序一致；失败的任务 result 为 None，metrics["error"] 为异常描述
+    """
+    from django.conf import settings
+    from django.db import connections
+
+    from .iphone_catalog import get_iphone_catalog
+
+    jobs = list(jobs)
+    if not jobs:
+        return [], []
+    if max_workers is None:
+        max_workers = int(getattr(settings, "CLEANER_MAX_WORKERS", 0) or os.cpu_count() or 1)
+    workers = max(1, min(max_workers, len(jobs)))
+
+    if workers == 1 or not _can_fork_pool():
+        pairs = [_run_cleaner_timed(k, df) for k, df in jobs]
+    else:
+        try:
+            get_iphone_catalog()
+        except Exception as e:
+            # 目录构建失败时由各子进程自行重试（并各自报错）
+            logger.warning(f"预构建 iPhone 目录失败，子进程将各自加载: {e}")
+        connections.close_all()
+        ctx = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            keys, frames = zip(*jobs)
+            pairs = list(pool.map(_run_cleaner_timed, keys, frames))
+
+    results = [out for out, _ in pairs]
+    metrics = [m for _, m in pairs]
+    return results, metrics
@@ -22,7 +22,7 @@ import pandas as pd
 
 from ...external_ingest.cleaner_tools import to_int_yen, parse_dt_aware
 from ..cleaner_tools import (
-    normalize_text_stage0,
+    normalize_text_stage0_series,
     extract_price_yen,
     _parse_capacity_gb,
     _normalize_model_generic,
@@ -148,6 +148,8 @@ def clean_shop11(df: pd.DataFrame, debug: bool = True, debug_limit: int = 30) ->
         return early
 
     df2 = df.copy().reset_index(drop=True)
+    # 阶段0 整列预处理（逐行循环内只取结果）
+    caution_stage0 = normalize_text_stage0_series(df2["caution_empty"].map(lambda v: str(v or "")))
 
     rows: List[dict] = []
 
@@ -189,7 +191,7 @@ def clean_shop11(df: pd.DataFrame, debug: bool = True, debug_limit: int = 30) ->
 
         rec_at = parse_dt_aware(time_raw)
 
-        raw_caution_shop11 = normalize_text_stage0(str(caution_raw or ""))
+        raw_caution_shop11 = caution_stage0.iat[i]
 
         # 前置：all_delta 检测（全色±N）
         agg_all_delta: Optional[int] = None
@@ -22,7 +22,7 @@ import pandas as pd
 
 from ...external_ingest.cleaner_tools import to_int_yen, parse_dt_aware
 from ..cleaner_tools import (
-    normalize_text_stage0,
+    normalize_text_stage0_series,
     normalize_text_basic,
     extract_price_yen,
     _parse_capacity_gb,
@@ -167,8 +167,10 @@ def clean_shop12(df: pd.DataFrame, debug: bool = False) -> pd.DataFrame:
         return early
 
     rows: List[dict] = []
+    # 阶段0 整列预处理（逐行循环内只取结果）
+    remark_stage0 = normalize_text_stage0_series(df["備考1"].map(lambda v: str(v or "")))
 
-    for idx, row in df.iterrows():
+    for pos, (idx, row) in enumerate(df.iterrows()):
         base_price = extract_price_yen(row.get("買取価格"))
         if base_price is None:
             continue
@@ -198,7 +200,7 @@ def clean_shop12(df: pd.DataFrame, debug: bool = False) -> pd.DataFrame:
             continue
 
         remark_raw = row.get("備考1") or ""
-        raw_remark_shop12 = _clean_color_text_1_shop12(normalize_text_stage0(str(remark_raw)))
+        raw_remark_shop12 = _clean_color_text_1_shop12(remark_stage0.iat[pos])
 
         # 前置：all_delta 检测（全色±N）
         agg_all_delta: Optional[int] = None
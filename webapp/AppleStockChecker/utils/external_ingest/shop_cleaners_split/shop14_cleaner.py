@@ -25,7 +25,7 @@ import pandas as pd
 
 from ...external_ingest.cleaner_tools import to_int_yen, parse_dt_aware
 from ..cleaner_tools import (
-    normalize_text_stage0,
+    normalize_text_stage0_series,
     detect_all_delta_unified,
     match_tokens_generic,
     normalize_text_basic,
@@ -205,10 +205,15 @@ def clean_shop14(df: "pd.DataFrame", debug: bool = True) -> "pd.DataFrame":
         return early
 
     remark_cols_map = _resolve_remark_cols(df)
+    # 阶段0 整列预处理（逐行循环内只取结果）；缺失的备注列按空文本处理
+    remark_stage0 = {
+        logical: normalize_text_stage0_series(df[actual].map(lambda v: str(v or "")))
+        for logical, actual in remark_cols_map.items() if actual
+    }
 
     rows: List[dict] = []
 
-    for idx, row in df.iterrows():
+    for pos, (idx, row) in enumerate(df.iterrows()):
         status = str(row.get("data6") or "")
         if "未開封" not in status:
             continue
@@ -237,9 +242,8 @@ def clean_shop14(df: "pd.DataFrame", debug: bool = True) -> "pd.DataFrame":
 
         raw_frags_shop14: Dict[str, str] = {}
         for logical in ("减价条件", "减价条件2", "23432"):
-            actual = remark_cols_map.get(logical)
-            raw_val = row.get(actual) if actual else None
-            raw_frags_shop14[logical] = normalize_text_stage0(str(raw_val or ""))
+            col_stage0 = remark_stage0.get(logical)
+            raw_frags_shop14[logical] = col_stage0.iat[pos] if col_stage0 is not None else ""
 
         raw_combined_shop14 = " ".join([v for v in raw_frags_shop14.values() if v.strip()]).strip()
 
@@ -22,7 +22,7 @@ from typing import Dict, List, Optional, Tuple
 import pandas as pd
 from ...external_ingest.cleaner_tools import to_int_yen, parse_dt_aware
 from ..cleaner_tools import (
-    normalize_text_stage0,
+    normalize_text_stage0_series,
     _parse_capacity_gb,
     _normalize_model_generic,
     _norm_strip,
@@ -172,8 +172,10 @@ def clean_shop15(df: pd.DataFrame, debug: bool = True) -> pd.DataFrame:
         return early
 
     rows: List[dict] = []
+    # 阶段0 整列预处理（逐行循环内只取结果）
+    price_stage0 = normalize_text_stage0_series(df[PRICE_COL])
 
-    for i, row in df.iterrows():
+    for pos, (i, row) in enumerate(df.iterrows()):
         model_text = str(row.get(MODEL_COL) or "").strip()
         if not model_text:
             continue
@@ -189,8 +191,7 @@ def clean_shop15(df: pd.DataFrame, debug: bool = True) -> pd.DataFrame:
         if not color_map:
             continue
 
-        price_text = row.get(PRICE_COL)
-        raw_price_shop15 = normalize_text_stage0("" if price_text is None else str(price_text))
+        raw_price_shop15 = price_stage0.iat[pos]
 
         base_price = _extract_base_price_at_start(raw_price_shop15)
 
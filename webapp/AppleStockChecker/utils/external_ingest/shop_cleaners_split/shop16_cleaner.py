@@ -32,7 +32,7 @@ from typing import Dict, List, Optional, Tuple
 import pandas as pd
 from ...external_ingest.cleaner_tools import to_int_yen, parse_dt_aware
 from ..cleaner_tools import (
-    normalize_text_stage0,
+    normalize_text_stage0_series,
     _parse_capacity_gb,
     _normalize_model_generic,
     _norm_strip,
@@ -242,8 +242,10 @@ def clean_shop16(df: pd.DataFrame, debug: bool = True) -> pd.DataFrame:
         return early
 
     rows: List[dict] = []
+    # 阶段0 整列预处理（逐行循环内只取结果）
+    price_stage0 = normalize_text_stage0_series(df[PRICE_COL])
 
-    for idx, row in df.iterrows():
+    for pos, (idx, row) in enumerate(df.iterrows()):
         model_cell = str(row.get(MODEL_COL) or "").strip()
         desc_cell  = str(row.get(DESC_COL)  or "").strip()
         price_cell = row.get(PRICE_COL)
@@ -265,7 +267,7 @@ def clean_shop16(df: pd.DataFrame, debug: bool = True) -> pd.DataFrame:
         if not color_map:
             continue
 
-        raw_price_shop16 = normalize_text_stage0("" if price_cell is None else str(price_cell))
+        raw_price_shop16 = price_stage0.iat[pos]
         
         # 1. Base Price（需先归一化再提取）
         price_text_norm = _clean_color_text_shop16(raw_price_shop16)
@@ -2,7 +2,7 @@ from __future__ import annotations
 from typing import Protocol, Dict, Callable, Optional, List, Tuple
 from ...external_ingest.cleaner_tools import to_int_yen, parse_dt_aware
 from ..cleaner_tools import (
-    normalize_text_stage0,
+    normalize_text_stage0_series,
     _parse_capacity_gb,
     _normalize_model_generic,
     normalize_text_basic,
@@ -191,8 +191,10 @@ def clean_shop17(df: pd.DataFrame) -> pd.DataFrame:
         return early
 
     rows: List[dict] = []
+    # 阶段0 整列预处理（逐行循环内只取结果）
+    color_stage0 = normalize_text_stage0_series(df["色減額"])
 
-    for idx, row in df.iterrows():
+    for pos, (idx, row) in enumerate(df.iterrows()):
         model_text = str(row.get("type") or "").strip()
         if not model_text:
             continue
@@ -213,8 +215,7 @@ def clean_shop17(df: pd.DataFrame) -> pd.DataFrame:
             continue
         base_price = int(base_price)
 
-        raw_color = row.get("色減額")
-        raw_color_shop17 = normalize_text_stage0("" if raw_color is None else str(raw_color))
+        raw_color_shop17 = color_stage0.iat[pos]
 
         # 1. All Delta (on raw text)
         agg_all_delta = detect_all_delta_unified(raw_color_shop17, _ALL_DELTA_RE_shop17)
@@ -24,7 +24,7 @@ from typing import Dict, List, Optional, Tuple
 import pandas as pd
 from ...external_ingest.cleaner_tools import to_int_yen, parse_dt_aware
 from ..cleaner_tools import (
-    normalize_text_stage0,
+    normalize_text_stage0_series,
     extract_price_yen,
     _parse_capacity_gb,
     _normalize_model_generic,
@@ -189,6 +189,8 @@ def clean_shop2(shop2_df: pd.DataFrame, debug: bool = True, debug_limit: int = 3
     ctx.log_seq += 1
 
     out_rows: list[dict] = []
+    # 阶段0 整列预处理（逐行循环内只取结果）
+    rule_stage0 = normalize_text_stage0_series(df["data5"].map(safe_to_text)) if "data5" in df.columns else None
 
     for pos, row in enumerate(df.to_dict("records")):
         rec_raw = row.get("time-scraped")
@@ -196,7 +198,6 @@ def clean_shop2(shop2_df: pd.DataFrame, debug: bool = True, debug_limit: int = 3
 
         raw_modelcap = _norm(row.get("data2-1"))
         raw_price = row.get("data3")
-        raw_rule = row.get("data5")
 
         if not raw_modelcap:
             log_row_skip(ctx.logger, cleaner_name=CLEANER_NAME, shop_name=SHOP_NAME,
@@ -232,7 +233,7 @@ def clean_shop2(shop2_df: pd.DataFrame, debug: bool = True, debug_limit: int = 3
                          data3_raw=_truncate_for_log(str(raw_price), 100))
             continue
 
-        raw_rule_shop2 = normalize_text_stage0(safe_to_text(raw_rule))
+        raw_rule_shop2 = rule_stage0.iat[pos] if rule_stage0 is not None else ""
         base_price_val = int(base_price)
 
         delta_specs: List[Tuple[str, int]] = []
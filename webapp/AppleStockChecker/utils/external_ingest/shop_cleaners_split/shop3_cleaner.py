@@ -24,7 +24,7 @@ import pandas as pd
 
 from ...external_ingest.cleaner_tools import to_int_yen, parse_dt_aware
 from ..cleaner_tools import (
-    normalize_text_stage0,
+    normalize_text_stage0_series,
     _parse_capacity_gb,
     _normalize_model_generic,
     _norm_strip,
@@ -164,6 +164,8 @@ def clean_shop3(df: pd.DataFrame, debug: bool = True, debug_limit: int = 30) ->
     recorded_at = src["time-scraped"].map(parse_dt_aware)
 
     remark = src["减价1"] if "减价1" in src.columns else None
+    # 阶段0 整列预处理（逐行循环内只取结果）
+    remark_stage0 = normalize_text_stage0_series(remark.astype(str)) if remark is not None else None
 
     rows: List[dict] = []
 
@@ -174,7 +176,7 @@ def clean_shop3(df: pd.DataFrame, debug: bool = True, debug_limit: int = 30) ->
         t = recorded_at.iat[i]
         model_text = str(src["title"].iat[i])
 
-        raw_rem_shop3 = normalize_text_stage0(str(remark.iat[i]) if remark is not None else "")
+        raw_rem_shop3 = remark_stage0.iat[i] if remark_stage0 is not None else ""
 
         if not m or pd.isna(c) or p0 is None:
             continue
@@ -26,7 +26,7 @@ import pandas as pd
 
 from ...external_ingest.cleaner_tools import to_int_yen, parse_dt_aware
 from ..cleaner_tools import (
-    normalize_text_stage0,
+    normalize_text_stage0_series,
     PriceDecomposition,
     resolve_color_prices,
     _parse_capacity_gb,
@@ -386,6 +386,14 @@ def clean_shop4(df: pd.DataFrame, debug: bool = True, debug_limit: int = 30) ->
     rows: List[dict] = []
     n = len(df)
 
+    # 阶段0 按 block 整列预处理：先收集每个机型行起始的 block 文本，再对去重后的文本一次归一化
+    block_starts = [
+        i for i in range(n)
+        if (str(df["data11"].iat[i]) if df["data11"].iat[i] is not None else "").strip()
+    ]
+    block_texts = pd.Series([" / ".join(_collect_block_segments(df, i)) for i in block_starts], dtype=object)
+    block_stage0 = dict(zip(block_starts, normalize_text_stage0_series(block_texts)))
+
     for i in range(n):
         model_text = str(df["data11"].iat[i]) if df["data11"].iat[i] is not None else ""
         model_text = model_text.strip()
@@ -410,8 +418,7 @@ def clean_shop4(df: pd.DataFrame, debug: bool = True, debug_limit: int = 30) ->
         if base_price is None:
             continue
 
-        segments = _collect_block_segments(df, i)
-        raw_combined_shop4 = normalize_text_stage0(" / ".join(segments))
+        raw_combined_shop4 = block_stage0[i]
         block_lines_raw = []
         for j in range(i, block_end + 1):
             if j > i and _is_next_model_base_price_row(df, j, n):
@@ -6,7 +6,7 @@ import pandas as pd
 
 from ...external_ingest.cleaner_tools import to_int_yen, parse_dt_aware
 from ..cleaner_tools import (
-    normalize_text_stage0,
+    normalize_text_stage0_series,
     _parse_capacity_gb,
     _normalize_model_generic,
     _norm_strip,
@@ -169,6 +169,8 @@ def clean_shop7(df: pd.DataFrame, debug: bool = True, debug_limit: int = 30) ->
     cap_gb_series = df["data2"].map(_parse_capacity_gb)
     price_series = df["data3"].map(extract_price_yen)
     recorded_at = df["time-scraped"].map(parse_dt_aware)
+    # 阶段0 整列预处理（颜色行即下一行的 data2，逐行循环内只取结果）
+    data2_stage0 = normalize_text_stage0_series(df["data2"].map(safe_to_text))
 
     rows: List[dict] = []
     n = len(df)
@@ -207,7 +209,7 @@ def clean_shop7(df: pd.DataFrame, debug: bool = True, debug_limit: int = 30) ->
         abs_specs: List[Tuple[str, int]] = []
         j = i + 1
         if j < n:
-            raw_nxt_shop7 = normalize_text_stage0(safe_to_text(df["data2"].iat[j]) or "").strip()
+            raw_nxt_shop7 = data2_stage0.iat[j].strip()
             nxt_price_cell = safe_to_text(df["data3"].iat[j]).strip()
             nxt_price_val = extract_price_yen(nxt_price_cell) if nxt_price_cell else None
             is_color_line = bool(raw_nxt_shop7) and (nxt_price_val is None)
@@ -25,7 +25,7 @@ from typing import Dict, List, Optional
 import pandas as pd
 from ...external_ingest.cleaner_tools import to_int_yen, parse_dt_aware
 from ..cleaner_tools import (
-    normalize_text_stage0,
+    normalize_text_stage0_series,
     extract_price_yen,
     _parse_capacity_gb,
     _normalize_model_generic,
@@ -217,6 +217,9 @@ def clean_shop9(
     model_norm_ser = df[COL_MODEL].map(_normalize_model_generic)
     cap_gb_ser = df[COL_MODEL].map(_parse_capacity_gb)
     recorded_at_ser = df[COL_TIME].map(lambda x: parse_dt_aware(x))
+    # 阶段0 整列预处理（逐行循环内只取结果）
+    price_stage0_ser = normalize_text_stage0_series(df[COL_PRICE])
+    color_stage0_ser = normalize_text_stage0_series(df[COL_COLOR])
 
     rows: List[dict] = []
 
@@ -225,8 +228,6 @@ def clean_shop9(
         m = model_norm_ser.iat[i]
         c = cap_gb_ser.iat[i]
         t = recorded_at_ser.iat[i]
-        raw_price_cell = df[COL_PRICE].iat[i]
-        raw_color_cell = df[COL_COLOR].iat[i]
 
         if not m or pd.isna(c):
             log_row_skip(ctx.logger, cleaner_name=CLEANER_NAME, shop_name=SHOP_NAME,
@@ -245,8 +246,8 @@ def clean_shop9(
             ctx.log_seq += 1
             continue
 
-        raw_price_shop9 = normalize_text_stage0(str(raw_price_cell) if raw_price_cell is not None else "")
-        raw_color_shop9 = normalize_text_stage0(str(raw_color_cell) if raw_color_cell is not None else "")
+        raw_price_shop9 = price_stage0_ser.iat[i]
+        raw_color_shop9 = color_stage0_ser.iat[i]
         raw_combined_shop9 = " ".join(
             [s.strip() for s in (raw_price_shop9, raw_color_shop9) if s and str(s).strip()]
         )
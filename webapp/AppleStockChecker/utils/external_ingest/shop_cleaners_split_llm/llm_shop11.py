@@ -26,6 +26,7 @@ from ..cleaner_tools import (
     OLLAMA_URL,
     OLLAMA_MODEL_ID,
 )
+from ..llm_cache import cached_lx_extract
 
 logger = logging.getLogger(__name__)
 
@@ -70,7 +71,7 @@ def _lx_extract_ollama(text: str, prompt: str, examples: list):
     cfg = _shop11_model_config()
     try:
         if cfg is not None:
-            return lx.extract(
+            return cached_lx_extract("shop11",
                 text_or_documents=text,
                 prompt_description=prompt,
                 examples=examples,
@@ -85,7 +86,7 @@ def _lx_extract_ollama(text: str, prompt: str, examples: list):
 
     # 旧参数路径
     try:
-        return lx.extract(
+        return cached_lx_extract("shop11",
             text_or_documents=text,
             prompt_description=prompt,
             examples=examples,
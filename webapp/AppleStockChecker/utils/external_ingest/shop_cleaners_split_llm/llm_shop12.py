@@ -25,6 +25,7 @@ from ..cleaner_tools import (
     OLLAMA_URL,
     OLLAMA_MODEL_ID,
 )
+from ..llm_cache import cached_lx_extract
 
 logger = logging.getLogger(__name__)
 
@@ -55,6 +56,7 @@ _LX_PROMPT = textwrap.dedent(r"""
 """).strip()
 
 
+@lru_cache(maxsize=1)
 def _lx_examples():
     return [
         lx.data.ExampleData(
@@ -130,7 +132,7 @@ def extract_specs_shop12_llm_core(remark_for_llm: str) -> Tuple[List[Tuple[str,
     try:
         llm_input = "色別価格ルール:\n" + remark_for_llm
 
-        res = lx.extract(
+        res = cached_lx_extract("shop12",
             text_or_documents=llm_input,
             prompt_description=_LX_PROMPT,
             examples=_lx_examples(),
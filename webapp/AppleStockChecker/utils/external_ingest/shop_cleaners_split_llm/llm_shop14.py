@@ -25,6 +25,7 @@ from ..cleaner_tools import (
     OLLAMA_URL,
     OLLAMA_MODEL_ID,
 )
+from ..llm_cache import cached_lx_extract
 
 logger = logging.getLogger(__name__)
 
@@ -188,7 +189,7 @@ def extract_specs_shop14_llm_core(
     prompt, examples = _extract_specs_shop14_lx_prompt()
 
     try:
-        result = lx.extract(
+        result = cached_lx_extract("shop14",
             text_or_documents=s,
             prompt_description=prompt,
             examples=examples,
@@ -199,7 +200,7 @@ def extract_specs_shop14_llm_core(
             use_schema_constraints=False,
         )
     except TypeError:
-        result = lx.extract(
+        result = cached_lx_extract("shop14",
             text_or_documents=s,
             prompt_description=prompt,
             examples=examples,
@@ -23,6 +23,7 @@ from ..cleaner_tools import (
     OLLAMA_URL,
     OLLAMA_MODEL_ID,
 )
+from ..llm_cache import cached_lx_extract
 
 logger = logging.getLogger(__name__)
 
@@ -59,6 +60,7 @@ SHOP15_PRICE_PROMPT = (
 # LLM examples
 # ----------------------------------------------------------------------
 
+@lru_cache(maxsize=1)
 def _shop15_langextract_examples():
     return [
         lx.data.ExampleData(
@@ -202,7 +204,7 @@ def extract_specs_shop15_llm_core(
     examples = _shop15_langextract_examples()
 
     try:
-        result = lx.extract(
+        result = cached_lx_extract("shop15",
             text_or_documents=price_text,
             prompt_description=SHOP15_PRICE_PROMPT,
             examples=examples,
@@ -213,7 +215,7 @@ def extract_specs_shop15_llm_core(
             temperature=0.0,
         )
     except TypeError:
-        result = lx.extract(
+        result = cached_lx_extract("shop15",
             text_or_documents=price_text,
             prompt_description=SHOP15_PRICE_PROMPT,
             examples=examples,
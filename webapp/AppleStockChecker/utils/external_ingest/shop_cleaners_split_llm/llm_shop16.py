@@ -25,6 +25,7 @@ from ..cleaner_tools import (
     OLLAMA_URL,
     OLLAMA_MODEL_ID,
 )
+from ..llm_cache import cached_lx_extract
 
 logger = logging.getLogger(__name__)
 
@@ -87,6 +88,7 @@ def _to_signed_int_yen(x: object) -> Optional[int]:
 # LLM examples
 # ----------------------------------------------------------------------
 
+@lru_cache(maxsize=1)
 def _shop16_price_examples():
     return [
         lx.data.ExampleData(
@@ -239,7 +241,7 @@ def extract_specs_shop16_llm_core(
     except Exception:
         pass
 
-    result = lx.extract(**kwargs)
+    result = cached_lx_extract("shop16", **kwargs)
 
     docs = result if isinstance(result, list) else [result]
 
@@ -21,6 +21,7 @@ from ..cleaner_tools import (
     OLLAMA_URL,
     OLLAMA_MODEL_ID,
 )
+from ..llm_cache import cached_lx_extract
 
 logger = logging.getLogger(__name__)
 
@@ -169,6 +170,38 @@ def _parse_delta_attr_to_int(val) -> Optional[int]:
 # LLM 提取函数
 # ----------------------------------------------------------------------
 
+@lru_cache(maxsize=4096)
+def _extract_specs_shop17_llm_core(s: str):
+    """对归一化后的文本做一次 LangExtract 抽取（进程内缓存；模型异常直接抛出，不缓存）"""
+    return cached_lx_extract("shop17",
+        text_or_documents=s,
+        prompt_description=COLOR_DELTA_PROMPT_SHOP17,
+        examples=_get_color_delta_examples_shop17(),
+        model_id=OLLAMA_MODEL_ID,
+        model_url=OLLAMA_URL,
+        temperature=0.0,
+        fence_output=False,
+        use_schema_constraints=False,
+        prompt_validation_level="OFF",
+        prompt_validation_strict=False,
+    )
+
+
+def _shop17_llm_input(text, normalize_color_text_fn=None, pick_unopened_section_fn=None) -> Optional[str]:
+    """送入模型的文本；空文本或「なし / 減額なし」返回 None"""
+    if not text or not str(text).strip():
+        return None
+
+    if normalize_color_text_fn and pick_unopened_section_fn:
+        s = normalize_color_text_fn(pick_unopened_section_fn(str(text)))
+    else:
+        s = str(text).strip()
+
+    if re.fullmatch(r"\s*(?:なし|減額なし)\s*", s):
+        return None
+    return s
+
+
 def extract_specs_shop17_llm(
     text: str,
     shop_name: Optional[str] = None,
@@ -180,30 +213,12 @@ def extract_specs_shop17_llm(
 ) -> Tuple[List[Tuple[str, int]], List[Tuple[str, int]]]:
     if not HAS_LANGEXTRACT:
         return ([], [])
-    if not text or not str(text).strip():
-        return ([], [])
-
-    if normalize_color_text_fn and pick_unopened_section_fn:
-        s = normalize_color_text_fn(pick_unopened_section_fn(str(text)))
-    else:
-        s = str(text).strip()
-
-    if re.fullmatch(r"\s*(?:なし|減額なし)\s*", s):
+    s = _shop17_llm_input(text, normalize_color_text_fn, pick_unopened_section_fn)
+    if s is None:
         return ([], [])
 
     try:
-        result = lx.extract(
-            text_or_documents=s,
-            prompt_description=COLOR_DELTA_PROMPT_SHOP17,
-            examples=_get_color_delta_examples_shop17(),
-            model_id=OLLAMA_MODEL_ID,
-            model_url=OLLAMA_URL,
-            temperature=0.0,
-            fence_output=False,
-            use_schema_constraints=False,
-            prompt_validation_level="OFF",
-            prompt_validation_strict=False,
-        )
+        result = _extract_specs_shop17_llm_core(s)
     except Exception as e:
         log_llm_extraction_error(
             logger, cleaner_name=cleaner_name or "shop17",
@@ -25,6 +25,7 @@ from ..cleaner_tools import (
     OLLAMA_URL,
     OLLAMA_MODEL_ID,
 )
+from ..llm_cache import cached_lx_extract
 
 logger = logging.getLogger(__name__)
 
@@ -120,7 +121,7 @@ def _extract_specs_shop2_llm_core(
         return {}
 
     try:
-        result = lx.extract(
+        result = cached_lx_extract("shop2",
             text_or_documents=s,
             prompt_description=_COLOR_RULE_PROMPT,
             examples=_COLOR_RULE_EXAMPLES,
@@ -27,6 +27,7 @@ from ..cleaner_tools import (
     OLLAMA_URL,
     OLLAMA_MODEL_ID,
 )
+from ..llm_cache import cached_lx_extract
 
 logger = logging.getLogger(__name__)
 
@@ -237,7 +238,7 @@ def extract_specs_shop3_llm_cached(text: str) -> Tuple[Tuple[str, int], ...]:
     delta_global = _single_signed_delta_from_text(s)
     default_sign = _infer_default_sign_from_text(s)
 
-    result = lx.extract(
+    result = cached_lx_extract("shop3",
         text_or_documents=s,
         prompt_description=_SHOP3_COLOR_DELTA_PROMPT,
         examples=_SHOP3_COLOR_DELTA_EXAMPLES,
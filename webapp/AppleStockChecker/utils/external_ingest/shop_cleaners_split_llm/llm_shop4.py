@@ -27,6 +27,7 @@ from ..cleaner_tools import (
     OLLAMA_URL,
     OLLAMA_MODEL_ID,
 )
+from ..llm_cache import cached_lx_extract
 
 logger = logging.getLogger(__name__)
 
@@ -140,13 +141,9 @@ def _get_shop4_le_examples():
 # LLM 核心提取
 # ----------------------------------------------------------------------
 
-def _extract_specs_shop4_llm_core(text: str) -> list:
-    """
-    对 text 做一次 LangExtract 抽取，返回 result.extractions。
-    """
-    if not (HAS_LANGEXTRACT and isinstance(text, str) and text.strip()):
-        return []
-
+@lru_cache(maxsize=4096)
+def _shop4_lx_extractions(text: str) -> tuple:
+    """对 text 做一次 LangExtract 抽取（进程内缓存；模型异常直接抛出，不缓存）"""
     kwargs = dict(
         text_or_documents=text,
         prompt_description=_SHOP4_LE_PROMPT,
@@ -171,14 +168,22 @@ def _extract_specs_shop4_llm_core(text: str) -> list:
     except Exception:
         pass
 
+    result = cached_lx_extract("shop4", **kwargs)
+    return tuple(getattr(result, "extractions", None) or ())
+
+
+def _extract_specs_shop4_llm_core(text: str) -> list:
+    """
+    对 text 做一次 LangExtract 抽取，返回 result.extractions。
+    """
+    if not (HAS_LANGEXTRACT and isinstance(text, str) and text.strip()):
+        return []
+
     try:
-        result = lx.extract(**kwargs)
+        return list(_shop4_lx_extractions(text))
     except Exception:
         return []
 
-    exts = getattr(result, "extractions", None)
-    return list(exts) if exts else []
-
 
 def _get_start_pos(extraction) -> int:
     ci = getattr(extraction, "char_interval", None)
@@ -204,6 +209,25 @@ def _split_labels(label: str) -> List[str]:
     return [p.strip() for p in LABEL_SPLIT_RE.split(label or "") if p and p.strip()]
 
 
+def _shop4_block_lines(df, start_idx: int, is_next_model_base_price_row_fn=None) -> List[str]:
+    """从 start_idx 起收集同一机型 block 的 data 行，遇到下一机型（data11 非空或基础价行）为止"""
+    lines: List[str] = []
+    n = len(df)
+
+    for j in range(start_idx, n):
+        if j > start_idx:
+            nxt_model = ""
+            val = df["data11"].iat[j] if "data11" in df.columns else ""
+            nxt_model = str(val) if val is not None else ""
+            if nxt_model.strip():
+                break
+            if is_next_model_base_price_row_fn and is_next_model_base_price_row_fn(df, j, n):
+                break
+        raw = df["data"].iat[j] if "data" in df.columns else ""
+        lines.append("" if raw is None else str(raw))
+    return lines
+
+
 # ----------------------------------------------------------------------
 # LLM + Guardrails 封装
 # ----------------------------------------------------------------------
@@ -221,20 +245,7 @@ def extract_specs_shop4_llm(
     返回：(adjustments, delta_specs, color_delta_label_map)
     """
     _empty: Tuple[Dict[str, int], List[Tuple[str, int]], Dict[str, str]] = ({}, [], {})
-    lines: List[str] = []
-    n = len(df)
-
-    for j in range(start_idx, n):
-        if j > start_idx:
-            nxt_model = ""
-            val = df["data11"].iat[j] if "data11" in df.columns else ""
-            nxt_model = str(val) if val is not None else ""
-            if nxt_model.strip():
-                break
-            if is_next_model_base_price_row_fn and is_next_model_base_price_row_fn(df, j, n):
-                break
-        raw = df["data"].iat[j] if "data" in df.columns else ""
-        lines.append("" if raw is None else str(raw))
+    lines = _shop4_block_lines(df, start_idx, is_next_model_base_price_row_fn)
 
     if not lines:
         return _empty
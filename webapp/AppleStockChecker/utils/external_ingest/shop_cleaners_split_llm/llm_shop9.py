@@ -24,6 +24,7 @@ from ..cleaner_tools import (
     OLLAMA_URL,
     OLLAMA_MODEL_ID,
 )
+from ..llm_cache import cached_lx_extract
 
 logger = logging.getLogger(__name__)
 
@@ -191,9 +192,9 @@ def extract_specs_shop9_llm_core(
     )
 
     try:
-        result = lx.extract(**kw, temperature=LLM_TEMPERATURE)
+        result = cached_lx_extract("shop9", **kw, temperature=LLM_TEMPERATURE)
     except TypeError:
-        result = lx.extract(**kw)
+        result = cached_lx_extract("shop9", **kw)
     except Exception:
         return _empty
 
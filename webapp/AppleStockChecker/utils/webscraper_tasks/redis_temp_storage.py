@@ -3,16 +3,25 @@
 Redis 临时存储工具模块
 
 用于在数据接收任务和清洗任务之间传递 DataFrame 数据。
+
+- 默认以 Arrow IPC（zstd 压缩）二进制存储，保留 dtype、体积小、读取无需 JSON 解析；
+  pyarrow 不可用、列类型无法转换或 INGEST_TEMP_FORMAT=json 时退回 JSON 文本，便于手工查看。
+- key 带内容哈希：相同内容的重复上传落在同一个 key 上，只刷新 TTL。
+- 使用独立连接池（INGEST_TEMP_REDIS_URL，可指向单独的 DB），大块数据不挤占 Celery broker。
 """
 from __future__ import annotations
 
-import json
+import hashlib
+import logging
+import os
+from io import BytesIO, StringIO
 from typing import Optional
+
 import pandas as pd
 import redis
 from django.conf import settings
-from io import StringIO
 
+logger = logging.getLogger(__name__)
 
 # 默认 TTL: 1 小时
 DEFAULT_TTL = 3600
@@ -20,18 +29,74 @@ DEFAULT_TTL = 3600
 # Redis key 前缀
 KEY_PREFIX = "ingest:temp"
 
+# Arrow 负载的魔数前缀；JSON 负载以 "[" 开头，二者可直接区分
+ARROW_MAGIC = b"ARROW1\n"
 
-def _get_redis_client() -> redis.Redis:
-    """获取 Redis 客户端实例"""
-    redis_url = getattr(settings, "CELERY_BROKER_URL", "redis://127.0.0.1:6379/0")
-    return redis.from_url(redis_url, decode_responses=True)
+_pool: Optional[redis.ConnectionPool] = None
+_pool_pid: Optional[int] = None
 
 
-def make_redis_key(batch_id: str, source_name: str) -> str:
-    """生成 Redis key"""
+def _get_redis_client() -> redis.Redis:
+    """获取 Redis 客户端实例（进程内复用连接池，返回 bytes）"""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        redis_url = (
+            getattr(settings, "INGEST_TEMP_REDIS_URL", "")
+            or getattr(settings, "CELERY_BROKER_URL", "redis://127.0.0.1:6379/0")
+        )
+        _pool = redis.ConnectionPool.from_url(redis_url)
+        _pool_pid = os.getpid()
+    return redis.Redis(connection_pool=_pool)
+
+
+def make_redis_key(batch_id: str, source_name: str, digest: Optional[str] = None) -> str:
+    """生成 Redis key；给出 digest 时按内容寻址，与 batch_id 无关"""
+    if digest:
+        return f"{KEY_PREFIX}:{source_name}:{digest}"
     return f"{KEY_PREFIX}:{batch_id}:{source_name}"
 
 
+def encode_dataframe(df: pd.DataFrame, fmt: Optional[str] = None) -> bytes:
+    """
+    DataFrame → 字节负载
+
+    Args:
+        df: 要编码的 DataFrame
+        fmt: arrow | json，默认 settings.INGEST_TEMP_FORMAT
+
+    Returns:
+        ARROW_MAGIC + Arrow IPC 流，或 UTF-8 JSON（orient="records"）
+    """
+    fmt = (fmt or getattr(settings, "INGEST_TEMP_FORMAT", "arrow")).lower()
+    if fmt == "arrow":
+        try:
+            import pyarrow as pa
+
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            sink = pa.BufferOutputStream()
+            options = pa.ipc.IpcWriteOptions(compression="zstd")
+            with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+                writer.write_table(table)
+            return ARROW_MAGIC + sink.getvalue().to_pybytes()
+        except ImportError:
+            logger.warning("pyarrow 未安装，临时存储退回 JSON")
+        except Exception as e:
+            logger.warning(f"DataFrame 无法转换为 Arrow（{e}），临时存储退回 JSON")
+
+    # 使用 date_format="iso" 确保日期时间格式正确
+    return df.to_json(orient="records", date_format="iso", force_ascii=False).encode("utf-8")
+
+
+def decode_dataframe(data: bytes) -> pd.DataFrame:
+    """encode_dataframe 的逆操作，按前缀自动识别 Arrow / JSON"""
+    if data.startswith(ARROW_MAGIC):
+        import pyarrow as pa
+
+        with pa.ipc.open_stream(data[len(ARROW_MAGIC):]) as reader:
+            return reader.read_pandas()
+    return pd.read_json(StringIO(data.decode("utf-8")), orient="records")
+
+
 def store_dataframe(
     batch_id: str,
     source_name: str,
@@ -48,16 +113,15 @@ def store_dataframe(
         ttl: 过期时间（秒），默认 1 小时
 
     Returns:
-        Redis key
+        Redis key（按内容哈希寻址，相同内容返回同一个 key）
     """
     client = _get_redis_client()
-    key = make_redis_key(batch_id, source_name)
-
-    # 将 DataFrame 序列化为 JSON
-    # 使用 date_format="iso" 确保日期时间格式正确
-    data = df.to_json(orient="records", date_format="iso", force_ascii=False)
+    data = encode_dataframe(df)
+    key = make_redis_key(batch_id, source_name, hashlib.sha256(data).hexdigest()[:32])
 
-    client.setex(key, ttl, data)
+    # 已存在则只刷新 TTL，不重复写入
+    if not client.set(key, data, ex=ttl, nx=True):
+        client.expire(key, ttl)
     return key
 
 
@@ -77,8 +141,7 @@ def retrieve_dataframe(redis_key: str) -> Optional[pd.DataFrame]:
     if data is None:
         return None
 
-    # 反序列化为 DataFrame
-    return pd.read_json(StringIO(data), orient="records")
+    return decode_dataframe(data)
 
 
 def delete_key(redis_key: str) -> bool:
@@ -13,7 +13,7 @@ from datetime import datetime, date
 from .serializers import SecondHandShopSerializer, PurchasingShopPriceRecordSerializer
 from math import ceil
 import csv
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.db import transaction, IntegrityError
 from datetime import datetime
 from django.db import transaction
@@ -22,6 +22,7 @@ from django.db.models import Q
 from celery.result import AsyncResult
 from AppleStockChecker.utils.external_ingest.webscraper import fetch_webscraper_export_sync, to_dataframe_from_request
 from AppleStockChecker.tasks.webscraper_tasks import task_process_webscraper_job,task_process_xlsx
+from AppleStockChecker.services.trend_cache import note_price_records
 from datetime import timedelta
 from rest_framework.views import APIView
 
@@ -53,6 +54,8 @@ from .serializers import (
 )
 from .filters import PurchasingShopTimeAnalysisFilter
 import io
+import itertools
+import json
 import re
 import uuid
 from django.utils import timezone
@@ -230,15 +233,19 @@ class HealthView(APIView):
     permission_classes = [AllowAny]
 
     def get(self, request):
-        return Response(
-            {
-                "status": "ok",
-                "server_time": timezone.now().isoformat(),
-                "app": "api",
-                "version": "1.0.0",
-            },
-            status=status.HTTP_200_OK,
-        )
+        data = {
+            "status": "ok",
+            "server_time": timezone.now().isoformat(),
+            "app": "api",
+            "version": "1.0.0",
+        }
+        if request.query_params.get("stats"):
+            # ?stats=1: 本进程的 ClickHouse 连接池 / 元数据缓存计数
+            from AppleStockChecker.services.clickhouse_service import pool_stats
+            from AppleStockChecker.services.metadata_cache import metadata_cache_stats
+            data["clickhouse_pool"] = pool_stats()
+            data["metadata_cache"] = metadata_cache_stats()
+        return Response(data, status=status.HTTP_200_OK)
 
 
 class ApiRoot(APIView):
@@ -1171,6 +1178,7 @@ class PurchasingShopPriceRecordViewSet(viewsets.ModelViewSet):
 
         # —— 计数器 —— #
         total = inserted = updated = skipped = dedup_skipped = 0
+        backfilled = []  # (iphone_id, recorded_at)：QuerySet.update 不触发信号，结束后通知趋势缓存
         errors = []
         preview = []
 
@@ -1284,8 +1292,11 @@ class PurchasingShopPriceRecordViewSet(viewsets.ModelViewSet):
                         batch_id=batch_uuid,
                     )
                     PurchasingShopPriceRecord.objects.filter(pk=rec.pk).update(recorded_at=rec_at)
+                    backfilled.append((iphone.pk, rec_at))
                     inserted += 1
 
+        note_price_records(backfilled)
+
         resp = {
             "rows_total": total,
             "inserted": inserted,
@@ -1593,8 +1604,9 @@ class _CHListViewSet(viewsets.ViewSet):
         return _pd(raw)
 
     def _ch_service(self):
-        from AppleStockChecker.services.clickhouse_service import ClickHouseService
-        return ClickHouseService()
+        # 进程内共享的池化客户端, 不再每个请求新建 TCP 连接
+        from AppleStockChecker.services.clickhouse_service import get_pooled_service
+        return get_pooled_service()
 
     def _respond(self, request, rows, total):
         limit, offset = self._get_limit_offset(request)
@@ -1777,7 +1789,14 @@ _STATS_COLS = frozenset({
 
 @method_decorator(gzip_page, name="list")
 class FeatureSnapshotViewSet(_CHListViewSet):
-    """CH features_wide → 逐行 pivot 为 (bucket, scope, name, value) 格式。"""
+    """CH features_wide → 逐行 pivot 为 (bucket, scope, name, value) 格式。
+
+    ?stream=ndjson   每行一个对象 (字段同非流式结果)
+    ?stream=columnar 每行一块列式对象 {字段: [...]}
+    流式模式在 CH 内 ARRAY JOIN 展开并分块读取, 不做分页, 内存占用与时间范围无关。
+    """
+    _PIVOT_SKIP = _STATS_COLS
+    _STREAM_MODES = ("ndjson", "columnar")
 
     def _resolve_requested_columns(self, request):
         """从 request 参数解析需要的 CH 列名, 返回 list 或 None (全部)。"""
@@ -1793,6 +1812,8 @@ class FeatureSnapshotViewSet(_CHListViewSet):
         return list(names)
 
     def list(self, request):
+        if request.query_params.get("stream"):
+            return self._stream_list(request)
         try:
             columns = self._resolve_requested_columns(request)
             wide_rows, _ = self._query_ch_wide(request, columns=columns)
@@ -1807,35 +1828,88 @@ class FeatureSnapshotViewSet(_CHListViewSet):
         except Exception as exc:
             return self._handle_ch_error(exc)
 
-    def _query_ch_wide(self, request, *, columns=None):
-        ch = self._ch_service()
+    def _feature_filters(self, request):
+        """run_id / 时间范围 / scope / ordering 过滤参数 (query_features 与 iter_features_tall 共用)。"""
         params = request.query_params
-
-        bucket_gte = self._parse_dt(params.get("bucket__gte"))
-        bucket_lte = self._parse_dt(params.get("bucket__lte"))
-        # 有时间范围时不限行数; 否则回退安全上限
-        limit = 0 if (bucket_gte or bucket_lte) else 50000
         kwargs = {
             "run_id": self._get_run_id(request),
-            "bucket_gte": bucket_gte,
-            "bucket_lte": bucket_lte,
+            "bucket_gte": self._parse_dt(params.get("bucket__gte")),
+            "bucket_lte": self._parse_dt(params.get("bucket__lte")),
             "ordering": params.get("ordering", "bucket"),
-            "limit": limit,
-            "offset": 0,
-            "need_total": False,
         }
-        if columns:
-            kwargs["columns"] = columns
-
         scope = params.get("scope")
         scope_in = params.get("scope__in")
         if scope:
             kwargs["scope"] = scope
         elif scope_in:
             kwargs["scope_in"] = [s.strip() for s in scope_in.split(",")]
+        return kwargs
 
+    def _query_ch_wide(self, request, *, columns=None):
+        ch = self._ch_service()
+        kwargs = self._feature_filters(request)
+        # 有时间范围时不限行数; 否则回退安全上限
+        limit = 0 if (kwargs["bucket_gte"] or kwargs["bucket_lte"]) else 50000
+        kwargs.update(limit=limit, offset=0, need_total=False)
+        if columns:
+            kwargs["columns"] = columns
         return ch.query_features(**kwargs)
 
+    # ── 流式输出 ──
+
+    def _stream_list(self, request):
+        mode = request.query_params.get("stream")
+        if mode not in self._STREAM_MODES:
+            return Response({"detail": f"stream 仅支持 {'/'.join(self._STREAM_MODES)}"}, status=400)
+        try:
+            ch = self._ch_service()
+            columns = self._resolve_requested_columns(request) or [
+                c for c in ch._get_column_names("features_wide") if c not in self._PIVOT_SKIP
+            ]
+            chunks = ch.iter_features_tall(columns=columns, **self._feature_filters(request))
+            # 先取第一块: 查询错误仍以 503 返回, 而不是中断已开始的响应
+            first = next(chunks, None)
+        except Exception as exc:
+            return self._handle_ch_error(exc)
+        if first is None:
+            return StreamingHttpResponse(iter(()), content_type="application/x-ndjson")
+        body = self._encode_stream(itertools.chain([first], chunks), mode)
+        return StreamingHttpResponse(body, content_type="application/x-ndjson")
+
+    def _encode_stream(self, chunks, mode):
+        for rows in chunks:
+            frame = self._tall_frame(rows)
+            if mode == "columnar":
+                yield json.dumps(frame, ensure_ascii=False) + "\n"
+            else:
+                keys = list(frame)
+                yield "".join(
+                    json.dumps(dict(zip(keys, vals)), ensure_ascii=False) + "\n"
+                    for vals in zip(*frame.values())
+                )
+
+    @staticmethod
+    def _encode_buckets(rows):
+        """一块行的 bucket → (JSON 时间字符串列, is_final 列); 同一 bucket 只计算一次。"""
+        from rest_framework.utils.encoders import JSONEncoder
+        enc, memo = JSONEncoder(), {}
+        for r in rows:
+            if r[0] not in memo:
+                memo[r[0]] = (enc.default(r[0]), _derive_is_final(r[0]))
+        return [memo[r[0]][0] for r in rows], [memo[r[0]][1] for r in rows]
+
+    def _tall_frame(self, rows):
+        """一块 (bucket, scope, name, value) → 列式 dict, 字段与 _pivot_wide_to_tall 一致。"""
+        buckets, is_final = self._encode_buckets(rows)
+        return {
+            "bucket": buckets,
+            "scope": [r[1] for r in rows],
+            "name": [r[2] for r in rows],
+            "value": [r[3] for r in rows],
+            "version": ["v1"] * len(rows),
+            "is_final": is_final,
+        }
+
     def _pivot_wide_to_tall(self, wide_rows, columns):
         tall = []
         for row in wide_rows:
@@ -1844,7 +1918,7 @@ class FeatureSnapshotViewSet(_CHListViewSet):
             is_final = _derive_is_final(bucket)
 
             cols_to_scan = columns if columns else [
-                c for c in row if c not in _STATS_COLS
+                c for c in row if c not in self._PIVOT_SKIP
             ]
             for col in cols_to_scan:
                 val = row.get(col)
@@ -1901,7 +1975,13 @@ class FeaturePointsViewSet(FeatureSnapshotViewSet):
             ch_cols.add(self._FE_NAME_MAP.get(n, n))
         return list(ch_cols)
 
+    # 不需要 pivot 的元数据列 + 非特征统计列
+    _PIVOT_SKIP = frozenset({"run_id", "bucket", "scope", "inserted_at",
+                             "median", "shop_count", "dispersion"})
+
     def list(self, request):
+        if request.query_params.get("stream"):
+            return self._stream_list(request)
         try:
             columns = self._resolve_requested_columns(request)
             wide_rows, _ = self._query_ch_wide(request, columns=columns)
@@ -1910,11 +1990,17 @@ class FeaturePointsViewSet(FeatureSnapshotViewSet):
         except Exception as exc:
             return self._handle_ch_error(exc)
 
-    def _pivot_wide_to_tall(self, wide_rows, columns):
-        # 不需要 pivot 的元数据列 + 非特征统计列
-        skip = {"run_id", "bucket", "scope", "inserted_at",
-                "median", "shop_count", "dispersion"}
+    def _tall_frame(self, rows):
+        buckets, is_final = self._encode_buckets(rows)
+        return {
+            "t": buckets,
+            "v": [r[3] for r in rows],
+            "scope": [r[1] for r in rows],
+            "name": [self._FE_NAME_MAP_REV.get(r[2], r[2]) for r in rows],
+            "is_final": is_final,
+        }
 
+    def _pivot_wide_to_tall(self, wide_rows, columns):
         tall = []
         for row in wide_rows:
             bucket = row.get("bucket")
@@ -1922,7 +2008,7 @@ class FeaturePointsViewSet(FeatureSnapshotViewSet):
             is_final = _derive_is_final(bucket)
 
             cols_to_scan = columns if columns else [
-                c for c in row if c not in skip
+                c for c in row if c not in self._PIVOT_SKIP
             ]
             for col in cols_to_scan:
                 val = row.get(col)
@@ -1974,6 +2060,20 @@ class _PSTACHViewSet(_CHListViewSet):
 
         return ch.query_price_aligned(**kwargs)
 
+    # 店铺 / iPhone 元数据: 进程级共享缓存 (信号 + TTL 失效), 不再每个请求全表扫描;
+    # 每个请求只取一次快照
+    def _get_shop_cache(self):
+        if not hasattr(self, "_shop_cache"):
+            from AppleStockChecker.services.metadata_cache import get_shop_meta
+            self._shop_cache = get_shop_meta()
+        return self._shop_cache
+
+    def _get_iphone_cache(self):
+        if not hasattr(self, "_iphone_cache"):
+            from AppleStockChecker.services.metadata_cache import get_iphone_meta
+            self._iphone_cache = get_iphone_meta()
+        return self._iphone_cache
+
 
 class PSTACHFullViewSet(_PSTACHViewSet):
     """CH price_aligned → 完整 PSTA JSON (带 shop/iphone 展开)。"""
@@ -2000,38 +2100,6 @@ class PSTACHFullViewSet(_PSTACHViewSet):
             "iphone": iphone,
         }
 
-    def _get_shop_cache(self):
-        if not hasattr(self, "_shop_cache"):
-            self._shop_cache = {
-                s.id: {
-                    "id": s.id, "name": s.name,
-                    "website": s.website, "address": s.address,
-                }
-                for s in SecondHandShop.objects.all()
-            }
-        return self._shop_cache
-
-    def _get_iphone_cache(self):
-        if not hasattr(self, "_iphone_cache"):
-            self._iphone_cache = {}
-            for p in Iphone.objects.all():
-                self._iphone_cache[p.id] = {
-                    "id": p.id,
-                    "part_number": p.part_number,
-                    "jan": p.jan,
-                    "model_name": p.model_name,
-                    "capacity_gb": p.capacity_gb,
-                    "color": p.color,
-                    "release_date": str(p.release_date) if p.release_date else None,
-                    "capacity_label": (
-                        f"{p.capacity_gb // 1024}TB"
-                        if p.capacity_gb % 1024 == 0
-                        else f"{p.capacity_gb}GB"
-                    ),
-                    "label": f"{p.model_name} {p.color}",
-                }
-        return self._iphone_cache
-
 
 class PSTACHCompactViewSet(_PSTACHViewSet):
     """CH price_aligned → compact PSTA JSON。"""
@@ -2052,22 +2120,6 @@ class PSTACHCompactViewSet(_PSTACHViewSet):
             "New_Product_Price": row["price_new"],
         }
 
-    def _get_shop_cache(self):
-        if not hasattr(self, "_shop_cache"):
-            self._shop_cache = {
-                s.id: {"name": s.name}
-                for s in SecondHandShop.objects.all()
-            }
-        return self._shop_cache
-
-    def _get_iphone_cache(self):
-        if not hasattr(self, "_iphone_cache"):
-            self._iphone_cache = {
-                p.id: {"part_number": p.part_number}
-                for p in Iphone.objects.all()
-            }
-        return self._iphone_cache
-
 
 # ── 工具函数 ─────────────────────────────────────────────────────────────
 
@@ -15,6 +15,8 @@ from datetime import timedelta
 import os
 import logging
 
+from celery.schedules import crontab
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -316,6 +318,21 @@ WEB_SCRAPER_SOURCE_MAP = {
 
 # WEB_SCRAPER_WEBHOOK_TOKEN 已在上方通过 os.getenv 读取
 
+# WebScraper 接收任务 → 清洗任务之间的 DataFrame 暂存
+# 空则复用 CELERY_BROKER_URL；建议指向单独的 DB（如 redis://127.0.0.1:6379/3），大块数据不挤占 broker
+INGEST_TEMP_REDIS_URL = os.getenv("INGEST_TEMP_REDIS_URL", "")
+INGEST_TEMP_FORMAT = os.getenv("INGEST_TEMP_FORMAT", "arrow")  # arrow（zstd 压缩的 Arrow IPC）| json
+# 清洗器共用的 iPhone 机型目录缓存秒数（本进程内 Iphone 变更立即失效，其他进程靠 TTL 刷新）
+CLEANER_IPHONE_CATALOG_TTL = int(os.getenv("CLEANER_IPHONE_CATALOG_TTL", "300"))
+# LLM 抽取结果持久缓存（SQLite 文件，置空则不缓存）
+# 默认放在用户缓存目录（XDG_CACHE_HOME），不写进代码目录；容器部署时指向挂载卷
+LLM_EXTRACTION_CACHE_PATH = os.getenv(
+    "LLM_EXTRACTION_CACHE_PATH",
+    os.path.join(os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "yamagoti", "llm_extraction_cache.sqlite3"),
+)
+# run_cleaners_parallel 的进程数（0 = CPU 核数）
+CLEANER_MAX_WORKERS = int(os.getenv("CLEANER_MAX_WORKERS", "0"))
+
 # Celery/Redis
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://127.0.0.1:6379/0")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", CELERY_BROKER_URL)
@@ -344,9 +361,14 @@ CELERY_TASK_ROUTES = {
     "automl.preprocessing_rapid_simple": {"queue": "automl_preprocessing"},
     "automl.cause_and_effect_testing": {"queue": "automl_cause_effect"},
     "automl.cause_and_effect_testing_simple": {"queue": "automl_cause_effect"},
+    "automl.sliding_window_analysis": {"queue": "automl_cause_effect"},
     "automl.quantification_of_impact": {"queue": "automl_impact"},
     "automl.quantification_of_impact_simple": {"queue": "automl_impact"},
 }
+# AutoML 预处理: 元素数达到该阈值才搬到 GPU (小数组拷贝开销大于计算本身)
+AUTOML_GPU_MIN_ELEMENTS = int(os.getenv('AUTOML_GPU_MIN_ELEMENTS', '5000000'))
+# 滑动窗口 VAR/Granger 线程池大小 (0 = CPU 数; 1 = 串行)
+AUTOML_SLIDING_WORKERS = int(os.getenv('AUTOML_SLIDING_WORKERS', '0'))
 
 USE_X_FORWARDED_HOST = True
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
@@ -666,8 +688,13 @@ FX_API_KEYS = {
 
 TREND_MAX_LOOKBACK_DAYS = 90
 TREND_DB_MAX_WORKERS = 6
-TREND_CPU_MAX_WORKERS = 0  # 0/None=自动核数
 TREND_DOWNSAMPLE_TARGET = 0  # 每条曲线最多点数（0=关闭）
+# 趋势预聚合缓存（每 PN/店/15 分钟桶的最后一条；Redis，空 URL=复用 CELERY_BROKER_URL）
+TREND_CACHE_ENABLED = os.getenv("TREND_CACHE_ENABLED", "1") == "1"
+TREND_CACHE_REDIS_URL = os.getenv("TREND_CACHE_REDIS_URL", "")
+TREND_CACHE_TTL = int(os.getenv("TREND_CACHE_TTL", str(3 * 24 * 3600)))
+TREND_CACHE_SETTLE_MINUTES = 15       # 水位线滞后 now 的分钟数，晚到的近期记录从 PG 尾部读取
+TREND_CACHE_SHOP_NAMES_TTL = 600
 
 LIST_ORDER = [
     "iphone-17-pro-max-256",
@@ -754,10 +781,45 @@ CLICKHOUSE_PORT     = int(os.getenv('CLICKHOUSE_PORT', '9000'))
 CLICKHOUSE_DB       = os.getenv('CLICKHOUSE_DB', 'yamagoti')
 CLICKHOUSE_USER     = os.getenv('CLICKHOUSE_USER', 'default')
 CLICKHOUSE_PASSWORD = os.getenv('CLICKHOUSE_PASSWORD', '')
+# insert_price_aligned / insert_features: 列式 NumPy 分块写入 (False 回退逐行 tuple)
+CLICKHOUSE_COLUMNAR_INSERT  = os.getenv('CLICKHOUSE_COLUMNAR_INSERT', '1') == '1'
+CLICKHOUSE_INSERT_BLOCK_ROWS = int(os.getenv('CLICKHOUSE_INSERT_BLOCK_ROWS', '100000'))
+# 特征长表流式接口 (?stream=ndjson|columnar) 每块行数
+FEATURE_STREAM_CHUNK_ROWS = int(os.getenv('FEATURE_STREAM_CHUNK_ROWS', '5000'))
+# CH 读取型 ViewSet: 进程内连接池大小 / 借出等待秒数; 店铺、iPhone 元数据缓存 TTL (秒)
+CLICKHOUSE_POOL_SIZE    = int(os.getenv('CLICKHOUSE_POOL_SIZE', '8'))
+CLICKHOUSE_POOL_TIMEOUT = float(os.getenv('CLICKHOUSE_POOL_TIMEOUT', '10'))
+CH_METADATA_CACHE_TTL   = int(os.getenv('CH_METADATA_CACHE_TTL', '300'))
 
 # Pipeline 默认参数
 PIPELINE_DEVICE     = os.getenv('PIPELINE_DEVICE', 'cuda:0')
 PIPELINE_BATCH_DAYS = int(os.getenv('PIPELINE_BATCH_DAYS', '30'))
+# 流式模式 (run_pipeline --stream) 每段桶数, 须为 EMA_CHUNK (128) 的整数倍
+PIPELINE_STREAM_CHUNK_BUCKETS = int(os.getenv('PIPELINE_STREAM_CHUNK_BUCKETS', '2048'))
+# 增量 live-tail (pipeline.live_tail 任务): 桶结束后等待的分钟数 / 重建状态时回看的天数
+PIPELINE_LIVE_LAG_MIN        = int(os.getenv('PIPELINE_LIVE_LAG_MIN', '5'))
+PIPELINE_LIVE_BOOTSTRAP_DAYS = int(os.getenv('PIPELINE_LIVE_BOOTSTRAP_DAYS', '7'))
+
+# live-tail 接管 features_wide (run_id="live") 的特征派生; 逐分钟 batch_generate_psta_same_ts
+# 照常写 PSTA 行 / FeatureSnapshot, 只有本开关为 1 时才继续自己算 EMA/布林带等并写 features_wide
+# (停用 live-tail 周期任务时打开, 避免同一 run_id 双写)
+PSTA_MINUTE_CH_FEATURES = os.getenv('PSTA_MINUTE_CH_FEATURES', '0') == '1'
+
+# 定时任务 (DatabaseScheduler 启动时同步进 django_celery_beat, Admin 里可改间隔/暂停)
+# live-tail 写入各读取方默认的 run_id="live" (query_* / 预测任务 / API)
+CELERY_BEAT_SCHEDULE = {
+    "pipeline-live-tail": {
+        "task": "pipeline.live_tail",
+        "schedule": crontab(minute="*/15"),
+        "kwargs": {"run_id": "live", "nan_mode": "ffill"},
+    },
+}
+
+# LightGBM 价格预测: 并行训练的线程数 (0 = CPU 数) / 每个 booster 的 LightGBM 线程数 (0 = CPU 数 ÷ 训练线程数)
+PREDICTION_TRAIN_WORKERS = int(os.getenv('PREDICTION_TRAIN_WORKERS', '0'))
+PREDICTION_LGB_THREADS   = int(os.getenv('PREDICTION_LGB_THREADS', '0'))
+# 推理进程内缓存的已反序列化 booster 数 (LRU)
+PREDICTION_BOOSTER_CACHE_SIZE = int(os.getenv('PREDICTION_BOOSTER_CACHE_SIZE', '512'))
 
 # ============================================================================
 # Logging Configuration
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""
+engine 计算内核 benchmark: 原版逐元素循环 vs 向量化实现。
+
+在合成 PriceTensor 上分别计时, 并校验两者输出一致。
+不依赖 Django / PG / ClickHouse, 只需 torch + numpy + pandas。
+
+用法：
+    python scripts/bench_engine.py                        # 默认 30 天规模
+    python scripts/bench_engine.py --iphones 150 --shops 25 --days 90
+    python scripts/bench_engine.py --skip-legacy          # 只跑向量化版 (大规模时原版太慢)
+    python scripts/bench_engine.py --device cuda:0
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+from AppleStockChecker.engine import reference  # noqa: E402
+from AppleStockChecker.engine.aggregate import (  # noqa: E402
+    PriceTensor,
+    _mad_filter_median_dim1,
+    aggregate_cross_shop,
+    apply_dynamic_price_filter,
+)
+from AppleStockChecker.engine.features import (  # noqa: E402
+    EMA_HL_BUCKETS,
+    _forward_fill_1d,
+    compute_all_features,
+    compute_ema_batch,
+    compute_ema_batch_skipnan,
+    compute_ema_halflife_batch,
+)
+from AppleStockChecker.engine.config import WINDOW_TO_BUCKETS  # noqa: E402
+from AppleStockChecker.engine.pipeline import _agg_to_features_df  # noqa: E402
+
+
+def make_price_tensor(
+    n_iphones: int,
+    n_shops: int,
+    n_buckets: int,
+    *,
+    nan_ratio: float = 0.3,
+    outlier_ratio: float = 0.01,
+    seed: int = 0,
+    device: str = "cpu",
+) -> PriceTensor:
+    """合成 (I, S, B) 价格张量: 随机游走 + 缺失 + 离群值, 价格为整数円。"""
+    rng = np.random.default_rng(seed)
+    base = rng.uniform(110_000, 300_000, size=(n_iphones, 1, 1))
+    walk = rng.normal(0, 150, size=(n_iphones, 1, n_buckets)).cumsum(axis=2)
+    shop_bias = rng.normal(0, 1_500, size=(1, n_shops, 1))
+    noise = rng.normal(0, 500, size=(n_iphones, n_shops, n_buckets))
+    prices = np.round(base + walk + shop_bias + noise, -2)
+
+    outliers = rng.random(prices.shape) < outlier_ratio
+    prices[outliers] *= rng.choice([0.5, 1.6], size=int(outliers.sum()))
+    prices[rng.random(prices.shape) < nan_ratio] = np.nan
+
+    return PriceTensor(
+        data=torch.tensor(prices, dtype=torch.float64, device=device),
+        iphone_ids=np.arange(1, n_iphones + 1),
+        shop_ids=np.arange(1, n_shops + 1),
+        bucket_index=pd.date_range("2025-01-01", periods=n_buckets, freq="15min", tz="Asia/Tokyo"),
+    )
+
+
+def _timeit(fn, repeat: int):
+    best = float("inf")
+    out = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t)
+    return best, out
+
+
+def _report(name: str, t_new: float, t_old: float | None, same: bool | None) -> None:
+    if t_old is None:
+        print(f"  {name:<32} new={t_new:8.3f}s")
+        return
+    speedup = t_old / t_new if t_new > 0 else float("inf")
+    print(f"  {name:<32} old={t_old:8.3f}s  new={t_new:8.3f}s  x{speedup:7.1f}  "
+          f"{'OK' if same else 'MISMATCH'}")
+
+
+def bench_dynamic_price_filter(tensor: PriceTensor, *, legacy: bool, repeat: int) -> bool:
+    t_new, new = _timeit(lambda: apply_dynamic_price_filter(tensor).data, repeat)
+    if not legacy:
+        _report("apply_dynamic_price_filter", t_new, None, None)
+        return True
+    t_old, old = _timeit(lambda: reference.apply_dynamic_price_filter_loop(tensor.data), 1)
+    same = torch.equal(torch.isnan(new), torch.isnan(old))
+    _report("apply_dynamic_price_filter", t_new, t_old, same)
+    return same
+
+
+def bench_mad_filter_median(tensor: PriceTensor, *, legacy: bool, repeat: int) -> bool:
+    t_new, (filtered, median) = _timeit(lambda: _mad_filter_median_dim1(tensor.data), repeat)
+    if not legacy:
+        _report("mad_filter + nanmedian", t_new, None, None)
+        return True
+
+    def _old():
+        f = reference.mad_filter_dim1_loop(tensor.data)
+        return f, reference.nanmedian_dim1_loop(f)
+
+    t_old, (old_f, old_m) = _timeit(_old, 1)
+    same = (torch.equal(torch.isnan(filtered), torch.isnan(old_f))
+            and torch.equal(torch.nan_to_num(median), torch.nan_to_num(old_m)))
+    _report("mad_filter + nanmedian", t_new, t_old, same)
+    return same
+
+
+def bench_ema(tensor: PriceTensor, *, legacy: bool, repeat: int) -> bool:
+    """全部 EMA 窗口 (6 窗口 + 2 半衰期), ffill 与 skipnan 两种模式。"""
+    import math
+
+    series = torch.nanmean(tensor.data, dim=1)  # (I, B) 近似 agg.mean
+
+    def _new():
+        filled = _forward_fill_1d(series)
+        out = [compute_ema_batch(filled, w) for w in WINDOW_TO_BUCKETS.values()]
+        out += [compute_ema_halflife_batch(filled, hl) for hl in EMA_HL_BUCKETS.values()]
+        out += [compute_ema_batch_skipnan(series, w) for w in WINDOW_TO_BUCKETS.values()]
+        return out
+
+    t_new, new = _timeit(_new, repeat)
+    if not legacy:
+        _report("ema (all windows, both modes)", t_new, None, None)
+        return True
+
+    def _old():
+        filled = reference.forward_fill_1d_loop(series)
+        out = [reference.ema_loop(filled, 2.0 / (w + 1.0)) for w in WINDOW_TO_BUCKETS.values()]
+        out += [reference.ema_loop(filled, 1.0 - math.exp(-math.log(2) / hl))
+                for hl in EMA_HL_BUCKETS.values()]
+        out += [reference.ema_skipnan_loop(series, 2.0 / (w + 1.0)) for w in WINDOW_TO_BUCKETS.values()]
+        return out
+
+    t_old, old = _timeit(_old, 1)
+    same = all(
+        torch.equal(torch.isnan(a), torch.isnan(b))
+        and torch.allclose(torch.nan_to_num(a), torch.nan_to_num(b), rtol=1e-12, atol=1e-6)
+        for a, b in zip(new, old)
+    )
+    _report("ema (all windows, both modes)", t_new, t_old, same)
+    return same
+
+
+def bench_feature_frame(tensor: PriceTensor, *, legacy: bool, repeat: int) -> bool:
+    """features_wide 组装 (iphone scope): 逐行 dict vs 列式。"""
+    agg = aggregate_cross_shop(tensor)
+    feats = compute_all_features(agg.mean)
+    t_new, new = _timeit(lambda: _agg_to_features_df(agg, feats), repeat)
+    if not legacy:
+        _report(f"feature frame ({len(new)} rows)", t_new, None, None)
+        return True
+    t_old, old = _timeit(lambda: reference.agg_to_features_df_loop(agg, feats), 1)
+    same = new.equals(old) and list(new.columns) == list(old.columns)
+    _report(f"feature frame ({len(new)} rows)", t_new, t_old, same)
+    return same
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iphones", type=int, default=150)
+    parser.add_argument("--shops", type=int, default=25)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="向量化版重复次数, 取最快 (默认 %(default)s)")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--skip-legacy", action="store_true", help="不跑原版循环实现")
+    args = parser.parse_args(argv)
+
+    n_buckets = args.days * 24 * 4
+    tensor = make_price_tensor(args.iphones, args.shops, n_buckets, seed=args.seed, device=args.device)
+    print(f"PriceTensor: {args.iphones} iphones × {args.shops} shops × {n_buckets} buckets  "
+          f"device={args.device}")
+
+    legacy = not args.skip_legacy
+    ok = True
+    ok &= bench_dynamic_price_filter(tensor, legacy=legacy, repeat=args.repeat)
+    ok &= bench_mad_filter_median(tensor, legacy=legacy, repeat=args.repeat)
+    ok &= bench_ema(tensor, legacy=legacy, repeat=args.repeat)
+    ok &= bench_feature_frame(tensor, legacy=legacy, repeat=args.repeat)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""
+cleaner_tools 文本归一化 benchmark: 原版逐单元格 vs 列级 / 记忆化实现。
+
+对 shop4 / shop16（样本最大的两家）原始文件里的文本列，分别计时：
+  - old:  原版逐单元格实现（re.sub 逐次查编译缓存、无记忆化），拷贝在本脚本内作参照
+  - cell: 现版逐单元格调用（预编译正则 + translate 表 + LRU 记忆化；冷启动 / 预热两次）
+  - col:  列级实现（normalize_text_stage0_series，去重后用 pandas .str 一次完成；
+          normalize_text_basic / _norm_strip 只作用于循环内的片段，没有列级版本）
+并校验三者输出一致。不依赖 Django 环境，只需 pandas（读 xlsx 需 openpyxl）。
+
+用法：
+    python scripts/bench_text_normalize.py                       # shop-data/shop4, shop-data/shop16 下全部 xlsx
+    python scripts/bench_text_normalize.py --shops shop16 --limit 20
+    python scripts/bench_text_normalize.py --synthetic 200000    # 没有样本文件时用合成文本
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import re
+import sys
+import time
+import unicodedata
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+import pandas as pd  # noqa: E402
+
+from AppleStockChecker.utils.external_ingest import cleaner_tools as ct  # noqa: E402
+
+# 各 shop 逐行循环里做归一化的文本列
+TEXT_COLUMNS = {
+    "shop4": ["data", "data11"],
+    "shop16": ["iPhone 17 Pro Max", "説明1", "買取価格"],
+}
+
+
+# ----------------------------------------------------------------------
+# 原版逐单元格实现（参照）
+# ----------------------------------------------------------------------
+
+def legacy_stage0(text):
+    if text is None or not isinstance(text, str):
+        return "" if text is None else str(text)
+    s = re.sub(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f\u0080-\u009f]", "", text)
+    s = unicodedata.normalize("NFKC", s)
+    s = re.sub(r"<[^>]+>", "", s)
+    s = ct._MINUS_EMOJI_PAT.sub("-", s)
+    return ct._OTHER_EMOJI_PAT.sub("", s)
+
+
+def legacy_basic(text):
+    if text is None:
+        return ""
+    s = str(text).translate(ct._FZ_TO_HZ_TRANS)
+    s = s.replace("\r\n", " ").replace("\r", " ").replace("\n", " ")
+    return re.sub(r"\s+", " ", s).strip()
+
+
+def legacy_norm_strip(s):
+    t = (s or "").strip()
+    return re.sub(r"[\s　]+", "", t).lower()
+
+
+# ----------------------------------------------------------------------
+
+def load_columns(shops, limit: int | None) -> dict:
+    """{shop: [Series, ...]}，单元格统一转成逐行循环里看到的字符串"""
+    out = {}
+    for shop in shops:
+        files = sorted((BASE_DIR / "shop-data" / shop).glob("*.xlsx"))[:limit]
+        cols = []
+        for f in files:
+            try:
+                df = pd.read_excel(f, engine="openpyxl")
+            except Exception as e:
+                print(f"  跳过 {f.name}: {e}")
+                continue
+            cols += [df[c].astype(str) for c in TEXT_COLUMNS[shop] if c in df.columns]
+        if cols:
+            out[shop] = cols
+            print(f"{shop}: {len(files)} 个文件, {sum(len(c) for c in cols)} 个单元格")
+        else:
+            print(f"{shop}: 无样本（shop-data/{shop}/*.xlsx）")
+    return out
+
+
+def synthetic_columns(n: int, seed: int = 0) -> dict:
+    """模拟备注列：颜色 / 金额模板组合，夹带全角、emoji、HTML、换行"""
+    rng = random.Random(seed)
+    colors = ["ブルー", "ディープブルー", "シルバー", "コズミックオレンジ", "ブラック", "ホワイト", "全色"]
+    seps = ["：", ":", "－", " ", "　"]
+    extras = ["", "➖", "✨", "<br>", "\n", "（未開封）", "\xa0"]
+
+    def _cell():
+        parts = [
+            f"{rng.choice(colors)}{rng.choice(seps)}{rng.choice(['-', '－', '+', ''])}"
+            f"{rng.choice(['１,０００', '2,000', '３０００', '5,000'])}円{rng.choice(extras)}"
+            for _ in range(rng.randint(1, 4))
+        ]
+        return " / ".join(parts)
+
+    # 实际文件中同一备注会在多行 / 多个批次里反复出现：按 ~1% 的唯一率抽样
+    pool = [_cell() for _ in range(max(50, n // 100))]
+    return {"synthetic": [pd.Series([rng.choice(pool) for _ in range(n)], dtype=object)]}
+
+
+def _timeit(fn):
+    t = time.perf_counter()
+    out = fn()
+    return time.perf_counter() - t, out
+
+
+def bench(name: str, cols, legacy, cell, cached, col_fn=None, cell_input=lambda s: s.tolist()) -> bool:
+    cells = [v for c in cols for v in cell_input(c)]
+    t_old, old = _timeit(lambda: [legacy(v) for v in cells])
+    cached.cache_clear()
+    t_cold, cold = _timeit(lambda: [cell(v) for v in cells])
+    t_warm, _ = _timeit(lambda: [cell(v) for v in cells])
+    same = old == cold
+    col_part = ""
+    if col_fn is not None:
+        t_col, col = _timeit(lambda: [v for c in cols for v in col_fn(c).tolist()])
+        same = same and old == col
+        col_part = f"col={t_col:7.3f}s x{t_old / t_col:5.1f}  "
+    print(f"  {name:<22} old={t_old:7.3f}s  cell(cold)={t_cold:7.3f}s x{t_old / t_cold:5.1f}  "
+          f"cell(warm)={t_warm:7.3f}s x{t_old / t_warm:6.1f}  {col_part}"
+          f"{'OK' if same else 'MISMATCH'}")
+    return same
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shops", nargs="+", default=list(TEXT_COLUMNS), choices=list(TEXT_COLUMNS))
+    parser.add_argument("--limit", type=int, default=None, help="每个 shop 最多读取的文件数")
+    parser.add_argument("--synthetic", type=int, default=0, help="改用 N 行合成文本")
+    args = parser.parse_args(argv)
+
+    data = synthetic_columns(args.synthetic) if args.synthetic else load_columns(args.shops, args.limit)
+    if not data:
+        print("没有可用样本；可用 --synthetic N 生成合成文本")
+        return 1
+
+    ok = True
+    for shop, cols in data.items():
+        print(f"[{shop}] {sum(len(c) for c in cols)} cells, "
+              f"{len(set(v for c in cols for v in c.tolist()))} unique")
+        ok &= bench("normalize_text_stage0", cols, legacy_stage0, ct.normalize_text_stage0,
+                    ct._normalize_text_stage0_cached, ct.normalize_text_stage0_series)
+        ok &= bench("normalize_text_basic", cols, legacy_basic, ct.normalize_text_basic,
+                    ct._normalize_text_basic_cached)
+        ok &= bench("_norm_strip", cols, legacy_norm_strip, ct._norm_strip, ct._norm_strip_cached)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())